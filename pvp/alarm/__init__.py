@@ -52,7 +52,7 @@ ALARM_RULES = odict({
                         'value_name': ValueName.PIP,
                         'value_attr': 'value',
                         'condition_attr': 'limit',
-                        'transform': lambda x : x-(x*0.10)
+                        'transform': condition.RelativeLimit(-0.10)
                     }
                 )
             ),
@@ -66,7 +66,7 @@ ALARM_RULES = odict({
                         'value_name': ValueName.PIP,
                         'value_attr': 'value',
                         'condition_attr': 'limit',
-                        'transform': lambda x: x - (x * 0.15)
+                        'transform': condition.RelativeLimit(-0.15)
                     },
                     mode='min'
                 ) + \
@@ -92,7 +92,7 @@ ALARM_RULES = odict({
                         'value_name': ValueName.PIP,
                         'value_attr': 'value',
                         'condition_attr': 'limit',
-                        'transform': lambda x : x+(x*0.15)
+                        'transform': condition.RelativeLimit(0.15)
                     }
                 )
             ),
@@ -112,7 +112,7 @@ ALARM_RULES = odict({
                         'value_name': ValueName.VTE,
                         'value_attr': 'value',
                         'condition_attr': 'limit',
-                        'transform': lambda x : x-(x*0.15)
+                        'transform': condition.RelativeLimit(-0.15)
                     }
                 )
             ),
@@ -127,7 +127,7 @@ ALARM_RULES = odict({
                         'value_name': ValueName.VTE,
                         'value_attr': 'value',
                         'condition_attr': 'limit',
-                        'transform': lambda x : x-(x*0.25)
+                        'transform': condition.RelativeLimit(-0.25)
                     }
                 ) + \
                 condition.CycleAlarmSeverityCondition(
@@ -152,7 +152,7 @@ ALARM_RULES = odict({
                         'value_name': ValueName.VTE,
                         'value_attr': 'value',
                         'condition_attr': 'limit',
-                        'transform': lambda x : x+(x*0.15)
+                        'transform': condition.RelativeLimit(0.15)
                     }
                 )
             ),
@@ -167,7 +167,7 @@ ALARM_RULES = odict({
                         'value_name': ValueName.VTE,
                         'value_attr': 'value',
                         'condition_attr': 'limit',
-                        'transform': lambda x : x+(x*0.25)
+                        'transform': condition.RelativeLimit(0.25)
                     }
                 ) + \
                 condition.CycleAlarmSeverityCondition(
@@ -192,7 +192,7 @@ ALARM_RULES = odict({
                         'value_name': ValueName.PEEP,
                         'value_attr': 'value',
                         'condition_attr': 'limit',
-                        'transform': lambda x : x-(x*0.15)
+                        'transform': condition.RelativeLimit(-0.15)
                     }
                 )
             ),
@@ -212,7 +212,7 @@ ALARM_RULES = odict({
                         'value_name': ValueName.PEEP,
                         'value_attr': 'value',
                         'condition_attr': 'limit',
-                        'transform': lambda x: x + (x * 0.15)
+                        'transform': condition.RelativeLimit(0.15)
                     }
                 )
             ),
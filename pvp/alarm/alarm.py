@@ -1,5 +1,6 @@
 import time
 import importlib
+import typing
 from datetime import datetime
 
 from itertools import count
@@ -39,6 +40,8 @@ class Alarm:
             id (int): unique alarm ID
             end_time (None, float): If None, alarm has not ended. otherwise timestamp
             active (bool): Whether or not the alarm is currently active
+            timestamps (dict): {stage: time} the alarm passed through each stage of the alarm pipeline,
+                see :mod:`.alarm.latency`
 
 
 
@@ -68,6 +71,7 @@ class Alarm:
         self.message = message
         self.latch = latch
         self.cause = cause
+        self.timestamps = {} # type: typing.Dict[str, float]
 
         # if not managed:
         #     self.manager.register_alarm(self)
@@ -1,14 +1,20 @@
 import copy
+import logging
 import time
 from pprint import pformat
 import pdb
 
+import numpy as np
+
 from pvp.alarm import AlarmSeverity, AlarmType
 from pvp.alarm.condition import Condition
+from pvp.common.frame import SensorFrame
 from pvp.common.message import SensorValues, ControlSetting
 from pvp.common.loggers import init_logger
 from pvp.alarm.alarm import Alarm
 from pvp.alarm.rule import Alarm_Rule
+from pvp.alarm.compiled import Compiled_Rules, Input_Index, condition_chain
+from pvp.alarm.latency import Alarm_Latency
 from pvp.alarm import condition
 
 import typing
@@ -25,6 +31,14 @@ class Alarm_Manager(object):
     On initialization, the alarm manager calls :meth:`.Alarm_Manager.load_rules` , which
     loads all rules defined in :data:`.alarm.ALARM_RULES` .
 
+    ``Alarm_Manager()`` returns the alarm manager shared by the whole process (eg. by the GUI and its widgets),
+    making it the first time. ``Alarm_Manager(shared=False)`` makes an independent alarm manager with its own
+    alarms, callbacks and copy of the rules, whose conditions are bound to it (see :attr:`.Condition.manager` ),
+    eg. to check the alarms of many patients in one process.
+
+    Args:
+        shared (bool): if True (default), return the shared alarm manager, otherwise make a new one
+
     Attributes:
         active_alarms (dict): {:class:`.AlarmType`: :class:`.Alarm`}
         logged_alarms (list): A list of deactivated alarms.
@@ -35,39 +49,77 @@ class Alarm_Manager(object):
         snoozed_alarms (dict): of :class:`.AlarmType` s : times, alarms that should not be raised because they have been silenced for a period of time
         callbacks (list): list of callables to send :class:`.Alarm` objects to
         depends_callbacks (list): When we :meth:`.update_dependencies`, we send back a :class:`.ControlSetting` with the new min/max
+        dismiss_callbacks (list): called with the ``(alarm_type, duration)`` of each :meth:`.dismiss_alarm`
+        history (:class:`.Alarm_History`): if not None, every emitted alarm is added to it (default: None)
+        latency (:class:`.Alarm_Latency`): latency of the alarms emitted from sensor values, and of the stages
+            after they are emitted that are stamped with it (eg. by the GUI)
         rules (dict): A dict mapping :class:`.AlarmType` to :class:`.Alarm_Rule` .
+        use_compiled_rules (bool): If True (default), check rules with a :class:`.Compiled_Rules` that evaluates
+            all value thresholds in one vectorized pass, otherwise call :meth:`.Alarm_Rule.check` for each rule.
+        incremental (bool): If True (default), only check the rules whose inputs have changed since the last update
+            (see :class:`.Input_Index` ), the others keep the severity they were last checked at.
+        rules_evaluated (int): number of rules checked in the last update
+        total_rules_evaluated (int): number of rules checked since the last :meth:`.reset`
+        n_updates (int): number of updates since the last :meth:`.reset`
     """
     _instance = None
 
-    # use class attributes because __init__ is called every time instantiated
-
-    active_alarms: typing.Dict[AlarmType, Alarm] = {}
-    logged_alarms: typing.List[Alarm] = []
-
-    # get our alarm rules
-    dependencies = {}
-    pending_clears = []
-    cleared_alarms = []
-    snoozed_alarms = {}
-    callbacks = []
-    depends_callbacks = []
-    rules = {} # type: typing.Dict[AlarmType, Alarm_Rule]
+    # defaults that can be changed for each alarm manager
+    use_compiled_rules = True
+    incremental = True
 
     logger = init_logger(__name__)
 
 
-    def __new__(cls):
+    def __new__(cls, shared: bool = True):
         """
-        If an Alarm_Manager already exists, when initing just return that one
+        If a shared Alarm_Manager already exists, when initing just return that one
         """
+        if not shared:
+            return cls._new_instance()
 
         if not cls._instance:
-            cls._instance = super(Alarm_Manager, cls).__new__(cls)
+            cls._instance = cls._new_instance()
 
         return cls._instance
 
-
-    def __init__(self):
+    @classmethod
+    def _new_instance(cls) -> 'Alarm_Manager':
+        """
+        Make an alarm manager with its own state. State is set here rather than in __init__
+        because __init__ is called every time the shared alarm manager is instantiated
+        """
+        manager = super(Alarm_Manager, cls).__new__(cls)
+
+        manager.active_alarms = {} # type: typing.Dict[AlarmType, Alarm]
+        manager.logged_alarms = [] # type: typing.List[Alarm]
+        manager.dependencies = {}
+        manager.pending_clears = []
+        manager.cleared_alarms = []
+        manager.snoozed_alarms = {}
+        manager.callbacks = []
+        manager.depends_callbacks = []
+        manager.dismiss_callbacks = []
+        manager.history = None # type: typing.Optional['Alarm_History']
+        manager.latency = Alarm_Latency()
+        # times of the sensor values being checked, and of starting to check them
+        manager._sample_time = None # type: typing.Optional[float]
+        manager._check_time = None # type: typing.Optional[float]
+        manager.rules = {} # type: typing.Dict[AlarmType, Alarm_Rule]
+        manager._compiled = None # type: typing.Optional[Compiled_Rules]
+
+        manager.rules_evaluated = 0
+        manager.total_rules_evaluated = 0
+        manager.n_updates = 0
+        manager._index = None # type: typing.Optional[Input_Index]
+        manager._evaluate_all = True
+        manager._changed_rules = set()
+        manager._severities = {} # type: typing.Dict[Alarm_Rule, AlarmSeverity]
+        manager._alarm_states = {} # type: typing.Dict[Alarm_Rule, tuple]
+        return manager
+
+
+    def __init__(self, shared: bool = True):
 
         if len(self.rules) == 0:
             self.load_rules()
@@ -86,36 +138,160 @@ class Alarm_Manager(object):
 
     def load_rule(self, alarm_rule: Alarm_Rule):
         """
-        Add the Alarm Rule to :attr:`.Alarm_Manager.rules` and register any dependencies they have with :meth:`.Alarm_Manager.register_dependency`
+        Add the Alarm Rule to :attr:`.Alarm_Manager.rules` , bind its conditions to this alarm manager,
+        and register any dependencies they have with :meth:`.Alarm_Manager.register_dependency`
 
         Args:
             alarm_rule ( :class:`.Alarm_Rule` ): Alarm rule to be loaded
         """
         self.rules[alarm_rule.name] = alarm_rule
 
-        for severity, condition in alarm_rule.conditions:
+        for severity, rule_condition in alarm_rule.conditions:
+            # dependencies update the condition that declares them, even within a compound condition
+            for condition in condition_chain(rule_condition):
+                condition.manager = self
 
-            if isinstance(condition.depends, dict):
-                self.register_dependency(condition, condition.depends, severity)
-            elif isinstance(condition.depends, list) or isinstance(condition.depends, tuple): # pragma: no cover -- same operation as the single dependency
-                for depend in condition.depends:
-                    self.register_dependency(condition, depend, severity)
+                if isinstance(condition.depends, dict):
+                    self.register_dependency(condition, condition.depends, severity)
+                elif isinstance(condition.depends, list) or isinstance(condition.depends, tuple): # pragma: no cover -- same operation as the single dependency
+                    for depend in condition.depends:
+                        self.register_dependency(condition, depend, severity)
 
-        self.logger.info(f'Registered rule:\n{pformat(alarm_rule.__dict__)}')
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(f'Registered rule:\n{pformat(alarm_rule.__dict__)}')
 
 
 
     def update(self, sensor_values: SensorValues):
         """
-        Call :meth:`.Alarm_Manager.check_rule` for all rules in :attr:`.Alarm_Manager.rules`
+        Check all rules in :attr:`.Alarm_Manager.rules` and call :meth:`.Alarm_Manager.apply_severity` with each
+        rule's severity, like :meth:`.Alarm_Manager.check_rule` .
+
+        If :attr:`.use_compiled_rules` , the rules are checked all at once by :meth:`.Compiled_Rules.check` .
+
+        If :attr:`.incremental` , only rules whose inputs have changed are checked: rules that read a sensor value
+        that changed (see :meth:`.Input_Index.changed_rules` ), rules that read an alarm whose severity changed
+        since they were last checked, and every rule after the limits are changed or the manager is reset.
+        :meth:`.Alarm_Manager.apply_severity` is still called for every rule, so snoozes expire and dismissed
+        alarms are cleared on time.
+
+        Alarms emitted by the update are stamped with the time of the sensor values and the time the update started
+        (see :mod:`.alarm.latency` ).
 
         Args:
             sensor_values ( :class:`.SensorValues` ): New sensor values from the GUI
         """
-        for alarm_name, rule in self.rules.items():
-            self.check_rule(rule, sensor_values)
-            # don't want to do alarm emission here because any _check_,
-            # not any full update should trigger an alarm
+        self._sample_time = sensor_values.timestamp
+        self._check_time = time.time()
+        try:
+            self._update(sensor_values)
+        finally:
+            self._sample_time = None
+
+    def _update(self, sensor_values: SensorValues):
+        """
+        Check the rules for :meth:`.update`
+        """
+        if self.incremental:
+            index = self.input_index
+            self._changed_rules = index.changed_rules(sensor_values)
+            values_changed = self._evaluate_all or len(self._changed_rules) > 0
+            if index.alarm_inputs:
+                evaluate = self._check_needed
+            else:
+                evaluate = self._changed_rules.__contains__ if not self._evaluate_all else None
+        else:
+            evaluate = None
+            values_changed = True
+
+        if self.use_compiled_rules:
+            results = self.compiled_rules.check(sensor_values, evaluate=evaluate, values_changed=values_changed)
+        else:
+            results = self._check_rules(sensor_values, evaluate)
+
+        n_evaluated = 0
+        for rule, current_severity in results:
+            if current_severity is None:
+                current_severity = self._severities[rule]
+            else:
+                n_evaluated += 1
+                self._severities[rule] = current_severity
+            # an alarm that is off and has no state to update has nothing to do
+            if current_severity > AlarmSeverity.OFF or \
+                    self.active_alarms or self.snoozed_alarms or self.cleared_alarms:
+                self.apply_severity(rule, current_severity)
+
+        self._evaluate_all = False
+        self.rules_evaluated = n_evaluated
+        self.total_rules_evaluated += n_evaluated
+        self.n_updates += 1
+
+    def _check_rules(self, sensor_values: SensorValues,
+                     evaluate: typing.Optional[typing.Callable[[Alarm_Rule], bool]] = None
+                     ) -> typing.Iterator[typing.Tuple[Alarm_Rule, typing.Optional[AlarmSeverity]]]:
+        """
+        :meth:`.Alarm_Rule.check` each rule, the object-based version of :meth:`.Compiled_Rules.check`
+        """
+        for rule in list(self.rules.values()):
+            if evaluate is not None and not evaluate(rule):
+                yield rule, None
+            else:
+                yield rule, rule.check(sensor_values)
+
+    def _check_needed(self, rule: Alarm_Rule) -> bool:
+        """
+        Whether a rule's inputs have changed since it was last checked, called just before it would be checked.
+
+        Alarms are compared here rather than at the start of the update, because the rules before it may have just
+        raised or cleared them. A new :class:`.Alarm` is made whenever an alarm's severity changes, so rules that read
+        alarm severities are checked again whenever the active alarm objects have changed, which is rare and
+        cheaper to compare than the severities of each alarm they read.
+        """
+        if rule in self._index.alarm_inputs:
+            states = tuple(self.active_alarms.values())
+            if states != self._alarm_states.get(rule):
+                self._alarm_states[rule] = states
+                return True
+        return self._evaluate_all or rule in self._changed_rules
+
+    @property
+    def input_index(self) -> Input_Index:
+        """
+        The inputs each of :attr:`.rules` reads, indexed again whenever rules are added or removed
+
+        Returns:
+            :class:`.Input_Index`
+        """
+        if self._index is None or not self._index.is_compiled(self.rules):
+            self._index = Input_Index(self.rules)
+            self._evaluate_all = True
+        return self._index
+
+    @property
+    def compiled_rules(self) -> Compiled_Rules:
+        """
+        :attr:`.rules` compiled by :class:`.Compiled_Rules` , compiled again whenever rules are added or removed
+
+        Returns:
+            :class:`.Compiled_Rules`
+        """
+        if self._compiled is None or not self._compiled.is_compiled(self.rules):
+            self._compiled = Compiled_Rules(self.rules, previous=self._compiled)
+        return self._compiled
+
+    def evaluate_stream(self, frame: SensorFrame) -> np.ndarray:
+        """
+        Run :attr:`.rules` over a batch of recorded samples, see :meth:`.Compiled_Rules.evaluate_stream` .
+
+        Doesn't emit alarms or change the state of the alarm manager.
+
+        Args:
+            frame (:class:`.SensorFrame`): samples in time order
+
+        Returns:
+            :class:`numpy.ndarray`: alarm transitions with dtype :data:`.compiled.TRANSITION_DTYPE`
+        """
+        return self.compiled_rules.evaluate_stream(frame)
 
     def check_rule(self, rule: Alarm_Rule, sensor_values: SensorValues):
         """
@@ -132,8 +308,23 @@ class Alarm_Manager(object):
             rule ( :class:`.Alarm_Rule` ): Alarm rule to check
             sensor_values ( :class:`.SensorValues` ): sent by the GUI to check against alarm rule
         """
-        current_severity = rule.check(sensor_values)
+        self._sample_time = sensor_values.timestamp
+        self._check_time = time.time()
+        try:
+            current_severity = rule.check(sensor_values)
+            self.apply_severity(rule, current_severity)
+        finally:
+            self._sample_time = None
+
+    def apply_severity(self, rule: Alarm_Rule, current_severity: AlarmSeverity):
+        """
+        Handle the logic of raising, emitting, or lowering an alarm given the current severity of its rule
+        (see :meth:`.Alarm_Manager.check_rule` )
 
+        Args:
+            rule ( :class:`.Alarm_Rule` ): Alarm rule that was checked
+            current_severity ( :class:`.AlarmSeverity` ): severity returned by the rule's check
+        """
         ##################
         # Checks that prevent raising
 
@@ -206,10 +397,17 @@ class Alarm_Manager(object):
                 latch      = self.rules[alarm_type].latch,
                 cause = self.rules[alarm_type].value_names
             )
+            if self._sample_time is not None:
+                new_alarm.timestamps['sample'] = self._sample_time
+                self.latency.stamp(new_alarm, 'checked', self._check_time)
+                self.latency.stamp(new_alarm, 'emitted', new_alarm.start_time)
 
             for callback in self.callbacks:
                 callback(new_alarm)
 
+            if self.history is not None:
+                self.history.add(new_alarm)
+
             if severity> AlarmSeverity.OFF:
                 # don't add OFF alarms to active_alarms...
                 self.active_alarms[alarm_type] = new_alarm
@@ -276,6 +474,9 @@ class Alarm_Manager(object):
 
         assert(alarm_type in self.rules.keys())
 
+        for callback in self.dismiss_callbacks:
+            callback(alarm_type, duration)
+
         rule = self.rules[alarm_type]
         # if the alarm is latched, add it to the list of pending_clears
         if rule.latch:
@@ -394,6 +595,10 @@ class Alarm_Manager(object):
                     new_value = depend['transform'](new_value)
 
                 setattr(depend['condition'], depend['condition_attr'], new_value)
+                if self._compiled is not None:
+                    self._compiled.refresh_limits()
+                # limits aren't tracked as inputs, so check everything again
+                self._evaluate_all = True
 
                 # emit control signal with new info
                 if isinstance(depend['condition'], condition.ValueCondition):
@@ -436,6 +641,17 @@ class Alarm_Manager(object):
         assert callable(callback)
         self.depends_callbacks.append(callback)
 
+    def add_dismiss_callback(self, callback: typing.Callable):
+        """
+        Assert we're being given a callable and add it to our list of dismiss_callbacks,
+        eg. to dismiss the alarm in an alarm manager hosted by the controller as well
+
+        Args:
+            callback (typing.Callable): Callback that accepts an :class:`.AlarmType` and a duration
+        """
+        assert callable(callback)
+        self.dismiss_callbacks.append(callback)
+
     def clear_all_alarms(self):
         """
         call :meth:`.Alarm_Manager.deactivate_alarm` for all active alarms.
@@ -457,6 +673,16 @@ class Alarm_Manager(object):
 
         for rule in self.rules.values():
             rule.reset()
+        if self._compiled is not None:
+            self._compiled.reset()
+        if self._index is not None:
+            self._index.reset()
+        self._evaluate_all = True
+        self._severities = {}
+        self._alarm_states = {}
+        self.rules_evaluated = 0
+        self.total_rules_evaluated = 0
+        self.n_updates = 0
 
         self.clear_all_alarms()
 
@@ -0,0 +1,619 @@
+"""
+Alarm rules compiled into flat numpy arrays, so the value thresholds of every rule are checked in one vectorized pass.
+
+:class:`.Compiled_Rules` flattens each condition of each :class:`.Alarm_Rule` into its chain of conditions
+(conditions that were added together into an :class:`.AllOf` ). Every :class:`.ValueCondition` and
+:class:`.CycleValueCondition` in a chain becomes a row of the threshold arrays (value, limit, comparison), and the
+consecutive-breath counters of the :class:`.CycleValueCondition` s become arrays too.
+
+Chains made up only of value conditions are evaluated for all rules at once, one vectorized step per position in
+the chain so that, like the object-based conditions, a condition later in a chain is only evaluated (and only
+updates its counters) if the conditions before it were met. Chains that contain any other condition, like the
+:class:`.AlarmSeverityCondition` s that depend on the alarm manager's current alarms, are evaluated in order as
+each rule is checked, still reading their value thresholds from the vectorized pass.
+
+The :class:`.Alarm_Manager` compiles its rules on the first update and uses them in place of :meth:`.Alarm_Rule.check` .
+
+:class:`.Input_Index` records which inputs each rule reads, so that the manager only checks the rules whose inputs
+changed since its last update.
+
+:meth:`.Compiled_Rules.evaluate_stream` runs the same rules over a whole :class:`.SensorFrame` at once, vectorized
+over time as well as over conditions, to replay recorded data without feeding it through the manager sample by sample.
+"""
+import operator
+import typing
+from operator import attrgetter
+
+import numpy as np
+
+from pvp.alarm import AlarmSeverity
+from pvp.alarm.condition import Condition, AllOf, ValueCondition, CycleValueCondition, TimeValueCondition, \
+    AlarmSeverityCondition, CycleAlarmSeverityCondition
+from pvp.alarm.rule import Alarm_Rule
+from pvp.common.frame import SensorFrame
+from pvp.common.message import SensorValues
+
+# AlarmSeverity by value, for the severities OFF and up that conditions can raise
+_SEVERITIES = tuple(AlarmSeverity(value) for value in range(max(AlarmSeverity) + 1))
+
+TRANSITION_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('index', np.int64),        # index of the sample in the frame
+    ('alarm_type', np.int16),   # AlarmType value
+    ('severity', np.int8)       # AlarmSeverity value
+])
+"""
+An alarm being raised, changing severity, or cleared (severity ``OFF`` ), as returned by
+:meth:`.Compiled_Rules.evaluate_stream`
+"""
+
+# kinds of elements of chains evaluated sample by sample in evaluate_stream
+_STREAM_VALUE, _STREAM_CYCLE, _STREAM_SEVERITY, _STREAM_TIME, _STREAM_OBJECT = range(5)
+
+
+def condition_chain(condition: Condition) -> typing.Tuple[Condition, ...]:
+    """
+    The conditions a possibly compound condition checks, in order
+
+    Args:
+        condition (:class:`.Condition`): a condition, or an :class:`.AllOf` of conditions
+
+    Returns:
+        tuple: of :class:`.Condition` s
+    """
+    if isinstance(condition, AllOf):
+        return condition.conditions
+    return (condition,)
+
+
+def count_cycles(exceeded: np.ndarray, breath_count: np.ndarray, n_cycles: int) -> np.ndarray:
+    """
+    Vectorized :meth:`.CycleValueCondition.check` over a sequence of checks, starting from a reset condition.
+
+    A check is met if the value has been out of range since a check at least ``n_cycles`` breaths earlier,
+    without a check in range in between.
+
+    Args:
+        exceeded (:class:`numpy.ndarray`): bool, whether the value was out of range at each check
+        breath_count (:class:`numpy.ndarray`): breath count at each check
+        n_cycles (int): number of breath cycles required
+
+    Returns:
+        :class:`numpy.ndarray`: bool, whether each check is met
+    """
+    if len(exceeded) == 0:
+        return np.zeros(0, dtype=bool)
+    previous = np.concatenate(([False], exceeded[:-1]))
+    # each out of range check belongs to the run that started at the last check that was out of range after one that wasn't
+    run_starts = np.where(exceeded & ~previous, np.arange(len(exceeded)), 0)
+    start_cycle = breath_count[np.maximum.accumulate(run_starts)]
+    return exceeded & previous & (breath_count >= start_cycle + n_cycles)
+
+
+def _step_cycles(exceeded: bool, breath_count: int, n_cycles: int, counter: list) -> bool:
+    """
+    A single :meth:`.CycleValueCondition.check` with its state in ``counter`` , ``[mid_check, start_cycle]``
+    """
+    if not exceeded:
+        counter[0] = False
+        return False
+    if counter[0]:
+        return breath_count >= counter[1] + n_cycles
+    counter[0] = True
+    counter[1] = breath_count
+    return False
+
+
+def _same_rules(rules: dict, compiled_dict: dict, compiled_rules: list) -> bool:
+    """
+    Whether ``compiled_rules`` are still the rules in ``rules`` , in the same order
+    """
+    if rules is not compiled_dict or len(rules) != len(compiled_rules):
+        return False
+    return all(map(operator.is_, rules.values(), compiled_rules))
+
+
+class Compiled_Rules(object):
+    """
+    Vectorized evaluation of a set of :class:`.Alarm_Rule` s
+
+    Args:
+        rules (dict): {:class:`.AlarmType`: :class:`.Alarm_Rule`}, checked in order
+        previous (:class:`.Compiled_Rules`): rules compiled before, to carry over the breath cycle counters of
+            conditions that are still in use. Otherwise counters start from the state of the condition objects.
+
+    Attributes:
+        rules (list): the compiled :class:`.Alarm_Rule` s
+        conditions (list): the :class:`.ValueCondition` of each row of the threshold arrays
+    """
+
+    def __init__(self, rules: typing.Dict['AlarmType', Alarm_Rule], previous: 'Compiled_Rules' = None):
+        self._rules_dict = rules
+        self.rules = list(rules.values())
+        self.conditions = [] # type: typing.List[ValueCondition]
+
+        # chains of only value conditions: (rule index, severity, [row, ...])
+        value_chains = []
+        # other chains: rule index -> [(severity, [(row or None, is cycle, check or None, condition), ...])]
+        self._mixed_chains = {} # type: typing.Dict[int, typing.List[tuple]]
+
+        for rule_index, rule in enumerate(self.rules):
+            for severity, condition in rule.conditions:
+                chain = condition_chain(condition)
+                elements = []
+                for element in chain:
+                    if type(element) in (ValueCondition, CycleValueCondition):
+                        elements.append((len(self.conditions), type(element) is CycleValueCondition, None, element))
+                        self.conditions.append(element)
+                    else:
+                        elements.append((None, False, element.check, element))
+
+                if all(row is not None for row, _, _, _ in elements):
+                    # like Alarm_Rule.check, severities below OFF are never raised
+                    value_chains.append((rule_index, max(int(severity), 0), [row for row, _, _, _ in elements]))
+                else:
+                    self._mixed_chains.setdefault(rule_index, []).append((severity, elements))
+
+        # value rows
+        n_rows = len(self.conditions)
+        self._value_attrs = tuple(sorted({condition.value_name.name for condition in self.conditions}))
+        self._get_values = attrgetter(*self._value_attrs) if len(self._value_attrs) > 1 else \
+            lambda sensor_values: tuple(getattr(sensor_values, attr) for attr in self._value_attrs)
+        self._value_index = np.array([self._value_attrs.index(condition.value_name.name)
+                                      for condition in self.conditions], dtype=np.intp)
+        # 'min' conditions are compared as -value > -limit, so every row is a single greater than
+        self._sign = np.ones(n_rows)
+        self._signed_limits = np.zeros(n_rows)
+        self.refresh_limits()
+
+        # breath cycle counters
+        self._is_cycle = np.array([type(condition) is CycleValueCondition for condition in self.conditions], dtype=bool)
+        self._n_cycles = np.array([getattr(condition, 'n_cycles', 0) for condition in self.conditions], dtype=np.int64)
+        self._mid_check = np.array([getattr(condition, '_mid_check', False) for condition in self.conditions], dtype=bool)
+        self._start_cycle = np.array([getattr(condition, '_start_cycle', 0) for condition in self.conditions],
+                                     dtype=np.int64)
+        if previous is not None:
+            previous_rows = {id(condition): row for row, condition in enumerate(previous.conditions)}
+            for row, condition in enumerate(self.conditions):
+                previous_row = previous_rows.get(id(condition))
+                if previous_row is not None:
+                    self._mid_check[row] = previous._mid_check[previous_row]
+                    self._start_cycle[row] = previous._start_cycle[previous_row]
+
+        # value chains, padded with -1 to the longest chain
+        chain_length = max([len(rows) for _, _, rows in value_chains], default=0)
+        self._chain_rows = np.full((len(value_chains), chain_length), -1, dtype=np.intp)
+        for i, (_, _, rows) in enumerate(value_chains):
+            self._chain_rows[i, :len(rows)] = rows
+        self._chain_severity = np.array([severity for _, severity, _ in value_chains], dtype=np.int64)
+        self._position_has_cycle = [bool(np.any(self._is_cycle[rows[rows >= 0]])) for rows in self._chain_rows.T]
+        # value chains are made in rule order, so each rule's chains are a contiguous slice
+        chain_rules = [rule_index for rule_index, _, _ in value_chains]
+        self._rule_plan = []
+        for rule_index, rule in enumerate(self.rules):
+            # rules with one value chain (most of them) index it directly, rules without any index the 0 appended
+            # to the chain severities by _check_value_chains
+            start = chain_rules.index(rule_index) if rule_index in chain_rules else len(chain_rules)
+            stop = start + chain_rules.count(rule_index)
+            single = start if stop - start <= 1 else None
+            self._rule_plan.append((rule, single, start, stop, self._mixed_chains.get(rule_index, ())))
+
+        self._exceeded = np.zeros(n_rows, dtype=bool)
+        self._chain_severities = None # type: typing.Optional[typing.List[int]]
+
+    def is_compiled(self, rules: typing.Dict['AlarmType', Alarm_Rule]) -> bool:
+        """
+        Whether these are the compiled versions of ``rules`` , or rules have been added or removed since
+
+        Args:
+            rules (dict): {:class:`.AlarmType`: :class:`.Alarm_Rule`}
+
+        Returns:
+            bool
+        """
+        return _same_rules(rules, self._rules_dict, self.rules)
+
+    def refresh_limits(self):
+        """
+        Read the ``limit`` and ``mode`` of every value condition again, after they have been changed
+        (eg. by :meth:`.Alarm_Manager.update_dependencies` )
+        """
+        for row, condition in enumerate(self.conditions):
+            self._sign[row] = 1 if condition.mode == 'max' else -1
+            self._signed_limits[row] = self._sign[row] * condition.limit
+
+    def reset(self):
+        """
+        Reset the breath cycle counters, like :meth:`.CycleValueCondition.reset`
+        """
+        self._mid_check[:] = False
+        self._start_cycle[:] = 0
+        self._chain_severities = None
+
+    def check_values(self, sensor_values: SensorValues) -> np.ndarray:
+        """
+        Compare every value condition's value against its limit
+
+        Args:
+            sensor_values (:class:`.SensorValues`): values to check
+
+        Returns:
+            :class:`numpy.ndarray`: bool for each row of the threshold arrays, whether the value is out of range
+        """
+        # None becomes nan, which is never out of range
+        vals = np.array(self._get_values(sensor_values), dtype=np.float64)
+        self._exceeded = vals[self._value_index] * self._sign > self._signed_limits
+        return self._exceeded
+
+    def _count_cycles(self, rows: np.ndarray, breath_count: int) -> np.ndarray:
+        """
+        Update the breath cycle counters of ``rows`` , like :meth:`.CycleValueCondition.check`
+
+        Returns:
+            :class:`numpy.ndarray`: whether each row has been out of range for its ``n_cycles``
+        """
+        exceeded = self._exceeded[rows]
+        mid_check = self._mid_check[rows]
+        start_cycle = self._start_cycle[rows]
+        met = exceeded & mid_check & (breath_count >= start_cycle + self._n_cycles[rows])
+        self._start_cycle[rows] = np.where(exceeded & ~mid_check, breath_count, start_cycle)
+        self._mid_check[rows] = exceeded
+        return met
+
+    def _check_value_chains(self, breath_count: int) -> typing.List[int]:
+        """
+        Evaluate every chain of value conditions, one position of all chains at a time
+
+        Returns:
+            list: the severity of each chain if it is met, otherwise 0, followed by a 0 for rules without value chains
+        """
+        if len(self._chain_rows) == 0:
+            return [0]
+
+        # the first position of every chain is always evaluated
+        rows = self._chain_rows[:, 0]
+        alive = self._exceeded[rows]
+        if self._position_has_cycle[0]:
+            cycle = self._is_cycle[rows]
+            alive[cycle] = self._count_cycles(rows[cycle], breath_count)
+
+        for position in range(1, self._chain_rows.shape[1]):
+            rows = self._chain_rows[:, position]
+            evaluated = alive & (rows >= 0)
+            if not evaluated.any():
+                break
+            met = self._exceeded[rows] & evaluated
+            if self._position_has_cycle[position]:
+                cycle = evaluated & self._is_cycle[rows]
+                met[cycle] = self._count_cycles(rows[cycle], breath_count)
+            alive &= met | (rows < 0)
+
+        chain_severities = (alive * self._chain_severity).tolist()
+        chain_severities.append(0)
+        return chain_severities
+
+    def _check_mixed_chain(self, elements: list, sensor_values: SensorValues) -> bool:
+        """
+        Evaluate a chain that contains conditions other than value conditions, stopping at the first that isn't met
+        and skipping the rest, like :meth:`.AllOf.check`
+        """
+        for i, (row, is_cycle, check, _) in enumerate(elements):
+            if row is None:
+                met = check(sensor_values)
+            elif is_cycle:
+                met = bool(self._count_cycles(np.array([row]), sensor_values.breath_count)[0])
+            else:
+                met = bool(self._exceeded[row])
+            if not met:
+                for _, _, _, condition in elements[i + 1:]:
+                    condition.skip()
+                return False
+        return True
+
+    def check(self, sensor_values: SensorValues,
+              evaluate: typing.Optional[typing.Callable[[Alarm_Rule], bool]] = None,
+              values_changed: bool = True) -> typing.Iterator[typing.Tuple[Alarm_Rule, typing.Optional[AlarmSeverity]]]:
+        """
+        Check all rules, equivalent to calling :meth:`.Alarm_Rule.check` for each rule in order.
+
+        A generator, so that conditions that depend on the state of other alarms see the changes made by the
+        caller in response to the rules before them.
+
+        Args:
+            sensor_values (:class:`.SensorValues`): values to check
+            evaluate (callable): if given, called with each rule that has conditions other than value conditions
+                as it is reached, rules it returns False for aren't checked and are yielded with a severity of ``None``
+            values_changed (bool): if False, the values read by the value conditions and the limits are the same as
+                in the last check, so the vectorized pass is not repeated and rules with only value conditions are
+                yielded with a severity of ``None``
+
+        Yields:
+            tuple: (:class:`.Alarm_Rule`, :class:`.AlarmSeverity`) for each rule
+        """
+        if values_changed or self._chain_severities is None:
+            values_changed = True
+            self.check_values(sensor_values)
+            self._chain_severities = self._check_value_chains(sensor_values.breath_count)
+        chain_severities = self._chain_severities
+
+        for rule, single, start, stop, mixed_chains in self._rule_plan:
+            if not (values_changed if not mixed_chains else evaluate is None or evaluate(rule)):
+                yield rule, None
+                continue
+            if single is not None:
+                severity = _SEVERITIES[chain_severities[single]]
+            else:
+                severity = _SEVERITIES[max(chain_severities[start:stop])]
+            for chain_severity, elements in mixed_chains:
+                # always check, stateful conditions count breath cycles whether or not they decide the severity
+                if self._check_mixed_chain(elements, sensor_values) and chain_severity > severity:
+                    severity = chain_severity
+            rule._severity = severity
+            yield rule, severity
+
+    def evaluate_stream(self, frame: SensorFrame) -> np.ndarray:
+        """
+        Run the rules over every sample of a frame, as if each sample were given to :meth:`.Alarm_Manager.update`
+        in order, starting with no active alarms and reset conditions. Doesn't change the state of the rules or
+        of the alarm manager.
+
+        Value thresholds and breath cycle counts are evaluated for all samples at once. Only rules with conditions
+        that depend on the state of alarms (like :class:`.CycleAlarmSeverityCondition` ) are stepped through sample by
+        sample, reading the other rules' alarm states from their precomputed severities.
+
+        Since alarms can't be dismissed in a recording, latched alarms stay at their highest severity once raised.
+        Limits are the rules' current limits, alarm dependencies are not updated during the stream.
+
+        :class:`.TimeValueCondition` s are timed with the timestamps of the samples rather than their clock,
+        and start timing again after samples where they were skipped (see :meth:`.TimeValueCondition.skip` ).
+        Other conditions are checked with each sample as :class:`.SensorValues` .
+
+        Args:
+            frame (:class:`.SensorFrame`): samples to evaluate, in time order
+
+        Returns:
+            :class:`numpy.ndarray`: with dtype :data:`.TRANSITION_DTYPE` , each alarm raised, changed, or cleared, in the
+            order :meth:`.Alarm_Manager.update` would emit them
+        """
+        n_samples = len(frame)
+        breath_count = frame.breath_count
+        rule_index = {rule.name: index for index, rule in enumerate(self.rules)}
+
+        # every threshold at every sample, None values in the frame are nan and never out of range
+        if len(self._value_attrs) > 0 and n_samples > 0:
+            vals = np.stack([frame.column(attr).astype(np.float64) for attr in self._value_attrs], axis=-1)
+            exceeded = vals[:, self._value_index] * self._sign > self._signed_limits
+        else:
+            exceeded = np.zeros((n_samples, len(self.conditions)), dtype=bool)
+
+        # value chains, one position at a time
+        alive = np.ones((n_samples, len(self._chain_rows)), dtype=bool)
+        for position in range(self._chain_rows.shape[1]):
+            rows = self._chain_rows[:, position]
+            met = exceeded[:, rows]
+            met[:, rows < 0] = True
+            for chain in np.flatnonzero((rows >= 0) & self._is_cycle[rows]):
+                row = rows[chain]
+                evaluated = np.flatnonzero(alive[:, chain])
+                met[:, chain] = False
+                met[evaluated, chain] = count_cycles(exceeded[evaluated, row], breath_count[evaluated],
+                                                     self._n_cycles[row])
+            alive &= met
+        chain_severities = alive * self._chain_severity
+
+        # severity of each rule from its value chains, and the active alarm severity of rules that don't depend on alarms
+        active = np.zeros((n_samples, len(self.rules)), dtype=np.int64)
+        mixed_rules = []
+        for index, (rule, _, start, stop, mixed_chains) in enumerate(self._rule_plan):
+            if stop > start:
+                active[:, index] = chain_severities[:, start:stop].max(axis=1)
+            if mixed_chains:
+                mixed_rules.append(index)
+            elif rule.latch:
+                active[:, index] = np.maximum.accumulate(active[:, index])
+
+        if mixed_rules and n_samples > 0:
+            self._evaluate_stream_mixed(frame, exceeded, active, mixed_rules, rule_index)
+
+        # transitions are wherever the active severity of an alarm changes
+        previous = np.concatenate((np.zeros((1, len(self.rules)), dtype=np.int64), active[:-1]))
+        sample, changed_rule = np.nonzero(active != previous)
+        transitions = np.zeros(len(sample), dtype=TRANSITION_DTYPE)
+        transitions['timestamp'] = frame.timestamp[sample]
+        transitions['index'] = sample
+        transitions['alarm_type'] = np.array([rule.name.value for rule in self.rules], dtype=np.int16)[changed_rule] \
+            if len(self.rules) > 0 else []
+        transitions['severity'] = active[sample, changed_rule]
+        return transitions
+
+    def _evaluate_stream_mixed(self, frame: SensorFrame, exceeded: np.ndarray, active: np.ndarray,
+                               mixed_rules: typing.List[int], rule_index: dict):
+        """
+        Step the rules whose chains depend on alarm states through the stream, filling in their columns of ``active``
+        (which hold the severities of their value chains).
+        """
+        n_samples = len(frame)
+        breath_count = frame.breath_count.tolist()
+        timestamps = frame.timestamp.tolist()
+        mixed = set(mixed_rules)
+        # alarm states after each sample, preceded by the state before the first
+        padded = {index: [0] + active[:, index].tolist() for index in range(len(self.rules)) if index not in mixed}
+        off = [0] * (n_samples + 1)
+        exceeded_lists = {}
+
+        plan = []
+        for index in mixed_rules:
+            rule, _, _, _, mixed_chains = self._rule_plan[index]
+            chains = []
+            for chain_severity, elements in mixed_chains:
+                stream_elements = []
+                for row, is_cycle, check, condition in elements:
+                    if row is not None:
+                        if row not in exceeded_lists:
+                            exceeded_lists[row] = exceeded[:, row].tolist()
+                        if is_cycle:
+                            stream_elements.append((_STREAM_CYCLE, exceeded_lists[row], int(self._n_cycles[row]),
+                                                    [False, 0]))
+                        else:
+                            stream_elements.append((_STREAM_VALUE, exceeded_lists[row]))
+                    elif type(condition) in (AlarmSeverityCondition, CycleAlarmSeverityCondition):
+                        # alarms checked before this rule have been updated with the current sample, the rest haven't
+                        source = rule_index.get(condition.alarm_type)
+                        states = off if source is None or source in mixed else padded[source]
+                        offset = 1 if source is not None and source < index else 0
+                        n_cycles = condition.n_cycles if type(condition) is CycleAlarmSeverityCondition else 0
+                        stream_elements.append((_STREAM_SEVERITY, states, offset,
+                                                source if source in mixed else None,
+                                                condition.operator, condition.severity, n_cycles, [False, 0]))
+                    elif type(condition) is TimeValueCondition:
+                        stream_elements.append((_STREAM_TIME, frame.column(condition.value_name).tolist(),
+                                                condition.operator, condition.limit, condition.time, [None]))
+                    else:
+                        stream_elements.append((_STREAM_OBJECT, check))
+                # positions of the time conditions, whose deadlines are cleared when they are skipped
+                timed = [position for position, element in enumerate(stream_elements) if element[0] == _STREAM_TIME]
+                chains.append((int(chain_severity), stream_elements, timed))
+            plan.append((index, active[:, index].tolist(), rule.latch, chains, [0] * n_samples))
+
+        current = [0] * len(self.rules)
+        for sample in range(n_samples):
+            breath = breath_count[sample]
+            for index, severities, latch, chains, out in plan:
+                severity = severities[sample]
+                for chain_severity, elements, timed in chains:
+                    met = True
+                    for position, element in enumerate(elements):
+                        kind = element[0]
+                        if kind == _STREAM_VALUE:
+                            met = element[1][sample]
+                        elif kind == _STREAM_CYCLE:
+                            met = _step_cycles(element[1][sample], breath, element[2], element[3])
+                        elif kind == _STREAM_SEVERITY:
+                            _, states, offset, source, operator, alarm_severity, n_cycles, counter = element
+                            state = current[source] if source is not None else states[sample + offset]
+                            met = operator(state, alarm_severity)
+                            if n_cycles:
+                                met = _step_cycles(met, breath, n_cycles, counter)
+                        elif kind == _STREAM_TIME:
+                            _, values, operator, limit, duration, deadline = element
+                            if operator(values[sample], limit):
+                                if deadline[0] is None:
+                                    deadline[0] = timestamps[sample] + duration
+                                met = timestamps[sample] >= deadline[0]
+                            else:
+                                deadline[0] = None
+                                met = False
+                        else:
+                            met = element[1](frame[sample])
+                        if not met:
+                            for skipped in timed:
+                                if skipped > position:
+                                    elements[skipped][5][0] = None
+                            break
+                    if met and chain_severity > severity:
+                        severity = chain_severity
+
+                if latch and current[index] > severity:
+                    severity = current[index]
+                current[index] = severity
+                out[sample] = severity
+
+        for index, _, _, _, out in plan:
+            active[:, index] = out
+
+
+class Input_Index(object):
+    """
+    Which rules read which inputs, so that a rule only needs to be checked again when one of its inputs has changed.
+
+    Conditions are idempotent: checking one again with the same inputs returns the same result and leaves its breath
+    cycle counters where they were, so a rule whose inputs haven't changed still has the severity it was last checked at.
+
+    The inputs of a rule are the :class:`.SensorValues` read by its :class:`.ValueCondition` s and
+    :class:`.CycleValueCondition` s, ``breath_count`` for conditions that count breath cycles, and the
+    severity of the alarms read by its :class:`.AlarmSeverityCondition` s. Rules with any other kind of condition
+    are checked every time.
+
+    Args:
+        rules (dict): {:class:`.AlarmType`: :class:`.Alarm_Rule`}
+
+    Attributes:
+        readers (dict): {:class:`.ValueName` or ``'breath_count'``: set of the :class:`.Alarm_Rule` s that read it}
+        alarm_inputs (dict): {:class:`.Alarm_Rule`: tuple of the :class:`.AlarmType` s whose severity it reads}
+        always (set): of :class:`.Alarm_Rule` s that are checked every time
+    """
+
+    def __init__(self, rules: typing.Dict['AlarmType', Alarm_Rule]):
+        self._rules_dict = rules
+        self.rules = list(rules.values())
+        # keyed by the rules rather than their AlarmType, which is slower to hash
+        self.readers = {} # type: typing.Dict[typing.Union['ValueName', str], typing.Set[Alarm_Rule]]
+        self.alarm_inputs = {} # type: typing.Dict[Alarm_Rule, typing.Tuple['AlarmType', ...]]
+        self.always = set() # type: typing.Set[Alarm_Rule]
+
+        for rule in self.rules:
+            alarm_types = []
+            for _, condition in rule.conditions:
+                for element in condition_chain(condition):
+                    element_type = type(element)
+                    if element_type in (ValueCondition, CycleValueCondition):
+                        self.readers.setdefault(element.value_name, set()).add(rule)
+                    elif element_type in (AlarmSeverityCondition, CycleAlarmSeverityCondition):
+                        if element.alarm_type not in alarm_types:
+                            alarm_types.append(element.alarm_type)
+                    else:
+                        self.always.add(rule)
+                        continue
+                    if element_type in (CycleValueCondition, CycleAlarmSeverityCondition):
+                        self.readers.setdefault('breath_count', set()).add(rule)
+            if alarm_types:
+                self.alarm_inputs[rule] = tuple(alarm_types)
+
+        self._inputs = tuple(self.readers.keys())
+        attrs = [key if isinstance(key, str) else key.name for key in self._inputs]
+        self._get_values = attrgetter(*attrs) if len(attrs) > 1 else \
+            lambda sensor_values: tuple(getattr(sensor_values, attr) for attr in attrs)
+        self._last_values = None # type: typing.Optional[tuple]
+
+    def is_compiled(self, rules: typing.Dict['AlarmType', Alarm_Rule]) -> bool:
+        """
+        Whether this indexes ``rules`` , or rules have been added or removed since
+
+        Args:
+            rules (dict): {:class:`.AlarmType`: :class:`.Alarm_Rule`}
+
+        Returns:
+            bool
+        """
+        return _same_rules(rules, self._rules_dict, self.rules)
+
+    def changed_rules(self, sensor_values: SensorValues) -> typing.Set[Alarm_Rule]:
+        """
+        The rules that read a value that has changed since the last call, and the rules that are always checked.
+        Every rule that reads a value on the first call.
+
+        Args:
+            sensor_values (:class:`.SensorValues`): the new values
+
+        Returns:
+            set: of :class:`.Alarm_Rule`
+        """
+        values = self._get_values(sensor_values)
+        last_values = self._last_values
+        self._last_values = values
+        if last_values is None:
+            return set(self.always).union(*self.readers.values())
+        if values == last_values:
+            return set(self.always)
+
+        changed = set(self.always)
+        for key, value, last_value in zip(self._inputs, values, last_values):
+            if value != last_value:
+                changed |= self.readers[key]
+        return changed
+
+    def reset(self):
+        """
+        Forget the last values, so every rule has changed on the next call to :meth:`.Input_Index.changed_rules`
+        """
+        self._last_values = None
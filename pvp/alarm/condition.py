@@ -1,7 +1,8 @@
+import copy
 import operator
-import types
 import importlib
-import copy
+import typing
+from time import monotonic
 
 
 from pvp.alarm import AlarmType, AlarmSeverity
@@ -23,11 +24,8 @@ class Condition(object):
 
     Subclasses must define :meth:`.Condition.check` and :meth:`.Conditino.reset`
 
-    Condition objects can be added together to create compound conditions.
-
-    Attributes:
-        _child (:class:`Condition`): if another condition is added to this one, store a reference to it
-        """
+    Condition objects can be added together to create compound conditions (see :class:`.AllOf` ).
+    """
 
     def __init__(self, depends: dict = None, *args, **kwargs):
         """
@@ -45,14 +43,13 @@ class Condition(object):
         """
 
         self._manager = None
-        self._child = None
-        self._check = None
         self.depends = depends
 
     @property
     def manager(self):
         """
-        The active alarm manager, used to get status of alarms
+        The alarm manager used to get status of alarms: the one whose rules the condition was loaded into
+        (see :meth:`.Alarm_Manager.load_rule` ), otherwise the shared alarm manager
 
         Returns:
             :class:`pvp.alarm.alarm_manager.Alarm_Manager`
@@ -61,6 +58,10 @@ class Condition(object):
             self._manager = get_alarm_manager()
         return self._manager
 
+    @manager.setter
+    def manager(self, manager):
+        self._manager = manager
+
     def check(self, sensor_values) -> bool:
         """
         Every Condition subclass needs to define this method that accepts :class:`.SensorValues` and returns a boolean
@@ -79,7 +80,16 @@ class Condition(object):
         """
         raise NotImplementedError("every condition needs to override reset!")
 
-    def __add__(self, other: 'Condition'):
+    def skip(self):
+        """
+        Called instead of :meth:`.check` when a condition before this one in an :class:`.AllOf` isn't met.
+
+        Does nothing by default: breath cycle counters keep counting across checks that are missed
+        (see :meth:`.CycleValueCondition.check` ), and other conditions don't keep state.
+        """
+        pass
+
+    def __add__(self, other: 'Condition') -> 'AllOf':
         """
         Add another :class:`Condition` object to check in series.
 
@@ -87,46 +97,153 @@ class Condition(object):
 
         Args:
             other (:class:`Condition`)
+
+        Returns:
+            :class:`.AllOf`
         """
         # can't just add any ole apples n oranges
         assert(issubclass(type(other), Condition))
+        return AllOf(self, other)
 
-        _self = copy.deepcopy(self)
+    def __getstate__(self):
+        # the alarm manager is found again when needed rather than pickled with the condition
+        state = self.__dict__.copy()
+        state['_manager'] = None
+        return state
 
-        if _self._child is None:
-            # if something hasn't been added to us yet...
-            # claim our child
-            _self._child = other
+    def __deepcopy__(self, memo):
+        """
+        Conditions only hold scalars besides :attr:`.depends` , so copy their attributes and :attr:`.depends` rather than
+        recursing through them (which dominated the time to :meth:`.Alarm_Manager.load_rules` )
+        """
+        new = object.__new__(type(self))
+        new.__dict__.update(self.__dict__)
+        new._manager = None
+        if isinstance(self.depends, dict):
+            new.depends = _copy_dependency(self.depends, self, new)
+        elif isinstance(self.depends, (list, tuple)):
+            new.depends = type(self.depends)(_copy_dependency(depend, self, new) for depend in self.depends)
+        memo[id(self)] = new
+        return new
+
+
+def _copy_dependency(dependency: dict, condition: Condition, new_condition: Condition) -> dict:
+    """
+    Copy a :attr:`.Condition.depends` dict, pointing it at the copied condition if it was registered with
+    :meth:`.Alarm_Manager.register_dependency`
+    """
+    dependency = dependency.copy()
+    if dependency.get('condition') is condition:
+        dependency['condition'] = new_condition
+    return dependency
 
-            # override our check method so we check recursively
-            # make a quick backup first tho yno
-            _self._check = _self.check
-            _self._reset = _self.reset
 
-            def new_check(self, sensor_values):
-                if not self._check(sensor_values):
-                    # if our stashed condition check is false,
-                    # return immediately
-                    return False
-                else:
-                    # otherwise call check (potentially recursively)
-                    return self._child.check(sensor_values)
+class AllOf(Condition):
+    """
+    Conditions checked in series, met only if every one of them is.
 
-            # use python types to programmatically reassign method
-            _self.check = types.MethodType(new_check, _self)
+    Made by adding conditions together: ``a + b + c`` is ``AllOf(a, b, c)`` . Conditions are checked in order and
+    checking stops at the first condition that isn't met, so stateful conditions later in the sequence
+    (eg. :class:`.CycleValueCondition` ) are only checked while the conditions before them are met.
+    The conditions that aren't checked are told with :meth:`.Condition.skip` , so eg. a :class:`.TimeValueCondition`
+    starts timing again rather than being met as soon as it is checked again.
 
-            def new_reset(self):
-                self._reset()
-                self._child.reset()
+    Adding :class:`.AllOf` s together makes a single flat :class:`.AllOf` . The conditions are kept as they are,
+    not copied, so a stateful condition shouldn't be used in more than one compound condition.
 
-            _self.reset = types.MethodType(new_reset, _self)
+    Args:
+        *conditions (:class:`.Condition`): conditions to check, in order
 
-        else:
-            # if we have already had something added to us,
-            # add it to our child instead, (also potentially recursively)
-            _self._child = _self._child + other
+    Attributes:
+        conditions (tuple): of :class:`.Condition` s
+    """
+
+    def __init__(self, *conditions: Condition):
+        self._manager = None
+        flat = []
+        for condition in conditions:
+            assert(issubclass(type(condition), Condition))
+            if isinstance(condition, AllOf):
+                flat.extend(condition.conditions)
+            else:
+                flat.append(condition)
+        assert(len(flat) > 0)
+        self.conditions = tuple(flat)
+
+    @property
+    def depends(self):
+        """
+        :attr:`.Condition.depends` of the first condition
+        """
+        return self.conditions[0].depends
+
+    @property
+    def value_name(self) -> ValueName:
+        """
+        ``value_name`` of the first condition
+        """
+        return self.conditions[0].value_name
+
+    def check(self, sensor_values) -> bool:
+        """
+        Check each condition in order until one isn't met, and :meth:`.Condition.skip` the rest
+
+        Args:
+            sensor_values ( :class:`.SensorValues` ):
+
+        Returns:
+            bool: True if every condition is met
+        """
+        for i, condition in enumerate(self.conditions):
+            if not condition.check(sensor_values):
+                for skipped in self.conditions[i + 1:]:
+                    skipped.skip()
+                return False
+        return True
+
+    def reset(self):
+        """
+        Reset every condition
+        """
+        for condition in self.conditions:
+            condition.reset()
+
+    def __add__(self, other: Condition) -> 'AllOf':
+        assert(issubclass(type(other), Condition))
+        return AllOf(*self.conditions, other)
+
+    def __deepcopy__(self, memo):
+        new = AllOf(*(copy.deepcopy(condition, memo) for condition in self.conditions))
+        memo[id(self)] = new
+        return new
+
+    def __iter__(self):
+        return iter(self.conditions)
+
+    def __len__(self) -> int:
+        return len(self.conditions)
+
+
+class RelativeLimit(object):
+    """
+    A picklable ``transform`` for :attr:`.Condition.depends` that sets a limit relative to a control value,
+    ``value + value * fraction``
+
+    Args:
+        fraction (float): eg. ``-0.10`` for a limit 10% below the control value
+    """
+
+    def __init__(self, fraction: float):
+        self.fraction = fraction
 
-        return _self
+    def __call__(self, value: float) -> float:
+        return value + value * self.fraction
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, RelativeLimit) and other.fraction == self.fraction
+
+    def __repr__(self) -> str:
+        return f'RelativeLimit({self.fraction})'
 
 
 class ValueCondition(Condition):
@@ -281,33 +398,75 @@ class CycleValueCondition(ValueCondition):
         self._start_cycle = 0
 
 
-class TimeValueCondition(ValueCondition): # pragma: no cover
+class TimeValueCondition(ValueCondition):
     """
-    value goes out of range for specific amount of time
+    Value goes out of range for a specific amount of time
+
+    When the value first goes out of range, the time it has to stay out of range until is set as a deadline,
+    so each check only compares the clock to the deadline. The condition doesn't keep time between checks,
+    it is met at the first check at or after the deadline. If it isn't checked because a condition before it in
+    an :class:`.AllOf` isn't met, the deadline is cleared, since the value may have been in range in the meantime.
 
-    .. warning::
+    Args:
+        time (float): number of seconds value must be out of range
+        clock (callable): returns the current time in seconds, (default: :func:`time.monotonic` ).
+            the clock of a condition in :data:`.alarm.ALARM_RULES` has to be picklable.
 
-        Not implemented!
+    Attributes:
+        _deadline (float, None): time the condition is met at if the value stays out of range,
+            or None if the value is in range
     """
 
-    def __init__(self, time, *args, **kwargs):
+    def __init__(self, time: float, *args, clock: typing.Callable[[], float] = monotonic, **kwargs):
+        super(TimeValueCondition, self).__init__(*args, **kwargs)
+        self._time = None
+        self.time = time
+        self.clock = clock
+
+        self._deadline = None
+
+    @property
+    def time(self) -> float:
+        """Number of seconds value must be out of range"""
+        return self._time
+
+    @time.setter
+    def time(self, time: float):
+        assert(time >= 0)
+        self._time = float(time)
+
+    def check(self, sensor_values) -> bool:
         """
+        Check if outside of range, and then check if the deadline has passed
 
         Args:
-            time (float): number of seconds value must be out of range
-            *args:
-            **kwargs:
+            sensor_values ( :class:`.SensorValues` ):
+
+        Returns:
+            bool
         """
-        super(TimeValueCondition, self).__init__(*args, **kwargs)
-        self.time = time
+        if super(TimeValueCondition, self).check(sensor_values):
+            now = self.clock()
+            if self._deadline is None:
+                # first time out of range
+                self._deadline = now + self._time
+            return now >= self._deadline
+        else:
+            self._deadline = None
+            return False
 
-        raise NotImplementedError('Time condition has not been implemented!')
+    def reset(self):
+        """
+        Clear the deadline
+        """
+        self._deadline = None
 
-    def check(self, sensor_values):
-        pass
+    def skip(self):
+        """
+        Clear the deadline
+        """
+        self._deadline = None
 
-    def reset(self):
-        pass
 
 class AlarmSeverityCondition(Condition):
 
@@ -0,0 +1,287 @@
+"""
+A persistent history of alarms in an SQLite database, so alarms can be reviewed after the fact and across restarts
+rather than only while they are in :attr:`.Alarm_Manager.logged_alarms` .
+
+Every :class:`.Alarm` emitted by an alarm manager with a :attr:`.Alarm_Manager.history` is added as a row, including
+alarms that are cleared (:attr:`.AlarmSeverity.OFF` ), so the history is the sequence of every alarm's transitions.
+Rows are indexed by time, by alarm type and time, and by severity and time, for :meth:`.Alarm_History.alarms_between`
+and :meth:`.Alarm_History.counts_per_hour` .
+
+Alarms are added from the thread that emits them, often the controller's main loop, so :meth:`.Alarm_History.add`
+only queues the row. A writer thread inserts the queued rows and commits them in batches, and queries that read the
+database write any queued rows first.
+
+The most recent alarms are also kept in memory in :attr:`.Alarm_History.recent` , and queries that only reach back
+as far as they do are answered without reading the database.
+
+Only one process should add alarms to a history file at a time, other processes can open it with ``readonly=True`` .
+"""
+import os
+import sqlite3
+import threading
+import typing
+from collections import deque
+
+from pvp import prefs
+from pvp.alarm import AlarmType, AlarmSeverity
+from pvp.alarm.alarm import Alarm
+from pvp.common.loggers import init_logger
+from pvp.common.values import ValueName
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS alarms ('
+    'alarm_id INTEGER, timestamp REAL NOT NULL, alarm_type TEXT NOT NULL, severity INTEGER NOT NULL, '
+    'latch INTEGER, cause TEXT, value, message TEXT)',
+    'CREATE INDEX IF NOT EXISTS alarms_timestamp ON alarms (timestamp)',
+    'CREATE INDEX IF NOT EXISTS alarms_type ON alarms (alarm_type, timestamp)',
+    'CREATE INDEX IF NOT EXISTS alarms_severity ON alarms (severity, timestamp)',
+)
+
+_COLUMNS = 'alarm_id, timestamp, alarm_type, severity, latch, cause, value, message'
+
+
+class Alarm_History:
+    """
+    Persistent store of alarms.
+
+    Alarm types are stored by name and severities by value, so a history stays readable if alarm types are added.
+
+    Args:
+        path (str): path of the database file, absolute or relative to ``LOG_DIR`` , created if it doesn't exist.
+            ``':memory:'`` keeps the history in memory only.
+        recent_length (int): number of the most recent alarms kept in :attr:`.recent`
+        readonly (bool): open an existing history without adding to it, eg. from another process than the one
+            adding alarms. Queries always read the database, since :attr:`.recent` isn't kept up to date.
+
+    Attributes:
+        recent (:class:`collections.deque`): the most recent :class:`.Alarm` s, oldest first
+    """
+
+    def __init__(self, path: str, recent_length: int = 1000, readonly: bool = False):
+        if path != ':memory:' and not os.path.isabs(path):
+            path = os.path.join(prefs.get_pref('LOG_DIR'), path)
+        self.path = path
+        self.readonly = readonly
+        self.logger = init_logger(__name__)
+
+        # alarms are added from the thread that updates the alarm manager, and queried from others.
+        # _lock guards recent and the queued rows and is only held briefly, _db_lock guards the connection.
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._pending = [] # type: typing.List[tuple]
+        self._pending_event = threading.Event()
+        self._closed = False
+        self._writer = None # type: typing.Optional[threading.Thread]
+        if readonly:
+            self._connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        else:
+            if path != ':memory:':
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            # with a write-ahead log, commits don't wait for the disk, so adding alarms is fast
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in _SCHEMA:
+                self._connection.execute(statement)
+            self._connection.commit()
+
+        self.recent = deque(maxlen=recent_length) # type: typing.Deque[Alarm]
+        self._recent_complete = True
+        if not readonly and recent_length > 0:
+            rows = self._connection.execute(
+                f'SELECT {_COLUMNS} FROM alarms ORDER BY timestamp DESC LIMIT ?', (recent_length + 1,)).fetchall()
+            # if there are more alarms than fit, queries from before the oldest one kept have to read the database
+            self._recent_complete = len(rows) <= recent_length
+            self.recent.extend(_row_to_alarm(row) for row in reversed(rows[:recent_length]))
+
+        if not readonly:
+            self._writer = threading.Thread(target=self._write_queued, daemon=True)
+            self._writer.start()
+
+    def add(self, alarm: Alarm):
+        """
+        Add an alarm to the history. Can be used as an :meth:`.Alarm_Manager.add_callback` .
+
+        The alarm is in :attr:`.recent` when this returns, and is queued to be written to the database by the writer
+        thread. Errors writing to the database are logged rather than raised, so they don't interrupt emitting alarms.
+
+        Args:
+            alarm (:class:`.Alarm`): raised or cleared alarm
+        """
+        if self.readonly:
+            raise PermissionError('Alarm history was opened readonly')
+        row = (
+            alarm.id,
+            alarm.start_time,
+            alarm.alarm_type.name,
+            int(alarm.severity),
+            int(alarm.latch),
+            None if alarm.cause is None else ','.join(value_name.name for value_name in alarm.cause),
+            alarm.value,
+            alarm.message
+        )
+        with self._lock:
+            if len(self.recent) == self.recent.maxlen:
+                self._recent_complete = False
+            self.recent.append(alarm)
+            self._pending.append(row)
+        self._pending_event.set()
+
+    def flush(self):
+        """
+        Write the queued alarms to the database and commit them
+        """
+        with self._db_lock:
+            with self._lock:
+                rows = self._pending
+                self._pending = []
+            if not rows or self._closed:
+                return
+            try:
+                self._connection.executemany(
+                    f'INSERT INTO alarms ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                self._connection.commit()
+            except sqlite3.Error as e:
+                self.logger.exception(f'Couldnt add {len(rows)} alarms to history {self.path}, got exception\n    {e}')
+
+    def _write_queued(self):
+        """
+        Writer thread, writes queued alarms as they are added until the history is closed
+        """
+        while not self._closed:
+            self._pending_event.wait()
+            self._pending_event.clear()
+            self.flush()
+
+    def alarms_between(self, t0: float = None, t1: float = None,
+                       min_severity: AlarmSeverity = None,
+                       alarm_type: AlarmType = None) -> typing.List[Alarm]:
+        """
+        Alarms with ``t0 <= start_time < t1`` , in time order
+
+        Args:
+            t0 (float): if None, from the first alarm
+            t1 (float): if None, to the last alarm
+            min_severity (:class:`.AlarmSeverity`): only alarms at least this severe, eg. ``AlarmSeverity.LOW``
+                for raised alarms without the cleared ones. if None, all alarms
+            alarm_type (:class:`.AlarmType`): only alarms of this type. if None, all types
+
+        Returns:
+            list: of :class:`.Alarm` s. Alarms from the database are new objects with the ``id`` of the stored alarm.
+        """
+        with self._lock:
+            if self._in_recent(t0):
+                return [alarm for alarm in self.recent
+                        if (t0 is None or alarm.start_time >= t0)
+                        and (t1 is None or alarm.start_time < t1)
+                        and (min_severity is None or alarm.severity >= min_severity)
+                        and (alarm_type is None or alarm.alarm_type is alarm_type)]
+
+        self.flush()
+        where, params = _where(t0, t1, min_severity, alarm_type)
+        with self._db_lock:
+            rows = self._connection.execute(
+                f'SELECT {_COLUMNS} FROM alarms {where} ORDER BY timestamp', params).fetchall()
+        return [_row_to_alarm(row) for row in rows]
+
+    def counts_per_hour(self, t0: float = None, t1: float = None,
+                        min_severity: AlarmSeverity = AlarmSeverity.LOW
+                        ) -> typing.Dict[AlarmType, typing.Dict[float, int]]:
+        """
+        Number of alarms of each type in each hour, counted by the database. Each raise and change of severity counts
+        as an alarm, with the default ``min_severity`` clearing an alarm doesn't.
+
+        Args:
+            t0 (float): if None, from the first alarm
+            t1 (float): if None, to the last alarm
+            min_severity (:class:`.AlarmSeverity`): only count alarms at least this severe. if None, all alarms
+
+        Returns:
+            dict: {:class:`.AlarmType` : {start of the hour (``time.time()`` timestamp): number of alarms}}
+        """
+        self.flush()
+        where, params = _where(t0, t1, min_severity, None)
+        with self._db_lock:
+            rows = self._connection.execute(
+                f'SELECT alarm_type, CAST(timestamp / 3600 AS INTEGER) AS hour, COUNT(*) FROM alarms {where} '
+                f'GROUP BY alarm_type, hour ORDER BY hour', params).fetchall()
+
+        counts = {} # type: typing.Dict[AlarmType, typing.Dict[float, int]]
+        for alarm_type, hour, count in rows:
+            counts.setdefault(AlarmType[alarm_type], {})[hour * 3600.] = count
+        return counts
+
+    def _in_recent(self, t0: typing.Optional[float]) -> bool:
+        """
+        Whether every stored alarm since ``t0`` is in :attr:`.recent`
+        """
+        if self.readonly:
+            return False
+        if self._recent_complete:
+            return True
+        return t0 is not None and len(self.recent) > 0 and t0 > self.recent[0].start_time
+
+    def __len__(self) -> int:
+        self.flush()
+        with self._db_lock:
+            return self._connection.execute('SELECT COUNT(*) FROM alarms').fetchone()[0]
+
+    def close(self):
+        """
+        Write the queued alarms, stop the writer thread, and close the database
+        """
+        self.flush()
+        with self._db_lock:
+            self._closed = True
+            self._connection.close()
+        self._pending_event.set()
+        if self._writer is not None:
+            self._writer.join(1)
+            self._writer = None
+
+
+def _where(t0, t1, min_severity, alarm_type) -> typing.Tuple[str, tuple]:
+    """
+    WHERE clause and its parameters for :meth:`.Alarm_History.alarms_between` and :meth:`.Alarm_History.counts_per_hour`
+    """
+    clauses = []
+    params = []
+    if t0 is not None:
+        clauses.append('timestamp >= ?')
+        params.append(t0)
+    if t1 is not None:
+        clauses.append('timestamp < ?')
+        params.append(t1)
+    if min_severity is not None:
+        clauses.append('severity >= ?')
+        params.append(int(min_severity))
+    if alarm_type is not None:
+        clauses.append('alarm_type = ?')
+        params.append(alarm_type.name)
+    if not clauses:
+        return '', ()
+    return 'WHERE ' + ' AND '.join(clauses), tuple(params)
+
+
+def _row_to_alarm(row: tuple) -> Alarm:
+    alarm_id, timestamp, alarm_type, severity, latch, cause, value, message = row
+    if cause is not None:
+        cause = [ValueName[name] for name in cause.split(',')]
+    alarm = Alarm(AlarmType[alarm_type], AlarmSeverity(severity), start_time=float(timestamp), latch=bool(latch),
+                  cause=cause, value=value, message=message)
+    if alarm_id is not None:
+        alarm.id = alarm_id
+    return alarm
+
+
+def get_alarm_history() -> typing.Optional[Alarm_History]:
+    """
+    The alarm history at the ``ALARM_HISTORY_FN`` pref
+
+    Returns:
+        :class:`.Alarm_History` , or None if the pref isn't set
+    """
+    path = prefs.get_pref('ALARM_HISTORY_FN')
+    if path is None:
+        return None
+    return Alarm_History(path)
@@ -0,0 +1,171 @@
+"""
+Latency of the alarm pipeline, from the sensor values that crossed a threshold to the alarm being shown.
+
+Each :class:`.Alarm` carries the times it passed through each stage of the pipeline in :attr:`.Alarm.timestamps` ,
+all from ``time.time()`` so that stages in different processes can be compared:
+
+* ``'sample'`` - the :attr:`.SensorValues.timestamp` of the values the alarm was raised from
+* ``'checked'`` - when the :class:`.Alarm_Manager` started checking them (:meth:`.Alarm_Manager.update` or
+  :meth:`.Alarm_Manager.check_rule` )
+* ``'emitted'`` - when :meth:`.Alarm_Manager.emit_alarm` made the alarm, before calling its callbacks
+* ``'handled'`` - when :meth:`.PVP_Gui.handle_alarm` received it
+* ``'displayed'`` - when :meth:`.Alarm_Bar.add_alarm` has shown its card and started the alarm sound
+
+The latency of each stage since ``'sample'`` is counted in a histogram per alarm type by an :class:`.Alarm_Latency` ,
+which is :attr:`.Alarm_Manager.latency` . Alarms that weren't raised from sensor values (eg. cleared when dismissed)
+have no ``'sample'`` time and aren't counted.
+"""
+import time
+import typing
+from bisect import bisect_left
+
+import numpy as np
+
+from pvp.alarm import AlarmType
+from pvp.alarm.alarm import Alarm
+
+STAGES = ('checked', 'emitted', 'handled', 'displayed')
+"""
+Stages of the alarm pipeline after ``'sample'`` , in order
+"""
+
+
+class Alarm_Latency:
+    """
+    Histograms of the latency of each stage of the alarm pipeline, per alarm type.
+
+    Bins are log-spaced, so percentiles are accurate to within a bin width (about 12% with the default
+    20 bins per decade) from ``min_latency`` to ``max_latency`` . Latencies outside that range are counted in the
+    first or last bin.
+
+    Args:
+        min_latency (float): lower edge of the first bin (in seconds, default: 1e-6)
+        max_latency (float): upper edge of the last bin (in seconds, default: 100)
+        bins_per_decade (int): (default: 20)
+
+    Attributes:
+        edges (:class:`numpy.ndarray`): upper edges of the bins
+        histograms (dict): {:class:`.AlarmType`: {stage: :class:`numpy.ndarray` of counts per bin}}
+    """
+
+    def __init__(self, min_latency: float = 1e-6, max_latency: float = 100., bins_per_decade: int = 20):
+        n_bins = int(round(np.log10(max_latency / min_latency) * bins_per_decade))
+        self.edges = np.logspace(np.log10(min_latency), np.log10(max_latency), n_bins + 1)[1:]
+        self._edges = self.edges.tolist()
+        self.histograms = {} # type: typing.Dict[AlarmType, typing.Dict[str, np.ndarray]]
+        # exact number, sum and max of each histogram: {(alarm type, stage): [n, sum, max]}
+        self._stats = {} # type: typing.Dict[typing.Tuple[AlarmType, str], list]
+
+    def stamp(self, alarm: Alarm, stage: str, timestamp: float = None):
+        """
+        Set the time ``alarm`` reached ``stage`` , and :meth:`.record` its latency
+
+        Args:
+            alarm (:class:`.Alarm`):
+            stage (str): one of :data:`.STAGES`
+            timestamp (float): if None, ``time.time()``
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        alarm.timestamps[stage] = timestamp
+        self.record(alarm, stage)
+
+    def record(self, alarm: Alarm, stage: str):
+        """
+        Count the latency of ``alarm`` from ``'sample'`` to ``stage`` , if it has both timestamps
+
+        Args:
+            alarm (:class:`.Alarm`):
+            stage (str): one of :data:`.STAGES`
+        """
+        timestamps = alarm.timestamps
+        sample = timestamps.get('sample')
+        stage_time = timestamps.get(stage)
+        if sample is None or stage_time is None:
+            return
+        latency = stage_time - sample
+
+        alarm_type = alarm.alarm_type
+        stages = self.histograms.get(alarm_type)
+        if stages is None:
+            stages = self.histograms[alarm_type] = {}
+        histogram = stages.get(stage)
+        if histogram is None:
+            histogram = stages[stage] = np.zeros(len(self._edges), dtype=np.int64)
+            self._stats[(alarm_type, stage)] = [0, 0., latency]
+        histogram[min(bisect_left(self._edges, latency), len(self._edges) - 1)] += 1
+
+        stats = self._stats[(alarm_type, stage)]
+        stats[0] += 1
+        stats[1] += latency
+        if latency > stats[2]:
+            stats[2] = latency
+
+    def percentile(self, q: float, stage: str = 'displayed',
+                   alarm_type: typing.Optional[AlarmType] = None) -> typing.Optional[float]:
+        """
+        Latency that ``q`` percent of alarms reached ``stage`` within, the upper edge of the bin it falls in
+
+        Args:
+            q (float): percentile, from 0 to 100
+            stage (str): one of :data:`.STAGES`
+            alarm_type (:class:`.AlarmType`): if None, of all alarm types
+
+        Returns:
+            float: latency in seconds, or None if no alarms have reached ``stage``
+        """
+        histogram, n, _, maximum = self._combined(stage, alarm_type)
+        if n == 0:
+            return None
+        rank = max(int(np.ceil(q / 100. * n)), 1)
+        latency = self.edges[int(np.searchsorted(np.cumsum(histogram), rank))]
+        return float(min(latency, maximum))
+
+    def summary(self) -> typing.Dict[AlarmType, typing.Dict[str, typing.Dict[str, float]]]:
+        """
+        Latency statistics of each stage, per alarm type
+
+        Returns:
+            dict: {:class:`.AlarmType`: {stage: {'n', 'mean', 'p50', 'p99', 'max'}}}, latencies in seconds,
+            of the alarm types and stages that have been recorded
+        """
+        summary = {}
+        for alarm_type, stages in self.histograms.items():
+            summary[alarm_type] = {}
+            for stage in STAGES:
+                if stage not in stages:
+                    continue
+                n, total, maximum = self._stats[(alarm_type, stage)]
+                summary[alarm_type][stage] = {
+                    'n': n,
+                    'mean': total / n,
+                    'p50': self.percentile(50, stage, alarm_type),
+                    'p99': self.percentile(99, stage, alarm_type),
+                    'max': maximum
+                }
+        return summary
+
+    def reset(self):
+        """
+        Clear all histograms
+        """
+        self.histograms = {}
+        self._stats = {}
+
+    def _combined(self, stage: str, alarm_type: typing.Optional[AlarmType]) -> tuple:
+        """
+        histogram, number, sum and max of the latencies of ``stage`` of one or all alarm types
+        """
+        alarm_types = self.histograms.keys() if alarm_type is None else (alarm_type,)
+        histogram = np.zeros(len(self._edges), dtype=np.int64)
+        n, total, maximum = 0, 0., 0.
+        for combined_type in alarm_types:
+            stage_histogram = self.histograms.get(combined_type, {}).get(stage)
+            if stage_histogram is None:
+                continue
+            histogram += stage_histogram
+            type_n, type_total, type_max = self._stats[(combined_type, stage)]
+            n += type_n
+            total += type_total
+            maximum = max(maximum, type_max)
+        return histogram, n, total, maximum
@@ -1,6 +1,7 @@
 """
 Class to declare alarm rules
 """
+import copy
 import typing
 from pvp.common.values import ValueName
 from pvp.alarm import AlarmType, AlarmSeverity
@@ -24,6 +25,15 @@ class Alarm_Rule(object):
 
         self._severity = AlarmSeverity.OFF
 
+    def __deepcopy__(self, memo):
+        """
+        Copy the rule with copies of its conditions, without recursing through the rest of its attributes
+        """
+        new = copy.copy(self)
+        new.conditions = tuple((severity, copy.deepcopy(condition, memo)) for severity, condition in self.conditions)
+        memo[id(self)] = new
+        return new
+
     def check(self, sensor_values):
         """
         Check all of our :attr:`.conditions` .
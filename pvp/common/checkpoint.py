@@ -0,0 +1,190 @@
+"""
+Checkpoints of the controller's state in a memory-mapped file, so that a restarted controller can resume
+where the last one left off rather than from its defaults.
+
+The controller writes a checkpoint every ``CONTROLLER_CHECKPOINT_INTERVAL`` seconds (see
+:meth:`.ControlModuleBase._write_checkpoint` ), and a new controller given the same file restores the
+most recent checkpoint when it is initialized, if it is younger than ``CONTROLLER_CHECKPOINT_MAX_AGE`` .
+
+The file holds two slots with the fixed layout :data:`.CHECKPOINT_DTYPE` , written alternately and each guarded by
+a sequence counter, so there is always one complete checkpoint even if the controller dies mid-write.
+Writes go to the page cache through the memory map, so they survive the controller process being killed
+without having to be synced to disk.
+"""
+import os
+import time
+import typing
+
+import numpy as np
+
+from pvp.common.values import ValueName
+
+CHECKPOINT_VERSION = 1
+"""
+Version of :data:`.CHECKPOINT_DTYPE` , files written with another version are ignored
+"""
+
+CHECKPOINT_CONTROLS = (
+    ValueName.PIP,
+    ValueName.PIP_TIME,
+    ValueName.PEEP,
+    ValueName.PEEP_TIME,
+    ValueName.BREATHS_PER_MINUTE,
+    ValueName.INSPIRATION_TIME_SEC
+)
+"""
+Order of the control settings in ``CHECKPOINT_DTYPE['controls']``
+"""
+
+CHECKPOINT_DERIVED = ('PIP', 'PIP_PLATEAU', 'PIP_TIME', 'PEEP', 'PEEP_TIME', 'I_PHASE', 'BPM', 'VTE')
+"""
+Order of the controller's last derived values (its ``_DATA_<name>`` attributes) in ``CHECKPOINT_DTYPE['derived']``
+"""
+
+CHECKPOINT_FLOW_LENGTH = 500
+"""
+Number of flow samples kept for the baseline flow estimate, the controller's ``_BASELINE_ESTIMATOR_LENGTH``
+"""
+
+CHECKPOINT_WAVEFORM_LENGTH = 2048
+"""
+Maximum number of (phase, pressure, volume) rows kept of each waveform, the newest are kept
+"""
+
+CHECKPOINT_DTYPE = np.dtype([
+    ('seq', np.uint64),               # sequence counter, odd while a write is in progress
+    ('version', np.uint64),
+    ('timestamp', np.float64),        # time.time() of the checkpoint
+    ('controls', np.float64, (len(CHECKPOINT_CONTROLS),)),
+    ('breath_detection', np.int64),
+    ('limit_hapa', np.float64),
+    ('breath_count', np.int64),
+    ('cycle_start', np.float64),
+    ('derived', np.float64, (len(CHECKPOINT_DERIVED),)),   # nan if None
+    ('flow_length', np.int64),
+    ('flow', np.float64, (CHECKPOINT_FLOW_LENGTH,)),
+    ('last_waveform_length', np.int64),   # last complete breath cycle
+    ('last_waveform', np.float64, (CHECKPOINT_WAVEFORM_LENGTH, 3)),
+    ('cycle_waveform_length', np.int64),  # current breath cycle so far
+    ('cycle_waveform', np.float64, (CHECKPOINT_WAVEFORM_LENGTH, 3))
+])
+"""
+Fixed binary layout of one slot of a :class:`.Checkpoint` file
+"""
+
+
+class Checkpoint:
+    """
+    Controller state in a memory-mapped file.
+
+    Only one controller should write to a checkpoint file at a time.
+
+    Args:
+        path (str): path of the checkpoint file. created if it doesn't exist, or if it was written with
+            another :data:`.CHECKPOINT_VERSION`
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        size = 2 * CHECKPOINT_DTYPE.itemsize
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            self._create()
+        self._slots = np.memmap(path, dtype=CHECKPOINT_DTYPE, mode='r+', shape=(2,))
+        if np.any((self._slots['version'] != CHECKPOINT_VERSION) & (self._slots['seq'] != 0)):
+            self._slots[:] = np.zeros(2, dtype=CHECKPOINT_DTYPE)
+
+    def _create(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'wb') as checkpoint_file:
+            checkpoint_file.truncate(2 * CHECKPOINT_DTYPE.itemsize)
+
+    def write(self, state: dict):
+        """
+        Write a checkpoint to the slot that doesn't hold the most recent complete checkpoint, so a write that
+        is interrupted never destroys the checkpoint :meth:`.Checkpoint.read` would restore
+
+        Args:
+            state (dict): with keys ``controls`` ({:class:`.ValueName`: value} for each of :data:`.CHECKPOINT_CONTROLS` ),
+                ``breath_detection`` , ``limit_hapa`` , ``breath_count`` , ``cycle_start`` ,
+                ``derived`` ({name: value or None} for each of :data:`.CHECKPOINT_DERIVED` ),
+                ``flow`` (sequence of floats), ``last_waveform`` and ``cycle_waveform`` (Nx3 arrays, may be None) ,
+                and optionally ``timestamp`` (default ``time.time()`` )
+        """
+        seqs = self._slots['seq']
+        newest = _newest_complete(np.array(self._slots))
+        index = 0 if newest is None else 1 - newest
+        seq = int(max(seqs[0], seqs[1]))
+        seq = (seq + 1) & ~1
+
+        slot = self._slots[index:index + 1]
+        slot['seq'] = seq + 1
+        slot['version'] = CHECKPOINT_VERSION
+        slot['timestamp'] = state.get('timestamp', time.time())
+        slot['controls'][0] = [state['controls'][value_name] for value_name in CHECKPOINT_CONTROLS]
+        slot['breath_detection'] = int(state['breath_detection'])
+        slot['limit_hapa'] = state['limit_hapa']
+        slot['breath_count'] = state['breath_count']
+        slot['cycle_start'] = state['cycle_start']
+        slot['derived'][0] = [np.nan if state['derived'][name] is None else state['derived'][name]
+                              for name in CHECKPOINT_DERIVED]
+
+        flow = np.asarray(state['flow'], dtype=np.float64)[-CHECKPOINT_FLOW_LENGTH:]
+        slot['flow_length'] = len(flow)
+        slot['flow'][0, :len(flow)] = flow
+
+        for name in ('last_waveform', 'cycle_waveform'):
+            waveform = state[name]
+            if waveform is None:
+                waveform = np.zeros((0, 3))
+            waveform = np.asarray(waveform, dtype=np.float64)[-CHECKPOINT_WAVEFORM_LENGTH:]
+            slot[f'{name}_length'] = len(waveform)
+            slot[name][0, :len(waveform)] = waveform
+
+        slot['seq'] = seq + 2
+
+    def read(self) -> typing.Union[None, dict]:
+        """
+        Read the most recent complete checkpoint
+
+        Returns:
+            dict: in the format of :meth:`.Checkpoint.write` , including ``timestamp`` , or None if there is no
+            complete checkpoint
+        """
+        slots = np.array(self._slots)
+        newest = _newest_complete(slots)
+        if newest is None:
+            return None
+        slot = slots[newest]
+
+        derived = {name: None if np.isnan(value) else float(value)
+                   for name, value in zip(CHECKPOINT_DERIVED, slot['derived'])}
+        return {
+            'timestamp': float(slot['timestamp']),
+            'controls': {value_name: float(value) for value_name, value in zip(CHECKPOINT_CONTROLS, slot['controls'])},
+            'breath_detection': bool(slot['breath_detection']),
+            'limit_hapa': float(slot['limit_hapa']),
+            'breath_count': int(slot['breath_count']),
+            'cycle_start': float(slot['cycle_start']),
+            'derived': derived,
+            'flow': slot['flow'][:slot['flow_length']].copy(),
+            'last_waveform': slot['last_waveform'][:slot['last_waveform_length']].copy(),
+            'cycle_waveform': slot['cycle_waveform'][:slot['cycle_waveform_length']].copy()
+        }
+
+    def close(self):
+        """
+        Flush the checkpoint file to disk and close it
+        """
+        self._slots.flush()
+        del self._slots
+
+
+def _newest_complete(slots: np.ndarray) -> typing.Optional[int]:
+    """
+    Index of the slot with the most recent complete checkpoint, or None if neither slot is complete
+    """
+    complete = (slots['seq'] != 0) & (slots['seq'] % 2 == 0) & (slots['version'] == CHECKPOINT_VERSION)
+    if not np.any(complete):
+        return None
+    return int(np.flatnonzero(complete)[np.argmax(slots['seq'][complete])])
@@ -0,0 +1,407 @@
+"""
+Compact binary encoding of the messages that cross the process boundary, as an alternative to :mod:`pickle` .
+
+:func:`.encode` packs a :class:`.SensorValues` , :class:`.ControlSetting` , :class:`.ControlValues` ,
+:class:`.DerivedValues` or :class:`~.alarm.Alarm` (or ``None`` ) into a fixed binary layout, and :func:`.decode`
+unpacks it again. The result is plain ``bytes`` , so it can be sent by any coordinator transport or stored by the
+:class:`.DataLogger` .
+
+Every message starts with a two byte header: the :data:`.CODEC_VERSION` and the :class:`.MessageKind` . The rest
+of the message has the fixed layout given by the kind's numpy dtype in :data:`.MESSAGE_DTYPES` , so a batch of
+encoded messages of the same kind can be viewed as a structured array with :func:`.to_array` without decoding each one.
+The only variable-length part is an :class:`~.alarm.Alarm` 's ``message`` , which follows its fixed layout.
+
+Enums are stored by value and ``None`` s in a bitmask, so a message is decoded without looking anything up by module
+path. The layouts follow the order of :data:`.values.SENSOR` and :class:`.ValueName` , so :data:`.CODEC_VERSION`
+must be incremented whenever those change, and messages encoded with another version are refused.
+"""
+import struct
+import typing
+from operator import attrgetter
+from enum import IntEnum
+
+import numpy as np
+
+from pvp.common import values
+from pvp.common.message import SensorValues, ControlSetting, ControlValues, DerivedValues
+from pvp.common.values import ValueName
+from pvp.alarm import AlarmType, AlarmSeverity
+from pvp.alarm.alarm import Alarm
+
+CODEC_VERSION = 2
+"""
+Version of the binary layouts, the first byte of every encoded message
+"""
+
+_ALARM_STAGES = ('sample', 'checked', 'emitted')
+# stages of Alarm.timestamps that are encoded, the ones an alarm passes through before it leaves the controller
+
+
+class MessageKind(IntEnum):
+    """
+    Type of an encoded message, the second byte of every encoded message
+    """
+    NONE = 0
+    SENSOR_VALUES = 1
+    CONTROL_SETTING = 2
+    CONTROL_VALUES = 3
+    DERIVED_VALUES = 4
+    ALARM = 5
+
+
+SENSOR_VALUES = tuple(values.SENSOR.keys())
+"""
+Order of :class:`.ValueName` s in ``MESSAGE_DTYPES[MessageKind.SENSOR_VALUES]['values']``
+"""
+
+DERIVED_VALUES = ('I_phase_duration', 'pip_time', 'peep_time', 'pip', 'pip_plateau', 'peep', 'vte')
+"""
+Order of :class:`.DerivedValues` attributes in ``MESSAGE_DTYPES[MessageKind.DERIVED_VALUES]['values']``
+"""
+
+_HEADER = [('version', '<u1'), ('kind', '<u1')]
+
+MESSAGE_DTYPES = {
+    MessageKind.NONE: np.dtype(_HEADER),
+    MessageKind.SENSOR_VALUES: np.dtype(_HEADER + [
+        ('timestamp', '<f8'),
+        ('loop_counter', '<i8'),
+        ('breath_count', '<i8'),
+        ('none_mask', '<u4'),          # bit i set if SENSOR_VALUES[i] is None
+        ('values', '<f8', (len(SENSOR_VALUES),))
+    ]),
+    MessageKind.CONTROL_SETTING: np.dtype(_HEADER + [
+        ('name', '<u1'),               # ValueName.value
+        ('none_mask', '<u1'),          # bits: value, min_value, max_value, range_severity
+        ('value', '<f8'),
+        ('min_value', '<f8'),
+        ('max_value', '<f8'),
+        ('timestamp', '<f8'),
+        ('range_severity', '<i1')      # AlarmSeverity.value
+    ]),
+    MessageKind.CONTROL_VALUES: np.dtype(_HEADER + [
+        ('none_mask', '<u1'),          # bits: control_signal_in, control_signal_out
+        ('control_signal_in', '<f8'),
+        ('control_signal_out', '<f8')
+    ]),
+    MessageKind.DERIVED_VALUES: np.dtype(_HEADER + [
+        ('timestamp', '<f8'),
+        ('breath_count', '<i8'),
+        ('none_mask', '<u1'),          # bit i set if DERIVED_VALUES[i] is None
+        ('values', '<f8', (len(DERIVED_VALUES),))
+    ]),
+    MessageKind.ALARM: np.dtype(_HEADER + [
+        ('id', '<i8'),
+        ('alarm_type', '<u1'),         # AlarmType.value
+        ('severity', '<i1'),           # AlarmSeverity.value
+        ('flags', '<u1'),              # bits: active, latch, end_time is None, value is None, cause is None
+        ('start_time', '<f8'),
+        ('end_time', '<f8'),
+        ('value', '<f8'),
+        ('cause', '<u4'),              # bit ValueName.value set for each ValueName in cause
+        ('timestamps', '<f8', (len(_ALARM_STAGES),)),  # Alarm.timestamps of _ALARM_STAGES, nan if missing
+        ('message_length', '<u2')      # length of the utf-8 message that follows, 0xFFFF if None
+    ])
+}
+"""
+Fixed binary layout of each :class:`.MessageKind` , including the header
+"""
+
+_STRUCT_CODES = {
+    ('f', 8): 'd',
+    ('i', 8): 'q',
+    ('u', 8): 'Q',
+    ('u', 4): 'I',
+    ('u', 2): 'H',
+    ('i', 1): 'b',
+    ('u', 1): 'B'
+}
+
+
+def _make_struct(dtype: np.dtype) -> struct.Struct:
+    """
+    :class:`struct.Struct` with the same packed little-endian layout as a structured dtype
+    """
+    fmt = '<'
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        count = int(np.prod(field.shape)) if field.shape else 1
+        fmt += f'{count if count > 1 else ""}{_STRUCT_CODES[(field.base.kind, field.base.itemsize)]}'
+    assert struct.calcsize(fmt) == dtype.itemsize
+    return struct.Struct(fmt)
+
+
+_STRUCTS = {kind: _make_struct(dtype) for kind, dtype in MESSAGE_DTYPES.items()}
+_HEADER_STRUCT = struct.Struct('<BB')
+
+_ALARM_TYPES = {alarm_type.value: alarm_type for alarm_type in AlarmType}
+_ALARM_SEVERITIES = {severity.value: severity for severity in AlarmSeverity}
+_SENSOR_NAMES = tuple(value_name.name for value_name in SENSOR_VALUES)
+_get_sensor_values = attrgetter(*_SENSOR_NAMES)
+_get_derived_values = attrgetter(*DERIVED_VALUES)
+_NO_MESSAGE = 0xFFFF
+_NAN = float('nan')
+
+
+def _replace_none(vals: tuple) -> typing.Tuple[int, tuple]:
+    """
+    Bitmask of the positions of ``None`` s in ``vals`` , and ``vals`` with them replaced by ``nan``
+    """
+    if None not in vals:
+        return 0, vals
+    none_mask = 0
+    for i, value in enumerate(vals):
+        if value is None:
+            none_mask |= 1 << i
+    return none_mask, tuple(_NAN if value is None else value for value in vals)
+
+
+def _encode_sensor_values(sensor_values: SensorValues) -> bytes:
+    none_mask, vals = _replace_none(_get_sensor_values(sensor_values))
+    return _STRUCTS[MessageKind.SENSOR_VALUES].pack(
+        CODEC_VERSION, MessageKind.SENSOR_VALUES,
+        sensor_values.timestamp, sensor_values.loop_counter, sensor_values.breath_count,
+        none_mask, *vals)
+
+
+def _decode_sensor_values(data: bytes) -> SensorValues:
+    fields = _STRUCTS[MessageKind.SENSOR_VALUES].unpack(data)
+    none_mask = fields[5]
+    vals = fields[6:]
+    if none_mask:
+        vals = tuple(None if none_mask & (1 << i) else value for i, value in enumerate(vals))
+    return SensorValues.from_tuple(fields[2:5] + vals)
+
+
+def _encode_control_setting(control_setting: ControlSetting) -> bytes:
+    none_mask, vals = _replace_none((control_setting.value, control_setting.min_value, control_setting.max_value))
+    range_severity = 0
+    if control_setting.range_severity is None:
+        none_mask |= 1 << 3
+    else:
+        range_severity = control_setting.range_severity.value
+    return _STRUCTS[MessageKind.CONTROL_SETTING].pack(
+        CODEC_VERSION, MessageKind.CONTROL_SETTING,
+        control_setting.name.value, none_mask, *vals, control_setting.timestamp, range_severity)
+
+
+def _decode_control_setting(data: bytes) -> ControlSetting:
+    _, _, name, none_mask, value, min_value, max_value, timestamp, range_severity = \
+        _STRUCTS[MessageKind.CONTROL_SETTING].unpack(data)
+    control_setting = ControlSetting.__new__(ControlSetting)
+    control_setting.name = values.VALUE_NAMES[name]
+    control_setting.value = None if none_mask & 1 else value
+    control_setting.min_value = None if none_mask & 2 else min_value
+    control_setting.max_value = None if none_mask & 4 else max_value
+    control_setting.timestamp = timestamp
+    control_setting.range_severity = None if none_mask & 8 else _ALARM_SEVERITIES[range_severity]
+    return control_setting
+
+
+def _encode_control_values(control_values: ControlValues) -> bytes:
+    none_mask, vals = _replace_none((control_values.control_signal_in, control_values.control_signal_out))
+    return _STRUCTS[MessageKind.CONTROL_VALUES].pack(
+        CODEC_VERSION, MessageKind.CONTROL_VALUES, none_mask, *vals)
+
+
+def _decode_control_values(data: bytes) -> ControlValues:
+    _, _, none_mask, control_signal_in, control_signal_out = _STRUCTS[MessageKind.CONTROL_VALUES].unpack(data)
+    return ControlValues(None if none_mask & 1 else control_signal_in,
+                         None if none_mask & 2 else control_signal_out)
+
+
+def _encode_derived_values(derived_values: DerivedValues) -> bytes:
+    none_mask, vals = _replace_none(_get_derived_values(derived_values))
+    return _STRUCTS[MessageKind.DERIVED_VALUES].pack(
+        CODEC_VERSION, MessageKind.DERIVED_VALUES,
+        derived_values.timestamp, derived_values.breath_count, none_mask, *vals)
+
+
+def _decode_derived_values(data: bytes) -> DerivedValues:
+    fields = _STRUCTS[MessageKind.DERIVED_VALUES].unpack(data)
+    none_mask = fields[4]
+    vals = fields[5:]
+    if none_mask:
+        vals = [None if none_mask & (1 << i) else value for i, value in enumerate(vals)]
+    return DerivedValues(fields[2], fields[3], *vals)
+
+
+def _encode_alarm(alarm: Alarm) -> bytes:
+    flags = int(alarm.active) | int(alarm.latch) << 1
+    end_time = alarm.end_time
+    if end_time is None:
+        flags |= 1 << 2
+        end_time = _NAN
+    value = alarm.value
+    if value is None:
+        flags |= 1 << 3
+        value = _NAN
+    cause = 0
+    if alarm.cause is None:
+        flags |= 1 << 4
+    else:
+        for value_name in alarm.cause:
+            cause |= 1 << value_name.value
+
+    if alarm.message is None:
+        message = b''
+        message_length = _NO_MESSAGE
+    else:
+        message = str(alarm.message).encode('utf-8')[:_NO_MESSAGE - 1]
+        message_length = len(message)
+
+    timestamps = alarm.timestamps
+    return _STRUCTS[MessageKind.ALARM].pack(
+        CODEC_VERSION, MessageKind.ALARM,
+        alarm.id, alarm.alarm_type.value, alarm.severity.value, flags,
+        alarm.start_time, end_time, value, cause,
+        *(timestamps.get(stage, _NAN) for stage in _ALARM_STAGES), message_length) + message
+
+
+def _decode_alarm(data: bytes) -> Alarm:
+    alarm_struct = _STRUCTS[MessageKind.ALARM]
+    _, _, alarm_id, alarm_type, severity, flags, start_time, end_time, value, cause, *timestamps, message_length = \
+        alarm_struct.unpack_from(data)
+
+    # don't call __init__, which would draw a new id from Alarm.id_counter
+    alarm = Alarm.__new__(Alarm)
+    alarm.id = alarm_id
+    alarm._alarm_type = _ALARM_TYPES[alarm_type]
+    alarm._severity = _ALARM_SEVERITIES[severity]
+    alarm.start_time = start_time
+    alarm.active = bool(flags & 1)
+    alarm.latch = bool(flags & 2)
+    alarm.end_time = None if flags & 4 else end_time
+    alarm.value = None if flags & 8 else value
+    if flags & 16:
+        alarm.cause = None
+    else:
+        alarm.cause = [value_name for value_name in ValueName if cause & (1 << value_name.value)]
+    # nan != nan
+    alarm.timestamps = {stage: timestamp for stage, timestamp in zip(_ALARM_STAGES, timestamps)
+                        if timestamp == timestamp}
+    if message_length == _NO_MESSAGE:
+        alarm.message = None
+    else:
+        alarm.message = bytes(data[alarm_struct.size:alarm_struct.size + message_length]).decode('utf-8')
+    return alarm
+
+
+_ENCODERS = {
+    SensorValues: _encode_sensor_values,
+    ControlSetting: _encode_control_setting,
+    ControlValues: _encode_control_values,
+    DerivedValues: _encode_derived_values,
+    Alarm: _encode_alarm
+}
+
+_DECODERS = {
+    MessageKind.NONE: lambda data: None,
+    MessageKind.SENSOR_VALUES: _decode_sensor_values,
+    MessageKind.CONTROL_SETTING: _decode_control_setting,
+    MessageKind.CONTROL_VALUES: _decode_control_values,
+    MessageKind.DERIVED_VALUES: _decode_derived_values,
+    MessageKind.ALARM: _decode_alarm
+}
+
+_KINDS = {
+    SensorValues: MessageKind.SENSOR_VALUES,
+    ControlSetting: MessageKind.CONTROL_SETTING,
+    ControlValues: MessageKind.CONTROL_VALUES,
+    DerivedValues: MessageKind.DERIVED_VALUES,
+    Alarm: MessageKind.ALARM
+}
+
+_NONE_MESSAGE = _HEADER_STRUCT.pack(CODEC_VERSION, MessageKind.NONE)
+
+Message = typing.Union[None, SensorValues, ControlSetting, ControlValues, DerivedValues, Alarm]
+
+
+def encode(message: Message) -> bytes:
+    """
+    Encode a message in its fixed binary layout
+
+    Args:
+        message (None, :class:`.SensorValues`, :class:`.ControlSetting`, :class:`.ControlValues`, :class:`.DerivedValues`, :class:`~.alarm.Alarm`):
+            message to encode. Only the :data:`.values.SENSOR` values of a :class:`.SensorValues` are encoded,
+            and the ``cause`` of an :class:`~.alarm.Alarm` is decoded in :class:`.ValueName` order.
+
+    Returns:
+        bytes: encoded message
+
+    Raises:
+        TypeError: if the message isn't of a type that can be encoded
+    """
+    if message is None:
+        return _NONE_MESSAGE
+    try:
+        encoder = _ENCODERS[type(message)]
+    except KeyError:
+        raise TypeError(f'Cant encode message of type {type(message)}')
+    return encoder(message)
+
+
+def decode(data: typing.Union[bytes, bytearray, memoryview]) -> Message:
+    """
+    Decode a message encoded by :func:`.encode`
+
+    Args:
+        data (bytes): encoded message
+
+    Returns:
+        the decoded message, or ``None`` if ``None`` was encoded
+
+    Raises:
+        ValueError: if the message was encoded with another :data:`.CODEC_VERSION` or is of an unknown kind
+    """
+    version, kind = _HEADER_STRUCT.unpack_from(data)
+    if version != CODEC_VERSION:
+        raise ValueError(f'Cant decode message encoded with codec version {version}, expected {CODEC_VERSION}')
+    try:
+        decoder = _DECODERS[kind]
+    except KeyError:
+        raise ValueError(f'Cant decode message of unknown kind {kind}')
+    return decoder(data)
+
+
+def message_kind(message_type: type) -> MessageKind:
+    """
+    :class:`.MessageKind` that messages of a type are encoded as
+
+    Args:
+        message_type (type): eg. :class:`.SensorValues`
+
+    Returns:
+        :class:`.MessageKind`
+    """
+    try:
+        return _KINDS[message_type]
+    except KeyError:
+        raise TypeError(f'No message kind for {message_type}')
+
+
+def to_array(encoded: typing.Iterable[bytes], kind: MessageKind) -> np.ndarray:
+    """
+    View a batch of encoded messages of the same kind as a structured array, without decoding them one by one.
+
+    eg. to store many :class:`.SensorValues` at once, or to select the ``PRESSURE`` column of a batch
+    ``to_array(batch, MessageKind.SENSOR_VALUES)['values'][:, SENSOR_VALUES.index(ValueName.PRESSURE)]`` .
+    ``None`` values are ``nan`` in the array and flagged in its ``none_mask`` , and the ``message`` of
+    :class:`~.alarm.Alarm` s is left out.
+
+    Args:
+        encoded (iterable): of messages encoded by :func:`.encode`
+        kind (:class:`.MessageKind`): kind of every message in the batch
+
+    Returns:
+        :class:`numpy.ndarray` with dtype ``MESSAGE_DTYPES[kind]``
+
+    Raises:
+        ValueError: if any message is of another kind or :data:`.CODEC_VERSION`
+    """
+    dtype = MESSAGE_DTYPES[kind]
+    size = dtype.itemsize
+    array = np.frombuffer(b''.join(data[:size] for data in encoded), dtype=dtype)
+    if np.any(array['version'] != CODEC_VERSION) or np.any(array['kind'] != kind):
+        raise ValueError(f'Not all messages are of kind {kind.name} and codec version {CODEC_VERSION}')
+    return array
@@ -0,0 +1,310 @@
+"""
+Batches of sensor samples as numpy structured arrays, for consumers that process many :class:`.SensorValues` at once
+(plots, alarm checks, replay, analysis).
+
+A :class:`.SensorFrame` has one column per :data:`.values.SENSOR` value plus ``timestamp`` , ``loop_counter`` and
+``breath_count`` (see :data:`.FRAME_DTYPE` ). Columns are views onto the frame's array, and slicing by index, time
+or breath returns a frame that shares memory with the original wherever numpy allows, so nothing is copied until
+it is modified. ``None`` values are stored as ``nan`` .
+
+Samples are assumed to be in time order, as they are produced by the controller.
+"""
+import typing
+
+import numpy as np
+
+from pvp.common import values
+from pvp.common.message import SensorValues
+from pvp.common.shared import WAVEFORM_VALUES
+from pvp.common.values import ValueName
+
+INT_FIELDS = ('loop_counter', 'breath_count')
+"""
+Integer fields of :data:`.FRAME_DTYPE` , which can't be ``nan`` , and are :data:`.MISSING_INT` when not known
+"""
+
+FRAME_DTYPE = np.dtype([
+    (name, np.int64 if name in INT_FIELDS else np.float64)
+    for name in SensorValues.tuple_fields
+])
+"""
+Layout of one sample of a :class:`.SensorFrame` , in the order of :attr:`.SensorValues.tuple_fields`
+"""
+
+FLOAT_FIELDS = tuple(name for name in FRAME_DTYPE.names if name not in INT_FIELDS)
+"""
+Float fields of :data:`.FRAME_DTYPE` , ``nan`` when not known
+"""
+
+MISSING_INT = -1
+"""
+Value of the :data:`.INT_FIELDS` of a sample that doesn't have them
+"""
+
+_SENSOR_NAMES = tuple(value_name.name for value_name in values.SENSOR.keys())
+
+# frame columns filled from the derived values table of a DataLogger file
+_LOGGED_DERIVED = {
+    'PIP': 'pip',
+    'PEEP': 'peep',
+    'VTE': 'vte',
+    'INSPIRATION_TIME_SEC': 'I_phase_duration'
+}
+
+
+class SensorFrame:
+    """
+    A batch of sensor samples in a structured array with dtype :data:`.FRAME_DTYPE` .
+
+    * ``frame[ValueName.PRESSURE]`` or ``frame['PRESSURE']`` - column of a value, a view onto the frame
+    * ``frame[i]`` - a single sample as :class:`.SensorValues`
+    * ``frame[10:20]`` , ``frame[mask]`` - a :class:`.SensorFrame` of those samples
+    * :meth:`.SensorFrame.between` and :meth:`.SensorFrame.breaths` - samples in a time or breath range
+    * :meth:`.SensorFrame.per_breath` - reduce a value over each breath, eg. the peak pressure of every breath
+
+    Args:
+        array (:class:`numpy.ndarray`): samples with dtype :data:`.FRAME_DTYPE` , used without copying.
+            if None, the frame is empty.
+    """
+
+    def __init__(self, array: typing.Optional[np.ndarray] = None):
+        if array is None:
+            array = np.zeros(0, dtype=FRAME_DTYPE)
+        if array.dtype != FRAME_DTYPE:
+            raise ValueError(f'SensorFrame arrays must have dtype FRAME_DTYPE, got {array.dtype}')
+        self.array = array
+
+    @classmethod
+    def from_sensor_values(cls, sensor_values: typing.Iterable[SensorValues]) -> 'SensorFrame':
+        """
+        Make a frame from a sequence of :class:`.SensorValues`
+
+        Args:
+            sensor_values (iterable): of :class:`.SensorValues` , in time order
+
+        Returns:
+            :class:`.SensorFrame`
+        """
+        rows = [sv.to_tuple() for sv in sensor_values]
+        try:
+            array = np.array(rows, dtype=FRAME_DTYPE)
+        except TypeError:
+            # some values were None
+            rows = [tuple(np.nan if value is None else value for value in row) for row in rows]
+            array = np.array(rows, dtype=FRAME_DTYPE)
+        return cls(array)
+
+    @classmethod
+    def from_waveforms(cls, samples: np.ndarray) -> 'SensorFrame':
+        """
+        Make a frame from the samples of a :class:`.WaveformReader` .
+
+        Only the values stored in the waveform buffer (see :data:`.shared.WAVEFORM_VALUES` ) are filled,
+        the other values are ``nan`` and ``loop_counter`` is :data:`.MISSING_INT` .
+
+        Args:
+            samples (:class:`numpy.ndarray`): with dtype :data:`.shared.WAVEFORM_DTYPE`
+
+        Returns:
+            :class:`.SensorFrame`
+        """
+        array = _missing(len(samples))
+        array['timestamp'] = samples['timestamp']
+        array['breath_count'] = samples['breath_count']
+        for value_name, field in WAVEFORM_VALUES.items():
+            array[value_name.name] = samples[field]
+        return cls(array)
+
+    @classmethod
+    def from_log(cls, data: dict) -> 'SensorFrame':
+        """
+        Make a frame from the tables of a :class:`.DataLogger` file, as returned by :meth:`.DataLogger.load_file` .
+
+        Each row of the waveform table is a sample, with the derived values (``PIP`` , ``PEEP`` , ``VTE`` ,
+        ``INSPIRATION_TIME_SEC`` ) of the last breath stored in the derived table before it, as the controller
+        would have reported them. Values that aren't logged are ``nan`` and ``loop_counter`` is :data:`.MISSING_INT` .
+
+        Args:
+            data (dict): with ``'waveform_data'`` and ``'derived_data'`` structured arrays
+
+        Returns:
+            :class:`.SensorFrame`
+        """
+        waveforms = data['waveform_data']
+        derived = data['derived_data']
+
+        array = _missing(len(waveforms))
+        array['timestamp'] = waveforms['timestamp']
+        array['breath_count'] = waveforms['cycle_number']
+        array['PRESSURE'] = waveforms['pressure']
+        array['FLOWOUT'] = waveforms['flow_out']
+        array['FIO2'] = waveforms['oxygen']
+
+        if len(derived) > 0:
+            last_derived = np.searchsorted(derived['timestamp'], waveforms['timestamp'], side='right') - 1
+            logged = last_derived >= 0
+            for value_name, field in _LOGGED_DERIVED.items():
+                array[value_name][logged] = derived[field][last_derived[logged]]
+        return cls(array)
+
+    @classmethod
+    def concatenate(cls, frames: typing.Iterable['SensorFrame']) -> 'SensorFrame':
+        """
+        Join frames end to end, copying their samples
+
+        Args:
+            frames (iterable): of :class:`.SensorFrame` , in time order
+
+        Returns:
+            :class:`.SensorFrame`
+        """
+        arrays = [frame.array for frame in frames]
+        if len(arrays) == 0:
+            return cls()
+        return cls(np.concatenate(arrays))
+
+    def to_sensor_values(self) -> typing.List[SensorValues]:
+        """
+        Convert every sample to :class:`.SensorValues` , ``nan`` values become ``None``
+
+        Returns:
+            list: of :class:`.SensorValues`
+        """
+        rows = self.array.tolist()
+        if any(np.isnan(self.array[name]).any() for name in _SENSOR_NAMES):
+            rows = [tuple(None if value != value else value for value in row) for row in rows]
+        return [SensorValues.from_tuple(row) for row in rows]
+
+    def column(self, value_name: typing.Union[ValueName, str]) -> np.ndarray:
+        """
+        A column of the frame, as a view that shares memory with the frame
+
+        Args:
+            value_name (:class:`.ValueName`, str): a :data:`.values.SENSOR` value, or ``'timestamp'`` ,
+                ``'loop_counter'`` or ``'breath_count'``
+
+        Returns:
+            :class:`numpy.ndarray`
+        """
+        if isinstance(value_name, ValueName):
+            value_name = value_name.name
+        return self.array[value_name]
+
+    def values(self) -> np.ndarray:
+        """
+        All :data:`.values.SENSOR` values as a 2d (sample x value) float array, in the order of ``values.SENSOR`` .
+        This is a copy, since the columns of a structured array aren't evenly strided as a 2d array.
+
+        Returns:
+            :class:`numpy.ndarray`
+        """
+        return np.stack([self.array[name] for name in _SENSOR_NAMES], axis=-1) if len(self.array) \
+            else np.zeros((0, len(_SENSOR_NAMES)))
+
+    @property
+    def timestamp(self) -> np.ndarray:
+        """
+        ``timestamp`` column
+        """
+        return self.array['timestamp']
+
+    @property
+    def breath_count(self) -> np.ndarray:
+        """
+        ``breath_count`` column
+        """
+        return self.array['breath_count']
+
+    def between(self, start: float = None, stop: float = None) -> 'SensorFrame':
+        """
+        Samples with ``start <= timestamp < stop`` , as a view
+
+        Args:
+            start (float): if None, from the first sample
+            stop (float): if None, to the last sample
+
+        Returns:
+            :class:`.SensorFrame`
+        """
+        return self._range('timestamp', start, stop)
+
+    def breaths(self, start: int = None, stop: int = None) -> 'SensorFrame':
+        """
+        Samples of breaths ``start <= breath_count < stop`` , as a view
+
+        Args:
+            start (int): if None, from the first breath
+            stop (int): if None, to the last breath
+
+        Returns:
+            :class:`.SensorFrame`
+        """
+        return self._range('breath_count', start, stop)
+
+    def _range(self, field: str, start, stop) -> 'SensorFrame':
+        column = self.array[field]
+        i_start = 0 if start is None else np.searchsorted(column, start, side='left')
+        i_stop = len(column) if stop is None else np.searchsorted(column, stop, side='left')
+        return SensorFrame(self.array[i_start:i_stop])
+
+    def split_breaths(self) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        Where each breath starts in the frame
+
+        Returns:
+            tuple: (breath_counts, start indices) of each breath in the frame
+        """
+        breath_count = self.array['breath_count']
+        if len(breath_count) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.intp)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(breath_count)) + 1))
+        return breath_count[starts], starts
+
+    def per_breath(self, value_name: typing.Union[ValueName, str],
+                   ufunc: np.ufunc = np.maximum) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        Reduce a value over each breath in one vectorized call, eg. ``frame.per_breath(ValueName.PRESSURE, np.maximum)``
+        for the peak pressure of every breath.
+
+        Args:
+            value_name (:class:`.ValueName`, str): column to reduce
+            ufunc (:class:`numpy.ufunc`): binary ufunc to reduce with, like :func:`numpy.maximum` , :func:`numpy.minimum`
+                or :func:`numpy.add`
+
+        Returns:
+            tuple: (breath_counts, reduced values) of each breath in the frame
+        """
+        breath_counts, starts = self.split_breaths()
+        if len(starts) == 0:
+            return breath_counts, np.zeros(0)
+        return breath_counts, ufunc.reduceat(self.column(value_name), starts)
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def __getitem__(self, item):
+        if isinstance(item, (str, ValueName)):
+            return self.column(item)
+        if isinstance(item, (int, np.integer)):
+            row = self.array[item].tolist()
+            return SensorValues.from_tuple(tuple(None if value != value else value for value in row))
+        return SensorFrame(self.array[item])
+
+    def __repr__(self) -> str:
+        if len(self) == 0:
+            return 'SensorFrame(0 samples)'
+        return (f'SensorFrame({len(self)} samples, {self.timestamp[0]:.3f} - {self.timestamp[-1]:.3f}, '
+                f'breaths {self.breath_count[0]} - {self.breath_count[-1]})')
+
+
+def _missing(n_samples: int) -> np.ndarray:
+    """
+    Array of ``n_samples`` samples with none of their values known: ``nan`` in the :data:`.FLOAT_FIELDS` and
+    :data:`.MISSING_INT` in the :data:`.INT_FIELDS`
+    """
+    array = np.empty(n_samples, dtype=FRAME_DTYPE)
+    for name in FLOAT_FIELDS:
+        array[name] = np.nan
+    for name in INT_FIELDS:
+        array[name] = MISSING_INT
+    return array
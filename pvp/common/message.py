@@ -4,6 +4,7 @@ import typing
 from pvp.common import values
 from copy import copy
 from collections import OrderedDict as odict
+from operator import attrgetter
 from pvp.common.loggers import init_logger
 
 class SensorValues:
@@ -17,6 +18,8 @@ class SensorValues:
     
     Values can be accessed either via attribute name (``SensorValues.PIP``) or like a dictionary (``SensorValues['PIP']``)
 
+    Producers that already have every value, like the controller, should use :meth:`.SensorValues.from_tuple` ,
+    which skips validation.
     """
 
     additional_values = ('timestamp', 'loop_counter', 'breath_count')
@@ -24,6 +27,13 @@ class SensorValues:
     Additional attributes that are not :class:`.ValueName` s that are expected in each SensorValues message
     """
 
+    tuple_fields = additional_values + tuple(value.name for value in values.SENSOR.keys())
+    """
+    Order of the values in :meth:`.SensorValues.from_tuple` and :meth:`.SensorValues.to_tuple`
+    """
+
+    __slots__ = additional_values + tuple(value.name for value in values.ValueName)
+
     def __init__(self, timestamp=None, loop_counter=None, breath_count=None, vals=typing.Union[None, typing.Dict['ValueName', float]], **kwargs):
         """
         Args:
@@ -39,10 +49,9 @@ class SensorValues:
         # allow this because python doesn't allow ** unpacking when the keys are not strings
         if vals is not None:
             for key, val in vals.items():
-                if isinstance(key, values.ValueName):
-                    kwargs[key.name] = val
-                elif key in values.ValueName.__members__.keys():
-                    kwargs[key] = val
+                attr = values.ATTR_NAMES.get(key)
+                if attr is not None:
+                    kwargs[attr] = val
                 elif key in self.additional_values:
                     kwargs[key] = val
 
@@ -68,18 +77,68 @@ class SensorValues:
                         raise e
 
         # insist that we have all the rest of the vals
-        assert(all([value.name in kwargs.keys() for value in values.SENSOR.keys()]))
+        assert(all([name in kwargs for name in _SENSOR_ATTRS]))
 
         # assign kwargs as attributes,
         # don't allow any non-ValueName keys
         for key, value in kwargs.items():
-            if (key in values.ValueName.__members__.keys()):
+            if key in values.ATTR_NAMES:
                 setattr(self, key, copy(value))
             elif key in self.additional_values:
                 continue
             else:
                 raise KeyError(f'value {key} not declared in pvp.values!!!')  # pragma: no cover
 
+    @classmethod
+    def from_tuple(cls, vals: tuple) -> 'SensorValues':
+        """
+        Trusted fast constructor, without the validation of :meth:`.SensorValues.__init__` .
+
+        eg. ``SensorValues.from_tuple((timestamp, loop_counter, breath_count, pip, peep, ...))``
+
+        Args:
+            vals (tuple): timestamp, loop_counter, breath_count, and a value for each of :data:`.values.SENSOR` ,
+                in the order of :attr:`.SensorValues.tuple_fields` .
+
+        Returns:
+            :class:`.SensorValues`
+        """
+        sensor_values = cls.__new__(cls)
+        for setter, value in zip(_TUPLE_SETTERS, vals):
+            setter(sensor_values, value)
+        return sensor_values
+
+    def to_tuple(self) -> tuple:
+        """
+        Return the additional values and sensor values in the order of :attr:`.SensorValues.tuple_fields`
+
+        Returns:
+            tuple
+        """
+        return _get_tuple_fields(self)
+
+    def __copy__(self) -> 'SensorValues':
+        return _restore_sensor_values(self.to_tuple(), self._extra_values())
+
+    def __reduce__(self):
+        extra = self._extra_values()
+        if extra is None:
+            return _restore_sensor_values, (self.to_tuple(),)
+        return _restore_sensor_values, (self.to_tuple(), extra)
+
+    def _extra_values(self) -> typing.Union[None, dict]:
+        """
+        Values that aren't in :attr:`.SensorValues.tuple_fields` , which are rarely set
+        """
+        extra = None
+        for name in _EXTRA_SLOTS:
+            value = getattr(self, name, _UNSET)
+            if value is not _UNSET:
+                if extra is None:
+                    extra = {}
+                extra[name] = value
+        return extra
+
     def to_dict(self) -> dict:
         """
         Return a dictionary of all sensor values and additional values
@@ -88,7 +147,7 @@ class SensorValues:
             dict
         """
         ret_dict = {
-            valname: getattr(self, valname.name) for valname in values.SENSOR.keys()
+            valname: getattr(self, attr) for valname, attr in _SENSOR_ITEMS
         }
 
         ret_dict.update({
@@ -98,24 +157,49 @@ class SensorValues:
         return ret_dict
 
     def __getitem__(self, item):
-        if item in values.ValueName:
-            return getattr(self, item.name)
-        elif item in values.ValueName.__members__.keys():
-            return getattr(self, item)
-        elif item.lower() in self.additional_values:
-            return getattr(self, item.lower())
-        else:
-            raise KeyError(f'No such value as {item}')
+        return getattr(self, _item_attr(item))
 
     def __setitem__(self, key, value):
-        if key in values.ValueName:
-            return setattr(self, key.name, value)
-        elif key in values.ValueName.__members__.keys():
-            return setattr(self, key, value)
-        elif key.lower() in self.additional_values:
-            return setattr(self, key.lower(), value)
-        else:
-            raise KeyError(f'No such value as {key}')
+        return setattr(self, _item_attr(key), value)
+
+
+_ITEM_ATTRS = dict(values.ATTR_NAMES)
+_ITEM_ATTRS.update({name: name for name in SensorValues.additional_values})
+_SENSOR_ATTRS = tuple(value_name.name for value_name in values.SENSOR.keys())
+_SENSOR_ITEMS = tuple((value_name, value_name.name) for value_name in values.SENSOR.keys())
+
+
+def _item_attr(item) -> str:
+    """
+    Attribute name of a :class:`.ValueName` , its name, or one of the :attr:`.SensorValues.additional_values`
+    (case insensitive) to get or set with ``SensorValues[item]``
+    """
+    attr = _ITEM_ATTRS.get(item)
+    if attr is None:
+        if isinstance(item, str) and item.lower() in SensorValues.additional_values:
+            return item.lower()
+        raise KeyError(f'No such value as {item}')
+    return attr
+
+
+_TUPLE_SETTERS = tuple(getattr(SensorValues, name).__set__ for name in SensorValues.tuple_fields)
+_get_tuple_fields = attrgetter(*SensorValues.tuple_fields)
+
+
+def _restore_sensor_values(vals: tuple, extra: typing.Union[None, dict] = None) -> SensorValues:
+    """
+    Rebuild a pickled or copied :class:`.SensorValues`
+    """
+    sensor_values = SensorValues.from_tuple(vals)
+    if extra:
+        for name, value in extra.items():
+            setattr(sensor_values, name, value)
+    return sensor_values
+
+
+_UNSET = object()
+_EXTRA_SLOTS = tuple(name for name in SensorValues.__slots__ if name not in SensorValues.tuple_fields)
+
 
 class ControlSetting:
     def __init__(self,
@@ -143,15 +227,15 @@ class ControlSetting:
                 this attr, when present, specifies which is being set.
         """
         if isinstance(name, str):
-            ls = [x for x in values.CONTROL if str(x) == name]
-            if len(ls)>0:
-                name = ls[0]
+            value_name = values.VALUE_NAMES.get(name)
+            if value_name in values.CONTROL_SET:
+                name = value_name
             else:
                 logger = init_logger(__name__)
                 logger.exception(f'Couldnt create ControlSetting with name {name}, not in values.CONTROL')
                 raise KeyError
         elif isinstance(name, values.ValueName):
-            assert name in values.CONTROL.keys() or name in (values.ValueName.VTE, values.ValueName.FIO2)
+            assert name in values.CONTROL_SET or name in (values.ValueName.VTE, values.ValueName.FIO2)
             
         self.name = name # type: values.ValueName
 
@@ -214,3 +298,35 @@ class DerivedValues:
         self.peep             = peep
         self.vte              = vte
 
+
+class PollResult:
+    """
+    Everything the GUI needs from the controller on each update, returned by :meth:`.ControlModuleBase.poll`
+    in a single message.
+
+    Sensor values and alarms are only included if they have changed since the ``since_seq`` given to ``poll``,
+    otherwise they are ``None`` / ``alarms_changed`` is False. The caller passes ``seq`` to its next ``poll``.
+
+    :param seq: controller update sequence number at the time of the poll
+    :param timestamp: ``time.time()`` of the poll
+    :param loop_counter: the controller heartbeat, see :meth:`.ControlModuleBase.get_heartbeat`
+    :param sensors: :class:`.SensorValues` if changed, otherwise None
+    :param alarms_changed: whether the controller's alarms have changed
+    :param alarms: current controller alarms in the format returned by :meth:`.ControlModuleBase.get_alarms` , if changed
+    :param loop_stats: dict of ``loop_rate`` (Hz), ``mean_dt`` and ``max_dt`` (seconds, over the last 1000 loops),
+        and if the controller hosts an alarm manager, ``alarm_latency_mean`` and ``alarm_latency_max`` (seconds,
+        of its most recent alarms)
+    :param alarm_transitions: tuple of :class:`.Alarm` s emitted by the alarm manager hosted by the controller since
+        ``since_seq`` , including cleared (``OFF``) alarms, or None if the controller doesn't host one.
+        see :meth:`.ControlModuleBase.poll`
+    """
+    def __init__(self, seq, timestamp, loop_counter, sensors=None, alarms_changed=False, alarms=None, loop_stats=None,
+                 alarm_transitions=None):
+        self.seq            = seq
+        self.timestamp      = timestamp
+        self.loop_counter   = loop_counter
+        self.sensors        = sensors
+        self.alarms_changed = alarms_changed
+        self.alarms         = alarms
+        self.loop_stats     = loop_stats
+        self.alarm_transitions = alarm_transitions
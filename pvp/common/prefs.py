@@ -55,6 +55,17 @@ _DEFAULTS = {
     'HEARTBEAT_TIMEOUT': 0.02, # timeout used in heartbeat between gui and contorller,
     'GUI_STATE_FN': 'gui_state.json',
     'GUI_UPDATE_TIME': 0.05,
+    'GUI_SUBSCRIBE': True,
+    'CONTROLLER_PUBLISH_RATE': 20,
+    'CONTROLLER_ALARMS': False,
+    'CONTROLLER_SERVER_THREADS': 8,
+    'CONTROLLER_MONITOR': False,
+    'CONTROLLER_MONITOR_PERIOD': 0.01,
+    'CONTROLLER_MAX_HEARTBEAT_INTERVAL': 1.0,
+    'CONTROLLER_CHECKPOINT_FN': None,
+    'CONTROLLER_CHECKPOINT_INTERVAL': 0.1,
+    'CONTROLLER_CHECKPOINT_MAX_AGE': 10,
+    'ALARM_HISTORY_FN': None,
     'ENABLE_DIALOGS': True, # enable _all_ dialogs -- for testing on virtual frame buffer
     'ENABLE_WARNINGS': True, # enable user warnings and confirmations
     'CONTROLLER_MAX_FLOW': 10,
@@ -64,6 +75,7 @@ _DEFAULTS = {
     'CONTROLLER_LOOP_UPDATE_TIME_SIMULATOR': 0.005,
     'CONTROLLER_LOOPS_UNTIL_UPDATE': 1,  # update copied values like get_sensor every n loops,
     'CONTROLLER_RINGBUFFER_SIZE': 100,
+    'WAVEFORM_BUFFER_SIZE': 2**14,
     'COUGH_DURATION': 0.1,
     'BREATH_PRESSURE_DROP': 4,
     'BREATH_DETECTION': True,
@@ -85,6 +97,17 @@ Declare all available parameters and set default values. If no default, set as N
 * ``HEARTBEAT_TIMEOUT``: Time between heartbeats between GUI and controller after which contact is assumed to be lost (in seconds, default 0.02)
 * ``GUI_STATE_FN``: Filename of gui control state file, relative to ``VENT_DIR`` (default: gui_state.json)
 * ``GUI_UPDATE_TIME``: Time between calls of :meth:`.PVP_Gui.update_gui` (in seconds, default: 0.05)
+* ``GUI_SUBSCRIBE``: Have the controller push sensor values and alarms to the GUI with :meth:`.CoordinatorBase.subscribe` rather than polling it on each GUI update (default: True)
+* ``CONTROLLER_SERVER_THREADS``: Number of threads the xml-rpc server of the controller process handles requests with (default: 8)
+* ``CONTROLLER_MONITOR``: Whether a remote coordinator restarts a stalled or dead controller process, see :meth:`.ProcessManager.start_monitor` . A coordinator started with a standby always monitors it (default: False)
+* ``CONTROLLER_MONITOR_PERIOD``: Time between checks of the controller's heartbeat (in seconds, default 0.01)
+* ``CONTROLLER_MAX_HEARTBEAT_INTERVAL``: Time without a heartbeat after which a running controller is considered stalled and restarted. Should be well above the longest pause expected from a healthy controller, eg. from garbage collection or a busy machine (in seconds, default 1.0)
+* ``CONTROLLER_CHECKPOINT_FN``: Filename of the controller's :class:`.Checkpoint` file, absolute or relative to ``VENT_DIR`` . if None, no checkpoints are kept (default: None)
+* ``CONTROLLER_CHECKPOINT_INTERVAL``: Time between checkpoints of the controller's state (in seconds, default 0.1)
+* ``CONTROLLER_CHECKPOINT_MAX_AGE``: A restarted controller only restores a checkpoint younger than this (in seconds, default 10)
+* ``ALARM_HISTORY_FN``: Filename of the :class:`.Alarm_History` database that emitted alarms are added to, absolute or relative to ``LOG_DIR`` . if None, no history is kept (default: None)
+* ``CONTROLLER_PUBLISH_RATE``: Rate that sensor values are pushed to subscribers, alarm changes are pushed immediately (in Hz, default: 20)
+* ``CONTROLLER_ALARMS``: Check the alarm rules in the controller process on every loop rather than in the GUI on every update, see :meth:`.ControlModuleBase.set_alarm_manager` (default: False)
 * ``ENABLE_DIALOGS``: Enable all GUI dialogs -- set as False when testing on virtual frame buffer that doesn't support them (default: True and should stay that way)
 * ``ENABLE_WARNINGS``: Enable user warnings and value change confirmations (default: True)
 * ``CONTROLLER_MAX_FLOW``: Maximum flow, above which the controller considers a sensor error (default: 10)
@@ -94,6 +117,7 @@ Declare all available parameters and set default values. If no default, set as N
 * ``CONTROLLER_LOOP_UPDATE_TIME_SIMULATOR``: Amount of time to sleep in between controller updates when using :class:`.ControlModuleSimulator` (default: 0.005)
 * ``CONTROLLER_LOOPS_UNTIL_UPDATE``: Number of controller loops in between updating its externally-available ``COPY`` attributes retrieved by :meth:`.ControlModuleBase.get_sensor` et al
 * ``CONTROLLER_RINGBUFFER_SIZE``: Maximum number of breath cycle records to be kept in memory (default: 100)
+* ``WAVEFORM_BUFFER_SIZE``: Number of controller loop samples kept in the shared :class:`.WaveformBuffer` for the GUI to plot (default: 2**14)
 * ``COUGH_DURATION``: Amount of time the high-pressure alarm limit can be exceeded and considered a cough (in seconds, default: 0.1)
 * ``BREATH_PRESSURE_DROP``: Amount pressure can drop below set PEEP before being considered an autonomous breath when in breath detection mode
 * ``BREATH_DETECTION``: Whether the controller should detect autonomous breaths in order to reset ventilation cycles (default: True)
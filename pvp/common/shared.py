@@ -0,0 +1,546 @@
+"""
+Shared memory between the controller process and the GUI process.
+
+* :class:`.SensorSnapshot` - the latest :class:`.SensorValues` published by the controller, readable without a
+  request to the controller process.
+* :class:`.WaveformBuffer` - a ring buffer of every sample of the controller loop, drained by a
+  :class:`.WaveformReader` so that waveforms can be plotted at the full rate of the controller.
+* :class:`.Heartbeat` - the controller's loop counter and the time of its last loop, watched by the
+  :class:`.ProcessManager` to detect a stalled or dead controller.
+* :class:`.ControllerMirror` - the active controller's settings and breath phase, followed by a warm standby
+  controller so it can take over without losing its place in the breath cycle.
+
+Blocks are allocated with :func:`multiprocessing.sharedctypes.RawArray` by the :class:`.ProcessManager` and
+given to the controller process when it is started, so they survive restarts of the controller process.
+Numpy arrays with a fixed structured dtype are used as views onto the raw memory.
+"""
+import time
+import ctypes
+import typing
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+from pvp.common import prefs
+from pvp.common import values
+from pvp.common.message import SensorValues
+from pvp.common.values import ValueName
+
+SNAPSHOT_VALUES = tuple(values.SENSOR.keys())
+"""
+Order of :class:`.ValueName` s in ``SNAPSHOT_DTYPE['values']``
+"""
+
+SNAPSHOT_DTYPE = np.dtype([
+    ('seq', np.uint64),            # sequence counter, odd while a write is in progress
+    ('last_contact', np.float64),  # time.time() that a reader last read the snapshot
+    ('timestamp', np.float64),
+    ('loop_counter', np.int64),
+    ('breath_count', np.int64),
+    ('none_mask', np.uint64),      # bit i set if SNAPSHOT_VALUES[i] is None
+    ('values', np.float64, (len(SNAPSHOT_VALUES),))
+])
+"""
+Fixed binary layout of a :class:`.SensorSnapshot`
+"""
+
+
+class SensorSnapshot:
+    """
+    Latest :class:`.SensorValues` in a block of shared memory.
+
+    The controller calls :meth:`.SensorSnapshot.write` whenever it updates its ``COPY_sensor_values`` ,
+    and :class:`.CoordinatorRemote` calls :meth:`.SensorSnapshot.read` rather than calling ``get_sensors``
+    over rpc.
+
+    Writes are guarded by a sequence counter (a seqlock): the writer increments ``seq`` to an odd number before
+    writing and to the next even number after. A reader copies the block and discards the copy if ``seq``
+    was odd or changed while it was copying, so it never returns a torn read.
+
+    Since the GUI's coordinator doesn't call the controller to read sensor values, it records the time of its last
+    read in ``last_contact`` with ``read(touch=True)`` , which the controller uses in place of an rpc call to check
+    that it is still in contact with the GUI. Other readers don't, so they can't hide a GUI that has stopped reading.
+
+    Args:
+        buffer (:class:`multiprocessing.sharedctypes.RawArray`, None): Existing shared memory to use.
+            if None, allocate a new block.
+        max_retries (int): Number of times to retry a read that overlapped with a write before giving up.
+    """
+
+    def __init__(self, buffer=None, max_retries: int = 100):
+        if buffer is None:
+            buffer = RawArray(ctypes.c_uint8, SNAPSHOT_DTYPE.itemsize)
+        self.buffer = buffer
+        self.max_retries = max_retries
+
+        self._array = np.frombuffer(self.buffer, dtype=SNAPSHOT_DTYPE, count=1)
+        self._seq = self._array['seq']
+        self._last_contact = self._array['last_contact']
+
+    def write(self, sensor_values: SensorValues):
+        """
+        Publish new sensor values.
+
+        Only one process should write to a snapshot.
+
+        Args:
+            sensor_values (:class:`.SensorValues`): Values to publish
+        """
+        new_values = [sensor_values[value_name] for value_name in SNAPSHOT_VALUES]
+        none_mask = 0
+        for i, value in enumerate(new_values):
+            if value is None:
+                none_mask |= 1 << i
+                new_values[i] = np.nan
+
+        # round up to even in case a previous writer died mid-write
+        seq = (int(self._seq[0]) + 1) & ~1
+        self._seq[0] = seq + 1
+        array = self._array
+        array['timestamp'] = sensor_values.timestamp
+        array['loop_counter'] = sensor_values.loop_counter
+        array['breath_count'] = sensor_values.breath_count
+        array['none_mask'] = none_mask
+        array['values'][0] = new_values
+        self._seq[0] = seq + 2
+
+    def read(self, touch: bool = False) -> typing.Union[None, SensorValues]:
+        """
+        Read the latest sensor values.
+
+        Args:
+            touch (bool): record the time of this read in ``last_contact`` , only for the coordinator of the GUI
+
+        Returns:
+            :class:`.SensorValues`, or ``None`` if nothing has been written yet or a consistent
+            copy couldn't be made in ``max_retries`` attempts.
+        """
+        for _ in range(self.max_retries):
+            seq = self._seq[0]
+            if seq == 0:
+                return None
+            if seq % 2:
+                # write in progress
+                continue
+            snapshot = self._array[0].copy()
+            if self._seq[0] == seq:
+                break
+        else:
+            return None
+
+        if touch:
+            self.touch()
+
+        none_mask = int(snapshot['none_mask'])
+        vals = snapshot['values'].tolist()
+        if none_mask:
+            vals = [None if none_mask & (1 << i) else value for i, value in enumerate(vals)]
+        return SensorValues.from_tuple((float(snapshot['timestamp']),
+                                        int(snapshot['loop_counter']),
+                                        int(snapshot['breath_count']),
+                                        *vals))
+
+    def touch(self):
+        """
+        Record contact from the GUI in ``last_contact`` without reading
+        """
+        self._last_contact[0] = time.time()
+
+    @property
+    def seq(self) -> int:
+        """
+        Current sequence counter, incremented by two on every write.
+        """
+        return int(self._seq[0])
+
+    @property
+    def last_contact(self) -> float:
+        """
+        ``time.time()`` of the last :meth:`.touch` or successful :meth:`.read` with ``touch=True`` , or 0 if never touched
+        """
+        return float(self._last_contact[0])
+
+    def __getstate__(self):
+        # numpy views onto the buffer can't be pickled, so just send the buffer
+        return {'buffer': self.buffer, 'max_retries': self.max_retries}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+WAVEFORM_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('pressure', np.float64),
+    ('flow_out', np.float64),
+    ('control_in', np.float64),
+    ('control_out', np.float64),
+    ('breath_count', np.int64)
+])
+"""
+Layout of a single controller loop sample in a :class:`.WaveformBuffer`
+"""
+
+WAVEFORM_VALUES = {
+    ValueName.PRESSURE: 'pressure',
+    ValueName.FLOWOUT: 'flow_out'
+}
+"""
+Map of :class:`.ValueName` s to the fields of ``WAVEFORM_DTYPE`` that hold them
+"""
+
+
+class WaveformBuffer:
+    """
+    Ring buffer of controller loop samples in a block of shared memory.
+
+    The controller calls :meth:`.WaveformBuffer.append` once per loop. ``head`` counts all samples ever written,
+    and sample ``i`` is stored at ``i % size`` . Since the next write goes to the slot of the oldest sample,
+    at most ``size - 1`` samples can be read at once. Readers use a :class:`.WaveformReader` to keep track of
+    which samples they have already seen.
+
+    Only one process should write to a buffer.
+
+    Args:
+        size (int): number of samples to store. if None, use the ``WAVEFORM_BUFFER_SIZE`` pref
+        buffer (:class:`multiprocessing.sharedctypes.RawArray`, None): Existing shared memory to use.
+            if None, allocate a new block.
+    """
+
+    def __init__(self, size: int = None, buffer=None):
+        if size is None:
+            size = prefs.get_pref('WAVEFORM_BUFFER_SIZE')
+        self.size = int(size)
+        if buffer is None:
+            buffer = RawArray(ctypes.c_uint8, 8 + WAVEFORM_DTYPE.itemsize * self.size)
+        self.buffer = buffer
+
+        self._head = np.frombuffer(self.buffer, dtype=np.uint64, count=1)
+        self._samples = np.frombuffer(self.buffer, dtype=WAVEFORM_DTYPE, count=self.size, offset=8)
+
+    def append(self, timestamp: float, pressure: float, flow_out: float,
+               control_in: float, control_out: float, breath_count: int):
+        """
+        Write one sample, overwriting the oldest sample if the buffer is full.
+        """
+        head = int(self._head[0])
+        self._samples[head % self.size] = (timestamp, pressure, flow_out, control_in, control_out, breath_count)
+        self._head[0] = head + 1
+
+    @property
+    def head(self) -> int:
+        """
+        Total number of samples ever written
+        """
+        return int(self._head[0])
+
+    def __getstate__(self):
+        return {'size': self.size, 'buffer': self.buffer}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+class WaveformReader:
+    """
+    Drains new samples from a :class:`.WaveformBuffer` .
+
+    Keeps a cursor of the next sample to read. If the writer has lapped the reader since the last
+    :meth:`.WaveformReader.read` , the overwritten samples are counted in :attr:`.WaveformReader.lost`
+    rather than returned. Samples that are overwritten while being copied are also discarded and counted.
+
+    Args:
+        waveform_buffer (:class:`.WaveformBuffer`): buffer to read from
+        from_start (bool): if True, start reading with the oldest sample still in the buffer,
+            otherwise (default) only read samples written after the reader is created.
+
+    Attributes:
+        cursor (int): index of the next sample to read
+        lost (int): total number of samples that were overwritten before they could be read
+        overruns (int): number of reads that lost samples
+    """
+
+    def __init__(self, waveform_buffer: WaveformBuffer, from_start: bool = False):
+        self.waveform_buffer = waveform_buffer
+        self.cursor = waveform_buffer.head
+        if from_start:
+            self.cursor = max(0, self.cursor - waveform_buffer.size + 1)
+        self.lost = 0
+        self.overruns = 0
+
+    def read(self) -> np.ndarray:
+        """
+        Get all samples written since the last read.
+
+        Returns:
+            :class:`numpy.ndarray` with dtype ``WAVEFORM_DTYPE`` , possibly empty
+        """
+        wb = self.waveform_buffer
+        head = wb.head
+        start = self.cursor
+        lost = 0
+
+        # the slot of the oldest sample, head - size, is the one the writer is (about to be) writing,
+        # so only the newest size - 1 samples can be read safely
+        if head - start >= wb.size:
+            lost += head - start - wb.size + 1
+            start = head - wb.size + 1
+
+        samples = wb._samples[np.arange(start, head) % wb.size]
+
+        # the writer may have overwritten more of the oldest samples while we were copying.
+        overwritten = wb.head - wb.size + 1 - start
+        if overwritten > 0:
+            lost += overwritten
+            samples = samples[overwritten:]
+
+        if lost > 0:
+            self.lost += lost
+            self.overruns += 1
+
+        self.cursor = head
+        return samples
+
+
+HEARTBEAT_DTYPE = np.dtype([
+    ('loop_counter', np.int64),
+    ('timestamp', np.float64),   # time.time() of the last beat
+    ('running', np.uint64)       # 1 while the controller's main loop should be running
+])
+"""
+Layout of a :class:`.Heartbeat`
+"""
+
+
+class Heartbeat:
+    """
+    The controller's loop counter (see :meth:`.ControlModuleBase.get_heartbeat` ) in a block of shared memory.
+
+    The controller calls :meth:`.Heartbeat.beat` once per loop, and sets :attr:`.Heartbeat.running` when its
+    main loop is started and stopped. A controller that is running but hasn't beat recently has stalled.
+    Reading the heartbeat doesn't need a request to the controller process, so a stalled controller
+    can't stall the reader.
+
+    Each field is a single aligned 8-byte word, so they can be read and written without a lock.
+
+    Args:
+        buffer (:class:`multiprocessing.sharedctypes.RawArray`, None): Existing shared memory to use.
+            if None, allocate a new block.
+    """
+
+    def __init__(self, buffer=None):
+        if buffer is None:
+            buffer = RawArray(ctypes.c_uint8, HEARTBEAT_DTYPE.itemsize)
+        self.buffer = buffer
+        self._array = np.frombuffer(self.buffer, dtype=HEARTBEAT_DTYPE, count=1)
+        self._loop_counter = self._array['loop_counter']
+        self._timestamp = self._array['timestamp']
+        self._running = self._array['running']
+
+    def beat(self, loop_counter: int, timestamp: float = None):
+        """
+        Record an iteration of the controller's main loop
+
+        Args:
+            loop_counter (int): the controller's loop counter
+            timestamp (float): time of the iteration, if None, ``time.time()``
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        self._timestamp[0] = timestamp
+        self._loop_counter[0] = loop_counter
+
+    def reset(self):
+        """
+        Clear the heartbeat, eg. before starting a new controller process
+        """
+        self._running[0] = 0
+        self._loop_counter[0] = 0
+        self._timestamp[0] = time.time()
+
+    @property
+    def loop_counter(self) -> int:
+        """
+        Loop counter of the last beat
+        """
+        return int(self._loop_counter[0])
+
+    @property
+    def timestamp(self) -> float:
+        """
+        ``time.time()`` of the last beat
+        """
+        return float(self._timestamp[0])
+
+    @property
+    def running(self) -> bool:
+        """
+        Whether the controller's main loop should be running, and so beating
+        """
+        return bool(self._running[0])
+
+    @running.setter
+    def running(self, running: bool):
+        self._running[0] = int(running)
+
+    def age(self, now: float = None) -> float:
+        """
+        Time since the last beat
+
+        Args:
+            now (float): current time, if None, ``time.time()``
+
+        Returns:
+            float: seconds
+        """
+        if now is None:
+            now = time.time()
+        return now - float(self._timestamp[0])
+
+    def __getstate__(self):
+        return {'buffer': self.buffer}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+MIRROR_CONTROLS = (
+    ValueName.PIP,
+    ValueName.PIP_TIME,
+    ValueName.PEEP,
+    ValueName.PEEP_TIME,
+    ValueName.BREATHS_PER_MINUTE,
+    ValueName.INSPIRATION_TIME_SEC
+)
+"""
+Order of the control settings in ``MIRROR_DTYPE['controls']``
+"""
+
+MIRROR_DTYPE = np.dtype([
+    ('seq', np.uint64),              # sequence counter, odd while a write is in progress
+    ('owner', np.int64),             # pid of the controller process that is driving the valves, 0 if none
+    ('timestamp', np.float64),
+    ('cycle_start', np.float64),     # time.time() the current breath cycle started
+    ('breath_count', np.int64),
+    ('breath_detection', np.int64),
+    ('limit_hapa', np.float64),
+    ('controls', np.float64, (len(MIRROR_CONTROLS),))
+])
+"""
+Fixed binary layout of a :class:`.ControllerMirror`
+"""
+
+
+class ControllerMirror:
+    """
+    The active controller's control settings and breath phase in a block of shared memory.
+
+    The controller that owns the mirror (see :meth:`.ControlModuleBase.set_mirror` ) writes its state on
+    every loop, and a warm standby controller follows it so that it can take over mid-breath.
+    ``owner`` doubles as a fencing token: a standby claims the mirror when it takes over, and a controller
+    that finds it no longer owns the mirror stops driving the valves.
+
+    Writes are guarded by a seqlock like :class:`.SensorSnapshot` .
+
+    Args:
+        buffer (:class:`multiprocessing.sharedctypes.RawArray`, None): Existing shared memory to use.
+            if None, allocate a new block.
+        max_retries (int): Number of times to retry a read that overlapped with a write before giving up.
+    """
+
+    def __init__(self, buffer=None, max_retries: int = 100):
+        if buffer is None:
+            buffer = RawArray(ctypes.c_uint8, MIRROR_DTYPE.itemsize)
+        self.buffer = buffer
+        self.max_retries = max_retries
+
+        self._array = np.frombuffer(self.buffer, dtype=MIRROR_DTYPE, count=1)
+        self._seq = self._array['seq']
+        self._owner = self._array['owner']
+
+    def claim(self, owner: int):
+        """
+        Become the controller that drives the valves
+
+        Args:
+            owner (int): pid of the claiming controller process
+        """
+        self._owner[0] = owner
+
+    @property
+    def owner(self) -> int:
+        """
+        pid of the controller process that is driving the valves, 0 if none
+        """
+        return int(self._owner[0])
+
+    def reset(self):
+        """
+        Clear the mirror, eg. before starting new controller processes
+        """
+        self._owner[0] = 0
+        self._seq[0] = 0
+
+    def write(self, controls: typing.Dict[ValueName, float], cycle_start: float, breath_count: int,
+              breath_detection: bool, limit_hapa: float):
+        """
+        Publish the active controller's state
+
+        Args:
+            controls (dict): {:class:`.ValueName`: value} for each of :data:`.MIRROR_CONTROLS`
+            cycle_start (float): ``time.time()`` the current breath cycle started
+            breath_count (int): number of the current breath cycle
+            breath_detection (bool): whether autonomous breaths start a new cycle
+            limit_hapa (float): high airway pressure limit
+        """
+        seq = (int(self._seq[0]) + 1) & ~1
+        self._seq[0] = seq + 1
+        array = self._array
+        array['timestamp'] = time.time()
+        array['cycle_start'] = cycle_start
+        array['breath_count'] = breath_count
+        array['breath_detection'] = int(breath_detection)
+        array['limit_hapa'] = limit_hapa
+        array['controls'][0] = [controls[value_name] for value_name in MIRROR_CONTROLS]
+        self._seq[0] = seq + 2
+
+    def read(self) -> typing.Union[None, dict]:
+        """
+        Read the active controller's state
+
+        Returns:
+            dict: kwargs of :meth:`.ControllerMirror.write` and its ``timestamp`` , or ``None`` if nothing has
+            been written yet or a consistent copy couldn't be made in ``max_retries`` attempts.
+        """
+        for _ in range(self.max_retries):
+            seq = self._seq[0]
+            if seq == 0:
+                return None
+            if seq % 2:
+                continue
+            mirror = self._array[0].copy()
+            if self._seq[0] == seq:
+                break
+        else:
+            return None
+
+        return {
+            'controls': {value_name: float(value) for value_name, value in zip(MIRROR_CONTROLS, mirror['controls'])},
+            'cycle_start': float(mirror['cycle_start']),
+            'breath_count': int(mirror['breath_count']),
+            'breath_detection': bool(mirror['breath_detection']),
+            'limit_hapa': float(mirror['limit_hapa']),
+            'timestamp': float(mirror['timestamp'])
+        }
+
+    @property
+    def seq(self) -> int:
+        """
+        Current sequence counter, incremented by two on every write.
+        """
+        return int(self._seq[0])
+
+    def __getstate__(self):
+        return {'buffer': self.buffer, 'max_retries': self.max_retries}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
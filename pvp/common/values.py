@@ -503,3 +503,26 @@ Values that can be plotted
 
 Automatically generated as all :class:`.Value` objects in :data:`.VALUES` where ``plot == True``
 """
+
+VALUE_NAMES = {
+    **{value_name.name: value_name for value_name in ValueName},
+    **{str(value_name): value_name for value_name in ValueName},
+    **{value_name.value: value_name for value_name in ValueName}
+}
+"""
+Lookup table of :class:`.ValueName` s by their name (``'PIP'`` ), string representation (``'ValueName.PIP'`` ),
+or value (as encoded by :mod:`.codec` )
+"""
+
+ATTR_NAMES = {
+    **{value_name: value_name.name for value_name in ValueName},
+    **{value_name.name: value_name.name for value_name in ValueName}
+}
+"""
+Lookup table of the attribute name (eg. of :class:`.SensorValues` ) of each :class:`.ValueName` or its name
+"""
+
+CONTROL_SET = frozenset(CONTROL.keys())
+"""
+:class:`.ValueName` s in :data:`.CONTROL` , for fast membership tests
+"""
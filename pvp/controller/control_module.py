@@ -1,3 +1,4 @@
+import os
 import time
 import typing
 from typing import List
@@ -11,15 +12,23 @@ import signal
 
 import pvp.io as io
 
-from pvp.common.message import SensorValues, ControlValues, ControlSetting, DerivedValues
+from pvp.common.message import SensorValues, ControlValues, ControlSetting, DerivedValues, PollResult
+from pvp.common.shared import SensorSnapshot, WaveformBuffer, Heartbeat, ControllerMirror
+from pvp.common.checkpoint import Checkpoint, CHECKPOINT_DERIVED
 from pvp.common.loggers import init_logger, DataLogger
 from pvp.common.values import CONTROL, ValueName
 from pvp.common.utils import timeout
-from pvp.alarm import ALARM_RULES, AlarmType, AlarmSeverity, Alarm
+from pvp.alarm import ALARM_RULES, AlarmType, AlarmSeverity, Alarm, Alarm_Manager
 from pvp.common.utils import timeout, TimeoutException
 
 from pvp import prefs
 
+# slot of each alarm type in ControlModuleBase._techa_slots, and bit in ControlModuleBase._techa_mask
+_TECHA_SLOT = {alarm_type: slot for slot, alarm_type in enumerate(AlarmType)}
+_SENSORS_STUCK = _TECHA_SLOT[AlarmType.SENSORS_STUCK]
+_BAD_SENSOR_READINGS = _TECHA_SLOT[AlarmType.BAD_SENSOR_READINGS]
+_MISSED_HEARTBEAT = _TECHA_SLOT[AlarmType.MISSED_HEARTBEAT]
+
 
 class ControlModuleBase:
     """
@@ -50,15 +59,29 @@ class ControlModuleBase:
     * `set_control()`:                     Set the control
     * `is_running()`:                      Returns a bool whether the main-thread is running
     * `get_heartbeat()`:                   Returns a heartbeat, more specifically, the continuously increasing iteration-number of the main control loop.
+    * `poll(since_seq)`:                   Returns sensor values and alarms that changed since `since_seq`, the heartbeat, and loop statistics in one :class:`.PollResult`.
+    * `touch()`:                           Record contact from the GUI, which is checked for the MISSED_HEARTBEAT alarm.
+    * `wait_for_alarms(since_seq)`:        Blocks until the alarms change after `since_seq`, used to push alarms to subscribers immediately.
+    * `set_sensor_snapshot()`:             Publish sensor values to a shared memory :class:`.SensorSnapshot` whenever COPY_sensor_values is updated.
+    * `set_waveform_buffer()`:             Write every sample of the control loop to a shared memory :class:`.WaveformBuffer`.
+    * `set_heartbeat()`:                   Write the loop counter to a shared memory :class:`.Heartbeat` on every iteration, so a stalled loop can be detected from outside.
+    * `set_mirror()`:                      Write settings and breath phase to a shared memory :class:`.ControllerMirror` on every iteration, for a warm standby to follow.
+    * `follow_mirror(state)`:              Apply the settings of the active controller, while this one is a warm standby.
+    * `take_over(state)`:                  Continue ventilating from the active controller's settings and breath phase.
+    * `set_alarm_manager()`:               Check the rules of an :class:`.Alarm_Manager` on every iteration, and publish its alarms through `poll()`.
+    * `dismiss_alarm(alarm_type)`:         Dismiss an alarm of the alarm manager set with `set_alarm_manager()`.
     """
 
-    def __init__(self, save_logs: bool = False, flush_every: int = 10):
+    def __init__(self, save_logs: bool = False, flush_every: int = 10, checkpoint: typing.Optional[str] = None):
         """
         Initializes the ControlModuleBase class.
 
         Args:
             save_logs (bool, optional): Should sensor data and controls should be saved with the :class:`.DataLogger`? Defaults to False.
             flush_every (int, optional): Flush and rotate logs every n breath cycles. Defaults to 10.
+            checkpoint (str, optional): Path of a :class:`.Checkpoint` file (absolute, or relative to ``VENT_DIR``) to periodically save
+                the controller's state to, and to restore it from if it is recent. Defaults to the ``CONTROLLER_CHECKPOINT_FN`` pref,
+                if that is None, no checkpoints are kept.
 
         Raises:
             alert: [description]
@@ -101,7 +124,12 @@ class ControlModuleBase:
         # Alarm management; controller can only react to High airway pressure alarm, and report Hardware problems
         self.HAPA = None
         self.hapa_crossing_time = None # time that the pressure first crosses the threshold
-        self.TECHA = [] # A List as there can be multiplee technical alerts at the same time
+        # Technical alerts, as there can be multiple at the same time: one slot per AlarmType, and a bit set in
+        # _techa_mask for each slot that holds an alarm. Read and set as a tuple with TECHA.
+        self._techa_slots = [None] * len(_TECHA_SLOT) # type: typing.List[typing.Optional[Alarm]]
+        self._techa_mask = 0
+        self._techa = ()               # tuple of the alarms in _techa_slots, made again by the loop whenever they change
+        self._alarms_snapshot = (None, (), None)  # (HAPA, TECHA, get_alarms()) when get_alarms() last built it
         self.limit_hapa = ALARM_RULES[AlarmType.HIGH_PRESSURE].conditions[0][1].limit # TODO: Jonny write method to get limits from alarm manager
         self.cough_duration = prefs.get_pref('COUGH_DURATION') # type: typing.Union[float, int]
         self.breath_pressure_drop = prefs.get_pref('BREATH_PRESSURE_DROP') # type: typing.Union[float, int]
@@ -158,6 +186,30 @@ class ControlModuleBase:
         ############### Initialize COPY variables for threads  ##############
         # COPY variables that later updated on a regular basis
         self.COPY_sensor_values = None # empty SensorValues can no longer be instantiated -jls
+        self._sensor_snapshot = None   # Shared memory to publish COPY_sensor_values to, see set_sensor_snapshot()
+        self._waveform_buffer = None   # Shared memory ring buffer of every loop's waveform sample, see set_waveform_buffer()
+        self._heartbeat = None         # Shared memory loop counter, see set_heartbeat()
+        self._mirror = None            # Shared memory settings and breath phase for a warm standby, see set_mirror()
+        self._pid = os.getpid()        # Identifies this controller as the owner of the mirror
+        self._is_fenced = False        # Set once another controller has claimed the mirror, after which the valves aren't written
+
+        # Sequence numbers for poll(): _update_seq is incremented whenever sensor values or alarms change,
+        # and _sensor_seq/_alarm_seq record when each last changed.
+        self._update_seq    = 0
+        self._sensor_seq    = 0
+        self._alarm_seq     = 0
+        self._alarm_state   = (None, ())  # (HAPA, TECHA) when alarms last changed, compared by identity
+        self._last_loop_time = None       # time.time() of the last _PID_update, for loop statistics
+        self._loop_dt_mean  = 0
+        self._loop_dts      = deque(maxlen = 1000)  # times between the most recent loops, for the max reported by poll()
+
+        # Alarm manager hosted by the controller, see set_alarm_manager(). Its alarms are kept as (seq, Alarm)
+        # for poll(), and a caller that asks for alarms older than the oldest one kept gets all of them again.
+        self.alarm_manager = None         # type: typing.Optional[Alarm_Manager]
+        self._alarm_manager_lock = threading.Lock()
+        self._alarm_transitions = deque(maxlen = 256)
+        self._alarm_transitions_lost = 0  # seq of the newest transition dropped from _alarm_transitions
+        self.alarm_latencies = deque(maxlen = 1000)  # time from the sample that changed an alarm to its emission, in seconds
 
         ###########################  Threading init  #########################
         # Run the start() method as a thread
@@ -165,6 +217,7 @@ class ControlModuleBase:
         self._running = threading.Event()
         self._running.clear()
         self._lock = threading.Lock()
+        self._alarm_condition = threading.Condition(self._lock)   # notified when alarms change, see wait_for_alarms()
         self._initialize_set_to_COPY()
 
         self.__thread = None
@@ -184,6 +237,23 @@ class ControlModuleBase:
         self._time_last_contact = time.time()
         self._critical_time     = prefs.get_pref('HEARTBEAT_TIMEOUT')           #If Controller has not received set/get within the last 200 ms, it gets nervous.
 
+        ############################# Checkpoints ################################
+        # Periodically save the state of the controller, and restore it after a restart
+        self._checkpoint = None
+        self._last_checkpoint = 0
+        self._CHECKPOINT_INTERVAL = prefs.get_pref('CONTROLLER_CHECKPOINT_INTERVAL')
+        if checkpoint is None:
+            checkpoint = prefs.get_pref('CONTROLLER_CHECKPOINT_FN')
+        if checkpoint is not None:
+            if not os.path.isabs(checkpoint):
+                checkpoint = os.path.join(prefs.get_pref('VENT_DIR'), checkpoint)
+            try:
+                self._checkpoint = Checkpoint(checkpoint)
+                self._restore_checkpoint()
+            except (OSError, ValueError) as e:  # pragma: no cover
+                self.logger.exception(f'couldnt use checkpoint file {checkpoint}, not keeping checkpoints. Got exception\n    {e}')
+                self._checkpoint = None
+
     def __del__(self):
         """
         Destruction of the ControlModuleBase Class; closes the log-file.
@@ -209,6 +279,341 @@ class ControlModuleBase:
         # Make sure you have acquire and release!
         pass
 
+    def _publish_sensors(self):
+        """
+        Mark `COPY_sensor_values` as changed for `poll()`, and write it to the shared memory snapshot if there is one.
+        Called by `_sensor_to_COPY()` while holding the lock.
+        """
+        self._update_seq += 1
+        self._sensor_seq = self._update_seq
+        if self._sensor_snapshot is not None and self.COPY_sensor_values is not None:
+            self._sensor_snapshot.write(self.COPY_sensor_values)
+
+    def set_sensor_snapshot(self, sensor_snapshot: SensorSnapshot):
+        """
+        Publish sensor values to a block of shared memory so that other processes can read them
+        without calling `get_sensors()`. Readers record their last contact in the snapshot,
+        which counts as contact for the missed heartbeat alarm.
+
+        Args:
+            sensor_snapshot (SensorSnapshot): shared memory snapshot, or None to stop publishing
+        """
+        with self._lock:
+            self._sensor_snapshot = sensor_snapshot
+            self._publish_sensors()
+
+    def set_waveform_buffer(self, waveform_buffer: WaveformBuffer):
+        """
+        Write (timestamp, pressure, flow out, control signal in, control signal out, breath count)
+        to a shared memory ring buffer on every iteration of the control loop, so that the GUI can plot
+        waveforms at the full rate of the controller rather than at its own update rate.
+
+        Args:
+            waveform_buffer (WaveformBuffer): shared memory ring buffer, or None to stop writing
+        """
+        with self._lock:
+            self._waveform_buffer = waveform_buffer
+
+    def set_heartbeat(self, heartbeat: Heartbeat):
+        """
+        Write the loop counter to a block of shared memory on every iteration of the control loop,
+        and whether the loop is running, so that the :class:`.ProcessManager` can detect a stalled or dead controller
+        without calling `get_heartbeat()`.
+
+        Args:
+            heartbeat (Heartbeat): shared memory heartbeat, or None to stop writing
+        """
+        with self._lock:
+            self._heartbeat = heartbeat
+            if heartbeat is not None:
+                heartbeat.running = self._running.is_set()
+                heartbeat.beat(self._loop_counter)
+
+    def set_mirror(self, mirror: ControllerMirror):
+        """
+        Write the control settings and breath phase to a block of shared memory on every iteration of the control loop,
+        so that a warm standby controller in another process can follow them and take over mid-breath (see `take_over()`).
+
+        The controller claims the mirror when it is started. If another controller claims it, eg. because a standby
+        took over while this controller was stalled, this controller stops its main loop and stops writing to shared
+        memory, so that only one controller drives the valves.
+
+        Args:
+            mirror (ControllerMirror): shared memory mirror, or None to stop writing
+        """
+        with self._lock:
+            self._mirror = mirror
+            self._pid = os.getpid()
+
+    def set_alarm_manager(self, alarm_manager: typing.Optional[Alarm_Manager]):
+        """
+        Check the rules of an :class:`.Alarm_Manager` against the sensor values of every iteration of the control loop,
+        rather than in the GUI, so alarms don't depend on how often or whether the GUI updates.
+
+        Rules on values sampled every loop (pressure, flow, oxygen) are checked at the loop rate, and rules on values
+        derived from each breath are checked again when those values change at the start of a breath
+        (see :class:`.Input_Index` ). Alarms emitted by the manager are returned as the ``alarm_transitions``
+        of `poll()` and wake up `wait_for_alarms()`. Like the GUI, the manager is only updated after the first breath,
+        since the derived values aren't defined before then.
+
+        The alarm limits of the manager are updated from the current control settings, and then by `set_control()` .
+
+        Args:
+            alarm_manager (:class:`.Alarm_Manager`): alarm manager to host, or None to stop checking alarms
+        """
+        with self._alarm_manager_lock:
+            if self.alarm_manager is not None and self._publish_alarm in self.alarm_manager.callbacks:
+                self.alarm_manager.callbacks.remove(self._publish_alarm)
+            if alarm_manager is not None:
+                alarm_manager.add_callback(self._publish_alarm)
+                with self._lock:
+                    control_values = self._control_values()
+                for name, value in control_values.items():
+                    alarm_manager.update_dependencies(ControlSetting(name=name, value=value))
+            self.alarm_manager = alarm_manager
+            with self._alarm_condition:
+                self._alarm_transitions.clear()
+                self._alarm_transitions_lost = self._update_seq
+
+    def _update_alarm_manager(self, now: float):
+        """
+        Update the alarm manager with this iteration's sensor values, see `set_alarm_manager()` .
+        Exceptions are logged rather than raised, so the control loop keeps running.
+
+        Args:
+            now (float): time.time() of this iteration, the timestamp of the sensor values
+        """
+        if self._DATA_BREATH_COUNT <= 1:
+            return
+        # in the order of SensorValues.tuple_fields
+        sensor_values = SensorValues.from_tuple((
+            now,                        # timestamp
+            self._loop_counter,         # loop_counter
+            self._DATA_BREATH_COUNT,    # breath_count
+            self._DATA_PIP,             # PIP
+            self._DATA_PEEP,            # PEEP
+            self._DATA_BPM,             # BREATHS_PER_MINUTE
+            self._DATA_I_PHASE,         # INSPIRATION_TIME_SEC
+            self._DATA_PRESSURE,        # PRESSURE
+            self._DATA_VTE,             # VTE
+            self._DATA_Qout,            # FLOWOUT
+            self.COPY_DATA_OXYGEN       # FIO2
+        ))
+        with self._alarm_manager_lock:
+            if self.alarm_manager is None:
+                return
+            try:
+                self.alarm_manager.update(sensor_values)
+            except Exception as e:
+                self.logger.exception(f'Couldnt update alarm manager, got exception\n    {e}')
+
+    def _publish_alarm(self, alarm: Alarm):
+        """
+        Callback of the hosted alarm manager: keep the alarm for `poll()` and notify `wait_for_alarms()` .
+        Called while holding `_alarm_manager_lock` .
+
+        Args:
+            alarm (:class:`.Alarm`): raised or cleared alarm
+        """
+        sample_time = alarm.timestamps.get('sample')
+        if sample_time is not None:
+            self.alarm_latencies.append(time.time() - sample_time)
+        with self._alarm_condition:
+            self._update_seq += 1
+            self._alarm_seq = self._update_seq
+            if len(self._alarm_transitions) == self._alarm_transitions.maxlen:
+                self._alarm_transitions_lost = self._alarm_transitions[0][0]
+            self._alarm_transitions.append((self._update_seq, alarm))
+            self._alarm_condition.notify_all()
+
+    def _alarm_manager_state(self) -> typing.Tuple[Alarm]:
+        """
+        The state of every rule of the hosted alarm manager, as its active :class:`.Alarm` or an alarm with
+        :attr:`.AlarmSeverity.OFF` , for callers of `poll()` that have missed transitions.
+        """
+        with self._alarm_manager_lock:
+            if self.alarm_manager is None:
+                return ()
+            active_alarms = self.alarm_manager.active_alarms
+            return tuple(
+                active_alarms[alarm_type] if alarm_type in active_alarms else
+                Alarm(alarm_type, AlarmSeverity.OFF, latch=rule.latch, cause=rule.value_names)
+                for alarm_type, rule in self.alarm_manager.rules.items()
+            )
+
+    def dismiss_alarm(self, alarm_type: AlarmType, duration: float = None):
+        """
+        A method callable from the outside to dismiss an alarm of the hosted alarm manager,
+        see :meth:`.Alarm_Manager.dismiss_alarm`
+
+        Args:
+            alarm_type (:class:`.AlarmType`): Alarm to dismiss
+            duration (float): seconds before the alarm can be raised again
+        """
+        with self._alarm_manager_lock:
+            if self.alarm_manager is None:
+                self.logger.warning(f'Could not dismiss {alarm_type}, controller has no alarm manager')
+            elif alarm_type not in self.alarm_manager.rules:
+                self.logger.warning(f'Could not dismiss {alarm_type}, no rule for it in the alarm manager')
+            else:
+                self.alarm_manager.dismiss_alarm(alarm_type, duration)
+        self._time_last_contact = time.time()
+
+    def _control_values(self) -> typing.Dict[ValueName, float]:
+        """
+        The current control settings, as {ValueName: value}
+        """
+        return {
+            ValueName.PIP: self.COPY_SET_PIP,
+            ValueName.PIP_TIME: self.COPY_SET_PIP_TIME,
+            ValueName.PEEP: self.COPY_SET_PEEP,
+            ValueName.PEEP_TIME: self.COPY_SET_PEEP_TIME,
+            ValueName.BREATHS_PER_MINUTE: self.COPY_SET_BPM,
+            ValueName.INSPIRATION_TIME_SEC: self.COPY_SET_I_PHASE
+        }
+
+    def _write_checkpoint(self, now: float):
+        """
+        Save the controller's state to its :class:`.Checkpoint` : control settings, breath count and phase,
+        the flows used for the baseline flow estimate, the last derived values, and the last and current waveforms.
+
+        Called from `_PID_update()` every `_CHECKPOINT_INTERVAL` seconds, and when a new breath starts.
+
+        Args:
+            now (float): time.time() of this iteration
+        """
+        self._checkpoint.write({
+            'timestamp': now,
+            'controls': self._control_values(),
+            'breath_detection': self.breath_detection,
+            'limit_hapa': self.limit_hapa,
+            'breath_count': self._DATA_BREATH_COUNT,
+            'cycle_start': self._cycle_start,
+            'derived': {name: getattr(self, f'_DATA_{name}') for name in CHECKPOINT_DERIVED},
+            'flow': self._flow_list,
+            'last_waveform': self.__cycle_waveform_archive[-1] if len(self.__cycle_waveform_archive) > 0 else None,
+            'cycle_waveform': self.__cycle_waveform
+        })
+        self._last_checkpoint = now
+
+    def _restore_checkpoint(self) -> bool:
+        """
+        Restore the controller's state from its :class:`.Checkpoint` , if the last checkpoint is younger than
+        the ``CONTROLLER_CHECKPOINT_MAX_AGE`` pref. Called at the end of `__init__()`
+
+        The breath cycle continues from the checkpointed phase, so if the controller is started right away it
+        doesn't start a new breath, and the derived values of the last breath are reported until the next one.
+
+        Returns:
+            bool: True if the state was restored
+        """
+        state = self._checkpoint.read()
+        if state is None:
+            return False
+        age = time.time() - state['timestamp']
+        if age > prefs.get_pref('CONTROLLER_CHECKPOINT_MAX_AGE'):
+            self.logger.info(f'Checkpoint is {age:.1f}s old, not restoring it')
+            return False
+
+        controls = state['controls']
+        with self._lock:
+            self.COPY_SET_PIP       = controls[ValueName.PIP]
+            self.COPY_SET_PIP_TIME  = controls[ValueName.PIP_TIME]
+            self.COPY_SET_PEEP      = controls[ValueName.PEEP]
+            self.COPY_SET_PEEP_TIME = controls[ValueName.PEEP_TIME]
+            self.COPY_SET_BPM       = controls[ValueName.BREATHS_PER_MINUTE]
+            self.COPY_SET_I_PHASE   = controls[ValueName.INSPIRATION_TIME_SEC]
+            self.limit_hapa         = state['limit_hapa']
+        self._controls_from_COPY()
+        self.breath_detection = state['breath_detection']
+
+        self._DATA_BREATH_COUNT = state['breath_count']
+        self._breath_counter = count(state['breath_count'] + 1)
+        self._cycle_start = state['cycle_start']
+        for name, value in state['derived'].items():
+            setattr(self, f'_DATA_{name}', value)
+        self._flow_list.extend(state['flow'])
+        if len(state['last_waveform']) > 0:
+            self.__cycle_waveform_archive.append(state['last_waveform'])
+        if len(state['cycle_waveform']) > 0:
+            self.__cycle_waveform = state['cycle_waveform']
+
+        self.logger.info(f'Restored checkpoint from {age:.3f}s ago at breath {self._DATA_BREATH_COUNT}')
+        return True
+
+    def _write_mirror(self):
+        """
+        Write the current control settings and breath phase to the mirror
+        """
+        self._mirror.write(
+            controls=self._control_values(),
+            cycle_start=self._cycle_start,
+            breath_count=self._DATA_BREATH_COUNT,
+            breath_detection=self.breath_detection,
+            limit_hapa=self.limit_hapa)
+
+    def _fenced(self) -> bool:
+        """
+        Check whether another controller has claimed the mirror. If so, stop the main loop and detach from shared memory.
+        Once fenced, a controller stays fenced.
+
+        Returns:
+            bool: True if this controller should no longer drive the valves
+        """
+        if self._is_fenced:
+            return True
+        if self._mirror is None or self._mirror.owner == self._pid:
+            return False
+        self.logger.warning(f'Controller process {self._mirror.owner} has taken over, stopping the main loop.')
+        with self._lock:
+            self._is_fenced = True
+            self._running.clear()
+            self._mirror = None
+            self._heartbeat = None
+            self._sensor_snapshot = None
+            self._waveform_buffer = None
+            self._checkpoint = None
+        return True
+
+    def follow_mirror(self, state: dict):
+        """
+        Apply the control settings of the active controller, as read from a :class:`.ControllerMirror` ,
+        while this controller is a warm standby and its main loop isn't running.
+
+        Args:
+            state (dict): as returned by :meth:`.ControllerMirror.read`
+        """
+        controls = state['controls']
+        with self._lock:
+            self.COPY_SET_PIP       = controls[ValueName.PIP]
+            self.COPY_SET_PIP_TIME  = controls[ValueName.PIP_TIME]
+            self.COPY_SET_PEEP      = controls[ValueName.PEEP]
+            self.COPY_SET_PEEP_TIME = controls[ValueName.PEEP_TIME]
+            self.COPY_SET_BPM       = controls[ValueName.BREATHS_PER_MINUTE]
+            self.COPY_SET_I_PHASE   = controls[ValueName.INSPIRATION_TIME_SEC]
+            self.limit_hapa         = state['limit_hapa']
+        self.breath_detection = state['breath_detection']
+
+    def take_over(self, state: dict):
+        """
+        Continue ventilating where the active controller left off: apply its settings, continue its
+        breath cycle and breath count, and start the main loop.
+
+        The caller should claim the :class:`.ControllerMirror` first, see :func:`.standby.standby_server_main`
+
+        Args:
+            state (dict): as returned by :meth:`.ControllerMirror.read`
+        """
+        self.follow_mirror(state)
+        self._controls_from_COPY()
+        self._cycle_start = state['cycle_start']
+        self._DATA_BREATH_COUNT = state['breath_count']
+        self._breath_counter = count(state['breath_count'] + 1)
+        self._last_update = time.time()
+        self.logger.info(f'Taking over at breath {self._DATA_BREATH_COUNT}, '
+                         f'{time.time() - self._cycle_start:.3f}s into the cycle')
+        self.start()
+
     def _controls_from_COPY(self):
         # Update SET variables
         with self._lock:
@@ -324,6 +729,8 @@ class ControlModuleBase:
         A method callable from the outside to get a copy of the alarms, that the controller checks:
         High airway pressure, and technical alarms.
 
+        The tuple is only built again when the alarms have changed, otherwise the same tuple is returned.
+
         Returns:
             typing.Union[None, typing.Tuple[Alarm]]: A tuple of alarms
         """
@@ -331,6 +738,10 @@ class ControlModuleBase:
             hapa = self.HAPA
             techa = self.TECHA
 
+        last_hapa, last_techa, ret = self._alarms_snapshot
+        if hapa is last_hapa and techa is last_techa:
+            return ret
+
         # return a tuple of alarms if there are any.
         if (hapa is not None) and (len(techa)>0):
             ret = (hapa, techa)
@@ -340,12 +751,63 @@ class ControlModuleBase:
             ret = (techa,)
         else:
             ret = None
+        self._alarms_snapshot = (hapa, techa, ret)
 
         if ret is not None:
             self.logger.debug(f'Returning alarms {ret}')
 
         return ret
 
+    @property
+    def TECHA(self) -> typing.Tuple[Alarm, ...]:
+        """
+        The active technical alerts, a tuple that is only made again when they change
+
+        The tuple is made by the thread that changes the alerts (the main loop), so other threads only ever read
+        a complete tuple and never write it.
+
+        Can be set with an iterable of :class:`.Alarm` s, replacing all technical alerts.
+
+        Returns:
+            tuple: of :class:`.Alarm` s, in the order of :class:`.AlarmType`
+        """
+        return self._techa
+
+    @TECHA.setter
+    def TECHA(self, alarms: typing.Iterable[Alarm]):
+        slots = [None] * len(_TECHA_SLOT)
+        mask = 0
+        for alarm in alarms:
+            slot = _TECHA_SLOT[alarm.alarm_type]
+            slots[slot] = alarm
+            mask |= 1 << slot
+        self._techa_slots = slots
+        self._techa_mask = mask
+        self._update_techa()
+
+    def _raise_techa(self, slot: int, alarm: Alarm):
+        """
+        Put a technical alert in its slot of `TECHA`
+        """
+        self._techa_slots[slot] = alarm
+        self._techa_mask |= 1 << slot
+        self._update_techa()
+
+    def _clear_techa(self, slot: int):
+        """
+        Remove the technical alert in a slot of `TECHA` , if there is one
+        """
+        if self._techa_mask & (1 << slot):
+            self._techa_slots[slot] = None
+            self._techa_mask &= ~(1 << slot)
+            self._update_techa()
+
+    def _update_techa(self):
+        """
+        Make the `TECHA` tuple again from the slots, replacing the old one in a single assignment
+        """
+        self._techa = tuple(alarm for alarm in self._techa_slots if alarm is not None)
+
     def set_control(self, control_setting: ControlSetting):
         """
         A method callable from the outside to set alarms.
@@ -354,6 +816,11 @@ class ControlModuleBase:
         Args:
             control_setting (ControlSetting): [description]
         """
+        with self._alarm_manager_lock:
+            if self.alarm_manager is not None:
+                # alarm limits can depend on controls that aren't set in the controller, eg. VTE
+                self.alarm_manager.update_dependencies(control_setting)
+
         if control_setting.value is not None:
             with self._lock:
                 if control_setting.name == ValueName.PIP:
@@ -495,7 +962,7 @@ class ControlModuleBase:
         """
         self._cycle_start = time.time()
 
-    def __test_for_alarms(self):
+    def __test_for_alarms(self, now: float = None):
         """
         Implements tests that are to be executed in the main control loop:
             - Test for HAPA
@@ -503,7 +970,12 @@ class ControlModuleBase:
             - Test for Technical Alert, make sure continuous in contact
         Currently: Alarms are time.time() of first occurance.
 
+        Args:
+            now (float): time.time() of this loop, shared by all tests. if None, the current time
         """
+        if now is None:
+            now = time.time()
+
         # for now, assume UI will send updates, we init from the default value
         # jonny will implement means of getting limits from alarm manager
         limit_max_flows = 10            # If flows above that, hardware cannot be correct.
@@ -514,10 +986,10 @@ class ControlModuleBase:
         if self._DATA_PRESSURE > self.limit_hapa:
             # if just crossing, store time of threshold crossing
             if self.hapa_crossing_time is None:
-                self.hapa_crossing_time = time.time()
+                self.hapa_crossing_time = now
 
             # check if time elapsed is greater than cough duration.
-            if time.time() - self.hapa_crossing_time > self.cough_duration:       # 100 ms active to avoid being triggered by coughs
+            if now - self.hapa_crossing_time > self.cough_duration:       # 100 ms active to avoid being triggered by coughs
                 if self.__control_signal_in != 0 and self.__control_signal_out != 1:
                     self.__control_signal_out = 1
                     self.__control_signal_in  = 0
@@ -526,7 +998,7 @@ class ControlModuleBase:
                 if self.HAPA is None:
                     self.HAPA = Alarm(AlarmType.HIGH_PRESSURE,
                                       AlarmSeverity.HIGH,
-                                      time.time(),
+                                      now,
                                       value=self._DATA_PRESSURE)
 
                     self.logger.warning(f'Triggered HAPA at ' + str(self._DATA_PRESSURE))
@@ -550,19 +1022,20 @@ class ControlModuleBase:
 
         if inputs_dont_change:
             if self.sensor_stuck_since is None:
-                self.sensor_stuck_since = time.time()                # If inputs are stuck, remember the time.
+                self.sensor_stuck_since = now                        # If inputs are stuck, remember the time.
                 time_elapsed = 0
             else:
-                time_elapsed = time.time() - self.sensor_stuck_since   # If happened again, how long?
+                time_elapsed = now - self.sensor_stuck_since           # If happened again, how long?
 
-            if time_elapsed > self.limit_max_stuck_sensor and not any([a.alarm_type == AlarmType.SENSORS_STUCK for a in self.TECHA]):
-                    self.TECHA.append(Alarm(
+            if time_elapsed > self.limit_max_stuck_sensor and not self._techa_mask & (1 << _SENSORS_STUCK):
+                    self._raise_techa(_SENSORS_STUCK, Alarm(
                         AlarmType.SENSORS_STUCK,
                         AlarmSeverity.TECHNICAL,
+                        now
                     ))
                     self.logger.warning(f'Inputs do not change; raised alarm.')
         else:
-            self.TECHA = [a for a in self.TECHA if a.alarm_type != AlarmType.SENSORS_STUCK]
+            self._clear_techa(_SENSORS_STUCK)
             self.sensor_stuck_since = None                           # If ok, reset sensor_stuck
 
 
@@ -570,26 +1043,45 @@ class ControlModuleBase:
                            (self._DATA_Qout < 0 or self._DATA_Qout > self.limit_max_flows) or \
                            (self._DATA_PRESSURE < 0 or self._DATA_PRESSURE > self.limit_max_pressure)
         if data_implausible:
-            if not any([a.alarm_type == AlarmType.BAD_SENSOR_READINGS for a in self.TECHA]):
-                self.TECHA.append(Alarm(
+            if not self._techa_mask & (1 << _BAD_SENSOR_READINGS):
+                self._raise_techa(_BAD_SENSOR_READINGS, Alarm(
                     AlarmType.BAD_SENSOR_READINGS,
                     AlarmSeverity.TECHNICAL,
+                    now
                 ))
             self.logger.warning(f'Implausible values; raised alarm.')
 
         #### Third: Make sure that updates are coming in in a regular basis
         #
-        last_contact = np.abs(self._time_last_contact - time.time())
+        if self._sensor_snapshot is not None:
+            # readers of the shared memory snapshot don't call get_sensors()
+            self._time_last_contact = max(self._time_last_contact, self._sensor_snapshot.last_contact)
+        last_contact = abs(self._time_last_contact - now)
         if last_contact > self._critical_time:
-            if not any([a.alarm_type == AlarmType.MISSED_HEARTBEAT for a in self.TECHA]):
-                self.TECHA.append(Alarm(
+            if not self._techa_mask & (1 << _MISSED_HEARTBEAT):
+                self._raise_techa(_MISSED_HEARTBEAT, Alarm(
                     AlarmType.MISSED_HEARTBEAT,
                     AlarmSeverity.TECHNICAL,
+                    now,
                     message=f"Controller has not heard from coordinator in {last_contact}"
                 ))
 
+        self._check_alarm_changes()
+
         #self.TECHA = time.time()  # Technical alert, but continue running hoping for the best
 
+    def _check_alarm_changes(self):
+        """
+        Advance the sequence number used by `poll()` if HAPA or any of the TECHA have been raised or cleared.
+        """
+        hapa, techa = self._alarm_state
+        if self.HAPA is not hapa or self._techa is not techa:
+            with self._alarm_condition:
+                self._alarm_state = (self.HAPA, self.TECHA)
+                self._update_seq += 1
+                self._alarm_seq = self._update_seq
+                self._alarm_condition.notify_all()
+
     def __start_new_breathcycle(self):
         """
         Some housekeeping. This has to be executed when the next breath cycles starts:
@@ -624,7 +1116,11 @@ class ControlModuleBase:
             dt (float): timesstep since last update
         """
 
+        if self._fenced():
+            return
+
         now = time.time()
+        self._update_loop_stats(now)
         cycle_phase = now - self._cycle_start
         next_cycle = False
         if len(self._flow_list) == self._BASELINE_ESTIMATOR_LENGTH:  # estimate the baseline flow during expiration with a rankfilter
@@ -668,32 +1164,61 @@ class ControlModuleBase:
             self._DATA_dpdt    = 0            # and restart the rolling average for the dP/dt estimation
             next_cycle = True
 
-        self.__test_for_alarms()
+        self.__test_for_alarms(now)
         if next_cycle:                        # if a new breath cycle has started
             self.__start_new_breathcycle()
         else:
             self.__cycle_waveform = np.append(self.__cycle_waveform, [[cycle_phase, self._DATA_PRESSURE, self._DATA_VOLUME]], axis=0)
+        if self.alarm_manager is not None:
+            self._update_alarm_manager(now)
+        if self._waveform_buffer is not None:
+            self._waveform_buffer.append(now, self._DATA_PRESSURE, self._DATA_Qout,
+                                         self.__control_signal_in, self.__control_signal_out,
+                                         self._DATA_BREATH_COUNT)
+        if self._heartbeat is not None:
+            self._heartbeat.beat(self._loop_counter, now)
+        if self._mirror is not None:
+            self._write_mirror()
+        if self._checkpoint is not None and (next_cycle or now - self._last_checkpoint >= self._CHECKPOINT_INTERVAL):
+            self._write_checkpoint(now)
         if self._save_logs:
             self.__save_values()
 
+    def _update_loop_stats(self, now: float):
+        """
+        Update the running mean and the recent times between iterations of the main loop, reported by `poll()`
+
+        Args:
+            now (float): time.time() of this iteration
+        """
+        if self._last_loop_time is not None:
+            loop_dt = now - self._last_loop_time
+            if self._loop_dt_mean == 0:
+                self._loop_dt_mean = loop_dt
+            else:
+                self._loop_dt_mean += 0.01 * (loop_dt - self._loop_dt_mean)   # exponential moving average over ~100 loops
+            self._loop_dts.append(loop_dt)
+        self._last_loop_time = now
+
     def __save_values(self):
         """
         Helper function to reorganize key parameters in the main PID control loop, into a `SensorValues` object,
         that can be stored in the logfile, using a method from the DataLogger.
         """
-        sensor_values =  SensorValues(vals={
-        ValueName.PIP.name                  : self._DATA_PIP,
-        ValueName.PEEP.name                 : self._DATA_PEEP,
-        ValueName.FIO2.name                 : self.COPY_DATA_OXYGEN,
-        ValueName.PRESSURE.name             : self._DATA_PRESSURE,
-        ValueName.VTE.name                  : self._DATA_VTE,
-        ValueName.BREATHS_PER_MINUTE.name   : self._DATA_BPM,
-        ValueName.INSPIRATION_TIME_SEC.name : self._DATA_I_PHASE,
-        ValueName.FLOWOUT.name              : self._DATA_Qout,
-        'timestamp'                         : time.time(),
-        'loop_counter'                      : self._loop_counter,
-        'breath_count'                      : self._DATA_BREATH_COUNT
-        })
+        # in the order of SensorValues.tuple_fields
+        sensor_values = SensorValues.from_tuple((
+            time.time(),                # timestamp
+            self._loop_counter,         # loop_counter
+            self._DATA_BREATH_COUNT,    # breath_count
+            self._DATA_PIP,             # PIP
+            self._DATA_PEEP,            # PEEP
+            self._DATA_BPM,             # BREATHS_PER_MINUTE
+            self._DATA_I_PHASE,         # INSPIRATION_TIME_SEC
+            self._DATA_PRESSURE,        # PRESSURE
+            self._DATA_VTE,             # VTE
+            self._DATA_Qout,            # FLOWOUT
+            self.COPY_DATA_OXYGEN       # FIO2
+        ))
 
         #And the control value instance
         control_values = ControlValues(
@@ -734,7 +1259,13 @@ class ControlModuleBase:
         """
         self._time_last_contact = time.time()
         if self.__thread is None or not self.__thread.is_alive():  # If the previous thread has been stopped, make a new one.
+            self._last_loop_time = None
             self._running.set()
+            if self._mirror is not None:
+                self._mirror.claim(self._pid)
+            if self._heartbeat is not None:
+                self._heartbeat.beat(self._loop_counter)
+                self._heartbeat.running = True
             self.__thread = threading.Thread(target=self._start_mainloop, daemon=True)
             self.__thread.start()
         else:
@@ -747,6 +1278,8 @@ class ControlModuleBase:
         self._time_last_contact = time.time()
         if self.__thread is not None and self.__thread.is_alive():
             self._running.clear()
+            if self._heartbeat is not None:
+                self._heartbeat.running = False
         else:
             print("Main Loop is not running.")
 
@@ -774,12 +1307,101 @@ class ControlModuleBase:
         self._time_last_contact = time.time()
         return self._loop_counter
 
+    def touch(self):
+        """
+        Record contact from the GUI, which otherwise raises a `MISSED_HEARTBEAT` technical alarm after `HEARTBEAT_TIMEOUT`.
+
+        Called by the GUI for each update it handles, since updates pushed by a subscription (see `poll()` ) don't
+        count as contact on their own.
+        """
+        self._time_last_contact = time.time()
+
+    def poll(self, since_seq: int = 0, touch: bool = False) -> PollResult:
+        """
+        A method callable from the outside to get everything needed for a GUI update in one call:
+        sensor values and alarms if they changed since `since_seq`, the heartbeat, and loop statistics.
+
+        If the controller hosts an alarm manager (see `set_alarm_manager()` ), the alarms it emitted since `since_seq`
+        are returned in order as ``alarm_transitions`` . If some of them are no longer kept, or everything is returned,
+        ``alarm_transitions`` is the current state of every alarm instead, with :attr:`.AlarmSeverity.OFF` alarms
+        for the alarms that aren't active.
+
+        Pass the `seq` of the returned `PollResult` as `since_seq` to the next call. If `since_seq` is 0, or
+        greater than the current sequence number (e.g. the controller was restarted), everything is returned.
+
+        Polls don't count as contact with the GUI unless `touch` is True, since they are also made by subscription
+        publishers and read-only clients that keep polling when the GUI has stalled, see `touch()`.
+
+        Args:
+            since_seq (int): `seq` of the last `PollResult` the caller received
+            touch (bool): record contact from the GUI
+
+        Returns:
+            PollResult: the changes since `since_seq`
+        """
+        self._check_alarm_changes()
+        with self._lock:
+            seq = self._update_seq
+            everything = since_seq <= 0 or since_seq > seq
+            sensors = None
+            if everything or self._sensor_seq > since_seq:
+                sensors = copy.copy(self.COPY_sensor_values)
+            alarms_changed = everything or self._alarm_seq > since_seq
+
+            alarm_transitions = None
+            resync_alarms = False
+            if self.alarm_manager is not None:
+                if everything or since_seq < self._alarm_transitions_lost:
+                    resync_alarms = True
+                else:
+                    alarm_transitions = tuple(alarm for alarm_seq, alarm in self._alarm_transitions
+                                              if alarm_seq > since_seq)
+
+            loop_stats = {
+                'loop_rate': 1 / self._loop_dt_mean if self._loop_dt_mean > 0 else 0,
+                'mean_dt': self._loop_dt_mean,
+                'max_dt': max(tuple(self._loop_dts), default=0)
+            }
+            if self.alarm_manager is not None:
+                latencies = tuple(self.alarm_latencies)
+                loop_stats['alarm_latency_mean'] = sum(latencies) / len(latencies) if latencies else 0
+                loop_stats['alarm_latency_max'] = max(latencies, default=0)
+
+        if resync_alarms:
+            alarm_transitions = self._alarm_manager_state()
+        alarms = self.get_alarms() if alarms_changed else None
+        if touch:
+            self.touch()
+        return PollResult(seq=seq,
+                          timestamp=time.time(),
+                          loop_counter=self._loop_counter,
+                          sensors=sensors,
+                          alarms_changed=alarms_changed,
+                          alarms=alarms,
+                          loop_stats=loop_stats,
+                          alarm_transitions=alarm_transitions)
+
+    def wait_for_alarms(self, since_seq: int, timeout: float = None) -> bool:
+        """
+        Block until HAPA or TECHA change, or the hosted alarm manager emits an alarm,
+        after the `poll()` sequence number `since_seq`, or until `timeout`.
+
+        Args:
+            since_seq (int): `seq` of the last `PollResult` the caller received
+            timeout (float): maximum time to wait in seconds, or None to wait indefinitely
+
+        Returns:
+            bool: True if the alarms changed, False if the wait timed out
+        """
+        with self._alarm_condition:
+            return self._alarm_condition.wait_for(lambda: self._alarm_seq > since_seq, timeout)
+
 class ControlModuleDevice(ControlModuleBase): 
     """
     Uses ControlModuleBase to control the hardware.
     """
     # Implement ControlModuleBase functions
-    def __init__(self, save_logs = True, flush_every = 10, config_file = None):
+    def __init__(self, save_logs = True, flush_every = 10, config_file = None, checkpoint = None):
         """
         Initializes the ControlModule for the physical system. Inherits methods from ControlModuleBase
 
@@ -787,8 +1409,9 @@ class ControlModuleDevice(ControlModuleBase):
             save_logs (bool, optional): Should logs be kept? Defaults to True.
             flush_every (int, optional): How often are log-files to be flushed, in units of main-loop-itertions? Defaults to 10.
             config_file (str, optional): Path to device config file, e.g. 'pvp/io/config/dinky-devices.ini'. Defaults to None.
+            checkpoint (str, optional): Path of a checkpoint file, see :class:`.ControlModuleBase`. Defaults to None.
         """
-        ControlModuleBase.__init__(self, save_logs, flush_every)
+        ControlModuleBase.__init__(self, save_logs, flush_every, checkpoint = checkpoint)
 
         self.__get_hal(config_file)
         self._sensor_to_COPY()
@@ -822,19 +1445,21 @@ class ControlModuleDevice(ControlModuleBase):
         self._get_HAL() #Update sensor measurements
 
         with self._lock:
-          self.COPY_sensor_values = SensorValues(vals={
-              ValueName.PIP.name                  : self._DATA_PIP,
-              ValueName.PEEP.name                 : self._DATA_PEEP,
-              ValueName.FIO2.name                 : self.COPY_DATA_OXYGEN,
-              ValueName.PRESSURE.name             : self._DATA_PRESSURE,
-              ValueName.VTE.name                  : self._DATA_VTE,
-              ValueName.BREATHS_PER_MINUTE.name   : self._DATA_BPM,
-              ValueName.INSPIRATION_TIME_SEC.name : self._DATA_I_PHASE,
-              ValueName.FLOWOUT.name              : self._DATA_Qout,
-              'timestamp'                         : time.time(),
-              'loop_counter'                      : self._loop_counter,
-              'breath_count'                      : self._DATA_BREATH_COUNT
-          })
+          # in the order of SensorValues.tuple_fields
+          self.COPY_sensor_values = SensorValues.from_tuple((
+              time.time(),                # timestamp
+              self._loop_counter,         # loop_counter
+              self._DATA_BREATH_COUNT,    # breath_count
+              self._DATA_PIP,             # PIP
+              self._DATA_PEEP,            # PEEP
+              self._DATA_BPM,             # BREATHS_PER_MINUTE
+              self._DATA_I_PHASE,         # INSPIRATION_TIME_SEC
+              self._DATA_PRESSURE,        # PRESSURE
+              self._DATA_VTE,             # VTE
+              self._DATA_Qout,            # FLOWOUT
+              self.COPY_DATA_OXYGEN       # FIO2
+          ))
+          self._publish_sensors()
             
     # @timeout  #TODO: find a save setting for timeout, as the hardware is kinda slow. >10ms?
     def _set_HAL(self, valve_open_in, valve_open_out):
@@ -847,6 +1472,9 @@ class ControlModuleDevice(ControlModuleBase):
             valve_open_in (float): setting of the inspiratory valve; should be in range [0,100]
             valve_open_out (float): setting of the expiratory valve; should be 1/0 (open and close)
         """
+        if self._is_fenced:
+            return                      # Another controller drives the valves now
+
         if self.current_setting_in is not max(min(100, int(valve_open_in)), 0):
             self.HAL.setpoint_in = max(min(100, int(valve_open_in)), 0)
             self.current_setting_in = max(min(100, int(valve_open_in)), 0)
@@ -884,8 +1512,11 @@ class ControlModuleDevice(ControlModuleBase):
 
     def set_valves_standby(self):
         """
-        This returns valves back to normal setting (in: closed, out: open)
+        This returns valves back to normal setting (in: closed, out: open), unless another controller has taken
+        over the valves (see `_fenced()`)
         """
+        if self._is_fenced:
+            return
         self.logger.info('Valves to stand-by.')
         self._set_HAL(valve_open_in = 0, valve_open_out = 1)  # Defined state to make sure that it does not pop up.
 
@@ -912,6 +1543,8 @@ class ControlModuleDevice(ControlModuleBase):
 
                 self._get_HAL()                                          # Update pressure and flow measurement
                 self._PID_update(dt = dt)                                # With that, calculate controls
+                if self._is_fenced:
+                    break                                                # Another controller has taken over the valves
                 valve_open_in  = self._get_control_signal_in()           #    -> Inspiratory side: get control signal for PropValve
                 valve_open_out = self._get_control_signal_out()          #    -> Expiratory side: get control signal for Solenoid
                 self._set_HAL(valve_open_in, valve_open_out)             # And set values.
@@ -1043,7 +1676,7 @@ class ControlModuleSimulator(ControlModuleBase):
     Controlling Simulation.
     """
     # Implement ControlModuleBase functions
-    def __init__(self, save_logs: bool = False, simulator_dt = None, peep_valve_setting = 5):
+    def __init__(self, save_logs: bool = False, simulator_dt = None, peep_valve_setting = 5, checkpoint = None):
         """
         Initializes the ControlModuleBase with the simple simulation (for testing/dev).
 
@@ -1051,8 +1684,9 @@ class ControlModuleSimulator(ControlModuleBase):
             save_logs (bool, optional): should logs be saved? (Useful for testing)
             simulator_dt (float, optional): timestep between updates. Defaults to None.
             peep_valve_setting (int, optional): Simulates action of a PEEP valve. Pressure cannot fall below. Defaults to 5.
+            checkpoint (str, optional): Path of a checkpoint file, see :class:`.ControlModuleBase`. Defaults to None.
         """
-        ControlModuleBase.__init__(self, save_logs = False)
+        ControlModuleBase.__init__(self, save_logs = False, checkpoint = checkpoint)
         self.Balloon = Balloon_Simulator(peep_valve = peep_valve_setting)          # This is the simulation
         self._sensor_to_COPY()
         self._LOOP_UPDATE_TIME = prefs.get_pref('CONTROLLER_LOOP_UPDATE_TIME_SIMULATOR')
@@ -1098,19 +1732,21 @@ class ControlModuleSimulator(ControlModuleBase):
         Make the sensor value object from current (simulated) measurements
         """
         with self._lock:
-            self.COPY_sensor_values = SensorValues(vals={
-              ValueName.PIP.name                  : self._DATA_PIP,
-              ValueName.PEEP.name                 : self._DATA_PEEP,
-              ValueName.FIO2.name                 : self.Balloon.fio2,
-              ValueName.PRESSURE.name             : self.Balloon.current_pressure,
-              ValueName.VTE.name                  : self._DATA_VTE,
-              ValueName.BREATHS_PER_MINUTE.name   : self._DATA_BPM,
-              ValueName.INSPIRATION_TIME_SEC.name : self._DATA_I_PHASE,
-              ValueName.FLOWOUT.name              : self._DATA_Qout,
-              'timestamp'                         : time.time(),
-              'loop_counter'                      : self._loop_counter,
-              'breath_count'                      : self._DATA_BREATH_COUNT
-            })
+            # in the order of SensorValues.tuple_fields
+            self.COPY_sensor_values = SensorValues.from_tuple((
+              time.time(),                      # timestamp
+              self._loop_counter,               # loop_counter
+              self._DATA_BREATH_COUNT,          # breath_count
+              self._DATA_PIP,                   # PIP
+              self._DATA_PEEP,                  # PEEP
+              self._DATA_BPM,                   # BREATHS_PER_MINUTE
+              self._DATA_I_PHASE,               # INSPIRATION_TIME_SEC
+              self.Balloon.current_pressure,    # PRESSURE
+              self._DATA_VTE,                   # VTE
+              self._DATA_Qout,                  # FLOWOUT
+              self.Balloon.fio2                 # FIO2
+            ))
+            self._publish_sensors()
 
     def _start_mainloop(self):
         """
@@ -1161,18 +1797,21 @@ class ControlModuleSimulator(ControlModuleBase):
 
 
 
-def get_control_module(sim_mode=False, simulator_dt = None):
+def get_control_module(sim_mode=False, simulator_dt = None, checkpoint = None):
     """
     Generates control module.
 
     Args:
         sim_mode (bool, optional): if ``true``: returns simulation, else returns hardware. Defaults to False.
         simulator_dt (float, optional): a timescale for thee simulation. Defaults to None.
+        checkpoint (str, optional): Path of a checkpoint file to save the controller's state to and restore it from,
+            see :class:`.ControlModuleBase`. Defaults to the ``CONTROLLER_CHECKPOINT_FN`` pref.
 
     Returns:
         ControlModule-Object: Either configured for simulation, or physical device.
     """
     if sim_mode == True:
-        return ControlModuleSimulator(save_logs = True, simulator_dt = simulator_dt)
+        return ControlModuleSimulator(save_logs = True, simulator_dt = simulator_dt, checkpoint = checkpoint)
     else:
-        return ControlModuleDevice(save_logs = True, flush_every = 1, config_file = 'pvp/io/config/devices.ini')
+        return ControlModuleDevice(save_logs = True, flush_every = 1, config_file = 'pvp/io/config/devices.ini',
+                                   checkpoint = checkpoint)
@@ -0,0 +1,213 @@
+"""
+Collect sensor values and alarms from many controllers, eg. for a central station that watches a ward of ventilators.
+
+The :class:`.Aggregator` is given a coordinator for each bed (see :class:`.ProcessGroup` to start many
+controller processes) and either
+
+* polls them all with :meth:`.Aggregator.collect` , one :meth:`.CoordinatorBase.poll` per bed, or
+* subscribes to them all with :meth:`.Aggregator.subscribe` so updates are pushed as they happen.
+
+Each bed keeps its latest sensor values, its active controller alarms, and a bounded history of per-breath
+values (see :data:`.BREATH_VALUES` ). :meth:`.Aggregator.view` returns a compact combined view of all beds.
+"""
+import threading
+import time
+import typing
+from collections import deque
+
+from pvp.alarm import Alarm
+from pvp.common.loggers import init_logger
+from pvp.common.message import SensorValues, PollResult
+from pvp.common.values import ValueName, SENSOR
+
+BREATH_VALUES = (
+    ValueName.PIP,
+    ValueName.PEEP,
+    ValueName.VTE,
+    ValueName.BREATHS_PER_MINUTE,
+    ValueName.INSPIRATION_TIME_SEC,
+    ValueName.FIO2
+)
+"""
+Values that are derived once per breath, stored in each bed's history when a new breath starts
+"""
+
+
+class Bed:
+    """
+    Everything the :class:`.Aggregator` knows about one controller
+
+    Args:
+        bed_id: identifier of the bed
+        history_length (int): number of breaths to keep in :attr:`.Bed.history`
+
+    Attributes:
+        sensors (:class:`.SensorValues`): latest sensor values, or None if none have been received
+        alarms (tuple): active controller alarms
+        history (:class:`collections.deque`): per-breath dicts of ``breath_count`` , ``timestamp`` and :data:`.BREATH_VALUES`
+        loop_stats (dict): latest controller loop statistics, see :class:`.PollResult`
+        seq (int): sequence number of the last :class:`.PollResult` , passed to the next poll
+        last_update (float): ``time.time()`` of the last update received
+        n_updates (int): number of updates received
+    """
+
+    def __init__(self, bed_id, history_length: int):
+        self.bed_id = bed_id
+        self.sensors = None # type: typing.Union[None, SensorValues]
+        self.alarms = tuple() # type: typing.Tuple[Alarm, ...]
+        self.history = deque(maxlen=history_length)
+        self.loop_stats = {}
+        self.seq = 0
+        self.last_update = 0
+        self.n_updates = 0
+
+    def update(self, update: PollResult):
+        """
+        Apply a :class:`.PollResult` from this bed's controller
+
+        Args:
+            update (:class:`.PollResult`): changes since the last update
+        """
+        self.seq = update.seq
+        self.loop_stats = update.loop_stats
+        self.last_update = time.time()
+        self.n_updates += 1
+
+        if update.alarms_changed:
+            self.alarms = flatten_alarms(update.alarms)
+
+        sensors = update.sensors
+        if sensors is None:
+            return
+        if self.sensors is None or sensors.breath_count > self.sensors.breath_count:
+            # a new breath has started, so the derived values are those of the last breath
+            breath = {value_name: getattr(sensors, value_name.name) for value_name in BREATH_VALUES}
+            breath['breath_count'] = sensors.breath_count
+            breath['timestamp'] = sensors.timestamp
+            self.history.append(breath)
+        self.sensors = sensors
+
+
+def flatten_alarms(controller_alarms: typing.Union[None, tuple]) -> typing.Tuple[Alarm, ...]:
+    """
+    Flatten alarms as returned by :meth:`.ControlModuleBase.get_alarms` (a tuple of alarms or lists of them)
+
+    Args:
+        controller_alarms (None, tuple): controller alarms
+
+    Returns:
+        tuple: of :class:`~.Alarm` s
+    """
+    if controller_alarms is None:
+        return tuple()
+    alarms = []
+    for alarm in controller_alarms:
+        if isinstance(alarm, Alarm):
+            alarms.append(alarm)
+        else:
+            alarms.extend(alarm)
+    return tuple(alarms)
+
+
+class Aggregator:
+    """
+    Collects updates from many controllers.
+
+    Args:
+        coordinators (dict): {bed_id: :class:`.CoordinatorBase`}
+        history_length (int): number of breaths to keep for each bed
+
+    Attributes:
+        beds (dict): {bed_id: :class:`.Bed`}
+    """
+
+    def __init__(self, coordinators: typing.Dict[typing.Hashable, 'CoordinatorBase'], history_length: int = 1000):
+        self.coordinators = coordinators
+        self.beds = {bed_id: Bed(bed_id, history_length) for bed_id in coordinators.keys()}
+        self.subscriptions = {}
+        self.logger = init_logger(__name__)
+        self._lock = threading.Lock()
+
+    def update(self, bed_id, update: PollResult):
+        """
+        Apply an update from a bed's controller. Called by :meth:`.collect` and by subscriptions
+
+        Args:
+            bed_id: bed the update came from
+            update (:class:`.PollResult`): the update
+        """
+        with self._lock:
+            self.beds[bed_id].update(update)
+
+    def collect(self) -> int:
+        """
+        Poll every bed for the changes since its last update
+
+        Returns:
+            int: number of beds successfully polled
+        """
+        n_polled = 0
+        for bed_id, coordinator in self.coordinators.items():
+            try:
+                update = coordinator.poll(self.beds[bed_id].seq)
+            except Exception as e:
+                self.logger.exception(f'Couldnt poll bed {bed_id}, got error {e}')
+                continue
+            self.update(bed_id, update)
+            n_polled += 1
+        return n_polled
+
+    def subscribe(self, rate: float = None):
+        """
+        Subscribe to every bed, so updates are pushed to :meth:`.update` as they happen
+
+        Args:
+            rate (float): rate to receive sensor values from each bed (Hz), see :meth:`.CoordinatorBase.subscribe`
+        """
+        for bed_id, coordinator in self.coordinators.items():
+            if bed_id not in self.subscriptions:
+                self.subscriptions[bed_id] = coordinator.subscribe(
+                    lambda update, bed_id=bed_id: self.update(bed_id, update), rate)
+
+    def unsubscribe(self):
+        """
+        Stop all subscriptions
+        """
+        for subscription in self.subscriptions.values():
+            subscription.stop()
+        self.subscriptions = {}
+
+    def view(self) -> typing.Dict[typing.Hashable, dict]:
+        """
+        Compact combined view of all beds
+
+        Returns:
+            dict: {bed_id: {'timestamp', 'breath_count', 'values': {ValueName: value}, 'alarms': (AlarmType, ...),
+            'last_update'}}, beds that have never sent sensor values have ``None`` timestamp, breath_count and values
+        """
+        view = {}
+        with self._lock:
+            for bed_id, bed in self.beds.items():
+                sensors = bed.sensors
+                view[bed_id] = {
+                    'timestamp': sensors.timestamp if sensors is not None else None,
+                    'breath_count': sensors.breath_count if sensors is not None else None,
+                    'values': {value_name: getattr(sensors, value_name.name) for value_name in SENSOR}
+                              if sensors is not None else None,
+                    'alarms': tuple(alarm.alarm_type for alarm in bed.alarms),
+                    'last_update': bed.last_update
+                }
+        return view
+
+    def history(self, bed_id) -> typing.List[dict]:
+        """
+        Per-breath history of a bed, oldest first
+
+        Args:
+            bed_id: bed to get the history of
+
+        Returns:
+            list: of dicts of ``breath_count`` , ``timestamp`` and :data:`.BREATH_VALUES`
+        """
+        with self._lock:
+            return list(self.beds[bed_id].history)
@@ -3,15 +3,22 @@ import threading
 from typing import List, Dict
 import typing
 
+import numpy as np
+
 import pvp
 import pvp.controller.control_module
+from pvp.common import prefs, codec
 from pvp.common.message import ControlSetting
-from pvp.alarm import Alarm
-from pvp.common.message import SensorValues
+from pvp.alarm import Alarm, AlarmType, Alarm_Manager
+from pvp.alarm.history import get_alarm_history
+from pvp.common.message import SensorValues, PollResult
 from pvp.common.values import ValueName
 from pvp.common.loggers import init_logger
+from pvp.common.shared import WaveformBuffer, WaveformReader
 from pvp.coordinator.process_manager import ProcessManager
 from pvp.coordinator.rpc import get_rpc_client
+from pvp.coordinator.ipc import get_ipc_client, IPCSubscription, connection_key
+from pvp.coordinator.subscription import Subscription, LocalSubscription, PollingSubscription
 
 
 
@@ -21,6 +28,9 @@ class CoordinatorBase:
         # self.lock = threading.Lock()
         self.logger = init_logger(__name__)
         self.logger.info('coordinator init')
+        self.waveform_reader = None # type: typing.Union[None, WaveformReader]
+        # whether the controller checks the alarm rules and sends its alarms in PollResult.alarm_transitions
+        self.controller_alarms = False
 
     # TODO: do we still need this
     # def get_msg_timestamp(self):
@@ -36,6 +46,52 @@ class CoordinatorBase:
     def get_alarms(self) -> typing.Union[None, typing.Tuple[Alarm]]:        # pragma: no cover
         pass
 
+    def poll(self, since_seq: int = 0) -> PollResult:                    # pragma: no cover
+        pass
+
+    def touch(self):                                                        # pragma: no cover
+        """
+        Tell the controller the GUI is still handling its updates, see :meth:`.ControlModuleBase.touch`
+        """
+        pass
+
+    def subscribe(self, callback: typing.Callable[[PollResult], None], rate: float = None) -> Subscription:
+        """
+        Have updates from the controller pushed to ``callback`` from a background thread:
+        sensor values at ``rate`` and alarm changes as soon as they happen. see :mod:`pvp.coordinator.subscription`
+
+        Args:
+            callback (callable): called with each :class:`.PollResult`
+            rate (float): rate to receive sensor values (Hz). if None, use the ``CONTROLLER_PUBLISH_RATE`` pref
+
+        Returns:
+            :class:`.Subscription` : the started subscription, call its ``stop()`` method to unsubscribe
+        """
+        subscription = self._make_subscription(callback, rate)
+        subscription.start()
+        return subscription
+
+    def _make_subscription(self, callback, rate) -> Subscription:
+        return PollingSubscription(self.poll, callback, rate)
+
+    def get_waveforms(self) -> typing.Union[None, np.ndarray]:
+        """
+        Drain all controller loop samples written to the :class:`.WaveformBuffer` since the last call.
+
+        Samples that were overwritten before they could be read are logged as a warning.
+
+        Returns:
+            :class:`numpy.ndarray` with dtype :data:`~pvp.common.shared.WAVEFORM_DTYPE` , or None if there is
+            no waveform buffer
+        """
+        if self.waveform_reader is None:
+            return None
+        lost = self.waveform_reader.lost
+        samples = self.waveform_reader.read()
+        if self.waveform_reader.lost > lost:
+            self.logger.warning(f'waveform buffer overrun, lost {self.waveform_reader.lost - lost} samples')
+        return samples
+
     def set_control(self, control_setting: ControlSetting):                 # pragma: no cover
         pass
 
@@ -45,6 +101,9 @@ class CoordinatorBase:
     def set_breath_detection(self, breath_detection: bool):                 # pragma: no cover
         pass
 
+    def dismiss_alarm(self, alarm_type: AlarmType, duration: float = None):  # pragma: no cover
+        pass
+
     def get_breath_detection(self) -> bool:  # pragma: no cover
         pass
 
@@ -73,6 +132,15 @@ class CoordinatorLocal(CoordinatorBase):
         """
         super().__init__(sim_mode=sim_mode)
         self.control_module = pvp.controller.control_module.get_control_module(sim_mode)
+        self.waveform_buffer = WaveformBuffer()
+        self.control_module.set_waveform_buffer(self.waveform_buffer)
+        self.waveform_reader = WaveformReader(self.waveform_buffer)
+        if prefs.get_pref('CONTROLLER_ALARMS'):
+            # the GUI in this process has the shared alarm manager, so the controller gets its own
+            alarm_manager = Alarm_Manager(shared=False)
+            alarm_manager.history = get_alarm_history()
+            self.control_module.set_alarm_manager(alarm_manager)
+            self.controller_alarms = True
 
 
     def get_sensors(self) -> SensorValues:
@@ -83,6 +151,15 @@ class CoordinatorLocal(CoordinatorBase):
     def get_alarms(self) -> typing.Union[None, typing.Tuple[Alarm]]:
         return self.control_module.get_alarms()
 
+    def poll(self, since_seq: int = 0) -> PollResult:
+        return self.control_module.poll(since_seq)
+
+    def touch(self):
+        self.control_module.touch()
+
+    def _make_subscription(self, callback, rate) -> Subscription:
+        return LocalSubscription(self.control_module, callback, rate)
+
     def set_control(self, control_setting: ControlSetting):
         self.control_module.set_control(control_setting)
 
@@ -92,6 +169,9 @@ class CoordinatorLocal(CoordinatorBase):
     def set_breath_detection(self, breath_detection: bool):
         self.control_module.set_breath_detection(breath_detection)
 
+    def dismiss_alarm(self, alarm_type: AlarmType, duration: float = None):
+        self.control_module.dismiss_alarm(alarm_type, duration)
+
     def get_breath_detection(self) -> bool:
         return self.control_module.get_breath_detection()
 
@@ -122,42 +202,116 @@ class CoordinatorLocal(CoordinatorBase):
 
 
 class CoordinatorRemote(CoordinatorBase):
-    def __init__(self, sim_mode=False):
+    transport = 'xmlrpc'
+    """
+    Which transport is used to communicate with the controller process, passed to :class:`.ProcessManager`
+    """
+
+    def __init__(self, sim_mode=False, instance_id: int = 0, address: typing.Union[None, int, str] = None,
+                 process_manager: typing.Union[None, ProcessManager] = None, standby: bool = False):
+        """
+        Args:
+            sim_mode (bool): run the controller in simulation mode
+            instance_id (int): which controller instance to start, see :class:`.ProcessManager`
+            address (int, str): port or socket path of the controller process, if None, the default for ``instance_id``
+            process_manager (:class:`.ProcessManager`): use an already started controller process,
+                eg. from a :class:`.ProcessGroup` , rather than starting a new one
+            standby (bool): if starting a new controller process, also start a warm standby controller process
+                that takes over if it stalls or dies, see :mod:`pvp.coordinator.standby`
+
+        If the ``CONTROLLER_MONITOR`` pref is set or ``standby`` is True, and the coordinator starts its own process
+        manager, the controller process is restarted if it stalls or dies (see :meth:`.ProcessManager.start_monitor` ),
+        restoring the control settings set through this coordinator.
+
+        If the ``CONTROLLER_ALARMS`` pref is set, the controller process checks the alarm rules
+        (see :meth:`.ControlModuleBase.set_alarm_manager` ) and :attr:`.controller_alarms` is True.
+        """
         super().__init__(sim_mode=sim_mode)
         # TODO: according to documentation, pass max_heartbeat_interval?
-        self.process_manager = ProcessManager(sim_mode)
-        self.rpc_client = get_rpc_client()
+        # only stop a controller process that this coordinator started, not one shared with others
+        self._owns_process_manager = process_manager is None
+        if process_manager is None:
+            process_manager = ProcessManager(sim_mode, transport=self.transport,
+                                             instance_id=instance_id, address=address, standby=standby)
+            # the monitor replaces the controller process with the standby once it has taken over
+            if standby or prefs.get_pref('CONTROLLER_MONITOR'):
+                process_manager.start_monitor()
+        assert process_manager.transport == self.transport
+        self.process_manager = process_manager
+        self.rpc_client = self._get_client()
+        self.waveform_reader = WaveformReader(self.process_manager.waveform_buffer)
+        self.controller_alarms = prefs.get_pref('CONTROLLER_ALARMS')
         # TODO: make sure the ipc connection is setup. There should be a clever method
 
+    def _get_client(self):
+        return get_rpc_client(control_token=self.process_manager.control_token, port=self.process_manager.address)
+
+    def _close_client(self):
+        self.rpc_client('close')()
+
+    def _read_snapshot(self) -> typing.Union[None, SensorValues]:
+        """
+        Read sensor values directly from the controller's shared memory :class:`.SensorSnapshot`
+
+        Returns:
+            :class:`.SensorValues` , or None if the controller process isn't running
+            or no consistent snapshot is available
+        """
+        if self.process_manager.child_process is None:
+            return None
+        # the coordinator has control, so its reads count as contact with the GUI
+        return self.process_manager.sensor_snapshot.read(touch=True)
+
     def get_sensors(self) -> SensorValues:
-        sensor_values = pickle.loads(self.rpc_client.get_sensors().data)
+        sensor_values = self._read_snapshot()
+        if sensor_values is None:
+            sensor_values = codec.decode(self.rpc_client.get_sensors().data)
         return sensor_values
 
     def get_alarms(self) -> typing.Union[None, typing.Tuple[Alarm]]:
         controller_alarms = pickle.loads(self.rpc_client.get_alarms().data)
         return controller_alarms
 
+    def poll(self, since_seq: int = 0) -> PollResult:
+        return pickle.loads(self.rpc_client.poll(since_seq).data)
+
+    def touch(self):
+        # through shared memory rather than a call, since the controller already checks the snapshot for contact
+        self.process_manager.sensor_snapshot.touch()
+
+    def _make_subscription(self, callback, rate) -> Subscription:
+        # xml-rpc can't push, so poll from the subscription's thread with its own client
+        client = self._get_client()
+
+        def _poll(since_seq: int) -> PollResult:
+            return pickle.loads(client.poll(since_seq).data)
+
+        return PollingSubscription(_poll, callback, rate)
+
     def set_control(self, control_setting: ControlSetting):
-        pickled_args = pickle.dumps(control_setting)
-        self.rpc_client.set_control(pickled_args)
+        self.process_manager.record_control(control_setting)
+        self.rpc_client.set_control(codec.encode(control_setting))
 
     def get_control(self, control_setting_name: ValueName) -> ControlSetting:
-        pickled_args = pickle.dumps(control_setting_name)
-        pickled_res = self.rpc_client.get_control(pickled_args).data
-        return pickle.loads(pickled_res)
+        encoded_res = self.rpc_client.get_control(control_setting_name.name).data
+        return codec.decode(encoded_res)
 
     def set_breath_detection(self, breath_detection: bool):
-        pickled_args = pickle.dumps(breath_detection)
-        self.rpc_client.set_breath_detection(pickled_args)
+        self.process_manager.record_breath_detection(breath_detection)
+        self.rpc_client.set_breath_detection(bool(breath_detection))
 
     def get_breath_detection(self) -> bool:
         return pickle.loads(self.rpc_client.get_breath_detection().data)
 
+    def dismiss_alarm(self, alarm_type: AlarmType, duration: float = None):
+        self.rpc_client.dismiss_alarm(alarm_type.name, duration)
+
     def start(self):
         """
         Start the coordinator.
         This does a soft start (not allocating a process).
         """
+        self.process_manager.record_running(True)
         self.rpc_client.start()
 
     def is_running(self) -> bool:
@@ -171,6 +325,7 @@ class CoordinatorRemote(CoordinatorBase):
         Stop the coordinator.
         This does a soft stop (not kill a process)
         """
+        self.process_manager.record_running(False)
         try:
             self.rpc_client.stop()
         except ConnectionRefusedError:  # pragma: no cover
@@ -179,7 +334,14 @@ class CoordinatorRemote(CoordinatorBase):
     def kill(self):
         """
         Stop the coordinator and end the whole program
+
+        If the controller process was started by someone else, eg. a :class:`.ProcessGroup` , it is left running
+        and only this coordinator's connection to it is closed.
         """
+        if not self._owns_process_manager:
+            self._close_client()
+            return
+        self.process_manager.stop_monitor()
         self.stop()
         self.process_manager.try_stop_process()
 
@@ -187,8 +349,85 @@ class CoordinatorRemote(CoordinatorBase):
         self.kill()
 
 
-def get_coordinator(single_process=False, sim_mode=False) -> CoordinatorBase:
+class CoordinatorIPC(CoordinatorRemote):
+    """
+    Remote coordinator that uses the persistent connection transport in :mod:`pvp.coordinator.ipc`
+
+    Objects are sent as-is over the connection, so unlike :class:`.CoordinatorRemote` they
+    don't need to be pickled and wrapped in an xml ``Binary`` before being sent.
+    """
+    transport = 'ipc'
+
+    def _get_client(self):
+        return get_ipc_client(address=self.process_manager.address, control_token=self.process_manager.control_token)
+
+    def _close_client(self):
+        self.rpc_client.close()
+
+    def get_sensors(self) -> SensorValues:
+        sensor_values = self._read_snapshot()
+        if sensor_values is None:
+            sensor_values = self.rpc_client.get_sensors()
+        return sensor_values
+
+    def get_alarms(self) -> typing.Union[None, typing.Tuple[Alarm]]:
+        return self.rpc_client.get_alarms()
+
+    def poll(self, since_seq: int = 0) -> PollResult:
+        return self.rpc_client.poll(since_seq)
+
+    def _make_subscription(self, callback, rate) -> Subscription:
+        return IPCSubscription(callback, rate, address=self.process_manager.address,
+                               authkey=connection_key(self.process_manager.control_token))
+
+    def set_control(self, control_setting: ControlSetting):
+        self.process_manager.record_control(control_setting)
+        self.rpc_client.set_control(control_setting)
+
+    def get_control(self, control_setting_name: ValueName) -> ControlSetting:
+        return self.rpc_client.get_control(control_setting_name)
+
+    def set_breath_detection(self, breath_detection: bool):
+        self.process_manager.record_breath_detection(breath_detection)
+        self.rpc_client.set_breath_detection(breath_detection)
+
+    def get_breath_detection(self) -> bool:
+        return self.rpc_client.get_breath_detection()
+
+    def dismiss_alarm(self, alarm_type: AlarmType, duration: float = None):
+        self.rpc_client.dismiss_alarm(alarm_type, duration)
+
+
+def get_coordinator(single_process=False, sim_mode=False, transport='xmlrpc',
+                    instance_id: int = 0, address: typing.Union[None, int, str] = None,
+                    process_manager: typing.Union[None, ProcessManager] = None,
+                    standby: bool = False) -> CoordinatorBase:
+    """
+    Make a coordinator
+
+    Args:
+        single_process (bool): if True, run the controller in this process with :class:`.CoordinatorLocal`
+        sim_mode (bool): run the controller in simulation mode
+        transport ('xmlrpc', 'ipc'): if not ``single_process``, which transport to use to talk to the
+            controller process: :class:`.CoordinatorRemote` (xml-rpc) or :class:`.CoordinatorIPC` (persistent connection)
+        instance_id (int): if not ``single_process``, which controller instance to start. Each instance has its own
+            port or socket, so several can be run at once.
+        address (int, str): port (xml-rpc) or socket path (ipc) of the controller process. if None, the
+            default for ``instance_id`` , see :func:`.process_manager.instance_address`
+        process_manager (:class:`.ProcessManager`): use an already started controller process, eg.
+            from a :class:`.ProcessGroup` . ``transport`` must match.
+        standby (bool): if not ``single_process`` , also run a warm standby controller process, see :class:`.ProcessManager`
+
+    Returns:
+        :class:`.CoordinatorBase`
+    """
     if single_process:
         return CoordinatorLocal(sim_mode)
+    elif transport == 'ipc':
+        return CoordinatorIPC(sim_mode, instance_id=instance_id, address=address, process_manager=process_manager,
+                              standby=standby)
+    elif transport == 'xmlrpc':
+        return CoordinatorRemote(sim_mode, instance_id=instance_id, address=address, process_manager=process_manager,
+                                 standby=standby)
     else:
-        return CoordinatorRemote(sim_mode)
+        raise ValueError(f'transport must be one of xmlrpc or ipc, got {transport}')
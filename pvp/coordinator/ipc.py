@@ -0,0 +1,420 @@
+"""
+Persistent-connection transport between the coordinator and the controller process.
+
+An alternative to the XML-RPC transport in :mod:`pvp.coordinator.rpc` . Rather than opening an HTTP request,
+pickling the result, and wrapping it in an XML ``Binary`` for every call, the client keeps a single
+:class:`multiprocessing.connection.Connection` open over a Unix domain socket. Each request and response is sent
+as one length-prefixed binary frame (see :meth:`multiprocessing.connection.Connection.send` ).
+
+Requests are ``(method_name, args)`` tuples, responses are ``(status, result)`` tuples where status is either
+``'ok'`` or ``'error'`` -- in the latter case, the result is the exception raised by the controller, which is
+re-raised by :meth:`.IPCClient.call` .
+
+A ``('subscribe', (rate,))`` request instead turns the connection into a one-way stream of :class:`.PollResult` s
+pushed by :func:`.publish_updates` , received by an :class:`.IPCSubscription` .
+
+Each connection is served in its own thread, so several clients and subscriptions can be connected at once
+without blocking each other. Connections are read-only until they send ``('authenticate', (control_token,))``
+with the control token the controller process was started with, see :data:`.rpc.CONTROL_METHODS` .
+
+Since requests are unpickled, a client first has to prove it knows the :func:`.connection_key` derived from the
+control token before anything it sends is read (see :mod:`multiprocessing.connection` authentication), and the socket
+is made in a directory only the user running the controller can open, see :func:`.socket_dir` .
+
+Select with ``get_coordinator(transport='ipc')`` .
+"""
+import hashlib
+import hmac
+import os
+import stat
+import tempfile
+import threading
+import typing
+from multiprocessing.connection import Listener, Client, AuthenticationError, answer_challenge, deliver_challenge
+
+from pvp.controller import control_module
+from pvp.common.loggers import init_logger
+from pvp.common.message import PollResult
+from pvp.coordinator.subscription import Subscription, publish_updates
+from pvp.coordinator.rpc import CONTROL_METHODS, has_control, restore_controller, host_alarm_manager
+
+def socket_dir() -> str:
+    """
+    Directory the controller sockets are made in, ``pvp-<uid>`` in the temporary directory
+
+    Only the user running the controller can open it, see :func:`.make_socket_dir`
+
+    Returns:
+        str
+    """
+    return os.path.join(tempfile.gettempdir(), f'pvp-{os.getuid()}')
+
+
+default_address = os.path.join(socket_dir(), f'pvp_controller_{os.getpid()}.sock')
+"""
+Socket path of the default controller, unique to this process so that separate runs don't share a socket
+"""
+default_family = 'AF_UNIX'
+
+remote_controller = None # type: typing.Union[None, control_module.ControlModuleBase]
+
+
+def instance_address(instance_id: int) -> str:
+    """
+    Default socket path of controller instance ``instance_id``
+
+    Args:
+        instance_id (int): controller instance, 0 is the default controller
+
+    Returns:
+        str: ``default_address`` for instance 0, otherwise ``pvp_controller_<pid>_<instance_id>.sock`` in
+        :func:`.socket_dir`
+    """
+    if instance_id == 0:
+        return default_address
+    return os.path.join(socket_dir(), f'pvp_controller_{os.getpid()}_{instance_id}.sock')
+
+
+def make_socket_dir(address: str):
+    """
+    Make the directory of the socket at ``address`` , readable only by the current user
+
+    Raises:
+        PermissionError: if the directory already exists but belongs to another user or can be opened by others
+    """
+    directory = os.path.dirname(address)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    dir_stat = os.stat(directory)
+    if dir_stat.st_uid != os.getuid() or stat.S_IMODE(dir_stat.st_mode) & 0o077:
+        raise PermissionError(f'Socket directory {directory} must belong to the current user and have mode 0700')
+
+
+def remove_stale_socket(address: str):
+    """
+    Remove the socket at ``address`` if it was left over from a killed controller process
+
+    Raises:
+        FileExistsError: if another controller process is still serving at ``address``
+    """
+    try:
+        probe = Client(address, family=default_family)
+    except FileNotFoundError:
+        return
+    except ConnectionRefusedError:
+        # nothing is listening
+        os.remove(address)
+        return
+    probe.close()
+    raise FileExistsError(f'Another controller is already serving at {address}')
+
+
+def connection_key(control_token: typing.Optional[str]) -> typing.Optional[bytes]:
+    """
+    Key clients need to connect to a controller process started with ``control_token``
+
+    Derived from the control token, so it can be given to read-only clients without giving them control.
+
+    Args:
+        control_token (str, None): the controller process's control token
+
+    Returns:
+        bytes: authkey for :func:`multiprocessing.connection.Client` , or None if ``control_token`` is None
+    """
+    if control_token is None:
+        return None
+    return hmac.new(control_token.encode(), b'pvp connection', hashlib.sha256).digest()
+
+
+def get_methods(controller: 'control_module.ControlModuleBase') -> typing.Dict[str, typing.Callable]:
+    """
+    Methods of the controller that can be called by an :class:`.IPCClient`
+
+    Args:
+        controller (:class:`.ControlModuleBase`): controller to expose
+
+    Returns:
+        dict: {method_name: callable}
+    """
+    return {
+        'get_sensors': controller.get_sensors,
+        'get_alarms': controller.get_alarms,
+        'set_control': controller.set_control,
+        'get_control': controller.get_control,
+        'set_breath_detection': controller.set_breath_detection,
+        'get_breath_detection': controller.get_breath_detection,
+        'start': controller.start,
+        'is_running': controller.is_running,
+        'stop': controller.stop,
+        'get_heartbeat': controller.get_heartbeat,
+        'poll': controller.poll,
+        'dismiss_alarm': controller.dismiss_alarm
+    }
+
+
+def serve_connection(conn, methods: typing.Dict[str, typing.Callable], controller=None,
+                     control_token: str = None):   # pragma: no cover
+    """
+    Answer requests on a single connection until the client hangs up.
+
+    If the client sends a ``'subscribe'`` request, push updates from ``controller`` instead
+    until the client hangs up.
+
+    Args:
+        conn (:class:`multiprocessing.connection.Connection`): accepted client connection
+        methods (dict): {method_name: callable} as returned by :func:`.get_methods`
+        controller (:class:`.ControlModuleBase`): controller to push updates from to subscribers
+        control_token (str): token the client must authenticate with to call :data:`.rpc.CONTROL_METHODS` .
+            if None, all clients have control.
+    """
+    logger = init_logger(__name__)
+    control = has_control(None, control_token)
+
+    # authenticate here rather than in the Listener, so a client that never answers doesn't block accepting others
+    authkey = connection_key(control_token)
+    if authkey is not None:
+        try:
+            deliver_challenge(conn, authkey)
+            answer_challenge(conn, authkey)
+        except (AuthenticationError, EOFError, OSError):
+            conn.close()
+            return
+
+    while True:
+        try:
+            method_name, args = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        if method_name == 'authenticate':
+            control = has_control(args[0], control_token)
+            try:
+                conn.send(('ok', control))
+                continue
+            except (EOFError, OSError):
+                break
+
+        if method_name in CONTROL_METHODS and not control:
+            try:
+                conn.send(('error', PermissionError(f'{method_name} requires a control client')))
+                continue
+            except (EOFError, OSError):
+                break
+
+        if method_name == 'subscribe' and controller is not None:
+            try:
+                publish_updates(controller, conn.send, *args, stop_event=threading.Event())
+            except (EOFError, OSError):
+                pass
+            break
+
+        try:
+            response = ('ok', methods[method_name](*args))
+        except KeyError:
+            response = ('error', AttributeError(f'controller has no remote method {method_name}'))
+        except Exception as e:
+            logger.exception(f'Exception calling {method_name}: {e}')
+            response = ('error', e)
+
+        try:
+            conn.send(response)
+        except (EOFError, OSError):
+            break
+
+    conn.close()
+
+
+def ipc_server_main(sim_mode, serve_event, address=default_address, sensor_snapshot=None, waveform_buffer=None,
+                    control_token=None, heartbeat=None, restore=None, mirror=None, controller=None,
+                    checkpoint=None):  # pragma: no cover
+    """
+    Main function of the controller process when using the ``'ipc'`` transport
+
+    Args:
+        sim_mode (bool): whether the controller should be run in simulation mode
+        serve_event (:class:`multiprocessing.Event`): set once the listener is accepting connections
+        address (str): path of the Unix domain socket to listen on
+        sensor_snapshot (:class:`.SensorSnapshot`): if given, the controller publishes its sensor values here
+        waveform_buffer (:class:`.WaveformBuffer`): if given, the controller writes every loop's waveform sample here
+        control_token (str): if given, only clients that authenticate with this token have control
+        heartbeat (:class:`.Heartbeat`): if given, the controller writes its loop counter here on every loop
+        restore (dict): if given, kwargs for :func:`.rpc.restore_controller` to restore the state of a
+            controller that was restarted by the :class:`.ProcessManager`
+        mirror (:class:`.ControllerMirror`): if given, the controller writes its settings and breath phase here
+            for a warm standby to follow
+        controller (:class:`.ControlModuleBase`): serve an existing controller, eg. a standby that has taken over,
+            rather than making a new one
+        checkpoint (str): path of a checkpoint file for the controller to save its state to and restore it from,
+            see :class:`.ControlModuleBase`
+
+    Raises:
+        FileExistsError: if another controller process is already serving at ``address`` ,
+            see :func:`.remove_stale_socket`
+    """
+    logger = init_logger(__name__)
+    logger.info('controller process init')
+    global remote_controller
+    if controller is None and checkpoint is not None:
+        controller = control_module.get_control_module(sim_mode, checkpoint=checkpoint)
+    elif controller is None:
+        controller = control_module.get_control_module(sim_mode)
+    remote_controller = controller
+    if sensor_snapshot is not None:
+        remote_controller.set_sensor_snapshot(sensor_snapshot)
+    if waveform_buffer is not None:
+        remote_controller.set_waveform_buffer(waveform_buffer)
+    if heartbeat is not None:
+        remote_controller.set_heartbeat(heartbeat)
+    if mirror is not None:
+        remote_controller.set_mirror(mirror)
+    host_alarm_manager(remote_controller)
+    if restore is not None:
+        restore_controller(remote_controller, **restore)
+    methods = get_methods(remote_controller)
+
+    make_socket_dir(address)
+    remove_stale_socket(address)
+
+    listener = Listener(address, family=default_family)
+    serve_event.set()
+    while True:
+        conn = listener.accept()
+        threading.Thread(target=serve_connection, args=(conn, methods, remote_controller, control_token),
+                         daemon=True).start()
+
+
+class IPCClient:
+    """
+    Client side of the ``'ipc'`` transport.
+
+    Keeps a persistent connection to the controller process, reconnecting once if the connection was dropped
+    (eg. after :meth:`.ProcessManager.restart_process` ).
+
+    Remote methods can be called either with :meth:`.IPCClient.call` or as attributes, like the
+    :class:`xmlrpc.client.ServerProxy` used by :class:`.CoordinatorRemote` , eg. ``client.get_sensors()``
+
+    Args:
+        address (str): path of the Unix domain socket of the controller process
+        control_token (str): the controller process's control token. if None, the client is read-only
+        authkey (bytes): the controller process's :func:`.connection_key` , if None, derived from ``control_token``
+    """
+
+    def __init__(self, address: str = default_address, control_token: str = None, authkey: bytes = None):
+        self.address = address
+        self.control_token = control_token
+        if authkey is None:
+            authkey = connection_key(control_token)
+        self.authkey = authkey
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """
+        Open the connection to the controller process if it isn't already.
+
+        Raises:
+            ConnectionRefusedError: if the controller process is not listening
+        """
+        if self._conn is not None:
+            return
+        try:
+            self._conn = Client(self.address, family=default_family, authkey=self.authkey)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise ConnectionRefusedError(f'Could not connect to controller at {self.address}') from e
+
+        if self.control_token is not None:
+            self._conn.send(('authenticate', (self.control_token,)))
+            self._conn.recv()
+
+    def close(self):
+        """
+        Close the connection, if open.
+        """
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except OSError: # pragma: no cover
+                pass
+            self._conn = None
+
+    def call(self, method_name: str, *args):
+        """
+        Call a method of the remote controller and return its result.
+
+        Args:
+            method_name (str): name of the method, one of the keys of :func:`.get_methods`
+            *args: passed to the remote method
+
+        Returns:
+            whatever the remote method returns
+        """
+        with self._lock:
+            for attempt in range(2):
+                self.connect()
+                try:
+                    self._conn.send((method_name, args))
+                    status, result = self._conn.recv()
+                    break
+                except (EOFError, OSError):
+                    # connection was dropped, the controller process may have been restarted.
+                    self.close()
+                    if attempt > 0:
+                        raise ConnectionRefusedError(f'Lost connection to controller at {self.address}')
+
+        if status == 'error':
+            raise result
+        return result
+
+    def __getattr__(self, method_name: str) -> typing.Callable:
+        if method_name.startswith('_'):
+            raise AttributeError(method_name)
+
+        def _remote_method(*args):
+            return self.call(method_name, *args)
+
+        return _remote_method
+
+    def __del__(self):
+        self.close()
+
+
+def get_ipc_client(address: str = default_address, control_token: str = None, authkey: bytes = None) -> IPCClient:
+    return IPCClient(address, control_token, authkey)
+
+
+class IPCSubscription(Subscription):
+    """
+    Subscription to a controller process over its own connection of the ``'ipc'`` transport.
+
+    Reconnects if the connection is dropped, eg. when the controller process is restarted.
+
+    Args:
+        callback (callable): called with each :class:`.PollResult`
+        rate (float): rate to receive sensor values (Hz)
+        address (str): path of the Unix domain socket of the controller process
+        authkey (bytes): the controller process's :func:`.connection_key`
+    """
+
+    def __init__(self, callback: typing.Callable[[PollResult], None], rate: float = None,
+                 address: str = default_address, authkey: bytes = None):
+        super(IPCSubscription, self).__init__(callback, rate)
+        self.address = address
+        self.authkey = authkey
+
+    def _run(self):
+        conn = None
+        while not self.stop_event.is_set():
+            try:
+                if conn is None:
+                    conn = Client(self.address, family=default_family, authkey=self.authkey)
+                    conn.send(('subscribe', (self.rate,)))
+                # wake up periodically to check if we've been stopped
+                if conn.poll(0.1):
+                    self.callback(conn.recv())
+            except (FileNotFoundError, ConnectionRefusedError, AuthenticationError, EOFError, OSError):
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                self.stop_event.wait(0.1)
+
+        if conn is not None:
+            conn.close()
@@ -1,59 +1,402 @@
 import multiprocessing
+import secrets
+import threading
 import time
+import typing
+from collections import OrderedDict, deque
 
-from pvp.coordinator import rpc
+from pvp.coordinator import rpc, ipc, standby
+from pvp.common import prefs
+from pvp.common.loggers import init_logger
+from pvp.common.message import ControlSetting
+from pvp.common.shared import SensorSnapshot, WaveformBuffer, Heartbeat, ControllerMirror
+
+
+def instance_address(instance_id: int, transport: str = 'xmlrpc') -> typing.Union[int, str]:
+    """
+    Default address of controller instance ``instance_id`` .
+
+    Args:
+        instance_id (int): controller instance, 0 is the default controller
+        transport ('xmlrpc', 'ipc'): transport used to talk to the controller
+
+    Returns:
+        int, str: port for ``'xmlrpc'`` (see :func:`.rpc.instance_port` ), or
+        socket path for ``'ipc'`` (see :func:`.ipc.instance_address` )
+    """
+    if transport == 'ipc':
+        return ipc.instance_address(instance_id)
+    else:
+        return rpc.instance_port(instance_id)
 
 
 class ProcessManager:
+    """
+    Spawn and manage a controller process.
+
+    Several controllers can be run at once by giving each a different ``instance_id`` (or ``address`` ),
+    see :class:`.ProcessGroup`
+
+    The controller writes its loop counter to a shared memory :class:`.Heartbeat` on every loop.
+    :meth:`.ProcessManager.start_monitor` checks it every ``CONTROLLER_MONITOR_PERIOD`` seconds, and if the
+    controller process has died, or its main loop should be running but hasn't beat for ``max_heartbeat_interval`` ,
+    restarts it with the control settings it had (see :meth:`.ProcessManager.record_control` ) and
+    resumes ventilation.
+
+    With ``standby=True`` , a second, fully initialized controller process is kept as a warm standby
+    that follows the active controller's settings and breath phase through a shared :class:`.ControllerMirror` ,
+    and takes over the valves itself if the active controller misses its heartbeat (see :mod:`pvp.coordinator.standby` ).
+    The monitor then kills the old controller, treats the standby as the controller process, and starts a new standby.
+
+    Args:
+        sim_mode (bool): whether the controller should be run in simulation mode
+        maxHeartbeatInterval (float): time without a heartbeat after which a running controller is considered stalled
+            (seconds). if None, use the ``CONTROLLER_MAX_HEARTBEAT_INTERVAL`` pref
+        transport ('xmlrpc', 'ipc'): transport the controller process serves
+        instance_id (int): which controller instance this is, used to pick a default ``address``
+        address (int, str): port (``'xmlrpc'`` ) or socket path (``'ipc'`` ) of the controller process.
+            if None, use :func:`.instance_address`
+        start_wait (bool): wait for the controller process to start serving before returning,
+            otherwise call :meth:`.ProcessManager.wait_serving`
+        standby (bool): also run a warm standby controller process. only in simulation mode
+        checkpoint (str): path of a checkpoint file the controller saves its state to, and restores it from when it is
+            restarted, see :class:`.ControlModuleBase` . if None, use the ``CONTROLLER_CHECKPOINT_FN`` pref
+
+    Attributes:
+        controller_heartbeat (:class:`.Heartbeat`): the controller's heartbeat
+        mirror (:class:`.ControllerMirror`): the active controller's settings and breath phase, if ``standby``
+        restarts (:class:`collections.deque`): the most recent restarts by the monitor, dicts with the
+            ``reason`` ('died', 'stalled', or 'takeover' by the standby), the ``time.time()`` it was ``detected``
+            and the time the new controller process was ``restarted``
+    """
     # Functions:
-    def __init__(self, sim_mode, startCommandLine=None, maxHeartbeatInterval=None):
+    def __init__(self, sim_mode, startCommandLine=None, maxHeartbeatInterval=None, transport='xmlrpc',
+                 instance_id: int = 0, address: typing.Union[None, int, str] = None, start_wait: bool = True,
+                 standby: bool = False, checkpoint: typing.Optional[str] = None):
+        if standby and not sim_mode:
+            raise ValueError('A warm standby can only be run in simulation mode, see pvp.coordinator.standby')
         self.sim_mode = sim_mode
+        assert transport in ('xmlrpc', 'ipc')
+        self.transport = transport
+        self.instance_id = instance_id
+        if address is None:
+            address = instance_address(instance_id, transport)
+        self.address = address
+        self.child_pid = None
         self.command_line = None  # TODO: what is this?
-        self.max_heartbeat_interval = None
+        if maxHeartbeatInterval is None:
+            maxHeartbeatInterval = prefs.get_pref('CONTROLLER_MAX_HEARTBEAT_INTERVAL')
+        self.max_heartbeat_interval = maxHeartbeatInterval
         self.previous_timestamp = None
         self.child_process = None
         self.serve_event = multiprocessing.Event()
         self.serve_event.clear()
         self.timeout = 5
+        self.logger = init_logger(__name__)
+        # start/stop from the monitor thread and from the caller can't overlap. Held while processes are killed
+        # and spawned, but not while waiting for them to start serving
+        self._process_lock = threading.RLock()
+        # the last known state below is recorded from the GUI thread, so it has its own lock that isn't held
+        # while the controller process is restarted
+        self._state_lock = threading.Lock()
+        # shared memory the controller publishes sensor values to, kept across restarts
+        self.sensor_snapshot = SensorSnapshot()
+        self.waveform_buffer = WaveformBuffer()
+        self.controller_heartbeat = Heartbeat()
+        self.standby = standby
+        self.checkpoint = checkpoint
+        self.mirror = ControllerMirror() if standby else None
+        self.standby_process = None
+        self.standby_pid = None
+        self.standby_ready_event = multiprocessing.Event()
+        self.standby_serve_event = multiprocessing.Event()
+        # last known state of the controller, restored if the monitor restarts it
+        self._controls = OrderedDict()  # type: typing.Dict[tuple, ControlSetting]
+        self._breath_detection = None
+        self._running = False
+        self.restarts = deque(maxlen=100)
+        self._monitor_thread = None # type: typing.Union[None, threading.Thread]
+        self._monitor_stop = threading.Event()
+        # only clients with this token can change the controller's state, see rpc.CONTROL_METHODS
+        self.control_token = secrets.token_hex(16)
         # TODO: if child process exists, need to reconnect it
-        self.start_process()
+        self.start_process(wait=start_wait)
         #time.sleep(1)
 
     def __del__(self): #Destructor stop methode tested below:
         self.try_stop_process()          # pragma: no cover
 
-    def start_process(self):
-        if self.child_process is not None:
-            # Child process already started
-            return
-        self.serve_event.clear()
-        self.child_process = multiprocessing.Process(target=rpc.rpc_server_main,
-                                                     kwargs=
-                                                     {
-                                                         'sim_mode':self.sim_mode,
-                                                         'serve_event':self.serve_event
-                                                     })
-        # self.child_process.daemon = True
-        self.child_process.start()
-        self.child_pid = self.child_process.pid
-        self.serve_event.wait(self.timeout)
+    def start_process(self, wait: bool = True, restore: bool = False):
+        """
+        Start the controller process
+
+        Args:
+            wait (bool): wait for the controller process to start serving, see :meth:`.ProcessManager.wait_serving`
+            restore (bool): restore the last known state of the controller, see :meth:`.ProcessManager.restore_state`
+        """
+        with self._process_lock:
+            if self.child_process is not None:
+                # Child process already started
+                return
+            self.serve_event.clear()
+            self.controller_heartbeat.reset()
+            if self.mirror is not None:
+                self.mirror.reset()
+            kwargs = {
+                'sim_mode':self.sim_mode,
+                'serve_event':self.serve_event,
+                'sensor_snapshot':self.sensor_snapshot,
+                'waveform_buffer':self.waveform_buffer,
+                'control_token':self.control_token,
+                'heartbeat':self.controller_heartbeat
+            }
+            if restore:
+                kwargs['restore'] = self.restore_state()
+            if self.mirror is not None:
+                kwargs['mirror'] = self.mirror
+            if self.checkpoint is not None:
+                kwargs['checkpoint'] = self.checkpoint
+            if self.transport == 'ipc':
+                server_main = ipc.ipc_server_main
+                kwargs['address'] = self.address
+            else:
+                server_main = rpc.rpc_server_main
+                kwargs['port'] = self.address
+            self.child_process = multiprocessing.Process(target=server_main, kwargs=kwargs)
+            # self.child_process.daemon = True
+            self.child_process.start()
+            self.child_pid = self.child_process.pid
+            if self.standby:
+                self.start_standby(wait=False)
+        if wait:
+            self._wait_started()
+
+    def _wait_started(self):
+        """
+        Wait for a started controller process to serve, and for its standby to be ready
+        """
+        self.wait_serving()
+        if self.standby:
+            self.standby_ready_event.wait(self.timeout)
+
+    def start_standby(self, wait: bool = True):
+        """
+        Start the warm standby controller process, see :func:`.standby.standby_server_main`
+
+        Args:
+            wait (bool): wait for the standby controller to be initialized
+        """
+        with self._process_lock:
+            if self.standby_process is not None:
+                return
+            # each standby gets its own events, since after taking over its serve_event becomes ours
+            self.standby_ready_event = multiprocessing.Event()
+            self.standby_serve_event = multiprocessing.Event()
+            kwargs = {
+                'sim_mode': self.sim_mode,
+                'ready_event': self.standby_ready_event,
+                'serve_event': self.standby_serve_event,
+                'transport': self.transport,
+                'address': self.address,
+                'sensor_snapshot': self.sensor_snapshot,
+                'waveform_buffer': self.waveform_buffer,
+                'control_token': self.control_token,
+                'heartbeat': self.controller_heartbeat,
+                'mirror': self.mirror,
+                'period': prefs.get_pref('CONTROLLER_MONITOR_PERIOD'),
+                'max_heartbeat_interval': self.max_heartbeat_interval
+            }
+            self.standby_process = multiprocessing.Process(target=standby.standby_server_main, kwargs=kwargs)
+            self.standby_process.start()
+            self.standby_pid = self.standby_process.pid
+        if wait:
+            self.standby_ready_event.wait(self.timeout)
+
+    def wait_serving(self) -> bool:
+        """
+        Wait until the controller process is accepting connections, or ``self.timeout``
+
+        Returns:
+            bool: True if the controller process is serving
+        """
+        return self.serve_event.wait(self.timeout)
+
+    def is_alive(self) -> bool:
+        """
+        Whether the controller process is running
+        """
+        return self.child_process is not None and self.child_process.is_alive()
 
     def try_stop_process(self):
-        if self.child_process is not None:
-            # print(f'kill process {self.child_pid}')
-            self.child_process.kill()
-            while self.child_process.is_alive():
-                time.sleep(0.01)
-            self.child_process = None
-            self.child_pid = None
-
-    def restart_process(self):
-        self.try_stop_process()
-        self.start_process()
-
-    def heartbeat(self, timestamp):         # pragma: no cover
-        # TODO: if no heartbeat in maxInterval restart
-        pass
+        with self._process_lock:
+            if self.child_process is not None:
+                # print(f'kill process {self.child_pid}')
+                _kill(self.child_process)
+                self.child_process = None
+                self.child_pid = None
+            if self.standby_process is not None:
+                _kill(self.standby_process)
+                self.standby_process = None
+                self.standby_pid = None
+
+    def restart_process(self, restore: bool = False):
+        """
+        Kill the controller process and start a new one, and wait for it to start serving
+
+        Args:
+            restore (bool): restore the last known state of the controller, see :meth:`.ProcessManager.restore_state`
+        """
+        with self._process_lock:
+            self.try_stop_process()
+            self.start_process(wait=False, restore=restore)
+        self._wait_started()
+
+    def record_control(self, control_setting: ControlSetting):
+        """
+        Remember a control setting sent to the controller, to restore if it is restarted.
+
+        Settings are kept per name and per which of ``value`` , ``min_value`` , ``max_value`` they set
+        (and ``range_severity`` ), so setting an alarm limit doesn't replace the set value.
+
+        Args:
+            control_setting (:class:`.ControlSetting`): setting sent to the controller
+        """
+        key = (control_setting.name,
+               control_setting.value is not None,
+               control_setting.min_value is not None,
+               control_setting.max_value is not None,
+               control_setting.range_severity)
+        with self._state_lock:
+            self._controls.pop(key, None)
+            self._controls[key] = control_setting
+
+    def record_breath_detection(self, breath_detection: bool):
+        """
+        Remember whether breath detection was turned on, to restore if the controller is restarted.
+        """
+        with self._state_lock:
+            self._breath_detection = breath_detection
+
+    def record_running(self, running: bool):
+        """
+        Remember whether the controller was started, to resume ventilation if the controller is restarted.
+        """
+        with self._state_lock:
+            self._running = running
+
+    def restore_state(self) -> dict:
+        """
+        Last known state of the controller
+
+        Returns:
+            dict: kwargs for :func:`.rpc.restore_controller` : ``controls`` , a list of :class:`.ControlSetting` s
+            in the order they were last set, ``breath_detection`` , and ``running``
+        """
+        with self._state_lock:
+            return {
+                'controls': list(self._controls.values()),
+                'breath_detection': self._breath_detection,
+                'running': self._running
+            }
+
+    def check_heartbeat(self, now: float = None) -> typing.Union[None, str]:
+        """
+        Check that the controller process is alive and, if it should be running, that its main loop has beat
+        within ``max_heartbeat_interval`` . Otherwise restart it and restore its state.
+
+        The old process is killed and the new one spawned with the last known state while holding the process lock,
+        the new process is waited for without it.
+
+        Processes stopped with :meth:`.ProcessManager.try_stop_process` aren't restarted.
+
+        If there is a ready standby, it takes over from a running controller itself, and this only replaces
+        the controller process with the standby once it has (see :mod:`pvp.coordinator.standby` ).
+
+        Args:
+            now (float): current time, if None, ``time.time()``
+
+        Returns:
+            None if the controller is healthy, otherwise the reason it was restarted, 'died' or 'stalled',
+            or 'takeover' if the standby has taken over
+        """
+        with self._process_lock:
+            if self.child_process is None:
+                return None
+            if now is None:
+                now = time.time()
+            heartbeat = self.controller_heartbeat
+            if self.standby_process is not None:
+                if self.mirror.owner == self.standby_pid:
+                    self._promote_standby(now)
+                    return 'takeover'
+                if not self.standby_process.is_alive():
+                    self.logger.warning(f'standby controller process {self.standby_pid} died, restarting')
+                    self.standby_process = None
+                    self.start_standby(wait=False)
+                elif self.standby_ready_event.is_set() and heartbeat.running:
+                    # the standby takes over from a running controller that has stalled or died
+                    return None
+
+            if not self.child_process.is_alive():
+                reason = 'died'
+            elif self.serve_event.is_set() and heartbeat.running and heartbeat.age(now) > self.max_heartbeat_interval:
+                reason = 'stalled'
+            else:
+                return None
+
+            self.logger.warning(f'controller process {self.child_pid} {reason} '
+                                f'(last heartbeat {heartbeat.age(now):.3f}s ago), restarting')
+            self.try_stop_process()
+            self.start_process(wait=False, restore=True)
+
+        self._wait_started()
+        self.restarts.append({'reason': reason, 'detected': now, 'restarted': time.time()})
+        return reason
+
+    def _promote_standby(self, now: float):
+        """
+        The standby has taken over: kill the old controller process, make the standby the controller process,
+        and start a new standby
+        """
+        self.logger.warning(f'standby controller process {self.standby_pid} took over from {self.child_pid}')
+        _kill(self.child_process)
+        self.child_process, self.child_pid = self.standby_process, self.standby_pid
+        self.serve_event = self.standby_serve_event
+        self.standby_process = None
+        self.standby_pid = None
+        self.start_standby(wait=False)
+        self.restarts.append({'reason': 'takeover', 'detected': now, 'restarted': time.time()})
+
+    def start_monitor(self, period: float = None):
+        """
+        Check the controller's heartbeat with :meth:`.ProcessManager.check_heartbeat` in a background thread
+
+        Args:
+            period (float): time between checks (seconds). if None, use the ``CONTROLLER_MONITOR_PERIOD`` pref
+        """
+        if period is None:
+            period = prefs.get_pref('CONTROLLER_MONITOR_PERIOD')
+        if self._monitor_thread is not None and self._monitor_thread.is_alive():
+            return
+        self._monitor_stop.clear()
+        self._monitor_thread = threading.Thread(target=self._monitor, args=(period,), daemon=True)
+        self._monitor_thread.start()
+
+    def stop_monitor(self):
+        """
+        Stop checking the controller's heartbeat
+        """
+        self._monitor_stop.set()
+        if self._monitor_thread is not None and self._monitor_thread is not threading.current_thread():
+            self._monitor_thread.join(1)
+        self._monitor_thread = None
+
+    def _monitor(self, period: float):
+        while not self._monitor_stop.wait(period):
+            try:
+                self.check_heartbeat()
+            except Exception as e:  # pragma: no cover
+                self.logger.exception(f'couldnt check controller heartbeat, got error {e}')
 
     def __del__(self):
         try:
@@ -61,3 +404,67 @@ class ProcessManager:
         except AttributeError:
             pass
 
+
+
+def _kill(process: multiprocessing.Process):
+    process.kill()
+    while process.is_alive():
+        time.sleep(0.001)
+
+
+class ProcessGroup:
+    """
+    Spawn and supervise several controller processes, eg. to run many simulated ventilators on one machine.
+
+    Processes are all started before waiting for any of them to start serving.
+
+    Args:
+        sim_mode (bool): whether the controllers should be run in simulation mode
+        instances (int, dict): number of controllers (with instance ids ``0`` to ``instances-1`` and default addresses),
+            or a dict mapping instance ids to addresses (or None to use the default, see :func:`.instance_address` )
+        transport ('xmlrpc', 'ipc'): transport the controller processes serve
+
+    Attributes:
+        process_managers (dict): {instance_id: :class:`.ProcessManager`}
+    """
+
+    def __init__(self, sim_mode, instances: typing.Union[int, typing.Dict[int, typing.Union[None, int, str]]],
+                 transport='xmlrpc'):
+        if isinstance(instances, int):
+            instances = {instance_id: None for instance_id in range(instances)}
+
+        self.process_managers = {
+            instance_id: ProcessManager(sim_mode, transport=transport, instance_id=instance_id,
+                                        address=address, start_wait=False)
+            for instance_id, address in instances.items()
+        } # type: typing.Dict[int, ProcessManager]
+
+        for process_manager in self.process_managers.values():
+            process_manager.wait_serving()
+
+    def __getitem__(self, instance_id: int) -> ProcessManager:
+        return self.process_managers[instance_id]
+
+    def __len__(self):
+        return len(self.process_managers)
+
+    def supervise(self) -> typing.List[int]:
+        """
+        Restart any controller processes that have died.
+
+        Returns:
+            list: instance ids of restarted processes
+        """
+        restarted = []
+        for instance_id, process_manager in self.process_managers.items():
+            if not process_manager.is_alive():
+                process_manager.restart_process()
+                restarted.append(instance_id)
+        return restarted
+
+    def try_stop_processes(self):
+        """
+        Stop all controller processes
+        """
+        for process_manager in self.process_managers.values():
+            process_manager.try_stop_process()
@@ -1,12 +1,18 @@
+import hmac
 import logging
 import typing
 import pickle
 import socket
 import xmlrpc.client
-from xmlrpc.server import SimpleXMLRPCServer
+from concurrent.futures import ThreadPoolExecutor
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
 
 from pvp.controller import control_module
+from pvp.common import prefs, codec
 from pvp.common.loggers import init_logger
+from pvp.common.values import ValueName
+from pvp.alarm import Alarm_Manager, AlarmType
+from pvp.alarm.history import get_alarm_history
 
 default_addr = 'localhost'
 default_port = 9533
@@ -15,65 +21,224 @@ socket.setdefaulttimeout(default_timeout)
 
 remote_controller = None # type: typing.Union[None, control_module.ControlModuleBase]
 
+def instance_port(instance_id: int) -> int:
+    """
+    Default port of the xml-rpc server of controller instance ``instance_id``
+
+    Args:
+        instance_id (int): controller instance, 0 is the default controller
+
+    Returns:
+        int: ``default_port + instance_id``
+    """
+    return default_port + instance_id
+
+
+CONTROL_METHODS = ('set_control', 'set_breath_detection', 'start', 'stop', 'dismiss_alarm')
+"""
+Remote methods that change the state of the controller, which can only be called by clients
+that have the control token given to the controller process by the :class:`.ProcessManager` .
+All other methods are read-only and can be called by any client.
+"""
+
+
+def has_control(token: typing.Union[None, str], control_token: typing.Union[None, str]) -> bool:
+    """
+    Check whether a client may call :data:`.CONTROL_METHODS`
+
+    Args:
+        token (str, None): token presented by the client
+        control_token (str, None): token the controller process was started with. if None, all clients have control.
+
+    Returns:
+        bool
+    """
+    if control_token is None:
+        return True
+    if token is None:
+        return False
+    return hmac.compare_digest(token, control_token)
+
+
+class ControllerRequestHandler(SimpleXMLRPCRequestHandler):
+    """
+    Request handler that checks permissions: clients with control use the path ``/control/<control_token>`` ,
+    any other path is read-only.
+    """
+
+    def is_rpc_path_valid(self) -> bool:
+        return True
+
+    def _dispatch(self, method, params):
+        if method in CONTROL_METHODS:
+            token = None
+            if self.path.startswith('/control/'):
+                token = self.path[len('/control/'):]
+            if not has_control(token, self.server.control_token):
+                raise PermissionError(f'{method} requires a control client')
+        return self.server._dispatch(method, params)
+
+
+class ControllerRPCServer(SimpleXMLRPCServer):
+    """
+    :class:`~xmlrpc.server.SimpleXMLRPCServer` that handles requests in a thread pool,
+    so that a slow or hung client doesn't block the others.
+
+    Args:
+        addr (tuple): (host, port) to listen on
+        control_token (str, None): token that clients need to call :data:`.CONTROL_METHODS` .
+            if None, all clients have control.
+        max_workers (int): number of threads to handle requests with.
+            if None, use the ``CONTROLLER_SERVER_THREADS`` pref
+    """
+
+    def __init__(self, addr, control_token: str = None, max_workers: int = None, **kwargs):
+        super(ControllerRPCServer, self).__init__(addr, requestHandler=ControllerRequestHandler, **kwargs)
+        if max_workers is None:
+            max_workers = prefs.get_pref('CONTROLLER_SERVER_THREADS')
+        self.control_token = control_token
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def process_request(self, request, client_address):   # pragma: no cover
+        self.executor.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):   # pragma: no cover
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def restore_controller(controller: 'control_module.ControlModuleBase', controls: typing.Iterable = (),
+                       breath_detection: typing.Union[None, bool] = None, running: bool = False):
+    """
+    Restore the state of a restarted controller, see :meth:`.ProcessManager.restore_state`
+
+    Args:
+        controller (:class:`.ControlModuleBase`): new controller
+        controls (iterable): :class:`.ControlSetting` s to apply, in order
+        breath_detection (bool, None): if not None, passed to ``set_breath_detection``
+        running (bool): whether to start the controller's main loop
+    """
+    for control_setting in controls:
+        controller.set_control(control_setting)
+    if breath_detection is not None:
+        controller.set_breath_detection(breath_detection)
+    if running:
+        controller.start()
+
+
+def host_alarm_manager(controller: 'control_module.ControlModuleBase'):
+    """
+    If the ``CONTROLLER_ALARMS`` pref is set, have the controller check the alarm rules on every loop
+    (see :meth:`.ControlModuleBase.set_alarm_manager` ), unless it already does. Its alarms are added to the
+    ``ALARM_HISTORY_FN`` history, if set.
+
+    Args:
+        controller (:class:`.ControlModuleBase`): controller of this process
+    """
+    if prefs.get_pref('CONTROLLER_ALARMS') and controller.alarm_manager is None:
+        alarm_manager = Alarm_Manager()
+        if alarm_manager.history is None:
+            alarm_manager.history = get_alarm_history()
+        controller.set_alarm_manager(alarm_manager)
+
+
+# Arguments from clients are plain xml-rpc types or decoded with :mod:`pvp.common.codec` , never unpickled,
+# since any client can connect. Only results sent back to the coordinator are pickled.
 
 # General comment on the "# pragma: no cover":
 # These functions are extensively tested in the UI-tests, but not monitored by travis 
 
 def get_sensors():                                           # pragma: no cover
     res = remote_controller.get_sensors()
-    return pickle.dumps(res)
+    return codec.encode(res)
 
 def get_alarms():                                            # pragma: no cover
     res = remote_controller.get_alarms()
     return pickle.dumps(res)
 
 def set_control(control_setting):                            # pragma: no cover
-    args = pickle.loads(control_setting.data)
+    args = codec.decode(control_setting.data)
     remote_controller.set_control(args)
 
 def get_control(control_setting_name):                       # pragma: no cover
-    args = pickle.loads(control_setting_name.data)
+    args = ValueName[control_setting_name]
     res = remote_controller.get_control(args)
-    return pickle.dumps(res)
+    return codec.encode(res)
 
 def set_breath_detection(breath_detection):                  # pragma: no cover
-    args = pickle.loads(breath_detection.data)
-    remote_controller.set_breath_detection(args)
+    remote_controller.set_breath_detection(bool(breath_detection))
 
 def get_breath_detection():                                  # pragma: no cover
     res = remote_controller.get_breath_detection()
     return pickle.dumps(res)
 
-def rpc_server_main(sim_mode, serve_event, addr=default_addr, port=default_port):  # pragma: no cover
+def dismiss_alarm(alarm_type, duration):                     # pragma: no cover
+    remote_controller.dismiss_alarm(AlarmType[alarm_type], duration)
+
+def poll(since_seq):                                         # pragma: no cover
+    res = remote_controller.poll(int(since_seq))
+    return pickle.dumps(res)
+
+def rpc_server_main(sim_mode, serve_event, addr=default_addr, port=default_port, sensor_snapshot=None, waveform_buffer=None,
+                    control_token=None, heartbeat=None, restore=None, mirror=None, controller=None,
+                    checkpoint=None):  # pragma: no cover
     logger = init_logger(__name__)
     logger.info('controller process init')
     global remote_controller
-    if addr != default_addr:
-        raise NotImplementedError
-    if port != default_port:
-        raise NotImplementedError
-    remote_controller = control_module.get_control_module(sim_mode)
-    server = SimpleXMLRPCServer((addr, port), allow_none=True, logRequests=False)
+    if controller is None and checkpoint is not None:
+        controller = control_module.get_control_module(sim_mode, checkpoint=checkpoint)
+    elif controller is None:
+        controller = control_module.get_control_module(sim_mode)
+    remote_controller = controller
+    if sensor_snapshot is not None:
+        remote_controller.set_sensor_snapshot(sensor_snapshot)
+    if waveform_buffer is not None:
+        remote_controller.set_waveform_buffer(waveform_buffer)
+    if heartbeat is not None:
+        remote_controller.set_heartbeat(heartbeat)
+    if mirror is not None:
+        remote_controller.set_mirror(mirror)
+    host_alarm_manager(remote_controller)
+    if restore is not None:
+        restore_controller(remote_controller, **restore)
+    server = ControllerRPCServer((addr, port), control_token=control_token, allow_none=True, logRequests=False)
     server.register_function(get_sensors, "get_sensors")
     server.register_function(set_control, "set_control")
     server.register_function(get_control, "get_control")
     server.register_function(remote_controller.start, "start")
     server.register_function(remote_controller.is_running, "is_running")
     server.register_function(remote_controller.stop, "stop")
+    server.register_function(remote_controller.get_heartbeat, "get_heartbeat")
     server.register_function(get_alarms, 'get_alarms')
     server.register_function(set_breath_detection, 'set_breath_detection')
     server.register_function(get_breath_detection, "get_breath_detection")
+    server.register_function(poll, "poll")
+    server.register_function(dismiss_alarm, "dismiss_alarm")
     serve_event.set()
     server.serve_forever()
 
 
 
-def get_rpc_client():
+def get_rpc_client(control_token: str = None, addr: str = default_addr, port: int = default_port):
+    """
+    Make a client for the controller process
+
+    Args:
+        control_token (str): the controller process's control token. if None, the client is read-only,
+            see :data:`.CONTROL_METHODS`
+        addr (str): host of the controller process
+        port (int): port of the controller process, see :func:`.instance_port`
+    """
     # https://mail.python.org/pipermail/python-bugs-list/2015-January/260126.html
     #transport = xmlrpc.client.Transport()
     #con = transport.make_connection(f"http://{default_addr}:{default_port}/")
     #con.timeout = 5
     #
-    proxy = xmlrpc.client.ServerProxy(f"http://{default_addr}:{default_port}/")
+    path = '/' if control_token is None else f'/control/{control_token}'
+    proxy = xmlrpc.client.ServerProxy(f"http://{addr}:{port}{path}")
 
     return proxy
\ No newline at end of file
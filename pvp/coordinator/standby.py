@@ -0,0 +1,120 @@
+"""
+Warm standby controller process, which takes over the valves if the active controller stops beating.
+
+Started by a :class:`.ProcessManager` with ``standby=True`` alongside the active controller process.
+The standby is a fully initialized controller that isn't running its main loop. Until it is needed it
+
+* follows the active controller's settings from a shared :class:`.ControllerMirror` , and
+* watches the active controller's shared :class:`.Heartbeat` .
+
+If the active controller should be running but hasn't beat for ``max_heartbeat_interval`` , the standby claims the
+mirror, takes over the heartbeat and shared memory, and continues ventilating from the active controller's breath
+phase (see :meth:`.ControlModuleBase.take_over` ). Claiming the mirror fences the old controller: if it wakes up,
+it stops its main loop rather than fight the standby for the valves.
+
+Only then does the standby start serving the coordinator at the active controller's address, so the
+coordinator's clients reconnect to it as they would to a restarted controller. The :class:`.ProcessManager`
+kills the old controller and starts a new standby.
+
+Both controllers have their own :class:`.Hal` , and nothing stops the old one's writes from reaching the valves
+until it notices it has been fenced, so a standby is only run in simulation mode.
+"""
+import os
+import time
+import threading
+import typing
+
+from pvp.controller import control_module
+from pvp.common.loggers import init_logger
+from pvp.common.shared import Heartbeat, ControllerMirror
+from pvp.coordinator import rpc, ipc
+
+
+def wait_for_takeover(controller: 'control_module.ControlModuleBase', heartbeat: Heartbeat,
+                      mirror: ControllerMirror, period: float, max_heartbeat_interval: float,
+                      stop_event: typing.Optional[threading.Event] = None) -> typing.Union[None, dict]:
+    """
+    Follow the active controller's settings until it misses its heartbeat.
+
+    Args:
+        controller (:class:`.ControlModuleBase`): the standby controller
+        heartbeat (:class:`.Heartbeat`): the active controller's heartbeat
+        mirror (:class:`.ControllerMirror`): the active controller's settings and breath phase
+        period (float): time between checks (seconds)
+        max_heartbeat_interval (float): time without a heartbeat after which the active controller is considered stalled
+        stop_event (:class:`threading.Event`): if set, stop waiting
+
+    Returns:
+        dict: the last state of the active controller (see :meth:`.ControllerMirror.read` ) once the standby
+        should take over, or None if ``stop_event`` was set
+    """
+    seq = 0
+    while stop_event is None or not stop_event.is_set():
+        if mirror.seq != seq:
+            state = mirror.read()
+            if state is not None:
+                controller.follow_mirror(state)
+                seq = mirror.seq
+
+        if mirror.owner not in (0, os.getpid()) and heartbeat.running \
+                and heartbeat.age() > max_heartbeat_interval:
+            state = mirror.read()
+            if state is not None:
+                return state
+
+        time.sleep(period)
+    return None
+
+
+def standby_server_main(sim_mode, ready_event, serve_event, transport='xmlrpc',
+                        address: typing.Union[int, str] = None, sensor_snapshot=None, waveform_buffer=None,
+                        control_token=None, heartbeat: Heartbeat = None, mirror: ControllerMirror = None,
+                        period: float = 0.01, max_heartbeat_interval: float = 0.1):  # pragma: no cover
+    """
+    Main function of a warm standby controller process
+
+    Args:
+        sim_mode (bool): whether the controller should be run in simulation mode
+        ready_event (:class:`multiprocessing.Event`): set once the standby controller is initialized
+        serve_event (:class:`multiprocessing.Event`): set once the standby has taken over and is accepting connections
+        transport ('xmlrpc', 'ipc'): transport to serve once the standby has taken over
+        address (int, str): port (``'xmlrpc'`` ) or socket path (``'ipc'`` ) of the active controller
+        sensor_snapshot (:class:`.SensorSnapshot`): published to once the standby has taken over
+        waveform_buffer (:class:`.WaveformBuffer`): written to once the standby has taken over
+        control_token (str): only clients with this token have control
+        heartbeat (:class:`.Heartbeat`): the active controller's heartbeat, beat by the standby once it takes over
+        mirror (:class:`.ControllerMirror`): the active controller's settings and breath phase
+        period (float): time between checks of the heartbeat (seconds)
+        max_heartbeat_interval (float): time without a heartbeat after which the standby takes over (seconds)
+    """
+    if not sim_mode:
+        raise ValueError('A warm standby would drive the same valves as the active controller, '
+                         'it can only be run in simulation mode')
+    logger = init_logger(__name__)
+    logger.info('standby controller process init')
+    controller = control_module.get_control_module(sim_mode)
+    ready_event.set()
+
+    state = wait_for_takeover(controller, heartbeat, mirror, period, max_heartbeat_interval)
+    mirror.claim(os.getpid())
+    if sensor_snapshot is not None:
+        controller.set_sensor_snapshot(sensor_snapshot)
+    if waveform_buffer is not None:
+        controller.set_waveform_buffer(waveform_buffer)
+    controller.set_heartbeat(heartbeat)
+    controller.set_mirror(mirror)
+    controller.take_over(state)
+    logger.warning(f'standby controller process {os.getpid()} took over at breath {state["breath_count"]}')
+
+    # the old controller may hold the port until the process manager kills it
+    while True:
+        try:
+            if transport == 'ipc':
+                ipc.ipc_server_main(sim_mode, serve_event, address=address, control_token=control_token,
+                                    controller=controller)
+            else:
+                rpc.rpc_server_main(sim_mode, serve_event, port=address, control_token=control_token,
+                                    controller=controller)
+        except OSError as e:
+            logger.info(f'couldnt serve at {address} yet, got {e}')
+            time.sleep(period)
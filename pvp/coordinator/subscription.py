@@ -0,0 +1,163 @@
+"""
+Push updates from the controller to the GUI rather than having the GUI poll for them.
+
+A :class:`.Subscription` calls its ``callback`` with a :class:`.PollResult` from a background thread
+
+* at ``rate`` Hz, whenever the controller has new sensor values, and
+* immediately when the controller's alarms change (see :meth:`.ControlModuleBase.wait_for_alarms` )
+
+Subscriptions are made with :meth:`.CoordinatorBase.subscribe` , which picks the subscription that fits the coordinator:
+
+* :class:`.LocalSubscription` - the controller is in this process, updates are pushed by :func:`.publish_updates`
+* :class:`.IPCSubscription` - the controller process runs :func:`.publish_updates` and sends updates
+  over a connection of the ``'ipc'`` transport
+* :class:`.PollingSubscription` - for transports that can't push (xml-rpc), poll at ``rate`` from the background thread.
+  Alarms are only received as fast as ``rate`` .
+
+The callback is called from the background thread, so the GUI passes the ``emit`` method of a
+:class:`PySide2.QtCore.Signal` to receive updates in the GUI thread.
+"""
+import threading
+import time
+import typing
+
+from pvp.common import prefs
+from pvp.common.message import PollResult
+from pvp.common.loggers import init_logger
+
+
+def publish_updates(controller, send: typing.Callable[[PollResult], None], rate: float,
+                    stop_event: threading.Event, keepalive: float = 1):
+    """
+    Push :meth:`.ControlModuleBase.poll` results from a controller until ``stop_event`` is set.
+
+    Args:
+        controller (:class:`.ControlModuleBase`): controller to publish updates from
+        send (callable): called with each :class:`.PollResult` that has new sensor values or changed alarms, and keepalives
+        rate (float): rate to send sensor values (Hz)
+        stop_event (:class:`threading.Event`): set to stop publishing
+        keepalive (float): send an update at least this often (seconds) even if nothing changed,
+            so subscribers still get the heartbeat and a dropped connection is noticed
+    """
+    period = 1 / rate
+    seq = 0
+    next_time = time.monotonic()
+    last_sent = 0
+    while not stop_event.is_set():
+        alarms_changed = False
+        timeout = next_time - time.monotonic()
+        if timeout > 0:
+            alarms_changed = controller.wait_for_alarms(seq, timeout)
+        if not alarms_changed:
+            # don't try to catch up if we fell behind
+            next_time = max(next_time + period, time.monotonic())
+
+        update = controller.poll(seq)
+        seq = update.seq
+        if update.sensors is not None or update.alarms_changed or time.monotonic() - last_sent > keepalive:
+            send(update)
+            last_sent = time.monotonic()
+
+
+class Subscription:
+    """
+    Base class for subscriptions, which deliver :class:`.PollResult` s to a callback from a background thread.
+
+    Subclasses implement :meth:`.Subscription._run` , which should return once :attr:`.Subscription.stop_event` is set.
+
+    Args:
+        callback (callable): called with each :class:`.PollResult`
+        rate (float): rate to receive sensor values (Hz). if None, use the ``CONTROLLER_PUBLISH_RATE`` pref
+
+    Attributes:
+        stop_event (:class:`threading.Event`): set by :meth:`.Subscription.stop`
+    """
+
+    def __init__(self, callback: typing.Callable[[PollResult], None], rate: float = None):
+        if rate is None:
+            rate = prefs.get_pref('CONTROLLER_PUBLISH_RATE')
+        self.callback = callback
+        self.rate = rate
+        self.stop_event = threading.Event()
+        self.logger = init_logger(__name__)
+        self._thread = None # type: typing.Union[None, threading.Thread]
+
+    def start(self):
+        """
+        Start receiving updates in a background thread
+        """
+        if self.running:
+            return
+        self.stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 1):
+        """
+        Stop receiving updates
+
+        Args:
+            timeout (float): time to wait for the background thread to finish
+        """
+        self.stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        """
+        Whether the background thread is running
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):  # pragma: no cover
+        raise NotImplementedError()
+
+
+class LocalSubscription(Subscription):
+    """
+    Subscription to a controller in the same process
+
+    Args:
+        controller (:class:`.ControlModuleBase`): controller to subscribe to
+        callback (callable): called with each :class:`.PollResult`
+        rate (float): rate to receive sensor values (Hz)
+    """
+
+    def __init__(self, controller, callback: typing.Callable[[PollResult], None], rate: float = None):
+        super(LocalSubscription, self).__init__(callback, rate)
+        self.controller = controller
+
+    def _run(self):
+        publish_updates(self.controller, self.callback, self.rate, self.stop_event)
+
+
+class PollingSubscription(Subscription):
+    """
+    Subscription for transports that can't push updates: poll at ``rate`` from the background thread.
+
+    Args:
+        poll (callable): a ``poll(since_seq)`` method like :meth:`.CoordinatorBase.poll` that is safe
+            to call from the background thread
+        callback (callable): called with each :class:`.PollResult`
+        rate (float): rate to poll (Hz)
+    """
+
+    def __init__(self, poll: typing.Callable[[int], PollResult],
+                 callback: typing.Callable[[PollResult], None], rate: float = None):
+        super(PollingSubscription, self).__init__(callback, rate)
+        self.poll = poll
+
+    def _run(self):
+        seq = 0
+        while not self.stop_event.wait(1 / self.rate):
+            try:
+                update = self.poll(seq)
+            except (ConnectionRefusedError, OSError) as e:
+                # controller process may be restarting, try again next time
+                self.logger.warning(f'Couldnt poll controller, got error {e}')
+                continue
+            seq = update.seq
+            if update.sensors is not None or update.alarms_changed:
+                self.callback(update)
@@ -14,11 +14,13 @@ from pvp.alarm import AlarmSeverity, Alarm, AlarmType
 from pvp.common import values
 from pvp.common.values import ValueName
 from pvp.common.loggers import init_logger
-from pvp.common.message import ControlSetting, SensorValues
+from pvp.common.message import ControlSetting, SensorValues, PollResult
 from pvp.coordinator.coordinator import CoordinatorBase
+from pvp.coordinator.subscription import Subscription
 from pvp import gui
 from pvp.gui import widgets, set_gui_instance, get_gui_instance, styles, mono_font
 from pvp.alarm import Alarm_Manager
+from pvp.alarm.history import get_alarm_history
 
 
 
@@ -64,6 +66,8 @@ class PVP_Gui(QtWidgets.QMainWindow):
         locked (bool): whether controls have been locked
         start_time (float): Start time as returned by :func:`time.time`
         update_period (float): The global delay between redraws of the GUI (seconds)
+        loop_stats (dict): Controller loop statistics from the last :meth:`.CoordinatorBase.poll`
+        subscription (:class:`.Subscription`): Subscription to controller updates while running, if the ``GUI_SUBSCRIBE`` pref is set
         logger: Logger generated by :func:`.loggers.init_logger`
     """
 
@@ -77,6 +81,12 @@ class PVP_Gui(QtWidgets.QMainWindow):
     :class:`PySide2.QtCore.Signal` emitted when the gui is started (True) or stopped (False)
     """
 
+    controller_updated = QtCore.Signal(object)
+    """
+    :class:`PySide2.QtCore.Signal` emitted from the background thread of the controller :class:`.Subscription` with
+    each :class:`.PollResult` , handled in the GUI thread by :meth:`.PVP_Gui.receive_controller_update`
+    """
+
     MONITOR = values.DISPLAY_MONITOR
     """
     Values to create :class:`.Display` widgets for in the Sensor Monitor column. See :data:`.values.DISPLAY_MONITOR`
@@ -142,6 +152,18 @@ class PVP_Gui(QtWidgets.QMainWindow):
         self.controls = {} # type: typing.Dict[ValueName.name, widgets.Display]
 
         self.coordinator = coordinator
+        if self.coordinator.controller_alarms:
+            # alarms are checked by the controller, dismiss them there too
+            self.alarm_manager.add_dismiss_callback(self.coordinator.dismiss_alarm)
+        elif self.alarm_manager.history is None:
+            self.alarm_manager.history = get_alarm_history()
+        # sequence number of the last coordinator.poll(), and the last sensor values it returned
+        self._poll_seq = 0
+        self._last_sensors = None # type: typing.Union[None, SensorValues]
+        self.loop_stats = {}
+        # receive updates pushed from the controller while running, see toggle_start
+        self.subscription = None # type: typing.Union[None, Subscription]
+        self.controller_updated.connect(self.receive_controller_update)
 
         # start QTimer to update values
         self.timer = QtCore.QTimer()
@@ -200,12 +222,31 @@ class PVP_Gui(QtWidgets.QMainWindow):
             if not self.running:
                 return # pragma: no cover
 
+            # samples of every controller loop since the last update, to plot at full rate
+            waveforms = None
+            controller_alarms_changed = False
+            alarm_transitions = None
             if not vals:
-                vals = self.coordinator.get_sensors()
-
-            # update alarms
+                if self.subscription is None:
+                    # get sensor values and controller alarms that have changed since the last update in one call
+                    update = self.coordinator.poll(self._poll_seq)
+                    self.coordinator.touch()
+                    self._poll_seq = update.seq
+                    self.loop_stats = update.loop_stats
+                    if update.sensors is not None:
+                        self._last_sensors = update.sensors
+                    controller_alarms_changed = update.alarms_changed
+                    controller_alarms = update.alarms
+                    alarm_transitions = update.alarm_transitions
+                # otherwise, sensor values and alarms are pushed to receive_controller_update
+                vals = self._last_sensors
+                if vals is None:
+                    return # pragma: no cover - controller hasn't produced sensor values yet
+                waveforms = self.coordinator.get_waveforms()
+
+            # update alarms, unless the controller checks them
             # only after first breath! many values are only defined after first cycle
-            if vals.breath_count > 1:
+            if vals.breath_count > 1 and not self.coordinator.controller_alarms:
                 # don't test this because we don't usually want the GUI just updating during tests
                 # and this method is really heavy, so we test each of the pieces separately
                 try: # pragma: no cover
@@ -213,25 +254,14 @@ class PVP_Gui(QtWidgets.QMainWindow):
                 except Exception as e: # pragma: no cover
                     self.logger.exception(f"Couldnt update alarm manager: {e}")
 
-            try:
-                controller_alarms = self.coordinator.get_alarms()
-                if isinstance(controller_alarms, (tuple, list)):
-                    for alarm in controller_alarms:
-                        # alarm can either be Alarm object of a list of Alarm objects
-                        if isinstance(alarm, Alarm):
-                            self.handle_alarm(alarm) # pragma: no cover - testing separately
-                        elif isinstance(alarm, (tuple, list)):
-                            for subalarm in alarm:
-                                self.handle_alarm(subalarm)
-                        else:
-                            self.logger.warning(f'Dont know how to handle {alarm} gotten from controller get_alarms() method')
-                elif controller_alarms is not None:
-                    self.logger.warning(f'Dont know how to handle {controller_alarms} gotten from controller get_alarms() method')
-            except Exception as e: # pragma: no cover
-                self.logger.exception(f'Couldnt get alarms from controller, got error {e}')
+            if controller_alarms_changed:
+                self.handle_controller_alarms(controller_alarms)
+            if alarm_transitions:
+                for alarm in alarm_transitions:
+                    self.handle_alarm(alarm)
 
             try:
-                self.plot_box.update_value(vals)
+                self.plot_box.update_value(vals, waveforms)
             except Exception as e: # pragma: no cover
                 self.logger.exception(f"couldnt update plot box with {vals}, got {e}")
 
@@ -521,6 +551,54 @@ class PVP_Gui(QtWidgets.QMainWindow):
 
         self.update_state('controls', control_object.name.name, control_object.value)
 
+    @QtCore.Slot(object)
+    def receive_controller_update(self, update: PollResult):
+        """
+        Receive a :class:`.PollResult` pushed by the controller :attr:`.subscription` .
+
+        Alarms are handled immediately rather than on the next :meth:`.update_gui` , sensor values
+        are stored to be displayed on the next :meth:`.update_gui`
+
+        Args:
+            update (:class:`.PollResult`): update from the controller
+        """
+        if self.subscription is None:
+            # a last update from a subscription that was just stopped
+            return
+        # updates are pushed whether or not the GUI handles them, so tell the controller this one was
+        self.coordinator.touch()
+        self.loop_stats = update.loop_stats
+        if update.sensors is not None:
+            self._last_sensors = update.sensors
+        if update.alarms_changed:
+            self.handle_controller_alarms(update.alarms)
+        if update.alarm_transitions:
+            for alarm in update.alarm_transitions:
+                self.handle_alarm(alarm)
+
+    def handle_controller_alarms(self, controller_alarms: typing.Union[None, tuple]):
+        """
+        Handle alarms raised by the controller, as returned by :meth:`.ControlModuleBase.get_alarms`
+
+        Args:
+            controller_alarms (None, tuple): a tuple of :class:`~.Alarm` s or lists of them
+        """
+        try:
+            if isinstance(controller_alarms, (tuple, list)):
+                for alarm in controller_alarms:
+                    # alarm can either be Alarm object of a list of Alarm objects
+                    if isinstance(alarm, Alarm):
+                        self.handle_alarm(alarm) # pragma: no cover - testing separately
+                    elif isinstance(alarm, (tuple, list)):
+                        for subalarm in alarm:
+                            self.handle_alarm(subalarm)
+                    else:
+                        self.logger.warning(f'Dont know how to handle {alarm} gotten from controller get_alarms() method')
+            elif controller_alarms is not None:
+                self.logger.warning(f'Dont know how to handle {controller_alarms} gotten from controller get_alarms() method')
+        except Exception as e: # pragma: no cover
+            self.logger.exception(f'Couldnt handle alarms from controller, got error {e}')
+
     @QtCore.Slot(Alarm)
     def handle_alarm(self, alarm: Alarm):
         """
@@ -531,9 +609,12 @@ class PVP_Gui(QtWidgets.QMainWindow):
 
         Give the alarm to the :class:`.Alarm_Bar` and update the alarm :attr:`.Display.alarm_state` of all widgets listed as :attr:`.Alarm.cause`
 
+        The alarm is stamped as ``'handled'`` in :attr:`.Alarm_Manager.latency` (see :mod:`.alarm.latency` )
+
         Args:
             alarm (:class:`~.Alarm`): The alarm to raise (or clear)
         """
+        self.alarm_manager.latency.stamp(alarm, 'handled')
         self.logger.info(str(alarm))
 
         if alarm.severity > AlarmSeverity.OFF:
@@ -643,6 +724,8 @@ class PVP_Gui(QtWidgets.QMainWindow):
             self.control_panel.runtime.start_timer()
             self.plot_box.reset_start_time()
             self.coordinator.start()
+            if prefs.get_pref('GUI_SUBSCRIBE') and self.subscription is None:
+                self.subscription = self.coordinator.subscribe(self.controller_updated.emit)
             self.control_panel.start_button.set_state('ON')
             # self.control_panel.lock_button.set_state('LOCKED')
             self.toggle_lock(True)
@@ -677,6 +760,7 @@ class PVP_Gui(QtWidgets.QMainWindow):
                 do_stop = True
 
             if do_stop:
+                self.stop_subscription()
                 self.coordinator.stop()
                 self.running = False
                 self.control_panel.start_button.set_state('OFF')
@@ -688,6 +772,14 @@ class PVP_Gui(QtWidgets.QMainWindow):
 
         self.state_changed.emit(state)
 
+    def stop_subscription(self):
+        """
+        Stop receiving updates pushed by the controller, and go back to polling it in :meth:`.update_gui`
+        """
+        if self.subscription is not None:
+            self.subscription.stop()
+            self.subscription = None
+
     def closeEvent(self, event):
         """
         Emit :attr:`.gui_closing` and close!
@@ -697,6 +789,7 @@ class PVP_Gui(QtWidgets.QMainWindow):
         #globals()['_GUI_INSTANCE'] = None
         set_gui_instance(None)
         self.gui_closing.emit()
+        self.stop_subscription()
 
         if self.coordinator:
             try:
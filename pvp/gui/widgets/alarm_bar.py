@@ -123,7 +123,8 @@ class Alarm_Bar(QtWidgets.QFrame):
 
         Insert new alarm in order the prioritizes alarm severity with highest severity on right
 
-        Set alarm sound and begin playing if not already.
+        Set alarm sound and begin playing if not already, then stamp the alarm as ``'displayed'`` in
+        :attr:`.Alarm_Manager.latency` (see :mod:`.alarm.latency` ).
 
         Args:
             alarm (:class:`.Alarm` ): Alarm to be added
@@ -169,6 +170,8 @@ class Alarm_Bar(QtWidgets.QFrame):
         # update our icon
         self.update_icon()
 
+        Alarm_Manager().latency.stamp(alarm, 'displayed')
+
     def clear_alarm(self, alarm:Alarm=None, alarm_type:AlarmType=None):
         """
         Remove an alarm card, update appearance and sound player to reflect current max severity
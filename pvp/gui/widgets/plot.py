@@ -23,10 +23,11 @@ import pyqtgraph as pg
 from pvp.gui import styles
 from pvp.gui import mono_font
 from pvp.gui import get_gui_instance
-from pvp.common import unit_conversion
+from pvp.common import unit_conversion, prefs
 from pvp.common.message import SensorValues, ControlSetting
 from pvp.common.values import ValueName, Value
 from pvp.common.loggers import init_logger
+from pvp.common.shared import WAVEFORM_VALUES
 from pvp.alarm import AlarmSeverity
 
 PLOT_TIMER = None
@@ -171,6 +172,19 @@ class Plot(pg.PlotWidget):
         Args:
             new_value (tuple): (timestamp from time.time(), breath_cycle, value)
         """
+        self.update_values((new_value[0],), (new_value[1],), (new_value[2],))
+
+    def update_values(self, timestamps: typing.Sequence[float], cycles: typing.Sequence[int],
+                      new_values: typing.Sequence[float]):
+        """
+        Update with a batch of new sensor values, eg. all the samples from the controller's
+        :class:`.WaveformBuffer` since the last update, and redraw once.
+
+        Args:
+            timestamps (sequence): timestamps from time.time()
+            cycles (sequence): breath cycle of each value
+            new_values (sequence): sensor values
+        """
         try:
             this_time = time.time()
             #time_diff = this_time-self._last_time
@@ -180,9 +194,9 @@ class Plot(pg.PlotWidget):
             #                          [limits[1][0], limits[1][1]])
             self.time_marker.setValue(current_relative_time)
 
-            self.timestamps.append(new_value[0])
-            self.cycles.append(new_value[1])
-            self.history.append(new_value[2])
+            self.timestamps.extend(timestamps)
+            self.cycles.extend(cycles)
+            self.history.extend(new_values)
 
             # filter values based on timestamps
             ts_array = np.array(self.timestamps)
@@ -191,7 +205,7 @@ class Plot(pg.PlotWidget):
 
             # subtract start time and take modulus of duration to get wrapped timestamps
             plot_timestamps = np.mod(ts_array[start_ind:end_ind]-self._start_time, self.plot_duration)
-            plot_values = np.array([self.history[i] for i in range(start_ind, end_ind)])
+            plot_values = np.array(self.history)[start_ind:end_ind]
             if self._convert_in:
                 plot_values = self._convert_in(plot_values)
 
@@ -207,7 +221,7 @@ class Plot(pg.PlotWidget):
                 self.early_curve.setData(plot_timestamps, plot_values)
                 self.late_curve.clear()
         except Exception as e:  # pragma: no cover
-            self.logger.exception('{}: error plotting value: {}, {}'.format(self.name, new_value[1], e))
+            self.logger.exception('{}: error plotting values: {}'.format(self.name, e))
 
     # @QtCore.Slot(tuple)
     def set_safe_limits(self, limits: ControlSetting):
@@ -311,6 +325,7 @@ class Plot_Container(QtWidgets.QGroupBox):
 
         self.plot_descriptors = plot_descriptors
         self.plots = {}
+        self._waveform_fields = {value_name.name: field for value_name, field in WAVEFORM_VALUES.items()}
 
         self.setStyleSheet(styles.PLOT_BOX)
         self.setContentsMargins(0,0,0,0)
@@ -395,24 +410,42 @@ class Plot_Container(QtWidgets.QGroupBox):
                 plot_color = styles.SUBWAY_COLORS['orange']
             else:
                 plot_color = styles.SUBWAY_COLORS['ltblue']
-            self.plots[plot_key.name] = Plot(color=plot_color, **plot_params.to_dict())
+            # plots may be fed every sample of the controller loop, see update_value
+            self.plots[plot_key.name] = Plot(color=plot_color,
+                                             buffer_size=prefs.get_pref('WAVEFORM_BUFFER_SIZE'),
+                                             **plot_params.to_dict())
             self.layout.addWidget(self.plots[plot_key.name], 1)
             if plot_key == ValueName.FIO2:
                 self.plots[plot_key.name].setVisible(False)
 
         self.setLayout(self.layout)
 
-    def update_value(self, vals: SensorValues):
+    def update_value(self, vals: SensorValues, waveforms: typing.Optional[np.ndarray] = None):
         """
         Try to update all plots who have new sensorvalues
 
+        Plots of values that are in the controller's :class:`.WaveformBuffer` (see
+        :data:`~pvp.common.shared.WAVEFORM_VALUES` ) are updated with every sample in ``waveforms``
+        if given, and the rest are updated with ``vals`` .
+
         Args:
             vals (:class:`.SensorValues`): Sensor Values to update plots with
+            waveforms (:class:`numpy.ndarray`): Samples drained from the :class:`.WaveformBuffer` since
+                the last update, from :meth:`.CoordinatorBase.get_waveforms`
 
         """
 
         for plot_key, plot in self.plots.items():
-            if hasattr(vals, plot_key):
+            if waveforms is not None and plot_key in self._waveform_fields:
+                if len(waveforms) == 0:
+                    continue
+                try:
+                    plot.update_values(waveforms['timestamp'], waveforms['breath_count'],
+                                       waveforms[self._waveform_fields[plot_key]])
+                except Exception as e: # pragma: no cover
+                    self.logger.exception(f'Couldnt update plot with {plot_key}, got error {e}')
+
+            elif hasattr(vals, plot_key):
                 try:
                     plot.update_value((time.time(), getattr(vals, 'breath_count'), getattr(vals, plot_key)))
                 except Exception as e: # pragma: no cover
@@ -19,6 +19,14 @@ def parse_cmd_args(arg):
     parser.add_argument('--single_process',
                         help='running UI and coordinator within one process (default: False)',
                         action='store_true')
+    parser.add_argument('--transport',
+                        help='transport used to communicate with the controller process, xmlrpc or ipc (default: xmlrpc)',
+                        choices=('xmlrpc', 'ipc'),
+                        default='xmlrpc')
+    parser.add_argument('--instance',
+                        help='id of the controller instance to start, each uses its own port or socket (default: 0)',
+                        type=int,
+                        default=0)
     parser.add_argument('--default_controls',
                         help='set default ControlValues on start (default: False).',
                         action='store_true')
@@ -46,7 +54,8 @@ def set_valves_save_position(args, config_file = 'pvp/io/config/devices.ini'):
 def main(arg):
     args = parse_cmd_args(arg)         # pragma: no cover
     try:
-        coordinator = get_coordinator(single_process=args.single_process, sim_mode=args.simulation)
+        coordinator = get_coordinator(single_process=args.single_process, sim_mode=args.simulation, transport=args.transport,
+                                      instance_id=args.instance)
         app, gui = launch_gui(coordinator, args.default_controls, screenshot=args.screenshot)
         sys.exit(app.exec_())
     finally: #Only in cases of errors; tested above
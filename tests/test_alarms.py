@@ -1,15 +1,21 @@
 import pytest
 
 import pdb
+import pickle
 import time
 import copy
+import tracemalloc
 
 import numpy as np
 
 from pvp.alarm import condition, ALARM_RULES, AlarmType, AlarmSeverity, Alarm, Alarm_Manager
 from pvp.alarm.rule import Alarm_Rule
+from pvp.alarm.compiled import count_cycles, condition_chain, TRANSITION_DTYPE
+from pvp.alarm.history import Alarm_History
+from pvp.alarm.latency import Alarm_Latency, STAGES
 
 from pvp.common.values import ValueName, SENSOR
+from pvp.common.frame import SensorFrame, FRAME_DTYPE
 from pvp.common.message import SensorValues, ControlSetting
 
 ##########
@@ -282,6 +288,115 @@ def test_cyclealarmseverity_condition():
     # FIXME
     pass
 
+
+@pytest.mark.parametrize('mode', ['min', 'max'])
+def test_timevalue_condition(fake_sensors, mode):
+    """
+    A time condition is met once the value has been out of range for its time, and starts again whenever
+    the value comes back in range
+    """
+    clock = _Clock(100.)
+    cond = condition.TimeValueCondition(value_name=ValueName.PRESSURE, limit=10, mode=mode, time=2, clock=clock)
+    out_of_range = fake_sensors({ValueName.PRESSURE: 20 if mode == 'max' else 0})
+    in_range = fake_sensors({ValueName.PRESSURE: 10})
+
+    # in range, never met
+    for _ in range(3):
+        clock.now += 5
+        assert cond.check(in_range) == False
+
+    # out of range from the first check, met from the deadline on
+    assert cond.check(out_of_range) == False
+    clock.now += 1.999
+    assert cond.check(out_of_range) == False
+    clock.now += 0.001
+    assert cond.check(out_of_range) == True
+    clock.now += 60
+    assert cond.check(out_of_range) == True
+
+    # coming back in range starts again, even between checks
+    assert cond.check(in_range) == False
+    assert cond.check(out_of_range) == False
+    clock.now += 1
+    assert cond.check(in_range) == False
+    clock.now += 1
+    assert cond.check(out_of_range) == False
+    clock.now += 2
+    assert cond.check(out_of_range) == True
+
+    # checks that are far apart are met at the first check after the deadline
+    cond.reset()
+    assert cond.check(out_of_range) == False
+    clock.now += 10
+    assert cond.check(out_of_range) == True
+
+    # a time of 0 is met as soon as the value is out of range
+    cond.time = 0
+    cond.reset()
+    assert cond.check(out_of_range) == True
+
+    # the limit can be changed by dependencies like any value condition
+    cond.limit = 30 if mode == 'max' else -10
+    assert cond.check(out_of_range) == False
+
+    # and the default clock is monotonic
+    cond = condition.TimeValueCondition(value_name=ValueName.PRESSURE, limit=10, mode=mode, time=0.01)
+    assert cond.clock is time.monotonic
+    assert cond.check(out_of_range) == False
+    time.sleep(0.011)
+    assert cond.check(out_of_range) == True
+
+
+def test_timevalue_condition_rule(fake_sensors):
+    """
+    A time condition in :data:`.ALARM_RULES` is copied with the rules, can be pickled, and is checked on every update,
+    even when the sensor values don't change
+    """
+    manager = Alarm_Manager(shared=False)
+    clock = _Clock()
+    rule = Alarm_Rule(
+        name=AlarmType.BAD_SENSOR_READINGS,
+        latch=False,
+        conditions=(
+            (AlarmSeverity.LOW, condition.TimeValueCondition(
+                value_name=ValueName.PRESSURE, limit=50, mode='max', time=1, clock=clock)),
+            (AlarmSeverity.HIGH, condition.ValueCondition(
+                value_name=ValueName.PIP, limit=50, mode='max') +
+             condition.TimeValueCondition(
+                value_name=ValueName.PRESSURE, limit=50, mode='max', time=3, clock=clock)),
+        )
+    )
+    ALARM_RULES[rule.name] = rule
+    try:
+        manager.load_rules()
+    finally:
+        del ALARM_RULES[rule.name]
+    loaded = manager.rules[AlarmType.BAD_SENSOR_READINGS]
+    assert loaded is not rule
+    assert loaded.conditions[0][1].clock is clock
+
+    emitted = []
+    manager.add_callback(lambda alarm: emitted.append((clock.now, alarm.alarm_type, alarm.severity)))
+    high = fake_sensors({ValueName.PRESSURE: 60, ValueName.PIP: 60, 'breath_count': 1})
+    for step in range(50):
+        clock.now = step * 0.1
+        manager.update(high)
+    clock.now = 5.
+    manager.update(fake_sensors({ValueName.PRESSURE: 0, ValueName.PIP: 60, 'breath_count': 1}))
+    assert [(round(now, 1), alarm_type, severity) for now, alarm_type, severity in emitted
+            if alarm_type is AlarmType.BAD_SENSOR_READINGS] == [
+        (1.0, AlarmType.BAD_SENSOR_READINGS, AlarmSeverity.LOW),
+        (3.0, AlarmType.BAD_SENSOR_READINGS, AlarmSeverity.HIGH),
+        (5.0, AlarmType.BAD_SENSOR_READINGS, AlarmSeverity.OFF),
+    ]
+
+    # pickled with the default clock, with the deadline it had
+    cond = condition.TimeValueCondition(value_name=ValueName.PRESSURE, limit=50, mode='max', time=1)
+    cond.check(high)
+    unpickled = pickle.loads(pickle.dumps(cond))
+    assert unpickled.clock is time.monotonic
+    assert unpickled._deadline == cond._deadline
+
 def test_condition_addition(fake_sensors):
     no_alarm = fake_sensors({ValueName.PIP: 0})
     yes_alarm = fake_sensors({ValueName.PIP: 5})
@@ -321,6 +436,73 @@ def test_condition_addition(fake_sensors):
     assert cond_5.check(no_alarm_4_1) == False
 
 
+def test_condition_allof(fake_sensors):
+    """
+    Added conditions are a flat :class:`.AllOf` that stops checking at the first condition that isn't met,
+    and can be pickled
+    """
+    cond_1 = condition.ValueCondition(ValueName.PIP, 3, 'max')
+    cond_2 = condition.ValueCondition(ValueName.PEEP, 1, 'min')
+    cycle_cond = condition.CycleValueCondition(value_name=ValueName.FIO2, limit=5, mode='min', n_cycles=1)
+
+    compound = cond_1 + cond_2 + cycle_cond
+    assert isinstance(compound, condition.AllOf)
+    assert compound.conditions == (cond_1, cond_2, cycle_cond)
+    assert (cond_1 + (cond_2 + cycle_cond)).conditions == compound.conditions
+    assert compound.value_name == ValueName.PIP
+    # adding doesn't change the conditions that were added
+    assert cond_1.check(fake_sensors({ValueName.PIP: 4})) == True
+
+    # the cycle condition isn't checked (and doesn't start counting) unless the conditions before it are met
+    compound.check(fake_sensors({ValueName.PIP: 0, ValueName.PEEP: 0, ValueName.FIO2: 0, 'breath_count': 0}))
+    assert cycle_cond._mid_check == False
+    compound.check(fake_sensors({ValueName.PIP: 4, ValueName.PEEP: 0, ValueName.FIO2: 0, 'breath_count': 0}))
+    assert cycle_cond._mid_check == True
+    assert compound.check(fake_sensors({ValueName.PIP: 4, ValueName.PEEP: 0, ValueName.FIO2: 0, 'breath_count': 1}))
+    compound.reset()
+    assert cycle_cond._mid_check == False
+
+    # a time condition that isn't checked starts its time again, rather than being met as soon as it is checked
+    clock = _Clock(100.)
+    time_cond = condition.TimeValueCondition(value_name=ValueName.PRESSURE, limit=10, mode='max', time=2, clock=clock)
+    timed = cond_1 + time_cond
+    assert timed.check(fake_sensors({ValueName.PIP: 4, ValueName.PRESSURE: 20})) == False
+    clock.now += 1
+    assert timed.check(fake_sensors({ValueName.PIP: 0, ValueName.PRESSURE: 20})) == False
+    assert time_cond._deadline is None
+    clock.now += 10
+    assert timed.check(fake_sensors({ValueName.PIP: 4, ValueName.PRESSURE: 20})) == False
+    clock.now += 2
+    assert timed.check(fake_sensors({ValueName.PIP: 4, ValueName.PRESSURE: 20})) == True
+
+    unpickled = pickle.loads(pickle.dumps(compound))
+    assert [type(cond) for cond in unpickled.conditions] == [type(cond) for cond in compound.conditions]
+    assert unpickled.check(fake_sensors({ValueName.PIP: 4, ValueName.PEEP: 0, ValueName.FIO2: 6})) == False
+
+    # the default rules can be pickled, and their dependencies still transform control values
+    rules = pickle.loads(pickle.dumps(ALARM_RULES))
+    assert list(rules.keys()) == list(ALARM_RULES.keys())
+    low_pressure = rules[AlarmType.LOW_PRESSURE].conditions[1][1]
+    assert low_pressure.depends['transform'](20) == 20 - (20 * 0.15)
+
+
+def test_condition_allof_dependency():
+    """
+    Dependencies of conditions in an :class:`.AllOf` update the condition that declares them
+    """
+    manager = Alarm_Manager()
+    manager.rules = {}
+    manager.dependencies = {}
+    manager.load_rules()
+
+    medium_condition = manager.rules[AlarmType.LOW_PRESSURE].conditions[1][1]
+    assert isinstance(medium_condition, condition.AllOf)
+    manager.update_dependencies(ControlSetting(name=ValueName.PIP, value=20))
+    assert medium_condition.conditions[0].limit == 20 - (20 * 0.15)
+
+    manager.reset()
+
+
 @pytest.mark.parametrize('test_mode', ['max', 'min'])
 def test_condition_dependency(fake_rule, test_mode):
     rule = fake_rule(mode=test_mode)
@@ -875,3 +1057,780 @@ def test_alarm_manager_logged_alarms(fake_sensors, fake_rule):
 
 
 
+
+
+class _Clock(object):
+    """
+    Clock for :class:`.TimeValueCondition` s that is set rather than read
+    """
+    def __init__(self, now=0.):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+# timestamp of the sample being checked in _run_alarm_sequence
+_SAMPLE_CLOCK = _Clock()
+
+
+def _equivalence_rules():
+    """
+    Rules that aren't in the defaults, to check the compiled rules against every kind of condition
+    """
+    return [
+        # breath cycle counting on its own
+        Alarm_Rule(
+            name=AlarmType.OBSTRUCTION,
+            latch=False,
+            conditions=(
+                (AlarmSeverity.LOW, condition.CycleValueCondition(
+                    value_name=ValueName.PRESSURE, limit=30, mode='max', n_cycles=2)),
+            )
+        ),
+        # value condition chained with breath cycle counting, latched
+        Alarm_Rule(
+            name=AlarmType.LEAK,
+            latch=True,
+            conditions=(
+                (AlarmSeverity.MEDIUM, condition.ValueCondition(
+                    value_name=ValueName.VTE, limit=50, mode='min') +
+                 condition.CycleValueCondition(
+                    value_name=ValueName.PEEP, limit=5, mode='min', n_cycles=3)),
+                (AlarmSeverity.HIGH, condition.CycleValueCondition(
+                    value_name=ValueName.VTE, limit=20, mode='min', n_cycles=1)),
+            )
+        ),
+        # chain that depends on the state of another alarm
+        Alarm_Rule(
+            name=AlarmType.SENSORS_STUCK,
+            latch=False,
+            conditions=(
+                (AlarmSeverity.LOW, condition.ValueCondition(
+                    value_name=ValueName.FIO2, limit=60, mode='max')),
+                (AlarmSeverity.HIGH, condition.CycleValueCondition(
+                    value_name=ValueName.PRESSURE, limit=45, mode='max', n_cycles=1) +
+                 condition.AlarmSeverityCondition(
+                    alarm_type=AlarmType.HIGH_PRESSURE, severity=AlarmSeverity.HIGH) +
+                 condition.ValueCondition(
+                    value_name=ValueName.PEEP, limit=10, mode='max')),
+            )
+        ),
+        # time out of range on its own, and chained with a value condition
+        Alarm_Rule(
+            name=AlarmType.BAD_SENSOR_READINGS,
+            latch=False,
+            conditions=(
+                (AlarmSeverity.LOW, condition.TimeValueCondition(
+                    value_name=ValueName.PRESSURE, limit=20, mode='max', time=0.01, clock=_SAMPLE_CLOCK)),
+                (AlarmSeverity.HIGH, condition.ValueCondition(
+                    value_name=ValueName.FIO2, limit=60, mode='max') +
+                 condition.TimeValueCondition(
+                    value_name=ValueName.PRESSURE, limit=30, mode='max', time=0.005, clock=_SAMPLE_CLOCK)),
+            )
+        ),
+    ]
+
+
+def _load_equivalence_rules(manager):
+    """
+    Load the default and :func:`._equivalence_rules` into a reset manager, with limits set from values of 20
+    """
+    manager.rules = {}
+    manager.dependencies = {}
+    manager.load_rules()
+    for rule in _equivalence_rules():
+        manager.load_rule(rule)
+    manager.reset()
+    manager.clear_all_alarms()
+    for value_name in manager.dependencies.keys():
+        manager.update_dependencies(ControlSetting(name=value_name, value=20))
+
+
+def _run_alarm_sequence(manager, fake_sensors, seed, n_updates=2000, interventions=True, per_breath=False):
+    """
+    Feed the manager a reproducible sequence of sensor values, and if ``interventions`` , control changes and
+    dismissals. Returns the (step, alarm type, severity) of every emitted alarm and the sensor values.
+
+    If ``per_breath`` , the derived values only change when a new breath starts, like they do from the controller.
+    """
+    _load_equivalence_rules(manager)
+
+    sensors = []
+    emitted = []
+    step = 0
+    manager.add_callback(lambda alarm: emitted.append((step, alarm.alarm_type, alarm.severity)))
+
+    rng = np.random.default_rng(seed)
+    breath_count = 0
+    derived = {}
+    for step in range(n_updates):
+        new_breath = int(rng.integers(0, 2))
+        breath_count += new_breath
+        if new_breath or not per_breath or step == 0:
+            derived = {
+                ValueName.PIP: rng.uniform(10, 30),
+                ValueName.PEEP: rng.uniform(0, 20),
+                ValueName.VTE: rng.uniform(0, 130),
+                ValueName.FIO2: rng.uniform(15, 105),
+            }
+        sensors.append(fake_sensors({
+            **derived,
+            ValueName.PRESSURE: rng.uniform(0, 60),
+            'breath_count': breath_count,
+            'timestamp': step * 0.005
+        }))
+        _SAMPLE_CLOCK.now = step * 0.005
+        manager.update(sensors[-1])
+
+        if not interventions:
+            continue
+
+        if rng.random() < 0.02:
+            value_name = list(manager.dependencies.keys())[int(rng.integers(len(manager.dependencies)))]
+            manager.update_dependencies(ControlSetting(name=value_name, value=rng.uniform(10, 30)))
+
+        if rng.random() < 0.05 and len(manager.active_alarms) > 0:
+            alarm_type = list(manager.active_alarms.keys())[int(rng.integers(len(manager.active_alarms)))]
+            manager.dismiss_alarm(alarm_type)
+
+    return emitted, sensors
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_compiled_rules_equivalence(fake_sensors, seed):
+    """
+    Checking rules with :class:`.Compiled_Rules` raises and clears the same alarms at the same time as
+    checking each :class:`.Alarm_Rule`
+    """
+    manager = Alarm_Manager()
+
+    try:
+        manager.use_compiled_rules = False
+        expected, _ = _run_alarm_sequence(manager, fake_sensors, seed)
+        manager.use_compiled_rules = True
+        compiled, _ = _run_alarm_sequence(manager, fake_sensors, seed)
+    finally:
+        del manager.use_compiled_rules
+        manager.rules = {}
+        manager.dependencies = {}
+        manager.load_rules()
+        manager.reset()
+
+    # the sequence should exercise every rule
+    assert {alarm_type for _, alarm_type, _ in expected} >= {AlarmType.OBSTRUCTION, AlarmType.LEAK,
+                                                             AlarmType.SENSORS_STUCK}
+    assert compiled == expected
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('use_compiled_rules', [False, True])
+def test_incremental_equivalence(fake_sensors, seed, use_compiled_rules):
+    """
+    Only checking the rules whose inputs changed raises and clears the same alarms at the same time as checking
+    every rule on every update, while checking fewer rules
+    """
+    manager = Alarm_Manager()
+
+    try:
+        manager.use_compiled_rules = use_compiled_rules
+        manager.incremental = False
+        expected, _ = _run_alarm_sequence(manager, fake_sensors, seed, per_breath=True)
+        n_rules = len(manager.rules)
+        assert manager.total_rules_evaluated == manager.n_updates * n_rules
+
+        manager.incremental = True
+        incremental, _ = _run_alarm_sequence(manager, fake_sensors, seed, per_breath=True)
+        n_updates = manager.n_updates
+        total_rules_evaluated = manager.total_rules_evaluated
+    finally:
+        del manager.use_compiled_rules
+        del manager.incremental
+        manager.rules = {}
+        manager.dependencies = {}
+        manager.load_rules()
+        manager.reset()
+
+    assert {alarm_type for _, alarm_type, _ in expected} >= {AlarmType.OBSTRUCTION, AlarmType.LEAK,
+                                                             AlarmType.SENSORS_STUCK}
+    assert incremental == expected
+    if use_compiled_rules:
+        # rules with only value conditions are all evaluated by the vectorized pass whenever any value changes
+        assert total_rules_evaluated < n_updates * n_rules
+    else:
+        # about half of the updates are in the same breath as the last, when only pressure changes
+        assert total_rules_evaluated < 0.8 * n_updates * n_rules
+
+
+@pytest.mark.parametrize('use_compiled_rules', [False, True])
+def test_incremental_counters(fake_sensors, use_compiled_rules):
+    """
+    The manager counts the rules it checks, and only checks the rules that read a value that changed
+    """
+    manager = Alarm_Manager()
+    manager.rules = {}
+    manager.dependencies = {}
+    manager.load_rules()
+    manager.reset()
+    manager.use_compiled_rules = use_compiled_rules
+    n_rules = len(manager.rules)
+
+    try:
+        sensors = fake_sensors({ValueName.PRESSURE: 10, 'breath_count': 0})
+        manager.update(sensors)
+        assert manager.rules_evaluated == n_rules
+
+        # nothing changed, nothing to check
+        manager.update(sensors)
+        assert manager.rules_evaluated == 0
+
+        # only the rules that read pressure
+        index = manager.input_index
+        changed = set(index.readers[ValueName.PRESSURE])
+        assert 0 < len(changed) < n_rules
+        if use_compiled_rules:
+            changed |= {rule for rule in manager.rules.values()
+                        if rule not in index.alarm_inputs and rule not in index.always}
+        sensors.PRESSURE = 11
+        manager.update(sensors)
+        assert manager.rules_evaluated == len(changed)
+        assert manager.rules_evaluated < n_rules
+
+        # changing a limit checks everything again
+        manager.update_dependencies(ControlSetting(name=ValueName.PIP, value=20))
+        manager.update(sensors)
+        assert manager.rules_evaluated == n_rules
+
+        assert manager.n_updates == 4
+        assert manager.total_rules_evaluated == 2 * n_rules + len(changed)
+
+        manager.reset()
+        assert manager.n_updates == 0
+        manager.update(sensors)
+        assert manager.rules_evaluated == n_rules
+    finally:
+        del manager.use_compiled_rules
+        manager.rules = {}
+        manager.dependencies = {}
+        manager.load_rules()
+        manager.reset()
+
+
+def test_alarm_manager_instances(fake_sensors):
+    """
+    Independent alarm managers have their own rules and alarms, and conditions that read alarms read their own
+    manager's, so interleaving updates of several managers emits the same alarms as updating each one alone
+    """
+    assert Alarm_Manager() is Alarm_Manager()
+    managers = [Alarm_Manager(shared=False) for _ in range(3)]
+    assert all(manager is not Alarm_Manager() for manager in managers)
+    assert managers[0] is not managers[1]
+
+    # each manager alone
+    expected = []
+    sequences = []
+    for seed, manager in enumerate(managers):
+        emitted, sensors = _run_alarm_sequence(manager, fake_sensors, seed, n_updates=1000, interventions=False)
+        expected.append(emitted)
+        sequences.append(sensors)
+
+    # interleaved
+    emitted = [[] for _ in managers]
+    for i, manager in enumerate(managers):
+        _load_equivalence_rules(manager)
+        manager.add_callback(lambda alarm, i=i: emitted[i].append((step, alarm.alarm_type, alarm.severity)))
+    for step in range(1000):
+        _SAMPLE_CLOCK.now = step * 0.005
+        for manager, sensors in zip(managers, sequences):
+            manager.update(sensors[step])
+    assert emitted == expected
+    assert len(set(map(tuple, emitted))) == len(managers)
+
+    # rules are copied and bound to their own manager
+    rule_ids = set()
+    for manager in managers:
+        rule_ids.update(id(rule) for rule in manager.rules.values())
+        for rule in manager.rules.values():
+            for _, rule_condition in rule.conditions:
+                for element in condition_chain(rule_condition):
+                    assert element.manager is manager
+    assert len(rule_ids) == sum(len(manager.rules) for manager in managers)
+
+    # state isn't shared with the shared manager
+    shared = Alarm_Manager()
+    shared.reset()
+    assert len(shared.active_alarms) == 0
+    assert all(len(manager.active_alarms) > 0 for manager in managers)
+    assert shared.callbacks is not managers[0].callbacks
+
+
+def _history_alarms(n_alarms, t_start=0., interval=60.):
+    """
+    Alarms cycling through the alarm types and severities, one every ``interval`` seconds
+    """
+    alarm_types = list(AlarmType)
+    alarms = []
+    for i in range(n_alarms):
+        alarms.append(Alarm(alarm_types[i % len(alarm_types)], AlarmSeverity(i % 4),
+                            start_time=t_start + i * interval, latch=bool(i % 2),
+                            cause=[ValueName.PRESSURE, ValueName.PIP], value=i, message=f'alarm {i}'))
+    return alarms
+
+
+def _alarm_fields(alarms):
+    return [(alarm.id, alarm.alarm_type, alarm.severity, alarm.start_time, alarm.latch, alarm.cause,
+             alarm.value, alarm.message, alarm.active) for alarm in alarms]
+
+
+def test_alarm_history(tmp_path):
+    """
+    Alarms are stored with their fields, queried by time, severity and type, and counted per hour,
+    with the same results from memory as from the database
+    """
+    alarms = _history_alarms(300)
+    history = Alarm_History(str(tmp_path / 'alarms.db'), recent_length=100)
+    for alarm in alarms:
+        history.add(alarm)
+    assert len(history) == 300
+    assert list(history.recent) == alarms[-100:]
+
+    # all stored
+    assert _alarm_fields(history.alarms_between()) == _alarm_fields(alarms)
+
+    # filtered, before and within the recent window
+    for t0, t1 in ((0, 60*300), (60*10, 60*150), (60*250, 60*280), (60*250, None)):
+        for min_severity in (None, AlarmSeverity.LOW, AlarmSeverity.HIGH):
+            for alarm_type in (None, AlarmType.HIGH_PRESSURE):
+                expected = [alarm for alarm in alarms
+                            if alarm.start_time >= t0 and (t1 is None or alarm.start_time < t1)
+                            and (min_severity is None or alarm.severity >= min_severity)
+                            and (alarm_type is None or alarm.alarm_type is alarm_type)]
+                got = history.alarms_between(t0, t1, min_severity=min_severity, alarm_type=alarm_type)
+                assert _alarm_fields(got) == _alarm_fields(expected)
+    # queries within the recent window return the alarms that were added
+    assert history.alarms_between(60*250)[0] is alarms[250]
+
+    # 60 alarms an hour, 3 in 4 of them raised
+    counts = history.counts_per_hour()
+    assert set(counts.keys()) == set(alarm.alarm_type for alarm in alarms)
+    assert sum(sum(hours.values()) for hours in counts.values()) == 225
+    for alarm_type, hours in counts.items():
+        for hour, count in hours.items():
+            assert count == len([alarm for alarm in alarms
+                                 if alarm.alarm_type is alarm_type and alarm.severity > AlarmSeverity.OFF
+                                 and hour <= alarm.start_time < hour + 3600])
+    assert sum(sum(hours.values()) for hours in history.counts_per_hour(min_severity=None).values()) == 300
+    assert sum(sum(hours.values()) for hours in history.counts_per_hour(3600, 7200).values()) == 45
+
+    # persists, and is readable from other processes
+    history.close()
+    history = Alarm_History(str(tmp_path / 'alarms.db'), recent_length=100)
+    assert _alarm_fields(history.recent) == _alarm_fields(alarms[-100:])
+    assert _alarm_fields(history.alarms_between(60*10, 60*150)) == _alarm_fields(alarms[10:150])
+    reader = Alarm_History(str(tmp_path / 'alarms.db'), readonly=True)
+    history.add(Alarm(AlarmType.LOW_VTE, AlarmSeverity.HIGH, start_time=60.*300))
+    history.flush()
+    assert len(reader.alarms_between(60*299)) == 2
+    with pytest.raises(PermissionError):
+        reader.add(alarms[0])
+    reader.close()
+    history.close()
+
+
+def test_alarm_history_queued(tmp_path):
+    """
+    Adding an alarm doesn't wait for the database, the writer thread writes it in the background
+    """
+    alarms = _history_alarms(10)
+    history = Alarm_History(str(tmp_path / 'alarms.db'), recent_length=5)
+    # a slow write holds the database
+    with history._db_lock:
+        for alarm in alarms:
+            history.add(alarm)
+        assert list(history.recent) == alarms[-5:]
+
+    # written without being asked
+    deadline = time.time() + 1
+    while history._pending and time.time() < deadline:
+        time.sleep(0.01)
+    assert not history._pending
+    assert _alarm_fields(history.alarms_between()) == _alarm_fields(alarms)
+
+    # closing writes what is still queued
+    history.add(Alarm(AlarmType.LOW_VTE, AlarmSeverity.HIGH, start_time=60.*10))
+    history.close()
+    assert not history._writer
+    history = Alarm_History(str(tmp_path / 'alarms.db'))
+    assert len(history) == 11
+    history.close()
+
+
+def test_alarm_history_manager(fake_sensors):
+    """
+    An alarm manager adds every alarm it emits, raised and cleared, to its history
+    """
+    manager = Alarm_Manager(shared=False)
+    manager.history = Alarm_History(':memory:')
+    emitted = []
+    manager.add_callback(emitted.append)
+
+    for i in range(5):
+        manager.update(fake_sensors({ValueName.PRESSURE: 100, 'breath_count': 2 * i + 1}))
+        manager.update(fake_sensors({ValueName.PRESSURE: 0, 'breath_count': 2 * i + 2}))
+        # the high pressure alarm is latched
+        manager.dismiss_alarm(AlarmType.HIGH_PRESSURE)
+
+    assert len(emitted) >= 4
+    assert list(manager.history.recent) == emitted
+    assert _alarm_fields(manager.history.alarms_between(min_severity=AlarmSeverity.OFF)) == _alarm_fields(emitted)
+    assert any(alarm.severity == AlarmSeverity.OFF for alarm in manager.history.alarms_between())
+    assert all(alarm.severity > AlarmSeverity.OFF
+               for alarm in manager.history.alarms_between(min_severity=AlarmSeverity.LOW))
+
+
+def _crossing_manager():
+    """
+    An alarm manager with one unlatched rule, raised whenever pressure is above 50, whose callback stamps the
+    stages after emission like the GUI does
+    """
+    manager = Alarm_Manager(shared=False)
+    manager.rules = {}
+    manager.load_rule(Alarm_Rule(
+        name=AlarmType.HIGH_PRESSURE,
+        latch=False,
+        conditions=((AlarmSeverity.HIGH, condition.ValueCondition(
+            value_name=ValueName.PRESSURE, limit=50, mode='max')),)
+    ))
+
+    def handle_alarm(alarm):
+        manager.latency.stamp(alarm, 'handled')
+        if alarm.severity > AlarmSeverity.OFF:
+            manager.latency.stamp(alarm, 'displayed')
+
+    manager.add_callback(handle_alarm)
+    return manager
+
+
+def test_alarm_latency(fake_sensors):
+    """
+    Alarms are stamped as they pass through the pipeline, and the latency of each stage is counted per alarm type
+    """
+    latency = Alarm_Latency()
+    for i, value in enumerate((1e-3, 2e-3, 3e-3, 50e-3)):
+        alarm = Alarm(AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH)
+        alarm.timestamps['sample'] = 100.
+        latency.stamp(alarm, 'emitted', 100. + value / 2)
+        latency.stamp(alarm, 'displayed', 100. + value)
+        assert alarm.timestamps['displayed'] == 100. + value
+    # alarms without a sample time aren't counted
+    latency.stamp(Alarm(AlarmType.LOW_PRESSURE, AlarmSeverity.OFF), 'displayed')
+
+    summary = latency.summary()
+    assert list(summary.keys()) == [AlarmType.HIGH_PRESSURE]
+    assert list(summary[AlarmType.HIGH_PRESSURE].keys()) == ['emitted', 'displayed']
+    displayed = summary[AlarmType.HIGH_PRESSURE]['displayed']
+    assert displayed['n'] == 4
+    assert displayed['mean'] == pytest.approx(14e-3)
+    assert displayed['max'] == pytest.approx(50e-3)
+    # percentiles are within a bin
+    assert 2e-3 <= displayed['p50'] <= 2e-3 * 1.13
+    assert displayed['p99'] == pytest.approx(50e-3)
+    assert latency.percentile(50, 'emitted') == pytest.approx(summary[AlarmType.HIGH_PRESSURE]['emitted']['p50'])
+    assert latency.percentile(50, 'handled') is None
+    latency.reset()
+    assert latency.summary() == {}
+
+    # the alarm manager stamps the alarms it emits from sensor values
+    manager = _crossing_manager()
+    emitted = []
+    manager.add_callback(emitted.append)
+    start = time.time()
+    manager.update(fake_sensors({ValueName.PRESSURE: 100, 'timestamp': start - 0.01}))
+    manager.update(fake_sensors({ValueName.PRESSURE: 0, 'timestamp': start - 0.01}))
+    assert [alarm.severity for alarm in emitted] == [AlarmSeverity.HIGH, AlarmSeverity.OFF]
+    raised = emitted[0]
+    assert list(raised.timestamps.keys()) == ['sample', 'checked', 'emitted', 'handled', 'displayed']
+    times = list(raised.timestamps.values())
+    assert times == sorted(times)
+    assert raised.timestamps['emitted'] == raised.start_time
+    summary = manager.latency.summary()[AlarmType.HIGH_PRESSURE]
+    assert summary['displayed']['n'] == 1
+    assert summary['handled']['n'] == 2
+    assert 0.01 <= summary['displayed']['max'] < 1
+
+    # alarms that aren't emitted from sensor values aren't stamped
+    manager.update(fake_sensors({ValueName.PRESSURE: 100}))
+    manager.dismiss_alarm(AlarmType.HIGH_PRESSURE)
+    manager.emit_alarm(AlarmType.HIGH_PRESSURE, AlarmSeverity.OFF)
+    assert 'sample' not in emitted[-1].timestamps
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('use_compiled_rules', [False, True])
+def test_evaluate_stream_equivalence(fake_sensors, seed, use_compiled_rules):
+    """
+    :meth:`.Alarm_Manager.evaluate_stream` finds the same alarm transitions as updating the manager sample by sample
+    """
+    manager = Alarm_Manager()
+
+    try:
+        manager.use_compiled_rules = use_compiled_rules
+        expected, sensors = _run_alarm_sequence(manager, fake_sensors, seed, interventions=False)
+        active_alarms = dict(manager.active_alarms)
+
+        frame = SensorFrame.from_sensor_values(sensors)
+        transitions = manager.evaluate_stream(frame)
+
+        # evaluating a stream doesn't change the manager
+        assert manager.active_alarms == active_alarms
+    finally:
+        del manager.use_compiled_rules
+        manager.rules = {}
+        manager.dependencies = {}
+        manager.load_rules()
+        manager.reset()
+
+    assert transitions.dtype == TRANSITION_DTYPE
+    assert {alarm_type for _, alarm_type, _ in expected} >= {AlarmType.OBSTRUCTION, AlarmType.LEAK,
+                                                             AlarmType.SENSORS_STUCK, AlarmType.LOW_PRESSURE,
+                                                             AlarmType.BAD_SENSOR_READINGS}
+    assert [(int(index), AlarmType(alarm_type), AlarmSeverity(severity))
+            for index, alarm_type, severity in transitions[['index', 'alarm_type', 'severity']]] == expected
+    assert np.array_equal(transitions['timestamp'], frame.timestamp[transitions['index']])
+
+
+def test_count_cycles():
+    """
+    Vectorized cycle counting is the same as checking a :class:`.CycleValueCondition` repeatedly
+    """
+    rng = np.random.default_rng(0)
+    n_checks = 1000
+    exceeded = rng.random(n_checks) < 0.7
+    breath_count = np.cumsum(rng.integers(0, 2, n_checks))
+
+    for n_cycles in (1, 2, 5):
+        cycle_condition = condition.CycleValueCondition(
+            value_name=ValueName.PRESSURE, limit=0, mode='max', n_cycles=n_cycles)
+        expected = [cycle_condition.check(SensorValues(vals={
+            **{k: 0 for k in ValueName}, **{k: 0 for k in SensorValues.additional_values},
+            ValueName.PRESSURE: 1 if exceed else -1, 'breath_count': int(breath)}))
+            for exceed, breath in zip(exceeded, breath_count)]
+
+        assert count_cycles(exceeded, breath_count, n_cycles).tolist() == expected
+
+
+def test_evaluate_stream_benchmark(fake_sensors):
+    """
+    Throughput of :meth:`.Alarm_Manager.evaluate_stream` with the default rules, printed with ``pytest -s``
+    """
+    manager = Alarm_Manager()
+    for value_name in manager.dependencies.keys():
+        manager.update_dependencies(ControlSetting(name=value_name, value=20))
+
+    n_samples = 500000
+    rng = np.random.default_rng(0)
+    array = np.zeros(n_samples, dtype=FRAME_DTYPE)
+    array['timestamp'] = np.arange(n_samples) * 0.005
+    array['breath_count'] = np.arange(n_samples) // 600
+    for name, (low, high) in {'PIP': (10, 30), 'PEEP': (0, 20), 'VTE': (0, 130),
+                              'FIO2': (15, 105), 'PRESSURE': (0, 60)}.items():
+        # slowly varying, so alarms come and go rather than flickering every sample
+        array[name] = low + (high - low) * (np.sin(np.arange(n_samples) / rng.uniform(500, 5000)) + 1) / 2
+    frame = SensorFrame(array)
+
+    start = time.perf_counter()
+    transitions = manager.evaluate_stream(frame)
+    duration = time.perf_counter() - start
+    print(f'evaluate_stream: {n_samples / duration * 60 / 1e6:.1f} million samples/minute, '
+          f'{len(transitions)} transitions')
+
+    manager.rules = {}
+    manager.dependencies = {}
+    manager.load_rules()
+    manager.reset()
+
+
+def test_alarm_manager_benchmark(fake_sensors):
+    """
+    Alarm manager update throughput with the default rules, printed with ``pytest -s``
+    """
+    manager = Alarm_Manager()
+    manager.reset()
+    manager.callbacks = []
+
+    # cycle through in-range and out-of-range pressures so some alarms are raised and cleared
+    sensors = []
+    for i in range(100):
+        sensor = fake_sensors({ValueName.PRESSURE: (i % 10) * 10, 'breath_count': i // 10})
+        sensors.append(sensor)
+
+    n_updates = 5000
+    try:
+        for incremental in (False, True):
+            for use_compiled_rules in (False, True):
+                manager.use_compiled_rules = use_compiled_rules
+                manager.incremental = incremental
+                manager.reset()
+                manager.callbacks = []
+                start = time.perf_counter()
+                for i in range(n_updates):
+                    manager.update(sensors[i % len(sensors)])
+                update_time = (time.perf_counter() - start) / n_updates
+                print(f'{"compiled" if use_compiled_rules else "object"} rules'
+                      f'{", incremental" if incremental else ""}: '
+                      f'{1/update_time:.0f} updates/s, {update_time*1e6:.1f} us/update with {len(manager.rules)} rules, '
+                      f'{manager.total_rules_evaluated / manager.n_updates:.1f} rules checked/update')
+    finally:
+        del manager.use_compiled_rules
+        del manager.incremental
+
+    manager.reset()
+
+
+def test_alarm_manager_instances_benchmark(fake_sensors):
+    """
+    Memory of an independent alarm manager, and update throughput across 100 of them, printed with ``pytest -s``
+    """
+    n_managers = 100
+    sensors = []
+    for i in range(100):
+        sensor = fake_sensors({ValueName.PRESSURE: (i % 10) * 10, 'breath_count': i // 10})
+        sensors.append(sensor)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    managers = [Alarm_Manager(shared=False) for _ in range(n_managers)]
+    create_time = (time.perf_counter() - start) / n_managers
+    # the compiled rules and input index are made on the first update
+    for manager in managers:
+        manager.update(sensors[0])
+    memory = (tracemalloc.get_traced_memory()[0] - before) / n_managers
+    tracemalloc.stop()
+
+    n_rounds = 100
+    start = time.perf_counter()
+    for i in range(n_rounds):
+        # each manager at a different point in the sequence
+        for j, manager in enumerate(managers):
+            manager.update(sensors[(i + j) % len(sensors)])
+    update_time = (time.perf_counter() - start) / (n_rounds * n_managers)
+
+    print(f'{n_managers} alarm managers: {memory/1024:.1f} KiB and {create_time*1000:.2f} ms to make each, '
+          f'{1/update_time:.0f} updates/s ({update_time*1e6:.1f} us/update)')
+    assert sum(manager.n_updates for manager in managers) == n_managers * (n_rounds + 1)
+
+
+def test_alarm_history_benchmark(tmp_path):
+    """
+    Time to add alarms to a history file, and to query a day of alarms from memory and from the database,
+    printed with ``pytest -s``
+    """
+    n_alarms = 100000
+    alarms = _history_alarms(n_alarms, interval=1.)
+    history = Alarm_History(str(tmp_path / 'alarms.db'), recent_length=10000)
+
+    n_adds = 1000
+    start = time.perf_counter()
+    for alarm in alarms[:n_adds]:
+        history.add(alarm)
+    add_time = (time.perf_counter() - start) / n_adds
+    history.flush()
+
+    # fill the rest directly
+    history._connection.executemany(
+        'INSERT INTO alarms (alarm_id, timestamp, alarm_type, severity, latch) VALUES (?, ?, ?, ?, ?)',
+        [(alarm.id, alarm.start_time, alarm.alarm_type.name, int(alarm.severity), int(alarm.latch))
+         for alarm in alarms[n_adds:]])
+    history._connection.commit()
+    history.recent.extend(alarms[-10000:])
+    history._recent_complete = False
+
+    def query(t0, t1):
+        n_queries = 20
+        start = time.perf_counter()
+        for _ in range(n_queries):
+            result = history.alarms_between(t0, t1, min_severity=AlarmSeverity.HIGH)
+        return (time.perf_counter() - start) / n_queries, len(result)
+
+    recent_time, n_recent = query(n_alarms - 3600, n_alarms)
+    db_time, n_db = query(n_alarms / 2, n_alarms / 2 + 3600)
+    assert n_recent == n_db == 900
+
+    start = time.perf_counter()
+    counts = history.counts_per_hour()
+    count_time = time.perf_counter() - start
+    assert sum(sum(hours.values()) for hours in counts.values()) == n_alarms * 3 // 4
+
+    print(f'alarm history: {add_time*1e6:.0f} us/add, an hour of {n_alarms} alarms from memory '
+          f'{recent_time*1000:.2f} ms, from the database {db_time*1000:.2f} ms, '
+          f'counts per hour {count_time*1000:.1f} ms')
+    history.close()
+
+
+def test_alarm_latency_benchmark(fake_sensors):
+    """
+    Inject threshold crossings into an alarm manager and print the p50/p99 latency of each stage of the pipeline,
+    from the sample to the alarm being handled, with ``pytest -s``
+    """
+    manager = _crossing_manager()
+    low = fake_sensors({ValueName.PRESSURE: 0})
+
+    n_crossings = 1000
+    for i in range(n_crossings):
+        # every other update crosses the threshold, sampled just before it is checked
+        high = fake_sensors({ValueName.PRESSURE: 100, 'timestamp': time.time()})
+        manager.update(high)
+        low.timestamp = time.time()
+        manager.update(low)
+
+    summary = manager.latency.summary()[AlarmType.HIGH_PRESSURE]
+    assert summary['displayed']['n'] == n_crossings
+    assert summary['handled']['n'] == 2 * n_crossings
+    print(f'alarm latency over {n_crossings} crossings: ' + ', '.join(
+        f"{stage} p50 {summary[stage]['p50']*1e6:.1f} us p99 {summary[stage]['p99']*1e6:.1f} us"
+        for stage in STAGES if stage in summary))
+
+
+def test_condition_benchmark(fake_sensors):
+    """
+    Time to load the default rules, and to build and check a compound condition, printed with ``pytest -s``
+    """
+    manager = Alarm_Manager()
+
+    n_loads = 100
+    start = time.perf_counter()
+    for _ in range(n_loads):
+        copy.deepcopy(ALARM_RULES)
+    copy_time = (time.perf_counter() - start) / n_loads
+
+    start = time.perf_counter()
+    for _ in range(n_loads):
+        manager.rules = {}
+        manager.dependencies = {}
+        manager.load_rules()
+    load_time = (time.perf_counter() - start) / n_loads
+
+    def build():
+        compound = condition.ValueCondition(ValueName.PIP, -1, 'max')
+        for _ in range(4):
+            compound = compound + condition.ValueCondition(ValueName.PEEP, -1, 'max')
+        return compound
+
+    n_builds = 1000
+    start = time.perf_counter()
+    for _ in range(n_builds):
+        compound = build()
+    build_time = (time.perf_counter() - start) / n_builds
+
+    sensors = fake_sensors()
+    n_checks = 20000
+    start = time.perf_counter()
+    for _ in range(n_checks):
+        compound.check(sensors)
+    check_time = (time.perf_counter() - start) / n_checks
+
+    print(f'copy ALARM_RULES: {copy_time*1e6:.0f} us, load_rules: {load_time*1e6:.0f} us, '
+          f'build 5 condition AllOf: {build_time*1e6:.1f} us, check: {check_time*1e6:.2f} us')
+
+    manager.reset()
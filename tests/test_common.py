@@ -1,8 +1,18 @@
+import pickle
+import random
+import threading
+import time
+from copy import copy
+
 import numpy as np
 import pytest
 
-from pvp.common import values
-from pvp.common.message import ControlSetting, SensorValues
+from pvp.alarm import Alarm, AlarmType, AlarmSeverity
+from pvp.common import values, codec
+from pvp.common.checkpoint import Checkpoint, CHECKPOINT_CONTROLS, CHECKPOINT_DERIVED
+from pvp.common.frame import SensorFrame, MISSING_INT
+from pvp.common.message import ControlSetting, SensorValues, ControlValues, DerivedValues
+from pvp.common.shared import SensorSnapshot, WaveformBuffer, WaveformReader, ControllerMirror, MIRROR_CONTROLS
 from pvp.common.values import ValueName
 
 
@@ -64,3 +74,436 @@ def test_sensor_values():
         sv = SensorValues(vals=vals)
     sv = SensorValues(timestamp=None, loop_counter=0, breath_count=0, vals=vals)
     assert sv.timestamp > 0
+
+
+def test_sensor_values_from_tuple():
+    vals = (time.time(), 12, 3) + tuple(float(i) for i in range(len(values.SENSOR)))
+    sv = SensorValues.from_tuple(vals)
+    assert sv.to_tuple() == vals
+    assert sv.loop_counter == 12
+    assert sv[ValueName.PIP] == vals[SensorValues.tuple_fields.index('PIP')]
+
+    validated = SensorValues(vals=dict(zip(SensorValues.tuple_fields, vals)))
+    assert validated.to_dict() == sv.to_dict()
+
+    # slots, so no stray attributes
+    with pytest.raises(AttributeError):
+        sv.not_a_value = 1
+
+    sv.IE_RATIO = 2.0
+    unpickled = pickle.loads(pickle.dumps(sv))
+    assert unpickled.to_tuple() == vals
+    assert unpickled.IE_RATIO == 2.0
+    assert copy(sv).to_tuple() == vals
+
+
+def test_sensor_values_benchmark():
+    """
+    cost of constructing, copying and pickling SensorValues, printed with ``pytest -s``
+    """
+    n = 10000
+    vals = (time.time(), 12, 3) + tuple(float(i) for i in range(len(values.SENSOR)))
+    vals_dict = dict(zip(SensorValues.tuple_fields, vals))
+    sv = SensorValues.from_tuple(vals)
+
+    timings = {}
+    for name, fn in (('validating constructor', lambda: SensorValues(vals=vals_dict)),
+                     ('from_tuple', lambda: SensorValues.from_tuple(vals)),
+                     ('copy', lambda: copy(sv)),
+                     ('pickle round trip', lambda: pickle.loads(pickle.dumps(sv)))):
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        timings[name] = (time.perf_counter() - start) / n
+        print(f'{name}: {timings[name]*1e6:.2f} us')
+    print(f'pickled size: {len(pickle.dumps(sv))} bytes')
+
+    assert timings['from_tuple'] < timings['validating constructor']
+
+
+def _snapshot_sensors(i):
+    vals = {value_name: float(i) for value_name in values.SENSOR.keys()}
+    return SensorValues(timestamp=float(i), loop_counter=i, breath_count=i, vals=vals)
+
+
+def test_sensor_snapshot():
+    snapshot = SensorSnapshot()
+    assert snapshot.read() is None
+
+    sv = _snapshot_sensors(5)
+    sv.PIP = None
+    snapshot.write(sv)
+    assert snapshot.seq == 2
+
+    read_sv = snapshot.read()
+    assert read_sv.to_dict() == sv.to_dict()
+    assert read_sv.PIP is None
+    # only reads that touch the snapshot count as contact
+    assert snapshot.last_contact == 0
+    snapshot.read(touch=True)
+    assert snapshot.last_contact > 0
+
+    # a new snapshot around the same buffer sees the same values, as would another process
+    assert SensorSnapshot(snapshot.buffer).read().to_dict() == sv.to_dict()
+
+    # a write in progress prevents a read
+    snapshot._seq[0] += 1
+    assert snapshot.read() is None
+    # and a writer that finds the counter odd (eg. a previous writer died mid-write) recovers
+    snapshot.write(_snapshot_sensors(6))
+    assert snapshot.seq % 2 == 0
+    assert snapshot.read().loop_counter == 6
+
+
+def test_sensor_snapshot_torn_reads():
+    """
+    Hammer the snapshot with writes from another thread and make sure every read is internally consistent
+    """
+    snapshot = SensorSnapshot()
+    snapshot.write(_snapshot_sensors(0))
+    stop = threading.Event()
+
+    def writer():
+        i = 1
+        while not stop.is_set():
+            snapshot.write(_snapshot_sensors(i))
+            i += 1
+
+    write_thread = threading.Thread(target=writer, daemon=True)
+    write_thread.start()
+
+    n_reads = 0
+    read_start = time.perf_counter()
+    try:
+        for _ in range(5000):
+            sv = snapshot.read()
+            if sv is None:
+                continue
+            n_reads += 1
+            assert all([v == sv.loop_counter for v in sv.to_dict().values()])
+    finally:
+        stop.set()
+        write_thread.join()
+
+    read_time = (time.perf_counter() - read_start) / 5000
+    print(f'{n_reads} consistent reads, {read_time*1e6:.1f} us/read')
+    assert n_reads > 0
+
+
+def test_waveform_buffer():
+    buffer = WaveformBuffer(size=10)
+    reader = WaveformReader(buffer)
+    assert len(reader.read()) == 0
+
+    for i in range(7):
+        buffer.append(i, i, i, i, i, i)
+    samples = reader.read()
+    assert list(samples['timestamp']) == list(range(7))
+    assert reader.cursor == buffer.head == 7
+
+    # wrap around the end of the buffer
+    for i in range(7, 15):
+        buffer.append(i, i, i, i, i, i)
+    samples = reader.read()
+    assert list(samples['breath_count']) == list(range(7, 15))
+    assert reader.lost == 0
+
+    # a reader in another process sees the same samples
+    late_reader = WaveformReader(WaveformBuffer(buffer.size, buffer.buffer), from_start=True)
+    assert list(late_reader.read()['pressure']) == list(range(6, 15))
+
+    # lapping the reader loses the oldest samples, but the newest are still read
+    for i in range(15, 40):
+        buffer.append(i, i, i, i, i, i)
+    samples = reader.read()
+    assert reader.lost == 16
+    assert reader.overruns == 1
+    assert list(samples['timestamp']) == list(range(31, 40))
+
+
+def test_controller_mirror():
+    mirror = ControllerMirror()
+    assert mirror.read() is None
+    assert mirror.owner == 0
+
+    controls = {value_name: float(i) for i, value_name in enumerate(MIRROR_CONTROLS)}
+    mirror.write(controls, cycle_start=12.5, breath_count=3, breath_detection=True, limit_hapa=40)
+    mirror.claim(1234)
+
+    # a standby in another process sees the same state
+    state = ControllerMirror(mirror.buffer).read()
+    assert state['controls'] == controls
+    assert state['cycle_start'] == 12.5
+    assert state['breath_count'] == 3
+    assert state['breath_detection'] is True
+    assert state['limit_hapa'] == 40
+    assert ControllerMirror(mirror.buffer).owner == 1234
+
+    mirror.reset()
+    assert mirror.read() is None
+    assert mirror.owner == 0
+
+
+def _checkpoint_state(breath_count):
+    return {
+        'controls': {value_name: float(i) for i, value_name in enumerate(CHECKPOINT_CONTROLS)},
+        'breath_detection': False,
+        'limit_hapa': 40,
+        'breath_count': breath_count,
+        'cycle_start': 12.5,
+        'derived': {name: None for name in CHECKPOINT_DERIVED},
+        'flow': np.arange(10.),
+        'last_waveform': None,
+        'cycle_waveform': np.ones((5, 3))
+    }
+
+
+def test_checkpoint_torn_write(tmp_path):
+    """
+    A write interrupted mid-way leaves the previous checkpoint, and the next write doesn't overwrite it either
+    """
+    checkpoint = Checkpoint(str(tmp_path / 'controller.ckpt'))
+    assert checkpoint.read() is None
+    checkpoint.write(_checkpoint_state(1))
+    checkpoint.write(_checkpoint_state(2))
+    assert checkpoint.read()['breath_count'] == 2
+
+    # the controller dies writing breath 3 to the other slot
+    slots = checkpoint._slots
+    torn = int(np.argmin(slots['seq']))
+    slots['seq'][torn] = slots['seq'].max() + 1
+    slots['breath_count'][torn] = 3
+    assert checkpoint.read()['breath_count'] == 2
+
+    # the next write replaces the torn slot, so there are still two complete checkpoints
+    checkpoint.write(_checkpoint_state(4))
+    assert checkpoint.read()['breath_count'] == 4
+    assert np.all(slots['seq'] % 2 == 0)
+    assert sorted(slots['breath_count']) == [2, 4]
+    checkpoint.close()
+
+    checkpoint = Checkpoint(str(tmp_path / 'controller.ckpt'))
+    state = checkpoint.read()
+    assert state['breath_count'] == 4
+    assert list(state['flow']) == list(range(10))
+    assert state['cycle_waveform'].shape == (5, 3)
+    checkpoint.close()
+
+
+def _maybe_none(value, p=0.2):
+    return None if random.random() < p else value
+
+
+def _random_messages():
+    """
+    one random message of each kind that can be encoded, with some values None
+    """
+    sensor_values = SensorValues(timestamp=time.time(), loop_counter=random.randint(0, 2**40),
+                                 breath_count=random.randint(0, 2**20),
+                                 vals={value_name: _maybe_none(np.random.randn() * 100)
+                                       for value_name in values.SENSOR.keys()})
+    value, min_value, max_value = [_maybe_none(np.random.randn()) for _ in range(3)]
+    if value is None and min_value is None and max_value is None:
+        value = np.random.randn()
+    control_setting = ControlSetting(name=random.choice(list(values.CONTROL.keys())),
+                                     value=value, min_value=min_value, max_value=max_value,
+                                     range_severity=_maybe_none(random.choice(list(AlarmSeverity)), 0.5))
+    control_values = ControlValues(_maybe_none(np.random.rand()), _maybe_none(np.random.rand()))
+    derived_values = DerivedValues(time.time(), random.randint(0, 2**20),
+                                   *[_maybe_none(np.random.randn()) for _ in codec.DERIVED_VALUES])
+    alarm = Alarm(random.choice(list(AlarmType)), random.choice(list(AlarmSeverity)),
+                  latch=random.random() < 0.5,
+                  cause=_maybe_none(sorted(random.sample(list(ValueName), random.randint(0, 3)), key=lambda v: v.value)),
+                  value=_maybe_none(np.random.randn()),
+                  message=_maybe_none(random.choice(['', 'Controller has not heard from coordinator in 5', '\u00b5s'])))
+    if random.random() < 0.5:
+        alarm.deactivate()
+    if random.random() < 0.5:
+        alarm.timestamps = {'sample': alarm.start_time - 1e-3, 'checked': alarm.start_time - 5e-4,
+                            'emitted': alarm.start_time}
+    return sensor_values, control_setting, control_values, derived_values, alarm
+
+
+def _message_attrs(message):
+    if isinstance(message, SensorValues):
+        return message.to_dict()
+    return vars(message)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_codec_round_trip(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    for message in _random_messages():
+        decoded = codec.decode(codec.encode(message))
+        assert type(decoded) is type(message)
+        assert _message_attrs(decoded) == _message_attrs(message)
+
+    assert codec.decode(codec.encode(None)) is None
+    with pytest.raises(TypeError):
+        codec.encode(object())
+
+
+def test_codec_version():
+    encoded = bytearray(codec.encode(_random_messages()[0]))
+    encoded[0] = codec.CODEC_VERSION + 1
+    with pytest.raises(ValueError):
+        codec.decode(encoded)
+
+
+def test_codec_to_array():
+    messages = [_random_messages() for _ in range(10)]
+    sensor_values = [message[0] for message in messages]
+    array = codec.to_array([codec.encode(sv) for sv in sensor_values], codec.MessageKind.SENSOR_VALUES)
+    pressure = codec.SENSOR_VALUES.index(ValueName.PRESSURE)
+    for sv, row in zip(sensor_values, array):
+        assert row['timestamp'] == sv.timestamp
+        assert row['breath_count'] == sv.breath_count
+        if sv.PRESSURE is None:
+            assert row['none_mask'] & (1 << pressure)
+        else:
+            assert row['values'][pressure] == sv.PRESSURE
+
+    alarms = [message[4] for message in messages]
+    array = codec.to_array([codec.encode(alarm) for alarm in alarms], codec.MessageKind.ALARM)
+    assert list(array['id']) == [alarm.id for alarm in alarms]
+
+    with pytest.raises(ValueError):
+        codec.to_array([codec.encode(message[1]) for message in messages], codec.MessageKind.SENSOR_VALUES)
+
+
+def test_codec_throughput():
+    """
+    encode and decode throughput compared to pickle, printed with ``pytest -s``
+    """
+    n_messages = 5000
+    for message in _random_messages():
+        timings = {}
+        for name, dumps, loads in (('pickle', pickle.dumps, pickle.loads),
+                                   ('codec', codec.encode, codec.decode)):
+            start = time.perf_counter()
+            for _ in range(n_messages):
+                encoded = dumps(message)
+            encode_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(n_messages):
+                loads(encoded)
+            decode_time = time.perf_counter() - start
+            timings[name] = (len(encoded), n_messages / encode_time, n_messages / decode_time)
+
+        print(type(message).__name__, ', '.join(
+            f'{name}: {size} bytes, {encode_rate:.0f} encodes/s, {decode_rate:.0f} decodes/s'
+            for name, (size, encode_rate, decode_rate) in timings.items()))
+        assert timings['codec'][0] < timings['pickle'][0]
+
+
+def _frame_sensors(n_samples, samples_per_breath=10):
+    return [SensorValues.from_tuple((float(i) * 0.01, i, i // samples_per_breath) +
+                                    tuple(float(i % samples_per_breath + j) for j in range(len(values.SENSOR))))
+            for i in range(n_samples)]
+
+
+def test_sensor_frame():
+    sensor_values = _frame_sensors(100)
+    sensor_values[5].PIP = None
+    frame = SensorFrame.from_sensor_values(sensor_values)
+    assert len(frame) == 100
+
+    # round trip, with None values
+    assert [sv.to_dict() for sv in frame.to_sensor_values()] == [sv.to_dict() for sv in sensor_values]
+    assert frame[5].PIP is None
+    assert frame[7].to_dict() == sensor_values[7].to_dict()
+
+    # columns are views
+    pressure = frame[ValueName.PRESSURE]
+    assert np.shares_memory(pressure, frame.array)
+    assert np.array_equal(pressure, frame['PRESSURE'])
+    assert np.array_equal(pressure, [sv.PRESSURE for sv in sensor_values])
+
+    # slicing by time and breath
+    window = frame.between(0.1, 0.25)
+    assert np.shares_memory(window.array, frame.array)
+    assert list(window['loop_counter']) == list(range(10, 25))
+    breaths = frame.breaths(3, 5)
+    assert set(breaths.breath_count) == {3, 4}
+    assert len(breaths) == 20
+    assert len(frame.breaths(start=9)) == 10
+    assert len(frame[frame[ValueName.PRESSURE] > 7]) == np.sum(pressure > 7)
+
+    # vectorized per-breath reductions
+    breath_counts, peaks = frame.per_breath(ValueName.PRESSURE, np.maximum)
+    assert list(breath_counts) == list(range(10))
+    for breath_count, peak in zip(breath_counts, peaks):
+        assert peak == max(sv.PRESSURE for sv in sensor_values if sv.breath_count == breath_count)
+
+    assert len(SensorFrame.concatenate([frame.breaths(0, 2), frame.breaths(2, 4)])) == 40
+    assert frame.values().shape == (100, len(values.SENSOR))
+    assert len(SensorFrame()) == 0
+    with pytest.raises(ValueError):
+        SensorFrame(np.zeros(3))
+
+
+def test_sensor_frame_from_waveforms():
+    buffer = WaveformBuffer(size=20)
+    reader = WaveformReader(buffer)
+    for i in range(10):
+        buffer.append(float(i), i * 2., i * 3., 0, 0, i // 5)
+    frame = SensorFrame.from_waveforms(reader.read())
+    assert list(frame[ValueName.PRESSURE]) == [i * 2. for i in range(10)]
+    assert list(frame[ValueName.FLOWOUT]) == [i * 3. for i in range(10)]
+    assert np.all(np.isnan(frame[ValueName.PIP]))
+    assert frame[0].PIP is None
+    assert np.all(frame['loop_counter'] == MISSING_INT)
+
+
+def test_sensor_frame_from_log():
+    tables = pytest.importorskip('tables')
+    from pvp.common.loggers import ContinuousData, CycleData
+
+    waveform_data = np.zeros(10, dtype=tables.dtype_from_descr(ContinuousData))
+    waveform_data['timestamp'] = np.arange(10)
+    waveform_data['pressure'] = np.arange(10) * 2.
+    waveform_data['oxygen'] = 21
+    waveform_data['cycle_number'] = np.arange(10) // 4
+
+    derived_data = np.zeros(2, dtype=tables.dtype_from_descr(CycleData))
+    derived_data['timestamp'] = [3.5, 7.5]
+    derived_data['cycle_number'] = [0, 1]
+    derived_data['pip'] = [20, 25]
+    derived_data['peep'] = [5, 6]
+
+    frame = SensorFrame.from_log({'waveform_data': waveform_data, 'derived_data': derived_data})
+    assert len(frame) == 10
+    assert list(frame[ValueName.PRESSURE]) == [i * 2. for i in range(10)]
+    assert list(frame.breath_count) == [i // 4 for i in range(10)]
+    assert np.all(frame['loop_counter'] == MISSING_INT)
+    assert frame[0].FIO2 == 21
+    # derived values are those of the last breath logged before each sample
+    assert frame[0].PIP is None
+    assert list(frame[ValueName.PIP][4:]) == [20, 20, 20, 20, 25, 25]
+    assert list(frame[ValueName.PEEP][8:]) == [6, 6]
+
+
+def test_sensor_frame_benchmark():
+    """
+    batch conversion and per-breath reduction vs. one SensorValues at a time, printed with ``pytest -s``
+    """
+    sensor_values = _frame_sensors(10000, samples_per_breath=200)
+
+    start = time.perf_counter()
+    frame = SensorFrame.from_sensor_values(sensor_values)
+    convert_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    peaks = {}
+    for sv in sensor_values:
+        peaks[sv.breath_count] = max(peaks.get(sv.breath_count, -np.inf), sv.PRESSURE)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    breath_counts, frame_peaks = frame.per_breath(ValueName.PRESSURE)
+    frame_time = time.perf_counter() - start
+
+    print(f'{len(sensor_values)} samples: from_sensor_values {convert_time*1e3:.2f} ms, '
+          f'peak pressure per breath {loop_time*1e3:.2f} ms one at a time, {frame_time*1e3:.3f} ms per_breath')
+    assert list(frame_peaks) == [peaks[breath_count] for breath_count in breath_counts]
@@ -2,15 +2,19 @@ import time
 import numpy as np
 import pytest
 import random
+from itertools import count
 
 from pvp import prefs
 prefs.init()
 
 from pvp.common import values
 from pvp.common.message import ControlSetting
-from pvp.alarm import Alarm, AlarmType, AlarmSeverity
+from pvp.common.shared import SensorSnapshot, WaveformBuffer, WaveformReader, ControllerMirror
+from pvp.alarm import Alarm, AlarmType, AlarmSeverity, Alarm_Manager
 from pvp.common.values import ValueName
+from pvp.controller import control_module
 from pvp.controller.control_module import get_control_module
+from pvp.io import HALMock
 
 
 
@@ -201,6 +205,412 @@ def test_missed_heartbeat_alarm():
     a = Controller.get_alarms()[0][0]
     assert a.alarm_type == AlarmType.MISSED_HEARTBEAT
 
+def test_sensor_snapshot():
+    '''
+    Controller publishes sensor values to shared memory, and reads that touch the snapshot count as contact
+    '''
+    Controller = get_control_module(sim_mode=True, simulator_dt=0.01)
+    snapshot = SensorSnapshot()
+    Controller.set_sensor_snapshot(snapshot)
+    assert snapshot.read().loop_counter == Controller.get_sensors().loop_counter
+
+    Controller.start()
+    time.sleep(0.3)
+    Controller.stop()
+    time.sleep(0.1)
+
+    vals = snapshot.read()
+    assert vals.loop_counter > 0
+    assert vals.to_dict() == Controller.get_sensors().to_dict()
+
+    Controller._time_last_contact = 0
+    snapshot.read(touch=True)
+    Controller._ControlModuleBase__test_for_alarms()
+    assert Controller._time_last_contact == snapshot.last_contact
+
+
+def test_sensor_snapshot_reader_missed_heartbeat():
+    '''
+    Readers of the snapshot other than the GUI's coordinator don't hide that the GUI has stopped reading
+    '''
+    Controller = get_control_module(sim_mode=True, simulator_dt=0.01)
+    snapshot = SensorSnapshot()
+    Controller.set_sensor_snapshot(snapshot)
+    Controller._critical_time = 1
+
+    Controller._time_last_contact = time.time() - 5
+    assert snapshot.read() is not None
+    Controller._ControlModuleBase__test_for_alarms()
+    assert AlarmType.MISSED_HEARTBEAT in [alarm.alarm_type for alarm in Controller.TECHA]
+
+
+def test_technical_alarms():
+    '''
+    Technical alerts are raised and cleared in their slots, and get_alarms() returns the same tuple until they change
+    '''
+    Controller = get_control_module(sim_mode=True, simulator_dt=0.01)
+    now = time.time()
+
+    def test_for_alarms(loop_time):
+        # in contact on every loop
+        Controller._time_last_contact = loop_time
+        Controller._ControlModuleBase__test_for_alarms(loop_time)
+
+    Controller.COPY_DATA_OXYGEN = 50
+    Controller._DATA_Qout = 1
+    Controller._DATA_PRESSURE = 5
+
+    # the same values, until they have been stuck for longer than the limit since the second loop that saw them
+    test_for_alarms(now - 1)
+    test_for_alarms(now)
+    test_for_alarms(now + Controller.limit_max_stuck_sensor / 2)
+    assert Controller.TECHA == ()
+    assert Controller.get_alarms() is None
+    test_for_alarms(now + Controller.limit_max_stuck_sensor * 1.1)
+    alarms = Controller.get_alarms()
+    assert [a.alarm_type for a in alarms[0]] == [AlarmType.SENSORS_STUCK]
+    assert alarms[0][0].start_time == now + Controller.limit_max_stuck_sensor * 1.1
+
+    # unchanged alarms are the same tuple
+    techa = Controller.TECHA
+    test_for_alarms(now + Controller.limit_max_stuck_sensor * 1.2)
+    assert Controller.TECHA is techa
+    assert Controller.get_alarms() is alarms
+
+    # implausible values raise another alert, ordered by type
+    Controller._DATA_PRESSURE = -1
+    test_for_alarms(now + Controller.limit_max_stuck_sensor * 1.3)
+    assert [a.alarm_type for a in Controller.get_alarms()[0]] == [AlarmType.BAD_SENSOR_READINGS]
+
+    # alerts can be set directly
+    Controller.TECHA = [Alarm(AlarmType.MISSED_HEARTBEAT, AlarmSeverity.TECHNICAL),
+                        Alarm(AlarmType.SENSORS_STUCK, AlarmSeverity.TECHNICAL)]
+    assert [a.alarm_type for a in Controller.TECHA] == [AlarmType.SENSORS_STUCK, AlarmType.MISSED_HEARTBEAT]
+    Controller._DATA_PRESSURE = 6
+    test_for_alarms(now + Controller.limit_max_stuck_sensor * 1.4)
+    assert [a.alarm_type for a in Controller.TECHA] == [AlarmType.MISSED_HEARTBEAT]
+    Controller.TECHA = []
+    assert Controller.get_alarms() is None
+
+
+def test_technical_alarms_interrupted_reader():
+    '''
+    A reader of TECHA in another thread that is interrupted by the loop changing the alerts doesn't leave
+    TECHA out of date
+    '''
+    Controller = get_control_module(sim_mode=True, simulator_dt=0.01)
+    slot = control_module._TECHA_SLOT[AlarmType.SENSORS_STUCK]
+    alarm = Alarm(AlarmType.SENSORS_STUCK, AlarmSeverity.TECHNICAL)
+
+    class InterruptedSlots(list):
+        # the loop clears the alert after the slots have been read, before the reader is done
+        interrupted = False
+
+        def __iter__(self):
+            yield from list.__iter__(self)
+            if not self.interrupted:
+                self.interrupted = True
+                Controller._clear_techa(slot)
+
+    Controller._raise_techa(slot, alarm)
+    Controller._techa_slots = InterruptedSlots(Controller._techa_slots)
+    Controller.TECHA
+    Controller.get_alarms()
+    # the loop clears it, if it didn't already while it was being read
+    Controller._clear_techa(slot)
+    assert Controller.TECHA == ()
+    assert Controller.get_alarms() is None
+
+
+def test_technical_alarms_benchmark():
+    '''
+    Time of the alarm tests run every loop, without and with an alert raised, printed with ``pytest -s``
+    '''
+    Controller = get_control_module(sim_mode=True, simulator_dt=0.01)
+    test_for_alarms = Controller._ControlModuleBase__test_for_alarms
+    now = time.time()
+    Controller.COPY_DATA_OXYGEN = 50
+    Controller._DATA_Qout = 1
+
+    n_loops = 20000
+    times = {}
+    for stuck in (False, True):
+        Controller.TECHA = []
+        start = time.perf_counter()
+        for i in range(n_loops):
+            Controller._time_last_contact = now + i
+            Controller._DATA_PRESSURE = 5 if stuck else 5 + (i % 2)
+            test_for_alarms(now + i)
+            Controller.get_alarms()
+        times[stuck] = (time.perf_counter() - start) / n_loops
+        assert (len(Controller.TECHA) > 0) == stuck
+
+    print(f'technical alarm tests: {times[False]*1e6:.2f} us/loop, '
+          f'{times[True]*1e6:.2f} us/loop with an alert raised')
+
+
+def test_poll():
+    '''
+    poll() returns changed sensor values and alarms since the caller's last sequence number
+    '''
+    Controller = get_control_module(sim_mode=True, simulator_dt=0.01)
+    first = Controller.poll()
+    assert first.sensors.to_dict() == Controller.get_sensors().to_dict()
+    assert first.alarms_changed and first.alarms is None
+
+    unchanged = Controller.poll(first.seq)
+    assert unchanged.sensors is None
+    assert not unchanged.alarms_changed
+
+    # raising a technical alarm is a change
+    Controller.TECHA = [Alarm(AlarmType.SENSORS_STUCK, AlarmSeverity.TECHNICAL)]
+    update = Controller.poll(first.seq)
+    assert update.seq > first.seq
+    assert update.sensors is None
+    assert update.alarms_changed
+    assert update.alarms[0][0].alarm_type == AlarmType.SENSORS_STUCK
+    assert not Controller.poll(update.seq).alarms_changed
+    assert not Controller.wait_for_alarms(update.seq, timeout=0.01)
+
+    Controller.TECHA = []
+    Controller._check_alarm_changes()
+    assert Controller.wait_for_alarms(update.seq, timeout=0.01)
+    assert Controller.poll(update.seq).alarms_changed
+
+    # the loop stats of recent loops are the same for every poller, polling doesn't reset them
+    for now in (100., 100.01, 100.51, 100.52):
+        Controller._update_loop_stats(now)
+    assert Controller.poll().loop_stats['max_dt'] == pytest.approx(0.5)
+    assert Controller.poll().loop_stats['max_dt'] == pytest.approx(0.5)
+
+def _hosted_alarm_manager(Controller) -> Alarm_Manager:
+    """
+    Load a fresh set of rules into the alarm manager, host it in the controller,
+    and give the controller sensor values within the alarm limits
+    """
+    manager = Alarm_Manager()
+    manager.rules = {}
+    manager.dependencies = {}
+    manager.load_rules()
+    manager.reset()
+    Controller.set_alarm_manager(manager)
+
+    Controller._DATA_BREATH_COUNT = 2
+    Controller._DATA_PIP = Controller.COPY_SET_PIP
+    Controller._DATA_PEEP = Controller.COPY_SET_PEEP
+    Controller._DATA_BPM = Controller.COPY_SET_BPM
+    Controller._DATA_I_PHASE = Controller.COPY_SET_I_PHASE
+    Controller._DATA_PRESSURE = Controller.COPY_SET_PEEP
+    Controller._DATA_VTE = np.mean(values.VALUES[ValueName.VTE]['safe_range'])
+    Controller._DATA_Qout = 0
+    Controller.COPY_DATA_OXYGEN = np.mean(values.VALUES[ValueName.FIO2]['safe_range'])
+    return manager
+
+
+def test_alarm_manager():
+    '''
+    A controller hosting an alarm manager checks each sample, and publishes the alarms it emits through poll()
+    '''
+    Controller = get_control_module(sim_mode=True, simulator_dt=0.01)
+    assert Controller.poll().alarm_transitions is None
+
+    manager = _hosted_alarm_manager(Controller)
+    try:
+        # limits follow the controller's settings
+        high_pressure = manager.rules[AlarmType.HIGH_PRESSURE].conditions[0][1]
+        assert high_pressure.limit == pytest.approx(Controller.COPY_SET_PIP * 1.15)
+        Controller.set_control(ControlSetting(ValueName.PIP, 30))
+        assert high_pressure.limit == pytest.approx(30 * 1.15)
+
+        # everything starts with the state of every alarm
+        first = Controller.poll()
+        assert [alarm.alarm_type for alarm in first.alarm_transitions] == list(manager.rules.keys())
+        assert all(alarm.severity == AlarmSeverity.OFF for alarm in first.alarm_transitions)
+
+        Controller._update_alarm_manager(time.time())
+        assert Controller.poll(first.seq).alarm_transitions == ()
+
+        # a single sample above the limit raises the alarm
+        Controller._DATA_PRESSURE = high_pressure.limit + 1
+        Controller._update_alarm_manager(time.time())
+        Controller._DATA_PRESSURE = Controller.COPY_SET_PEEP
+        Controller._update_alarm_manager(time.time())
+        assert Controller.wait_for_alarms(first.seq, timeout=0.01)
+        raised = Controller.poll(first.seq)
+        assert raised.alarms_changed
+        assert [(alarm.alarm_type, alarm.severity) for alarm in raised.alarm_transitions] == \
+               [(AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH)]
+        assert len(Controller.alarm_latencies) == 1
+        assert 0 <= raised.loop_stats['alarm_latency_max'] < 0.1
+
+        # the alarm is latched until it is dismissed
+        assert not Controller.wait_for_alarms(raised.seq, timeout=0.01)
+        Controller.dismiss_alarm(AlarmType.HIGH_PRESSURE)
+        Controller._update_alarm_manager(time.time())
+        cleared = Controller.poll(raised.seq)
+        assert [(alarm.alarm_type, alarm.severity) for alarm in cleared.alarm_transitions] == \
+               [(AlarmType.HIGH_PRESSURE, AlarmSeverity.OFF)]
+
+        # not checked before the second breath, when the derived values aren't defined yet
+        Controller._DATA_BREATH_COUNT = 1
+        Controller._DATA_PRESSURE = high_pressure.limit + 1
+        Controller._update_alarm_manager(time.time())
+        assert Controller.poll(cleared.seq).alarm_transitions == ()
+    finally:
+        Controller.set_alarm_manager(None)
+        manager.reset()
+    assert Controller.poll().alarm_transitions is None
+
+
+def test_alarm_manager_unpolled():
+    '''
+    Alarms are checked whether or not anyone polls the controller, and a caller that has missed
+    some of the alarms gets the current state of every alarm instead
+    '''
+    Controller = get_control_module(sim_mode=True, simulator_dt=0.01)
+    manager = _hosted_alarm_manager(Controller)
+    try:
+        low_pressure = manager.rules[AlarmType.LOW_PRESSURE].conditions[0][1]
+        first = Controller.poll()
+        n_transitions = Controller._alarm_transitions.maxlen + 1
+        for i in range(n_transitions):
+            Controller._DATA_PIP = low_pressure.limit - 1 if i % 2 == 0 else Controller.COPY_SET_PIP
+            Controller._update_alarm_manager(time.time())
+        assert len(Controller.alarm_latencies) == n_transitions
+
+        # the most recent alarms are still kept
+        recent = Controller.poll(Controller._alarm_seq - 1)
+        assert [(alarm.alarm_type, alarm.severity) for alarm in recent.alarm_transitions] == \
+               [(AlarmType.LOW_PRESSURE, AlarmSeverity.LOW)]
+
+        resync = Controller.poll(first.seq)
+        assert len(resync.alarm_transitions) == len(manager.rules)
+        for alarm in resync.alarm_transitions:
+            if alarm.alarm_type == AlarmType.LOW_PRESSURE:
+                assert alarm is manager.active_alarms[AlarmType.LOW_PRESSURE]
+            else:
+                assert alarm.severity == AlarmSeverity.OFF
+    finally:
+        Controller.set_alarm_manager(None)
+        manager.reset()
+
+
+def test_alarm_manager_loop():
+    '''
+    The running control loop raises alarms without anyone polling it, and measures how long it took to emit them
+    '''
+    Controller = get_control_module(sim_mode=True, simulator_dt=0.01)
+    manager = _hosted_alarm_manager(Controller)
+    # start past the first breath, with a high pressure limit that inspiration will exceed
+    Controller._breath_counter = count(3)
+    manager.update_dependencies(ControlSetting(ValueName.PIP, Controller.COPY_SET_PEEP))
+    try:
+        first = Controller.poll()
+        Controller.start()
+        time.sleep(0.5)
+        Controller.stop()
+        time.sleep(0.1)
+
+        update = Controller.poll(first.seq)
+        assert (AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH) in \
+               [(alarm.alarm_type, alarm.severity) for alarm in update.alarm_transitions]
+        latencies = np.array(Controller.alarm_latencies)
+        print(f'alarm latency: mean {latencies.mean()*1000:.3f} ms, max {latencies.max()*1000:.3f} ms')
+        assert update.loop_stats['alarm_latency_max'] == latencies.max() < 0.05
+    finally:
+        Controller.set_alarm_manager(None)
+        manager.reset()
+
+
+def test_waveform_buffer():
+    '''
+    Draining the waveform buffer at the GUI's update rate gets every sample of every controller loop
+    '''
+    Controller = get_control_module(sim_mode=True, simulator_dt=0.01)
+    Controller._LOOP_UPDATE_TIME = 0.001
+    waveform_buffer = WaveformBuffer()
+    Controller.set_waveform_buffer(waveform_buffer)
+    reader = WaveformReader(waveform_buffer)
+
+    samples = []
+    Controller.start()
+    try:
+        for _ in range(int(2 / prefs.get_pref('GUI_UPDATE_TIME'))):
+            time.sleep(prefs.get_pref('GUI_UPDATE_TIME'))
+            samples.append(reader.read())
+    finally:
+        Controller.stop()
+    samples.append(reader.read())
+    samples = np.concatenate(samples)
+
+    print(f'{len(samples)} samples, {len(samples)/(samples["timestamp"][-1]-samples["timestamp"][0]):.0f} samples/s')
+    assert reader.lost == 0
+    assert len(samples) == Controller._loop_counter == waveform_buffer.head
+    assert np.all(np.diff(samples['timestamp']) > 0)
+    assert np.all(np.diff(samples['breath_count']) >= 0)
+
+
+def _time_to_stable_peep(Controller, peep, new_breath=-1, tolerance=1., timeout=20):
+    '''
+    Time until the controller reports a PEEP within `tolerance` of `peep`, measured in a breath after `new_breath`
+    '''
+    start = time.time()
+    while time.time() - start < timeout:
+        sensors = Controller.get_sensors()
+        if sensors.breath_count > new_breath and sensors.PEEP is not None and abs(sensors.PEEP - peep) < tolerance:
+            return time.time() - start
+        time.sleep(0.01)
+    return None
+
+def test_checkpoint_restore(tmp_path):
+    '''
+    A controller restored from a checkpoint continues with the settings, breath count, baseline flows and derived
+    values of the last one. Report the time until PEEP is stable after a restart, with and without the checkpoint.
+    '''
+    checkpoint = str(tmp_path / 'controller.ckpt')
+    settings = [ControlSetting(name=ValueName.PEEP, value=8),
+                ControlSetting(name=ValueName.BREATHS_PER_MINUTE, value=30)]
+
+    Controller = get_control_module(sim_mode=True, checkpoint=checkpoint)
+    for setting in settings:
+        Controller.set_control(setting)
+    Controller.start()
+    start = time.time()
+    while Controller.get_sensors().breath_count < 3 and time.time() - start < 30:
+        time.sleep(0.05)
+    peep = Controller.get_sensors().PEEP
+    Controller.stop()
+    time.sleep(0.1)
+
+    Restored = get_control_module(sim_mode=True, checkpoint=checkpoint)
+    assert Restored.get_control(ValueName.PEEP).value == 8
+    assert Restored.get_control(ValueName.BREATHS_PER_MINUTE).value == 30
+    assert Restored._DATA_BREATH_COUNT == Controller._DATA_BREATH_COUNT
+    assert Restored._cycle_start == Controller._cycle_start
+    assert len(Restored._flow_list) == len(Controller._flow_list)
+    assert Restored.get_sensors().PEEP == pytest.approx(peep)
+
+    Restored.start()
+    restored_reported = _time_to_stable_peep(Restored, peep)
+    restored_measured = _time_to_stable_peep(Restored, peep, new_breath=Restored._DATA_BREATH_COUNT)
+    Restored.stop()
+
+    # without the checkpoint, the settings have to be sent again and the breath cycle starts over
+    Fresh = get_control_module(sim_mode=True, checkpoint=str(tmp_path / 'fresh.ckpt'))
+    for setting in settings:
+        Fresh.set_control(setting)
+    Fresh.start()
+    fresh_measured = _time_to_stable_peep(Fresh, peep)
+    Fresh.stop()
+
+    print(f'PEEP {peep:.1f}: restored from checkpoint reported in {restored_reported:.2f}s, '
+          f'measured in a new breath in {restored_measured:.2f}s; '
+          f'without checkpoint measured in {fresh_measured:.2f}s')
+    assert restored_reported < 0.1
+    assert restored_measured is not None
+    assert fresh_measured is not None
+    assert restored_reported < fresh_measured
+
 ######################################################################
 #########################   TEST 3  ##################################
 ######################################################################
@@ -262,6 +672,42 @@ def test_random_HAL():
 
 
 
+def test_fenced_HAL():
+    """
+    Once another controller has claimed the mirror, the fenced controller doesn't write the valves again,
+    not even to put them in standby when its main loop stops
+    """
+    Controller = get_control_module(sim_mode=False, simulator_dt=0.01)
+    Controller._LOOP_UPDATE_TIME = 0.01
+    writes = []
+
+    class RecordingHAL(HALMock):
+        def __setattr__(self, name, value):
+            if name.startswith('setpoint'):
+                writes.append((Controller._is_fenced, name, value))
+            super().__setattr__(name, value)
+
+    Controller.HAL = RecordingHAL()
+    mirror = ControllerMirror()
+    Controller.set_mirror(mirror)
+    Controller.start()
+    time.sleep(0.2)
+    assert writes
+
+    mirror.claim(1234)
+    timeout = time.time() + 1
+    while Controller._running.is_set() and time.time() < timeout:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    assert Controller._is_fenced
+    assert not Controller._running.is_set()
+
+    Controller.current_setting_in = 50
+    Controller.set_valves_standby()
+    Controller._set_HAL(valve_open_in=50, valve_open_out=0)
+    assert not any(fenced for fenced, _, _ in writes)
+
+
 def test_nan_HAL():
     """
     nan should work to, make PEEP et al. nan
@@ -1,19 +1,27 @@
 # TODO: this is a unit test, need to add integration test
+import os
 import random
+import signal
 import socket
 import threading
 import time
+import typing
+import xmlrpc.client
 from unittest.mock import patch, Mock
 
+import numpy as np
 import pytest
 
-from pvp.common import values
-from pvp.common.message import ControlSetting, SensorValues
-from pvp.alarm import AlarmSeverity, Alarm
+from pvp import prefs
+from pvp.common import values, codec
+from pvp.common.message import ControlSetting, SensorValues, PollResult
+from pvp.alarm import AlarmSeverity, Alarm, AlarmType, Alarm_Manager
 from pvp.common.values import ValueName
 from pvp.controller.control_module import ControlModuleBase
-from pvp.coordinator import rpc
-from pvp.coordinator.coordinator import get_coordinator
+from pvp.coordinator import rpc, ipc, process_manager
+from pvp.coordinator.process_manager import ProcessGroup
+from pvp.coordinator.coordinator import get_coordinator, CoordinatorBase
+from pvp.coordinator.aggregator import Aggregator
 
 
 def is_port_in_use(port):
@@ -85,13 +93,14 @@ def test_local_coordinator(control_setting_name):
     assert c_read.timestamp == c.timestamp
 
 @pytest.mark.timeout(10)
+@pytest.mark.parametrize("transport", ['xmlrpc', 'ipc'])
 @pytest.mark.parametrize("control_setting_name", values.CONTROL.keys())
 @patch('pvp.controller.control_module.get_control_module', mock_get_control_module, Mock())
-def test_remote_coordinator(control_setting_name):
+def test_remote_coordinator(control_setting_name, transport):
     # wait before
     #while not is_port_in_use(rpc.default_port):
     #    time.sleep(1)
-    coordinator = get_coordinator(single_process=False, sim_mode=True)
+    coordinator = get_coordinator(single_process=False, sim_mode=True, transport=transport)
     #TODO need to wait for rpc client start?
     #time.sleep(1)
     coordinator.start()
@@ -155,6 +164,196 @@ def test_process_manager():
 
     coordinator.process_manager.__del__() #And test the destructor
 
+@pytest.mark.timeout(60)
+@pytest.mark.parametrize("failure", ['died', 'stalled'])
+@pytest.mark.parametrize("transport", ['xmlrpc', 'ipc'])
+def test_controller_monitor(transport, failure):
+    """
+    A controller process that dies or stalls is restarted with its control settings and resumes ventilating.
+    Report the time from the failure until it was detected and until the new controller's loop was running.
+    """
+    prefs.set_pref('CONTROLLER_MONITOR', True)
+    try:
+        coordinator = get_coordinator(sim_mode=True, transport=transport)
+    finally:
+        prefs.set_pref('CONTROLLER_MONITOR', False)
+    manager = coordinator.process_manager
+    heartbeat = manager.controller_heartbeat
+    try:
+        coordinator.set_control(ControlSetting(name=ValueName.PIP, value=30))
+        coordinator.set_control(ControlSetting(name=ValueName.PIP, max_value=40))
+        coordinator.set_control(ControlSetting(name=ValueName.PEEP, value=8))
+        coordinator.set_breath_detection(False)
+        # the alarm limit doesn't replace the set value
+        assert len(manager.restore_state()['controls']) == 3
+        coordinator.start()
+        time.sleep(0.5)
+        assert heartbeat.running
+        assert heartbeat.loop_counter > 0
+        assert len(manager.restarts) == 0
+
+        failed = time.time()
+        if failure == 'died':
+            manager.child_process.kill()
+        else:
+            os.kill(manager.child_pid, signal.SIGSTOP)
+
+        deadline = failed + 10
+        while len(manager.restarts) == 0 and time.time() < deadline:
+            time.sleep(0.001)
+        # the new controller's loop is beating
+        while not (heartbeat.running and heartbeat.loop_counter > 0) and time.time() < deadline:
+            time.sleep(0.001)
+        resumed = time.time()
+
+        assert len(manager.restarts) == 1
+        restart = manager.restarts[0]
+        assert restart['reason'] == failure
+        detection = restart['detected'] - failed
+        print(f'{transport} {failure}: detected in {detection * 1000:.1f} ms, '
+              f'restarted in {(restart["restarted"] - failed) * 1000:.1f} ms, '
+              f'ventilating in {(resumed - failed) * 1000:.1f} ms')
+        assert detection < manager.max_heartbeat_interval + 0.2
+
+        assert coordinator.is_running()
+        assert coordinator.get_control(ValueName.PIP).value == 30
+        assert coordinator.get_control(ValueName.PEEP).value == 8
+        assert coordinator.get_breath_detection() is False
+    finally:
+        coordinator.kill()
+
+
+@pytest.mark.timeout(30)
+def test_controller_monitor_restart_unlocked():
+    """
+    While the monitor waits for a restarted controller to start serving, control settings can still be recorded
+    and the process lock is free
+    """
+    coordinator = get_coordinator(sim_mode=True)
+    manager = coordinator.process_manager
+    waiting = threading.Event()
+    release = threading.Event()
+    wait_serving = manager.wait_serving
+
+    def slow_wait_serving():
+        waiting.set()
+        release.wait(10)
+        return wait_serving()
+
+    try:
+        manager.wait_serving = slow_wait_serving
+        process_manager._kill(manager.child_process)
+        monitor = threading.Thread(target=manager.check_heartbeat)
+        monitor.start()
+        assert waiting.wait(10)
+
+        start = time.time()
+        manager.record_control(ControlSetting(name=ValueName.PIP, value=30))
+        assert manager._process_lock.acquire(timeout=1)
+        manager._process_lock.release()
+        assert time.time() - start < 0.5
+
+        release.set()
+        monitor.join(10)
+        assert manager.restarts[0]['reason'] == 'died'
+        assert manager.restore_state()['controls'][0].value == 30
+    finally:
+        release.set()
+        manager.wait_serving = wait_serving
+        coordinator.kill()
+
+
+@pytest.mark.timeout(30)
+def test_controller_monitor_short_stall():
+    """
+    A one-off stall of the controller's loop doesn't restart it with the default ``CONTROLLER_MAX_HEARTBEAT_INTERVAL``
+    """
+    # a prefs file saved by an older version may have a shorter interval
+    max_heartbeat_interval = prefs.get_pref('CONTROLLER_MAX_HEARTBEAT_INTERVAL')
+    prefs.set_pref('CONTROLLER_MAX_HEARTBEAT_INTERVAL', prefs._DEFAULTS['CONTROLLER_MAX_HEARTBEAT_INTERVAL'])
+    prefs.set_pref('CONTROLLER_MONITOR', True)
+    try:
+        coordinator = get_coordinator(sim_mode=True)
+    finally:
+        prefs.set_pref('CONTROLLER_MONITOR', False)
+        prefs.set_pref('CONTROLLER_MAX_HEARTBEAT_INTERVAL', max_heartbeat_interval)
+    manager = coordinator.process_manager
+    try:
+        coordinator.start()
+        time.sleep(0.5)
+        pid = manager.child_pid
+
+        os.kill(pid, signal.SIGSTOP)
+        time.sleep(0.2)
+        os.kill(pid, signal.SIGCONT)
+        time.sleep(0.5)
+
+        assert len(manager.restarts) == 0
+        assert manager.child_pid == pid
+        assert coordinator.is_running()
+    finally:
+        coordinator.kill()
+
+
+@pytest.mark.timeout(60)
+@pytest.mark.parametrize("transport", ['xmlrpc', 'ipc'])
+def test_standby_takeover(transport):
+    """
+    A warm standby takes over the valves from a stalled controller, continuing its breath cycle.
+    Report the time from the failure, and from the missed heartbeat, until the standby was driving the valves.
+    """
+    coordinator = get_coordinator(sim_mode=True, transport=transport, standby=True)
+    manager = coordinator.process_manager
+    heartbeat = manager.controller_heartbeat
+    try:
+        assert manager.standby_process.is_alive()
+        coordinator.set_control(ControlSetting(name=ValueName.PIP, value=30))
+        coordinator.start()
+        time.sleep(0.5)
+        primary_pid, standby_pid = manager.child_pid, manager.standby_pid
+        assert manager.mirror.owner == primary_pid
+        breath_count = manager.mirror.read()['breath_count']
+
+        os.kill(primary_pid, signal.SIGSTOP)
+        failed = time.time()
+        last_beat = heartbeat.timestamp
+
+        deadline = failed + 10
+        while manager.mirror.owner != standby_pid and time.time() < deadline:
+            time.sleep(0.0005)
+        # the standby's loop is beating
+        loop_counter = heartbeat.loop_counter
+        while heartbeat.loop_counter <= loop_counter and time.time() < deadline:
+            time.sleep(0.0005)
+        took_over = time.time()
+
+        assert manager.mirror.owner == standby_pid
+        print(f'{transport}: standby driving valves {(took_over - failed) * 1000:.1f} ms after the failure, '
+              f'{(took_over - last_beat - manager.max_heartbeat_interval) * 1000:.1f} ms after the missed heartbeat')
+        assert took_over - last_beat - manager.max_heartbeat_interval < 0.1
+        assert manager.mirror.read()['breath_count'] >= breath_count
+
+        # the monitor replaces the old controller with the standby and starts a new standby
+        while len(manager.restarts) == 0 and time.time() < deadline:
+            time.sleep(0.001)
+        assert manager.restarts[0]['reason'] == 'takeover'
+        assert manager.child_pid == standby_pid
+        assert manager.standby_pid not in (None, primary_pid, standby_pid)
+        assert manager.wait_serving()
+        assert coordinator.is_running()
+        assert coordinator.get_control(ValueName.PIP).value == 30
+    finally:
+        coordinator.kill()
+
+
+def test_standby_sim_mode_only():
+    """
+    A standby and the active controller would both write the valves, so there is no standby outside simulation mode
+    """
+    with pytest.raises(ValueError):
+        process_manager.ProcessManager(sim_mode=False, standby=True, start_wait=False)
+
+
 def test_local_sensors():
     coordinator = get_coordinator(single_process=True, sim_mode=True)
     coordinator.start()
@@ -179,12 +378,42 @@ def test_local_sensors():
     assert coordinator.is_running()
     coordinator.stop()
 
+
+def test_local_controller_alarms():
+    '''
+    With the ``CONTROLLER_ALARMS`` pref, a single-process controller checks alarms with an alarm manager of its own,
+    rather than the one shared with the GUI
+    '''
+    prefs.set_pref('CONTROLLER_ALARMS', True)
+    try:
+        coordinator = get_coordinator(single_process=True, sim_mode=True)
+    finally:
+        prefs.set_pref('CONTROLLER_ALARMS', False)
+    manager = coordinator.control_module.alarm_manager
+    assert coordinator.controller_alarms
+    assert manager is not None and manager is not Alarm_Manager()
+
+    update = coordinator.poll()
+    assert [alarm.alarm_type for alarm in update.alarm_transitions] == list(manager.rules.keys())
+
+    # dismissing a raised alarm clears it
+    high_pressure = manager.rules[AlarmType.HIGH_PRESSURE]
+    manager.apply_severity(high_pressure, AlarmSeverity.HIGH)
+    manager.apply_severity(high_pressure, AlarmSeverity.OFF)
+    coordinator.dismiss_alarm(AlarmType.HIGH_PRESSURE)
+    manager.apply_severity(high_pressure, AlarmSeverity.OFF)
+    transitions = coordinator.poll(update.seq).alarm_transitions
+    assert [(alarm.alarm_type, alarm.severity) for alarm in transitions] == \
+           [(AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH), (AlarmType.HIGH_PRESSURE, AlarmSeverity.OFF)]
+    assert len(Alarm_Manager().active_alarms) == 0
+
 @pytest.mark.timeout(10)
-def test_remote_sensors():
+@pytest.mark.parametrize("transport", ['xmlrpc', 'ipc'])
+def test_remote_sensors(transport):
     # wait before
     #while not is_port_in_use(rpc.default_port):
     #    time.sleep(1)
-    coordinator = get_coordinator(single_process=False, sim_mode=True)
+    coordinator = get_coordinator(single_process=False, sim_mode=True, transport=transport)
     # TODO need to wait for rpc client start?
     #time.sleep(1)
     coordinator.start()
@@ -200,3 +429,473 @@ def test_remote_sensors():
     for k, v in sensor_values.to_dict().items():
         assert isinstance(k, ValueName) or (k in sensor_values.additional_values)
         assert isinstance(v, int) or isinstance(v, float) or v is None
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.parametrize("transport", ['xmlrpc', 'ipc'])
+def test_remote_poll(transport):
+    """
+    A single poll returns sensor values, alarms, the heartbeat and loop statistics,
+    and only returns what changed since the last poll
+    """
+    coordinator = get_coordinator(single_process=False, sim_mode=True, transport=transport)
+
+    first = coordinator.poll(0)
+    assert isinstance(first.sensors, SensorValues)
+    assert first.alarms_changed
+
+    # nothing has changed while the controller is stopped
+    unchanged = coordinator.poll(first.seq)
+    assert unchanged.seq == first.seq
+    assert unchanged.sensors is None
+    assert not unchanged.alarms_changed
+
+    coordinator.start()
+    time.sleep(0.5)
+    update = coordinator.poll(first.seq)
+    assert update.seq > first.seq
+    assert update.sensors.loop_counter > first.sensors.loop_counter
+    assert update.loop_counter >= update.sensors.loop_counter
+    assert update.loop_stats['loop_rate'] > 0
+    assert update.loop_stats['max_dt'] >= update.loop_stats['mean_dt']
+
+    # a seq from before a controller restart gets everything
+    assert coordinator.poll(update.seq + 1000).sensors is not None
+    coordinator.kill()
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.parametrize("transport", ['local', 'xmlrpc', 'ipc'])
+def test_subscription_alarm_latency(transport):
+    """
+    Alarms raised by the controller are pushed to subscribers immediately.
+
+    Measure the time from the controller raising HAPA to the subscriber receiving it
+    """
+    coordinator = get_coordinator(single_process=transport == 'local', sim_mode=True,
+                                  transport='xmlrpc' if transport == 'local' else transport)
+    updates = []
+    alarm_received = threading.Event()
+
+    def receive(update):
+        updates.append(update)
+        if update.alarms_changed:
+            alarm_received.set()
+
+    subscription = coordinator.subscribe(receive)
+    coordinator.start()
+    latencies = []
+    try:
+        time.sleep(0.5)
+        assert len(updates) > 0
+        assert updates[-1].sensors is not None
+
+        for _ in range(5):
+            alarm_received.clear()
+            # an impossibly low HAPA limit raises HAPA
+            coordinator.set_control(ControlSetting(ValueName.PIP, value=30, max_value=1))
+            assert alarm_received.wait(5)
+            received = time.time()
+            hapa = updates[-1].alarms[0]
+            assert hapa.alarm_type == AlarmType.HIGH_PRESSURE
+            latencies.append(received - hapa.start_time)
+
+            # and a high limit clears it
+            alarm_received.clear()
+            coordinator.set_control(ControlSetting(ValueName.PIP, value=30, max_value=100))
+            assert alarm_received.wait(5)
+    finally:
+        subscription.stop()
+        coordinator.stop()
+        coordinator.kill()
+
+    latencies = np.array(latencies) * 1000
+    print(f'{transport}: alarm latency median {np.median(latencies):.2f} ms, max {np.max(latencies):.2f} ms')
+    if transport == 'xmlrpc':
+        # polled at the publish rate
+        assert np.median(latencies) < 2000 / prefs.get_pref('CONTROLLER_PUBLISH_RATE')
+    else:
+        assert np.median(latencies) < prefs.get_pref('GUI_UPDATE_TIME') * 1000
+
+
+def _alarm_types(controller_alarms) -> list:
+    """
+    Alarm types of the alarms returned by :meth:`.ControlModuleBase.get_alarms`
+    """
+    alarm_types = []
+    for alarm in controller_alarms or ():
+        if isinstance(alarm, (tuple, list)):
+            alarm_types.extend(subalarm.alarm_type for subalarm in alarm)
+        else:
+            alarm_types.append(alarm.alarm_type)
+    return alarm_types
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.parametrize("transport", ['local', 'ipc'])
+def test_subscription_stalled_gui(transport):
+    """
+    Updates pushed to a subscriber don't count as contact with the GUI, so a GUI that has stopped handling them
+    still gets a MISSED_HEARTBEAT alarm
+    """
+    # longer than the time between pushed updates, so pushing them would count as contact if it could
+    heartbeat_timeout = prefs.get_pref('HEARTBEAT_TIMEOUT')
+    prefs.set_pref('HEARTBEAT_TIMEOUT', 1)
+    try:
+        coordinator = get_coordinator(single_process=transport == 'local', sim_mode=True,
+                                      transport='xmlrpc' if transport == 'local' else transport)
+    finally:
+        prefs.set_pref('HEARTBEAT_TIMEOUT', heartbeat_timeout)
+    updates = []
+    # a stalled GUI: updates are received but never handled
+    subscription = coordinator.subscribe(updates.append)
+    coordinator.start()
+    try:
+        deadline = time.time() + 10
+        alarm_types = []
+        while AlarmType.MISSED_HEARTBEAT not in alarm_types and time.time() < deadline:
+            time.sleep(0.1)
+            alarm_types = _alarm_types(coordinator.get_alarms())
+        assert len(updates) > 0
+        assert AlarmType.MISSED_HEARTBEAT in alarm_types
+    finally:
+        subscription.stop()
+        coordinator.stop()
+        coordinator.kill()
+
+
+def test_subscription_touch():
+    """
+    A GUI that touches the controller for each update it handles doesn't get a MISSED_HEARTBEAT alarm
+    """
+    coordinator = get_coordinator(single_process=True, sim_mode=True)
+    coordinator.control_module._critical_time = 1
+    subscription = coordinator.subscribe(lambda update: coordinator.touch())
+    coordinator.start()
+    try:
+        time.sleep(2)
+        assert AlarmType.MISSED_HEARTBEAT not in _alarm_types(coordinator.get_alarms())
+    finally:
+        subscription.stop()
+        coordinator.stop()
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.parametrize("transport", ['xmlrpc', 'ipc'])
+def test_concurrent_clients(transport):
+    """
+    Several read-only clients and a hung client don't block the control client,
+    and read-only clients can't change the controller's state
+    """
+    coordinator = get_coordinator(single_process=False, sim_mode=True, transport=transport)
+    coordinator.start()
+
+    if transport == 'xmlrpc':
+        make_reader = lambda: rpc.get_rpc_client()
+        read_sensors = lambda client: codec.decode(client.get_sensors().data)
+        # a client that connects and never sends its request
+        hung_client = socket.create_connection((rpc.default_addr, rpc.default_port))
+        permission_error = xmlrpc.client.Fault
+    else:
+        authkey = ipc.connection_key(coordinator.process_manager.control_token)
+        make_reader = lambda: ipc.get_ipc_client(authkey=authkey)
+        read_sensors = lambda client: client.get_sensors()
+        hung_client = ipc.Client(ipc.default_address, family=ipc.default_family)
+        permission_error = PermissionError
+
+        # clients without the connection key can't connect at all
+        with pytest.raises(ipc.AuthenticationError):
+            ipc.Client(ipc.default_address, family=ipc.default_family, authkey=b'not the key')
+
+    # read-only clients can read, but not control
+    reader = make_reader()
+    assert isinstance(read_sensors(reader), SensorValues)
+    with pytest.raises(permission_error):
+        reader.stop()
+    assert coordinator.is_running()
+
+    stop = threading.Event()
+    reads = []
+
+    def read_loop():
+        client = make_reader()
+        while not stop.is_set():
+            read_sensors(client)
+            reads.append(time.perf_counter())
+
+    read_threads = [threading.Thread(target=read_loop, daemon=True) for _ in range(3)]
+    for thread in read_threads:
+        thread.start()
+
+    latencies = []
+    try:
+        for i in range(50):
+            start = time.perf_counter()
+            coordinator.set_control(ControlSetting(ValueName.PIP, value=20 + i % 5))
+            latencies.append(time.perf_counter() - start)
+    finally:
+        stop.set()
+        for thread in read_threads:
+            thread.join()
+        hung_client.close()
+        coordinator.kill()
+
+    latencies = np.array(latencies) * 1000
+    print(f'{transport}: {len(reads)} reads by 3 readers, '
+          f'set_control latency median {np.median(latencies):.2f} ms, max {np.max(latencies):.2f} ms')
+    assert len(reads) > 0
+    assert np.max(latencies) < 1000
+
+
+def test_ipc_stale_socket(tmp_path):
+    """
+    A socket left by a killed controller is removed, but one another controller is serving at isn't
+    """
+    address = str(tmp_path / 'controller.sock')
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(address)
+    stale.close()
+    ipc.remove_stale_socket(address)
+    assert not os.path.exists(address)
+
+    listener = ipc.Listener(address, family=ipc.default_family)
+    try:
+        with pytest.raises(FileExistsError):
+            ipc.remove_stale_socket(address)
+        assert os.path.exists(address)
+    finally:
+        listener.close()
+
+
+@pytest.mark.timeout(60)
+@pytest.mark.parametrize("transport", ['xmlrpc', 'ipc'])
+def test_multiple_instances(transport):
+    """
+    Controller instances get their own addresses, and dead instances are restarted by the group
+    """
+    group = ProcessGroup(sim_mode=True, instances={1: None, 2: None}, transport=transport)
+    try:
+        assert group[1].address == process_manager.instance_address(1, transport)
+        assert group[1].address != group[2].address
+
+        coordinators = {i: get_coordinator(sim_mode=True, transport=transport, process_manager=group[i])
+                        for i in (1, 2)}
+        coordinators[1].start()
+        assert coordinators[1].is_running()
+        assert not coordinators[2].is_running()
+
+        group[2].child_process.kill()
+        group[2].child_process.join()
+        assert group.supervise() == [2]
+        assert not coordinators[2].is_running()
+        assert coordinators[1].is_running()
+    finally:
+        group.try_stop_processes()
+
+
+@pytest.mark.timeout(60)
+@pytest.mark.parametrize("transport", ['xmlrpc', 'ipc'])
+def test_shared_process_manager_outlives_coordinator(transport):
+    """
+    A coordinator given someone else's process manager leaves its controller process running when it's deleted
+    """
+    group = ProcessGroup(sim_mode=True, instances={1: None}, transport=transport)
+    try:
+        coordinator = get_coordinator(sim_mode=True, transport=transport, process_manager=group[1])
+        coordinator.start()
+        del coordinator
+
+        assert group[1].child_process.is_alive()
+        coordinator = get_coordinator(sim_mode=True, transport=transport, process_manager=group[1])
+        assert coordinator.is_running()
+        coordinator.kill()
+        assert group[1].child_process.is_alive()
+    finally:
+        group.try_stop_processes()
+
+
+@pytest.mark.timeout(120)
+def test_many_instances_load():
+    """
+    Run 32 simulated controllers at once, report each one's loop rate and the latency of polling it
+    """
+    n_instances = 32
+    start = time.perf_counter()
+    group = ProcessGroup(sim_mode=True, instances=n_instances, transport='ipc')
+    print(f'started {n_instances} controllers in {time.perf_counter() - start:.2f} s')
+
+    try:
+        coordinators = [get_coordinator(sim_mode=True, transport='ipc', process_manager=group[i])
+                        for i in range(n_instances)]
+        for coordinator in coordinators:
+            coordinator.start()
+        time.sleep(2)
+
+        loop_rates = []
+        latencies = []
+        for _ in range(10):
+            for coordinator in coordinators:
+                poll_start = time.perf_counter()
+                update = coordinator.poll(0)
+                latencies.append(time.perf_counter() - poll_start)
+                loop_rates.append(update.loop_stats['loop_rate'])
+            time.sleep(0.05)
+
+        for coordinator in coordinators:
+            coordinator.stop()
+    finally:
+        group.try_stop_processes()
+
+    loop_rates = np.array(loop_rates).reshape(10, n_instances).mean(axis=0)
+    latencies = np.array(latencies) * 1000
+    for i, rate in enumerate(loop_rates):
+        print(f'instance {i}: {rate:.1f} loops/s')
+    print(f'loop rate min {loop_rates.min():.1f}, median {np.median(loop_rates):.1f} loops/s, '
+          f'poll latency median {np.median(latencies):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms')
+    assert np.all(loop_rates > 0)
+
+
+def _stand_in_updates(n_updates: int, breath_every: int = 10) -> typing.List[PollResult]:
+    """
+    Updates a controller would send, a new breath every ``breath_every`` updates and HAPA on the third breath
+    """
+    updates = []
+    hapa = Alarm(AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH)
+    for i in range(1, n_updates + 1):
+        breath_count = i // breath_every
+        sensors = SensorValues(timestamp=i, loop_counter=i, breath_count=breath_count,
+                               vals={value_name: float(i) for value_name in values.SENSOR})
+        alarms_changed = i % breath_every == 0 and breath_count in (3, 4)
+        alarms = (hapa,) if breath_count == 3 else None
+        updates.append(PollResult(seq=i, timestamp=i, loop_counter=i, sensors=sensors,
+                                  alarms_changed=alarms_changed, alarms=alarms, loop_stats={}))
+    return updates
+
+
+class StandInCoordinator(CoordinatorBase):
+    """
+    Stands in for the coordinator of one bed, replays prebuilt updates
+    """
+    def __init__(self, updates: typing.List[PollResult]):
+        super(StandInCoordinator, self).__init__()
+        self.updates = updates
+
+    def poll(self, since_seq: int = 0) -> PollResult:
+        return self.updates[since_seq % len(self.updates)]
+
+
+def test_aggregator():
+    updates = _stand_in_updates(100)
+    aggregator = Aggregator({bed_id: StandInCoordinator(updates) for bed_id in ('a', 'b')}, history_length=5)
+    view = aggregator.view()
+    assert view['a']['values'] is None
+
+    for i in range(35):
+        assert aggregator.collect() == 2
+
+    view = aggregator.view()
+    assert view['a']['breath_count'] == 3
+    assert view['a']['values'][ValueName.PIP] == 35
+    assert view['b']['alarms'] == (AlarmType.HIGH_PRESSURE,)
+
+    # one history entry per breath
+    history = aggregator.history('a')
+    assert [breath['breath_count'] for breath in history] == [0, 1, 2, 3]
+
+    for i in range(20):
+        aggregator.collect()
+    assert aggregator.view()['a']['alarms'] == tuple()
+    # history is bounded
+    assert [breath['breath_count'] for breath in aggregator.history('a')] == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.timeout(30)
+def test_aggregator_controllers():
+    """
+    Aggregate several simulated controllers, by polling and by subscription
+    """
+    coordinators = {bed_id: get_coordinator(single_process=True, sim_mode=True) for bed_id in range(3)}
+    aggregator = Aggregator(coordinators)
+    for coordinator in coordinators.values():
+        coordinator.start()
+    try:
+        for _ in range(20):
+            aggregator.collect()
+            time.sleep(0.05)
+        view = aggregator.view()
+        assert all([bed['values'] is not None for bed in view.values()])
+
+        n_updates = {bed_id: bed.n_updates for bed_id, bed in aggregator.beds.items()}
+        aggregator.subscribe()
+        time.sleep(0.5)
+        aggregator.unsubscribe()
+        assert all([bed.n_updates > n_updates[bed_id] for bed_id, bed in aggregator.beds.items()])
+    finally:
+        for coordinator in coordinators.values():
+            coordinator.stop()
+
+
+@pytest.mark.parametrize("n_beds", [10, 50, 100])
+def test_aggregator_fan_in_benchmark(n_beds):
+    """
+    Throughput of collecting updates from many beds (with stand-in coordinators, on one core)
+    """
+    updates = _stand_in_updates(1000)
+    aggregator = Aggregator({bed_id: StandInCoordinator(updates) for bed_id in range(n_beds)})
+    n_rounds = 50
+
+    start = time.perf_counter()
+    for _ in range(n_rounds):
+        aggregator.collect()
+    collect_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(n_rounds):
+        aggregator.view()
+    view_time = (time.perf_counter() - start) / n_rounds
+
+    print(f'{n_beds} beds: {n_beds * n_rounds / collect_time:.0f} bed updates/s, '
+          f'{collect_time / n_rounds * 1000:.2f} ms to collect all beds, {view_time * 1000:.2f} ms per view')
+    assert all([bed.n_updates == n_rounds for bed in aggregator.beds.values()])
+
+@pytest.mark.timeout(30)
+def test_transport_benchmark():
+    """
+    Compare round-trip latency and client CPU time per ``get_sensors`` call
+    between the xml-rpc and persistent connection transports, and reading the shared memory snapshot
+    """
+    n_calls = 500
+    results = {}
+    xmlrpc_coordinator = get_coordinator(single_process=False, sim_mode=True, transport='xmlrpc')
+    ipc_coordinator = get_coordinator(single_process=False, sim_mode=True, transport='ipc')
+    methods = {
+        'xmlrpc': lambda: codec.decode(xmlrpc_coordinator.rpc_client.get_sensors().data),
+        'ipc': ipc_coordinator.rpc_client.get_sensors,
+        'snapshot': ipc_coordinator.get_sensors,
+        # one gui update: sensors and alarms in two calls, or in one poll
+        'xmlrpc_sensors_alarms': lambda: (codec.decode(xmlrpc_coordinator.rpc_client.get_sensors().data),
+                                          xmlrpc_coordinator.get_alarms())[0],
+        'xmlrpc_poll': lambda: xmlrpc_coordinator.poll(0).sensors,
+    }
+
+    for method_name, method in methods.items():
+        # warm up the connection
+        method()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        for i in range(n_calls):
+            sensor_values = method()
+        wall_time = (time.perf_counter() - wall_start) / n_calls
+        cpu_time = (time.process_time() - cpu_start) / n_calls
+
+        assert isinstance(sensor_values, SensorValues)
+        results[method_name] = (wall_time, cpu_time)
+        print(f'{method_name}: {wall_time*1e6:.1f} us/call round trip, {cpu_time*1e6:.1f} us/call client cpu')
+
+    xmlrpc_coordinator.kill()
+    ipc_coordinator.kill()
+
+    assert results['ipc'][0] < results['xmlrpc'][0]
+    assert results['snapshot'][0] < results['xmlrpc'][0]
+    assert results['xmlrpc_poll'][0] < results['xmlrpc_sensors_alarms'][0]
@@ -428,6 +428,11 @@ def test_raise_alarm_card(qtbot, spawn_gui, fake_sensors):
 
     assert any([a.alarm_type == AlarmType.HIGH_PRESSURE for a in vent_gui.alarm_bar.alarms])
 
+    # stamped at each stage on the way to the alarm bar
+    hapa = [a for a in vent_gui.alarm_bar.alarms if a.alarm_type == AlarmType.HIGH_PRESSURE][0]
+    assert list(hapa.timestamps.keys()) == ['sample', 'checked', 'emitted', 'handled', 'displayed']
+    assert vent_gui.alarm_manager.latency.summary()[AlarmType.HIGH_PRESSURE]['displayed']['n'] >= 1
+
 def test_gui_main_etc(qtbot, spawn_gui):
 
     app, vent_gui = spawn_gui
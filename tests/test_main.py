@@ -18,6 +18,12 @@ def test_parser():
     parsed_argument = pvp.main.parse_cmd_args(['--screenshot'])
     assert parsed_argument.screenshot
 
+    parsed_argument = pvp.main.parse_cmd_args(['--transport', 'ipc'])
+    assert parsed_argument.transport == 'ipc'
+
+    parsed_argument = pvp.main.parse_cmd_args(['--instance', '3'])
+    assert parsed_argument.instance == 3
+
 @pytest.mark.timeout(10)
 def test_valve_save():
     "Test shutdown for vales"